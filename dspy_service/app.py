@@ -7,17 +7,74 @@ frontend to call LLM logic implemented in Python/DSPy instead of TypeScript/Genk
 Endpoints:
 - GET /health - Health check endpoint
 - POST /api/intent-skill-trajectory - Extract intent, skills, and learning trajectory from student utterances
+- POST /api/intent-skill-trajectory/batch - Several IST requests in one call (used by ist_client.py)
+- POST /api/intent-skill-trajectory/stream - Same, streamed as Server-Sent Events field by field
+- POST /api/tutor-turn - Socratic tutor reply (streamed) and IST fields from one LM call
+- WS /ws/chat/{thread_id} - Chat session: send only new utterances, IST partials and results pushed back
+- POST /api/assessment/batch, GET /api/assessment/batch/{run_id} - Class-wide personalized assessments (background run, progress report)
+- GET /api/metrics - LM token/cost accounting and program registry counters
+- GET /api/profile, GET /api/profile/{name} - Sampled / on-demand request profiles (token required)
+- GET /api/admin/lm-cache, POST /api/admin/lm-cache/purge - LM-call cache namespaces, purge old program versions (admin token required)
+
+JSON is the default wire format. Internal callers may send and/or accept
+application/msgpack instead (see wire_format.py).
 """
 
-from fastapi import FastAPI, HTTPException
+import asyncio
+import contextlib
+import hmac
+import json
+import os
+import time
+
+from fastapi import BackgroundTasks, FastAPI, Header, HTTPException, Query, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field, PrivateAttr, ValidationError, field_validator, model_validator
 from typing import List, Optional, Literal
 
 from dotenv import load_dotenv
 
+from assessment import AssessmentRunConflict, AssessmentRunner
+from chat_sessions import (
+    CLOSE_SUPERSEDED,
+    CLOSE_TRY_AGAIN_LATER,
+    ChatSession,
+    ChatSessionManager,
+    SessionChannel,
+    SessionInit,
+    SessionOwner,
+    SlowConsumer,
+)
+from conversation_summary import ConversationSummarizer, ThreadSummary, use_summary
+
 # Import DSPy flows
-from dspy_flows import initialize_ist_extractor
+from dspy_flows import (
+    CHAT_HISTORY_PROMPT_LIMIT,
+    IST_HISTORY_PROMPT_LIMIT,
+    PROFILE_SKILLS_PROMPT_LIMIT,
+    initialize_ist_extractor,
+    is_fallback_result,
+    resolve_course_id,
+    resolve_output_mode,
+    resolve_pipeline,
+    resolve_trajectory_source,
+    service_program_fingerprint,
+    use_context_sections,
+)
+from event_sink import EventSink, make_event
+from idempotency import IdempotencyKeyReused, IdempotencyStore, request_hash
+from ingestion_limits import BodySizeLimitMiddleware, max_body_bytes_from_env, route_limits_from_env
+from lm_accounting import TokenBudgetExceeded, count_lm_calls, get_accountant
+from request_profiler import RequestProfiler
+from semantic_cache import SemanticISTCache, context_from_request
+from shadow import ShadowRunner
+from shared_cache import LMCallCache, SharedCache, cached_program_fingerprint
+from traffic_capture import install_traffic_capture
+import tracing
+from tracing import Tracer, TracingMiddleware
+from wire_format import NegotiatedJSONResponse, NegotiatedRoute
 
 # Load environment variables
 load_dotenv()
@@ -25,8 +82,11 @@ load_dotenv()
 app = FastAPI(
     title="CourseLLM DSPy Service",
     description="Python/DSPy service for AI tutor LLM logic",
-    version="0.1.0"
+    version="0.1.0",
+    default_response_class=NegotiatedJSONResponse,
 )
+# Set before any route is declared: every API route gets msgpack negotiation.
+app.router.route_class = NegotiatedRoute
 
 # Configure CORS to allow requests from Next.js dev server
 app.add_middleware(
@@ -40,6 +100,56 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in traffic capture for load replay (TRAFFIC_CAPTURE_DIR, see traffic_capture.py)
+capture_writer = install_traffic_capture(app)
+
+# Request tracing with W3C traceparent propagation (IST_TRACE_EXPORTER, see tracing.py)
+tracing.configure(Tracer.from_env())
+app.add_middleware(TracingMiddleware)
+
+# Reject oversized bodies while they stream in (IST_MAX_BODY_BYTES, IST_ASSESSMENT_MAX_BODY_BYTES, see
+# ingestion_limits.py). Added last so it is the outermost middleware and runs before anything buffers the body.
+app.add_middleware(BodySizeLimitMiddleware, max_bytes=max_body_bytes_from_env(), route_limits=route_limits_from_env())
+
+# Near-duplicate IST result cache (IST_SEMANTIC_CACHE=1, see semantic_cache.py)
+semantic_cache = SemanticISTCache.from_env()
+
+# Cross-worker exact-match IST cache and DSPy LM-call tier (SHARED_CACHE_URL, see shared_cache.py)
+shared_cache = SharedCache.from_env()
+
+# DSPy LM-call cache, versioned by the programs' fingerprint (shared store or IST_LM_CACHE_DIR, see shared_cache.py)
+lm_cache = LMCallCache.from_env(shared_cache)
+
+# Write-behind IST event segments (IST_EVENT_DIR, see event_sink.py)
+event_sink = EventSink.from_env()
+
+# Durable idempotency keys for IST requests (IST_IDEMPOTENCY_DB, see idempotency.py)
+idempotency_store = IdempotencyStore.from_env()
+IDEMPOTENCY_WAIT_S = float(os.getenv("IST_IDEMPOTENCY_WAIT_S", "60"))
+
+# Mirror a fraction of IST requests to a candidate model/program (IST_SHADOW_RATE, see shadow.py)
+shadow_runner = ShadowRunner.from_env()
+
+# Rolling per-thread chat summaries, folded off the request path (IST_THREAD_SUMMARY_DB, see conversation_summary.py)
+thread_summarizer = ConversationSummarizer.from_env()
+
+# Batched personalized assessments with cached course digests (IST_ASSESSMENT_DB, see assessment.py)
+assessment_runner = AssessmentRunner.from_env()
+
+# Per-thread WebSocket chat sessions with warm context (IST_WS_*, see chat_sessions.py)
+chat_sessions = ChatSessionManager.from_env()
+
+# On-demand and 1-in-N request profiling (IST_PROFILE_TOKEN / IST_PROFILE_SAMPLE_N, see request_profiler.py)
+request_profiler = RequestProfiler.from_env()
+
+# IST requests per /api/intent-skill-trajectory/batch call, and how many of them run at once
+BATCH_MAX_ITEMS = int(os.getenv("IST_BATCH_MAX_ITEMS", "32"))
+BATCH_CONCURRENCY = int(os.getenv("IST_BATCH_CONCURRENCY", "8"))
+
+# Truncate history lists to what the prompt builders use before validating them
+# (IST_TRUNCATE_HISTORY=0 keeps every item, e.g. for memory benchmarks).
+TRUNCATE_HISTORY = os.getenv("IST_TRUNCATE_HISTORY", "1").strip().lower() not in ("0", "false", "no")
+
 
 # ============================================================================
 # Pydantic Models for API Requests/Responses
@@ -66,17 +176,70 @@ class StudentProfile(BaseModel):
     weak_skills: List[str] = []
     course_progress: Optional[str] = None
 
+    @field_validator("strong_skills", "weak_skills", mode="before")
+    @classmethod
+    def _truncate_skills(cls, value):
+        if TRUNCATE_HISTORY and isinstance(value, list):
+            return value[:PROFILE_SKILLS_PROMPT_LIMIT]
+        return value
+
 
 class IntentSkillRequest(BaseModel):
     """Request model for intent-skill-trajectory extraction endpoint."""
     utterance: str = Field(..., description="Student's message / question in natural language", min_length=1)
     course_context: Optional[str] = Field(None, description="Optional context about the course, topic, or recent activity")
+    course_id: Optional[str] = Field(None, description="Course id used to pick a course-specific IST program (parsed from 'Course: <id>' context when omitted)")
+    user_id: Optional[str] = Field(None, description="Optional student id used for per-user token accounting and budgets")
+    pipeline: Optional[Literal["monolithic", "decomposed", "cascade"]] = Field(None, description="IST pipeline for this request (defaults to IST_PIPELINE)")
+    output_mode: Optional[Literal["json_string", "typed"]] = Field(None, description="Monolithic output mode: JSON-in-a-string or typed fields (defaults to IST_OUTPUT_MODE)")
+    trajectory_source: Optional[Literal["llm", "graph"]] = Field(None, description="Trajectory from the LM or from the course's prerequisite skill graph (defaults to IST_TRAJECTORY_SOURCE)")
+    idempotency_key: Optional[str] = Field(None, max_length=256, description="Optional key (e.g. the chat message id); repeats return the first result instead of recomputing it")
+    thread_id: Optional[str] = Field(None, max_length=256, description="Optional chat thread id; older turns of the thread are sent as a rolling summary (needs IST_THREAD_SUMMARY_DB)")
     
     # STEP 2: Extended fields for richer context (optional with safe defaults for backward compatibility)
     chat_history: List[ChatMessage] = []
     ist_history: List[IstHistoryItem] = []
     student_profile: Optional[StudentProfile] = None
 
+    # History sizes as received, before truncation to the prompt limits.
+    _chat_history_total: int = PrivateAttr(default=0)
+    _ist_history_total: int = PrivateAttr(default=0)
+
+    @model_validator(mode="wrap")
+    @classmethod
+    def _truncate_histories(cls, data, handler):
+        """
+        Slice history lists down to what the prompt can use *before* their items
+        are validated, so a whole semester of history costs a list slice rather
+        than thousands of model instances.
+        """
+        chat_total = ist_total = None
+        if TRUNCATE_HISTORY and isinstance(data, dict):
+            data = dict(data)
+            chat_history = data.get("chat_history")
+            if isinstance(chat_history, list):
+                chat_total = len(chat_history)
+                data["chat_history"] = chat_history[-CHAT_HISTORY_PROMPT_LIMIT:]
+            ist_history = data.get("ist_history")
+            if isinstance(ist_history, list):
+                ist_total = len(ist_history)
+                data["ist_history"] = ist_history[:IST_HISTORY_PROMPT_LIMIT]
+
+        with tracing.span("ist.validate_request") as span:
+            model = handler(data)
+            span.set_attributes({"ist.chat_history_total": chat_total, "ist.ist_history_total": ist_total})
+        model._chat_history_total = chat_total if chat_total is not None else len(model.chat_history)
+        model._ist_history_total = ist_total if ist_total is not None else len(model.ist_history)
+        return model
+
+    @property
+    def chat_history_total(self) -> int:
+        return self._chat_history_total
+
+    @property
+    def ist_history_total(self) -> int:
+        return self._ist_history_total
+
 
 class IntentSkillResponse(BaseModel):
     """Response model for intent-skill-trajectory extraction endpoint."""
@@ -85,6 +248,152 @@ class IntentSkillResponse(BaseModel):
     trajectory: List[str]
 
 
+class IntentSkillBatchRequest(BaseModel):
+    """Request model for the batch endpoint: independent IST requests, answered in order."""
+    requests: List[IntentSkillRequest] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS)
+
+
+class TutorTurnRequest(IntentSkillRequest):
+    """
+    Request model for the fused tutor-turn endpoint: an IST request plus the
+    course material the tutor answers from. pipeline, output_mode,
+    trajectory_source and idempotency_key do not apply and are ignored.
+    """
+    course_material: Optional[str] = Field(None, description="Course material for the tutor reply (retrieved course passages are used when omitted)")
+
+
+class AssessmentStudent(BaseModel):
+    """One student of an assessment batch."""
+    user_id: str = Field(..., min_length=1, max_length=256)
+    learning_path: Optional[str] = Field(None, description="Optional short description of the student's learning path")
+    ist_events: List[IstHistoryItem] = Field([], description="IST events, most recent first; when empty they are read from IST_EVENT_DIR")
+
+
+class AssessmentBatchRequest(BaseModel):
+    """Request model for a class-wide assessment batch (replaces one generatePersonalizedAssessment call per student)."""
+    run_id: Optional[str] = Field(None, max_length=128, description="Run id; posting the same batch again resumes the run")
+    course_id: str = Field(..., min_length=1)
+    course_content: str = Field(..., min_length=1, description="The complete course content (condensed once into a cached digest)")
+    learning_objectives: str = ""
+    students: List[AssessmentStudent] = Field(..., min_length=1)
+    since: Optional[float] = Field(None, description="Only IST events at or after this Unix time")
+    until: Optional[float] = Field(None, description="Only IST events before this Unix time")
+
+
+# ============================================================================
+# Result Normalization and Budgets
+# ============================================================================
+
+def normalize_ist_result(result) -> IntentSkillResponse:
+    """
+    Defensively normalize an IST module result into an IntentSkillResponse:
+    coerce types, split comma-separated strings and fill empty fields.
+    """
+    # Validate and normalize result
+    if not isinstance(result, dict):
+        print(f"[IST][WARNING] Result is not a dict: {type(result)}")
+        result = {
+            "intent": "Error: Invalid result format",
+            "skills": [],
+            "trajectory": []
+        }
+
+    # Defensive normalization
+    intent = result.get("intent", "")
+    skills = result.get("skills") or []
+    trajectory = result.get("trajectory") or []
+
+    # Ensure types are correct
+    if not isinstance(intent, str):
+        intent = str(intent) if intent is not None else ""
+    if not isinstance(skills, list):
+        if isinstance(skills, str):
+            # Try to parse as comma-separated
+            skills = [s.strip() for s in skills.split(",") if s.strip()]
+        else:
+            skills = []
+    if not isinstance(trajectory, list):
+        if isinstance(trajectory, str):
+            trajectory = [t.strip() for t in trajectory.split(",") if t.strip()]
+        else:
+            trajectory = []
+
+    # Ensure non-empty values (fallbacks)
+    if not intent or not intent.strip():
+        intent = "Student is asking for help with a course concept."
+    if not skills:
+        skills = [f"Understand: {intent[:50]}"]
+    if not trajectory:
+        trajectory = [
+            "Review the relevant lecture notes or slides.",
+            "Watch a short explanation video on this topic.",
+            "Solve 1–3 simple practice problems about this topic.",
+        ]
+
+    # Normalize all strings in lists
+    skills = [str(s).strip() for s in skills if str(s).strip()]
+    trajectory = [str(t).strip() for t in trajectory if str(t).strip()]
+
+    # Final validation
+    intent = intent.strip()
+
+    print(f"[IST] Returning response - intent length: {len(intent)}, skills count: {len(skills)}, trajectory count: {len(trajectory)}")
+    
+    return IntentSkillResponse(
+        intent=intent,
+        skills=skills,
+        trajectory=trajectory,
+    )
+
+
+def _record_ist_event(request: IntentSkillRequest, course_id: Optional[str], result: dict, source: str) -> None:
+    """Queue the produced IST result for the event segments (no-op when IST_EVENT_DIR is unset)."""
+    if event_sink is not None:
+        event_sink.record(make_event(result, utterance=request.utterance, course_id=course_id,
+                                     user_id=request.user_id, course_context=request.course_context, source=source))
+
+
+def _semantic_cache_context(request: IntentSkillRequest, program):
+    """
+    Semantic-cache context for a request answered by `program`: entries are
+    only reused for the same program version and selectors and a similar
+    recent conversation (the same one for follow-ups).
+    """
+    selectors = (resolve_pipeline(request.pipeline), resolve_output_mode(request.output_mode),
+                 resolve_trajectory_source(request.trajectory_source))
+    return context_from_request(request.course_context, request.ist_history, request.student_profile,
+                                request.chat_history, "/".join((cached_program_fingerprint(program), *selectors)),
+                                request.utterance)
+
+
+async def _thread_summary(thread_id: Optional[str], chat_total: int) -> Optional[ThreadSummary]:
+    """The thread's rolling summary for the prompt (None without a thread id or IST_THREAD_SUMMARY_DB); read off the event loop."""
+    if thread_summarizer is None or not thread_id:
+        return None
+    return await asyncio.to_thread(thread_summarizer.summary_for, thread_id, chat_total)
+
+
+def _fold_task(request: IntentSkillRequest) -> Optional[BackgroundTask]:
+    """Post-response task that folds the thread's older turns into its summary when due."""
+    if thread_summarizer is None or not request.thread_id:
+        return None
+    return BackgroundTask(thread_summarizer.maybe_fold, request.thread_id, request.chat_history,
+                          request.chat_history_total)
+
+
+def _check_token_budget(course_id: Optional[str], user_id: Optional[str]) -> None:
+    """Raise a structured 429 when the course or user has used its LM token budget."""
+    try:
+        get_accountant().check_budget(course_id, user_id)
+    except TokenBudgetExceeded as exc:
+        print(f"[IST][BUDGET] {exc}")
+        raise HTTPException(
+            status_code=429,
+            detail=exc.to_detail(),
+            headers={"Retry-After": str(exc.retry_after_s)},
+        )
+
+
 # ============================================================================
 # API Endpoints
 # ============================================================================
@@ -100,7 +409,13 @@ async def health_check():
 
 
 @app.post("/api/intent-skill-trajectory", response_model=IntentSkillResponse)
-async def infer_intent_skill_trajectory(request: IntentSkillRequest) -> IntentSkillResponse:
+async def infer_intent_skill_trajectory(
+    request: IntentSkillRequest,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    x_ist_profile: Optional[str] = Header(None, include_in_schema=False),
+    profile: Optional[str] = Query(None, include_in_schema=False),
+) -> IntentSkillResponse:
     """
     Infer the student's intent, the relevant skills, and a suggested learning trajectory
     from a single utterance + optional course context.
@@ -109,7 +424,15 @@ async def infer_intent_skill_trajectory(request: IntentSkillRequest) -> IntentSk
         request: IntentSkillRequest with utterance and optional course_context
     
     Returns:
-        IntentSkillResponse containing intent, skills, and trajectory
+        IntentSkillResponse containing intent, skills, and trajectory.
+        LM usage for the request is reported in X-LM-* response headers, and
+        X-IST-Cache says whether the semantic cache served it ("hit"/"miss"),
+        and X-IST-Shared-Cache the same for the cross-worker exact-match cache.
+        With the profiling token in X-IST-Profile (or ?profile=), the request is
+        profiled and X-IST-Profile-File names the saved speedscope file.
+        With an idempotency_key, X-IST-Idempotency says whether the result was
+        computed ("new"), replayed ("replay") or awaited from a concurrent
+        duplicate ("waited").
     
     Example request:
         {
@@ -128,13 +451,92 @@ async def infer_intent_skill_trajectory(request: IntentSkillRequest) -> IntentSk
           ]
         }
     """
+    if request.idempotency_key and idempotency_store is not None:
+        return await _idempotent_ist(request, response, x_ist_profile, profile, background_tasks)
+    return await _infer_ist(request, response, x_ist_profile, profile, background_tasks)
+
+
+async def _claim_idempotency_key(request: IntentSkillRequest, course_id: Optional[str]):
+    """
+    Claim the request's idempotency key, waiting while a duplicate is running.
+    Returns (claim, waited); a "done" claim carries the stored result.
+    """
+    key = f"{request.user_id or ''}:{request.idempotency_key}"
+    # Only the message itself identifies the answer; history may legitimately differ between retries.
+    body_hash = request_hash({"utterance": request.utterance, "course_id": course_id,
+                              "course_context": request.course_context})
+    try:
+        # SQLite (BEGIN IMMEDIATE, busy timeout) must not block the event loop: every store call runs on a thread.
+        claim = await asyncio.to_thread(idempotency_store.claim, key, body_hash)
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_S
+        waited = claim.state == "pending"
+        while claim.state == "pending":
+            if time.monotonic() >= deadline:
+                raise HTTPException(status_code=409, headers={"Retry-After": "5"},
+                                    detail="A request with this idempotency key is still in progress")
+            await asyncio.sleep(0.05)
+            claim = await asyncio.to_thread(idempotency_store.claim, key, body_hash, count_wait=False)
+    except IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    if claim.state == "done":
+        print(f"[IST][IDEMPOTENCY] {'Awaited' if waited else 'Replayed'} result for key {request.idempotency_key!r}")
+    elif claim.took_over:
+        print(f"[IST][IDEMPOTENCY] Took over stale pending key {request.idempotency_key!r}")
+    return claim, waited
+
+
+async def _idempotent_ist(request: IntentSkillRequest, response: Response,
+                          x_ist_profile: Optional[str], profile: Optional[str],
+                          background_tasks: Optional[BackgroundTasks] = None) -> IntentSkillResponse:
+    """Serve a keyed request: replay a stored result, wait for a running duplicate, or compute and store it."""
+    course_id = resolve_course_id(request.course_id, request.course_context)
+    claim, waited = await _claim_idempotency_key(request, course_id)
+    if claim.state == "done":
+        response.headers["X-IST-Idempotency"] = "waited" if waited else "replay"
+        tracing.current_span().set_attribute("ist.idempotency", response.headers["X-IST-Idempotency"])
+        return IntentSkillResponse(**claim.result)
+
+    response.headers["X-IST-Idempotency"] = "new"
+    tracing.current_span().set_attribute("ist.idempotency", "new")
+    try:
+        with count_lm_calls() as lm_calls:
+            result = await _infer_ist(request, response, x_ist_profile, profile, background_tasks)
+    except BaseException:
+        await asyncio.to_thread(idempotency_store.release, claim)
+        raise
+    if is_fallback_result(result.model_dump()):
+        await asyncio.to_thread(idempotency_store.release, claim)  # let a retry try the LM again
+    else:
+        await asyncio.to_thread(idempotency_store.complete, claim, result.model_dump(), lm_calls=lm_calls.calls)
+    return result
+
+
+def _shared_cache_inputs(request: IntentSkillRequest, thread_summary: Optional[ThreadSummary]) -> dict:
+    """The request fields that key the shared exact-match cache."""
+    inputs = request.model_dump(include={
+        "utterance", "course_context", "chat_history", "ist_history", "student_profile",
+    })
+    if thread_summary is not None:
+        inputs["thread_summary"] = [thread_summary.thread_id, thread_summary.version]
+    return inputs
+
+
+async def _infer_ist(request: IntentSkillRequest, response: Response,
+                     x_ist_profile: Optional[str], profile: Optional[str],
+                     background_tasks: Optional[BackgroundTasks] = None) -> IntentSkillResponse:
     import traceback
     import logging
     
     logger = logging.getLogger(__name__)
     
     try:
-        from dspy_flows import ist_extractor  # import inside to read the current initialized value
+        from dspy_flows import get_ist_program  # reads the current initialized programs at call time
+
+        course_id = resolve_course_id(request.course_id, request.course_context)
+        ist_extractor = get_ist_program(course_id, request.pipeline, request.output_mode, request.trajectory_source)
+        root_span = tracing.current_span()
+        root_span.set_attributes({"ist.course_id": course_id, "ist.program": type(ist_extractor).__name__})
         
         if ist_extractor is None:
             error_msg = "IST extractor not initialized. Please restart the service."
@@ -143,12 +545,43 @@ async def infer_intent_skill_trajectory(request: IntentSkillRequest) -> IntentSk
                 status_code=500,
                 detail=error_msg
             )
+
+        thread_summary = await _thread_summary(request.thread_id, request.chat_history_total)
+        fold = _fold_task(request)
+        if fold is not None and background_tasks is not None:
+            # Cache hits count too: a fold only depends on the thread's history.
+            background_tasks.add_task(fold)
+
+        shared_inputs = None
+        if shared_cache is not None:
+            shared_inputs = _shared_cache_inputs(request, thread_summary)
+            # A store round trip (Redis socket or SQLite write lock) must not block the event loop.
+            shared_hit = await asyncio.to_thread(shared_cache.ist.lookup, ist_extractor, course_id, shared_inputs)
+            response.headers["X-IST-Shared-Cache"] = "hit" if shared_hit is not None else "miss"
+            if shared_hit is not None:
+                print(f"[IST][CACHE] Shared cache hit for course {course_id or '(none)'}")
+                root_span.set_attribute("ist.cache", "shared")
+                _record_ist_event(request, course_id, shared_hit, "shared_cache")
+                return IntentSkillResponse(**shared_hit)
+
+        cache_context = None
+        if semantic_cache is not None:
+            cache_context = _semantic_cache_context(request, ist_extractor)
+            hit = semantic_cache.lookup(course_id, request.utterance, cache_context)
+            response.headers["X-IST-Cache"] = "hit" if hit is not None else "miss"
+            if hit is not None:
+                print(f"[IST][CACHE] Semantic cache hit (similarity {hit.similarity:.2f}) for course {course_id or '(none)'}")
+                root_span.set_attribute("ist.cache", "semantic")
+                _record_ist_event(request, course_id, hit.result, "semantic_cache")
+                return IntentSkillResponse(**hit.result)
+
+        _check_token_budget(course_id, request.user_id)
         
         print(f"[IST] Processing request - utterance: {request.utterance[:100]}..., context: {request.course_context or 'None'}")
         
         # STEP 2: Log that we are receiving richer context (for debugging)
-        print(f"[IST] Received chat_history size: {len(request.chat_history)}")
-        print(f"[IST] Received ist_history size: {len(request.ist_history)}")
+        print(f"[IST] Received chat_history size: {request.chat_history_total} (using {len(request.chat_history)})")
+        print(f"[IST] Received ist_history size: {request.ist_history_total} (using {len(request.ist_history)})")
         if request.student_profile is not None:
             print(f"[IST] Received student_profile (strong_skills: {len(request.student_profile.strong_skills)}, weak_skills: {len(request.student_profile.weak_skills)})")
         
@@ -163,13 +596,34 @@ async def infer_intent_skill_trajectory(request: IntentSkillRequest) -> IntentSk
             print(f"[IST] IST history size: {len(request.ist_history)}")
             print(f"[IST] Student profile: {request.student_profile is not None}")
             
-            result = ist_extractor(
+            profile_requested = request_profiler.authorized(x_ist_profile or profile)
+            extractor_inputs = dict(
                 utterance=request.utterance,
                 course_context=request.course_context or "",
                 chat_history=request.chat_history,
                 ist_history=request.ist_history,
                 student_profile=request.student_profile,
+                chat_history_total=request.chat_history_total,
+                ist_history_total=request.ist_history_total,
+                course_id=course_id,
             )
+
+            def run_extractor():
+                # Blocks while the LM answers, so it runs on a worker thread (like the streaming endpoint).
+                with get_accountant().request_scope(course_id, request.user_id) as usage, \
+                        request_profiler.session(f"IST course={course_id or '-'}", explicit=profile_requested) as profile_session, \
+                        _background_backoff(), use_summary(thread_summary):
+                    try:
+                        return ist_extractor(**extractor_inputs), usage, profile_session
+                    finally:
+                        response.headers.update(usage.headers())
+                        print(f"[IST] LM usage: {usage.calls} calls, {usage.prompt_tokens} prompt + "
+                              f"{usage.completion_tokens} completion tokens, {usage.cache_hits} cache hits")
+
+            extract_started = time.perf_counter()
+            result, usage, profile_session = await asyncio.to_thread(run_extractor)
+            if profile_session is not None and profile_session.saved_as:
+                response.headers["X-IST-Profile-File"] = profile_session.saved_as
             
             print(f"[IST] ========== EXTRACTION COMPLETED ==========")
             print(f"[IST] Result type: {type(result)}")
@@ -185,64 +639,23 @@ async def infer_intent_skill_trajectory(request: IntentSkillRequest) -> IntentSk
             print(f"[IST][ERROR] Module error traceback:\n{traceback.format_exc()}")
             raise
         
-        # Validate and normalize result
-        if not isinstance(result, dict):
-            print(f"[IST][WARNING] Result is not a dict: {type(result)}")
-            result = {
-                "intent": "Error: Invalid result format",
-                "skills": [],
-                "trajectory": []
-            }
-        
-        # Defensive normalization
-        intent = result.get("intent", "")
-        skills = result.get("skills") or []
-        trajectory = result.get("trajectory") or []
-        
-        # Ensure types are correct
-        if not isinstance(intent, str):
-            intent = str(intent) if intent is not None else ""
-        if not isinstance(skills, list):
-            if isinstance(skills, str):
-                # Try to parse as comma-separated
-                skills = [s.strip() for s in skills.split(",") if s.strip()]
-            else:
-                skills = []
-        if not isinstance(trajectory, list):
-            if isinstance(trajectory, str):
-                trajectory = [t.strip() for t in trajectory.split(",") if t.strip()]
-            else:
-                trajectory = []
-        
-        # Ensure non-empty values (fallbacks)
-        if not intent or not intent.strip():
-            intent = "Student is asking for help with a course concept."
-        if not skills:
-            skills = [f"Understand: {intent[:50]}"]
-        if not trajectory:
-            trajectory = [
-                "Review the relevant lecture notes or slides.",
-                "Watch a short explanation video on this topic.",
-                "Solve 1–3 simple practice problems about this topic.",
-            ]
-        
-        # Normalize all strings in lists
-        skills = [str(s).strip() for s in skills if str(s).strip()]
-        trajectory = [str(t).strip() for t in trajectory if str(t).strip()]
-        
-        # Final validation
-        intent = intent.strip()
-        
-        print(f"[IST] Returning response - intent length: {len(intent)}, skills count: {len(skills)}, trajectory count: {len(trajectory)}")
-        
-        response = IntentSkillResponse(
-            intent=intent,
-            skills=skills,
-            trajectory=trajectory,
-        )
-        
-        return response
-    
+        # Only real LM answers are worth reusing for similar questions.
+        cacheable = isinstance(result, dict) and not is_fallback_result(result)
+
+        normalized = normalize_ist_result(result)
+
+        if cacheable and semantic_cache is not None:
+            semantic_cache.store(course_id, request.utterance, cache_context, normalized.model_dump())
+        if cacheable and shared_cache is not None:
+            await asyncio.to_thread(shared_cache.ist.store_result, ist_extractor, course_id, shared_inputs,
+                                    normalized.model_dump())
+        _record_ist_event(request, course_id, normalized.model_dump(), "lm" if cacheable else "fallback")
+        if shadow_runner is not None and background_tasks is not None:
+            # Runs after the response is sent; submit() only enqueues for the shadow pool.
+            background_tasks.add_task(shadow_runner.submit, extractor_inputs, normalized.model_dump(),
+                                      (time.perf_counter() - extract_started) * 1000, usage.as_dict())
+
+        return normalized
     except HTTPException:
         # Re-raise HTTP exceptions as-is
         raise
@@ -269,6 +682,524 @@ async def infer_intent_skill_trajectory(request: IntentSkillRequest) -> IntentSk
         )
 
 
+@app.post("/api/intent-skill-trajectory/batch")
+async def batch_intent_skill_trajectory(request: IntentSkillBatchRequest, background_tasks: BackgroundTasks):
+    """
+    Run several IST requests in one call, up to IST_BATCH_CONCURRENCY at a
+    time. Each item goes through the same path as
+    /api/intent-skill-trajectory (caches, idempotency keys, budgets) and fails
+    on its own: the response lists, in request order, either {"result": ...}
+    or {"error": {"status_code", "detail", "retry_after"}}.
+    """
+    semaphore = asyncio.Semaphore(max(1, BATCH_CONCURRENCY))
+
+    async def run_item(item: IntentSkillRequest) -> dict:
+        response = Response()
+        try:
+            if item.idempotency_key and idempotency_store is not None:
+                result = await _idempotent_ist(item, response, None, None, background_tasks)
+            else:
+                result = await _infer_ist(item, response, None, None, background_tasks)
+            return {"result": result.model_dump()}
+        except HTTPException as exc:
+            retry_after = (exc.headers or {}).get("Retry-After")
+            return {"error": {"status_code": exc.status_code, "detail": exc.detail,
+                              "retry_after": float(retry_after) if retry_after else None}}
+
+    async def run_limited(item: IntentSkillRequest) -> dict:
+        async with semaphore:
+            return await run_item(item)
+
+    print(f"[IST] Batch of {len(request.requests)} requests")
+    return {"results": await asyncio.gather(*(run_limited(item) for item in request.requests))}
+
+
+@contextlib.contextmanager
+def _background_backoff():
+    """Count a primary request as in flight for the shadow pool and the thread summarizer."""
+    with contextlib.ExitStack() as stack:
+        for pool in (shadow_runner, thread_summarizer):
+            if pool is not None:
+                stack.enter_context(pool.primary())
+        yield
+
+
+def _sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/intent-skill-trajectory/stream")
+async def stream_intent_skill_trajectory(request: IntentSkillRequest):
+    """
+    Same as /api/intent-skill-trajectory, streamed as Server-Sent Events so each
+    field reaches the caller as soon as it exists.
+
+    Events: `intent`, `skills` and `trajectory` (data: the field value), then
+    `done` (data: the normalized result and the request's LM usage), or
+    `error`. With the decomposed pipeline, intent and skills are sent while
+    the trajectory is still being generated; the monolithic module sends all
+    three when it finishes.
+
+    idempotency_key, the shared cache and the semantic cache work as on the
+    JSON endpoint, with the same X-IST-Idempotency, X-IST-Shared-Cache and
+    X-IST-Cache headers. A stored or cached result is streamed at once, and
+    its `done` event says where it came from ("idempotency": "replay" or
+    "waited", or "cache": "shared" or "hit") instead of carrying LM usage.
+    """
+    from dspy_flows import get_ist_program  # reads the current initialized programs at call time
+
+    course_id = resolve_course_id(request.course_id, request.course_context)
+    pipeline = resolve_pipeline(request.pipeline)
+    ist_extractor = get_ist_program(course_id, pipeline, request.output_mode, request.trajectory_source)
+    if ist_extractor is None:
+        raise HTTPException(status_code=500, detail="IST extractor not initialized. Please restart the service.")
+
+    fields = ("intent", "skills", "trajectory")
+    headers = {"Cache-Control": "no-cache"}
+    # A result that is streamed without calling the LM: (result, event source or None, extra `done` data).
+    served = None
+    claim = None
+    if request.idempotency_key and idempotency_store is not None:
+        claim, waited = await _claim_idempotency_key(request, course_id)
+        if claim.state == "done":
+            headers["X-IST-Idempotency"] = "waited" if waited else "replay"
+            served = (claim.result, None, {"idempotency": headers["X-IST-Idempotency"]})
+            claim = None
+        else:
+            headers["X-IST-Idempotency"] = "new"
+
+    thread_summary = await _thread_summary(request.thread_id, request.chat_history_total)
+    shared_inputs = cache_context = None
+    try:
+        if served is None and shared_cache is not None:
+            shared_inputs = _shared_cache_inputs(request, thread_summary)
+            shared_hit = await asyncio.to_thread(shared_cache.ist.lookup, ist_extractor, course_id, shared_inputs)
+            headers["X-IST-Shared-Cache"] = "hit" if shared_hit is not None else "miss"
+            if shared_hit is not None:
+                print(f"[IST][CACHE] Shared cache hit for course {course_id or '(none)'}")
+                served = (shared_hit, "shared_cache", {"cache": "shared"})
+        if served is None and semantic_cache is not None:
+            cache_context = _semantic_cache_context(request, ist_extractor)
+            hit = semantic_cache.lookup(course_id, request.utterance, cache_context)
+            headers["X-IST-Cache"] = "hit" if hit is not None else "miss"
+            if hit is not None:
+                print(f"[IST][CACHE] Semantic cache hit (similarity {hit.similarity:.2f}) for course {course_id or '(none)'}")
+                served = (hit.result, "semantic_cache", {"cache": "hit"})
+        if served is None:
+            _check_token_budget(course_id, request.user_id)
+    except BaseException:
+        if claim is not None:
+            await asyncio.to_thread(idempotency_store.release, claim)
+        raise
+    if served is not None and claim is not None:
+        # Served from a cache under a new key: store it like an LM answer so retries replay it.
+        await asyncio.to_thread(idempotency_store.complete, claim, served[0], lm_calls=0)
+        claim = None
+
+    print(f"[IST] Streaming request ({pipeline}) - utterance: {request.utterance[:100]}...")
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def on_field(name, value):
+        loop.call_soon_threadsafe(queue.put_nowait, (name, value))
+
+    def run_extractor():
+        kwargs = dict(
+            utterance=request.utterance,
+            course_context=request.course_context or "",
+            chat_history=request.chat_history,
+            ist_history=request.ist_history,
+            student_profile=request.student_profile,
+            chat_history_total=request.chat_history_total,
+            ist_history_total=request.ist_history_total,
+            course_id=course_id,
+        )
+        if pipeline == "decomposed":
+            kwargs["on_field"] = on_field
+        with get_accountant().request_scope(course_id, request.user_id) as usage, _background_backoff(), \
+                use_summary(thread_summary):
+            return ist_extractor(**kwargs), usage
+
+    async def events():
+        if served is not None:
+            result, source, done = served
+            for field in fields:
+                yield _sse_event(field, result[field])
+            if source is not None:
+                _record_ist_event(request, course_id, result, source)
+            yield _sse_event("done", {"result": result, **done})
+            return
+
+        settled = claim is None
+        try:
+            task = asyncio.ensure_future(asyncio.to_thread(run_extractor))
+            task.add_done_callback(lambda _: queue.put_nowait(None))
+            sent = set()
+            while (item := await queue.get()) is not None:
+                name, value = item
+                sent.add(name)
+                yield _sse_event(name, value)
+
+            try:
+                result, usage = task.result()
+            except Exception as e:
+                print(f"[IST][ERROR] Streaming extraction failed: {type(e).__name__}: {e}")
+                yield _sse_event("error", {"detail": f"{type(e).__name__}: {e}"})
+                return
+
+            fallback = not isinstance(result, dict) or is_fallback_result(result)
+            normalized = normalize_ist_result(result)
+            for field in fields:
+                if field not in sent:
+                    yield _sse_event(field, getattr(normalized, field))
+            if not fallback:
+                if semantic_cache is not None:
+                    semantic_cache.store(course_id, request.utterance, cache_context, normalized.model_dump())
+                if shared_cache is not None:
+                    await asyncio.to_thread(shared_cache.ist.store_result, ist_extractor, course_id, shared_inputs,
+                                            normalized.model_dump())
+                if claim is not None:
+                    await asyncio.to_thread(idempotency_store.complete, claim, normalized.model_dump(),
+                                            lm_calls=usage.calls)
+                    settled = True
+            _record_ist_event(request, course_id, normalized.model_dump(), "fallback" if fallback else "lm")
+            yield _sse_event("done", {"result": normalized.model_dump(), "lm_usage": usage.as_dict()})
+        finally:
+            if not settled:
+                # Errors, fallbacks and dropped connections let a retry run the LM again.
+                await asyncio.to_thread(idempotency_store.release, claim)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers,
+                             background=_fold_task(request))
+
+
+@app.post("/api/tutor-turn")
+async def tutor_turn(request: TutorTurnRequest):
+    """
+    Socratic tutor reply and IST extraction for one student message from a
+    single LM call (replaces the tutor generation plus the separate
+    /api/intent-skill-trajectory call).
+
+    Server-Sent Events: `reply` (data: a chunk of the reply text, in order)
+    as the LM generates it, then `done` (data: the full reply, the normalized
+    IST result and the request's LM usage), or `error`. The IST fields are
+    only complete after the reply, so they arrive in `done`.
+    """
+    from dspy_flows import get_tutor_turn_program
+
+    course_id = resolve_course_id(request.course_id, request.course_context)
+    _check_token_budget(course_id, request.user_id)
+    module = get_tutor_turn_program()
+
+    thread_summary = await _thread_summary(request.thread_id, request.chat_history_total)
+    print(f"[IST] Tutor turn - utterance: {request.utterance[:100]}...")
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def on_reply_chunk(chunk: str):
+        loop.call_soon_threadsafe(queue.put_nowait, chunk)
+
+    def run_turn():
+        with get_accountant().request_scope(course_id, request.user_id) as usage, _background_backoff(), \
+                use_summary(thread_summary):
+            result = module(
+                utterance=request.utterance,
+                course_context=request.course_context or "",
+                chat_history=request.chat_history,
+                ist_history=request.ist_history,
+                student_profile=request.student_profile,
+                chat_history_total=request.chat_history_total,
+                ist_history_total=request.ist_history_total,
+                course_id=course_id,
+                course_material=request.course_material,
+                on_reply_chunk=on_reply_chunk,
+            )
+            return result, usage
+
+    async def events():
+        task = asyncio.ensure_future(asyncio.to_thread(run_turn))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        while (chunk := await queue.get()) is not None:
+            yield _sse_event("reply", chunk)
+
+        try:
+            result, usage = task.result()
+        except Exception as e:
+            print(f"[IST][ERROR] Tutor turn failed: {type(e).__name__}: {e}")
+            yield _sse_event("error", {"detail": f"{type(e).__name__}: {e}"})
+            return
+
+        normalized = normalize_ist_result(result)
+        fallback = is_fallback_result(result)
+        _record_ist_event(request, course_id, normalized.model_dump(), "fallback" if fallback else "tutor_turn")
+        yield _sse_event("done", {"reply": result.get("reply", ""), "result": normalized.model_dump(),
+                                  "lm_usage": usage.as_dict()})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"},
+                             background=_fold_task(request))
+
+
+async def _chat_session_utterance(session: ChatSession, channel: SessionChannel, data: dict) -> None:
+    """Run IST on one utterance of a chat session and push the partials and the result on its channel."""
+    from dspy_flows import get_ist_program
+
+    msg_id = data.get("id")
+    utterance = str(data.get("utterance") or "").strip()
+    if not utterance:
+        await channel.send({"type": "error", "id": msg_id, "detail": "utterance is required"})
+        return
+    course_id = resolve_course_id(session.course_id, session.course_context)
+    pipeline = resolve_pipeline(session.pipeline)
+    ist_extractor = get_ist_program(course_id, pipeline, session.output_mode, session.trajectory_source)
+    if ist_extractor is None:
+        await channel.send({"type": "error", "id": msg_id, "detail": "IST extractor not initialized"})
+        return
+    try:
+        _check_token_budget(course_id, session.user_id)
+    except HTTPException as exc:
+        await channel.send({"type": "error", "id": msg_id, "detail": exc.detail})
+        return
+
+    chat_sessions.count("utterances")
+    thread_summary = await _thread_summary(session.thread_id, session.chat_total)
+    sections = session.sections(thread_summary)
+    kwargs = session.extractor_inputs(utterance)
+    loop = asyncio.get_running_loop()
+    if pipeline == "decomposed":
+        kwargs["on_field"] = lambda name, value: loop.call_soon_threadsafe(
+            channel.offer, {"type": "field", "id": msg_id, "name": name, "value": value})
+
+    def run_extractor():
+        with get_accountant().request_scope(course_id, session.user_id) as usage, _background_backoff(), \
+                use_summary(thread_summary), use_context_sections(sections):
+            return ist_extractor(**kwargs), usage
+
+    print(f"[IST][WS] Thread {session.thread_id} ({pipeline}) - utterance: {utterance[:100]}...")
+    try:
+        result, usage = await asyncio.to_thread(run_extractor)
+    except Exception as e:
+        print(f"[IST][ERROR] Chat session extraction failed: {type(e).__name__}: {e}")
+        await channel.send({"type": "error", "id": msg_id, "detail": f"{type(e).__name__}: {e}"})
+        return
+
+    normalized = normalize_ist_result(result).model_dump()
+    fallback = not isinstance(result, dict) or is_fallback_result(result)
+    if event_sink is not None:
+        event_sink.record(make_event(normalized, utterance=utterance, course_id=course_id, user_id=session.user_id,
+                                     course_context=session.course_context, source="fallback" if fallback else "lm"))
+    session.add_message("student", utterance)
+    session.add_ist(normalized)
+    await channel.send({"type": "result", "id": msg_id, "result": normalized, "lm_usage": usage.as_dict()})
+    if thread_summarizer is not None:
+        await asyncio.to_thread(thread_summarizer.maybe_fold, session.thread_id, list(session.chat_history),
+                                session.chat_total)
+
+
+@app.websocket("/ws/chat/{thread_id}")
+async def chat_session_socket(websocket: WebSocket, thread_id: str):
+    """
+    Chat session for one thread: the client seeds the thread's context once
+    ("init") and then sends only new utterances; IST partials and results are
+    pushed back on the connection. See chat_sessions.py for the protocol and
+    the per-worker limits (IST_WS_*).
+    """
+    await websocket.accept()
+    owner = SessionOwner()
+    session = chat_sessions.connect(thread_id, owner)
+    if session is None:
+        print(f"[IST][WS] Rejected thread {thread_id}: {chat_sessions.max_sessions} sessions already open")
+        await websocket.send_json({"type": "error", "detail": "Too many chat sessions on this worker, retry later"})
+        await websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+        return
+    if owner.predecessor is not None:
+        # Let the superseded connection finish an utterance it is still handling.
+        if not await owner.predecessor.wait_finished(chat_sessions.takeover_wait_s):
+            print(f"[IST][WS] Took over thread {thread_id} before the old connection finished")
+
+    channel = chat_sessions.channel(websocket.send_json)
+    channel.start()
+
+    def ready() -> dict:
+        return {"type": "ready", "thread_id": thread_id, "warm": session.seeded,
+                "chat_history_total": session.chat_total, "ist_history_total": session.ist_total}
+
+    close_code = None
+    try:
+        await channel.send(ready())
+        while True:
+            try:
+                text = await owner.receive(websocket.receive_text, chat_sessions.idle_ttl_s)
+            except asyncio.TimeoutError:
+                chat_sessions.count("idle_closed")
+                close_code = 1000
+                break
+            if text is None or not chat_sessions.owns(session, owner):
+                close_code = CLOSE_SUPERSEDED
+                break
+            session.touch()
+            try:
+                data = json.loads(text)
+                kind = data.get("type")
+            except (ValueError, AttributeError):
+                await channel.send({"type": "error", "detail": "Messages must be JSON objects"})
+                continue
+
+            if kind == "utterance":
+                await _chat_session_utterance(session, channel, data)
+            elif kind == "init":
+                try:
+                    session.seed(*SessionInit.from_message(data))
+                except ValidationError as exc:
+                    await channel.send({"type": "error", "detail": exc.errors(include_url=False, include_context=False)})
+                    continue
+                await channel.send(ready())
+            elif kind == "message":
+                try:
+                    session.add_message(str(data.get("role") or "tutor"), str(data.get("content") or ""))
+                except ValidationError as exc:
+                    await channel.send({"type": "error", "detail": exc.errors(include_url=False, include_context=False)})
+            elif kind == "ping":
+                await channel.send({"type": "pong"})
+            else:
+                await channel.send({"type": "error", "detail": f"Unknown message type {kind!r}"})
+    except WebSocketDisconnect:
+        pass
+    except SlowConsumer as exc:
+        print(f"[IST][WS] Closing thread {thread_id}: {exc}")
+        chat_sessions.count("slow_consumer_closed")
+        close_code = CLOSE_TRY_AGAIN_LATER
+    finally:
+        chat_sessions.release(session, owner)
+        owner.finish()
+        await channel.close()
+        if close_code is not None:
+            with contextlib.suppress(Exception):
+                await websocket.close(code=close_code)
+
+
+def _require_assessments() -> AssessmentRunner:
+    if assessment_runner is None:
+        raise HTTPException(status_code=404, detail="Assessments are disabled (IST_ASSESSMENT_DB is not set)")
+    return assessment_runner
+
+
+@app.post("/api/assessment/batch", status_code=202)
+async def start_assessment_batch(request: AssessmentBatchRequest):
+    """
+    Start (or resume) personalized assessments for a class. The batch runs in
+    the background; the response is its progress report. Poll
+    GET /api/assessment/batch/{run_id} for progress and results.
+    """
+    runner = _require_assessments()
+    try:
+        return await asyncio.to_thread(runner.start, request.model_dump())
+    except AssessmentRunConflict as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+
+
+@app.get("/api/assessment/batch/{run_id}")
+async def assessment_batch_report(run_id: str, results: bool = False):
+    """Progress report of an assessment run (done, failed, remaining, ETA); results=true adds each student's assessment."""
+    report = _require_assessments().report(run_id, include_results=results)
+    if report is None:
+        raise HTTPException(status_code=404, detail=f"No assessment run {run_id!r}")
+    return report
+
+
+@app.get("/api/metrics")
+async def metrics():
+    """LM token/cost totals, semantic/shared/LM-call cache hit rates, event sink, idempotency and tracing counters, output-mode retry/fallback rates, cascade escalations, shadow agreement, thread summaries, chat sessions, assessment runs, registry, retrieval, skill graph and profiler counters."""
+    import dspy_flows
+
+    registry = dspy_flows.program_registry
+    retriever = dspy_flows.course_retriever
+    graphs = dspy_flows.skill_graphs
+    return {
+        "lm": get_accountant().stats(),
+        "semantic_cache": semantic_cache.stats() if semantic_cache is not None else None,
+        "shared_cache": shared_cache.stats() if shared_cache is not None else None,
+        "lm_cache": lm_cache.stats() if lm_cache is not None else None,
+        "events": event_sink.stats() if event_sink is not None else None,
+        "idempotency": idempotency_store.stats() if idempotency_store is not None else None,
+        "tracing": tracing.get_tracer().stats() if tracing.get_tracer() is not None else None,
+        "output_modes": dspy_flows.output_mode_stats.stats(),
+        "cascade": dspy_flows.cascade_stats.stats(),
+        "shadow": shadow_runner.stats() if shadow_runner is not None else None,
+        "thread_summaries": thread_summarizer.stats() if thread_summarizer is not None else None,
+        "chat_sessions": chat_sessions.stats(),
+        "assessment": assessment_runner.stats() if assessment_runner is not None else None,
+        "program_registry": registry.stats() if registry is not None else None,
+        "retrieval": retriever.stats() if retriever is not None else None,
+        "skill_graph": graphs.stats() if graphs is not None else None,
+        "profiler": request_profiler.stats(),
+    }
+
+
+def _require_profile_token(token: Optional[str]) -> None:
+    if not request_profiler.token:
+        raise HTTPException(status_code=404, detail="Profiling is disabled (IST_PROFILE_TOKEN is not set)")
+    if not request_profiler.authorized(token):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+
+def _require_lm_cache(token: Optional[str]) -> LMCallCache:
+    admin_token = os.getenv("IST_ADMIN_TOKEN", "")
+    if not admin_token:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled (IST_ADMIN_TOKEN is not set)")
+    if not token or not hmac.compare_digest(token.encode(), admin_token.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    if lm_cache is None:
+        raise HTTPException(status_code=404, detail="LM-call cache is not managed (set SHARED_CACHE_URL or IST_LM_CACHE_DIR)")
+    return lm_cache
+
+
+@app.get("/api/admin/lm-cache")
+async def lm_cache_namespaces(x_ist_admin: Optional[str] = Header(None)):
+    """LM-call cache stats and its namespaces (entries, bytes, last use; current = this deploy's programs)."""
+    cache = _require_lm_cache(x_ist_admin)
+    return {"stats": cache.stats(), "namespaces": await asyncio.to_thread(cache.namespaces)}
+
+
+@app.post("/api/admin/lm-cache/purge")
+async def purge_lm_cache(older_than_days: Optional[float] = Query(None, ge=0), x_ist_admin: Optional[str] = Header(None)):
+    """
+    Delete LM-call cache namespaces of other program versions; with
+    older_than_days, only those unused for that long (e.g. keep the previous
+    deploy's entries for a rollback).
+    """
+    cache = _require_lm_cache(x_ist_admin)
+    older_than_s = older_than_days * 86_400 if older_than_days is not None else None
+    return {"deleted": await asyncio.to_thread(cache.purge, older_than_s), "current": cache.namespace}
+
+
+@app.get("/api/profile")
+async def aggregate_profile(
+    format: Literal["speedscope", "folded"] = "speedscope",
+    reset: bool = False,
+    x_ist_profile: Optional[str] = Header(None),
+):
+    """
+    Aggregate profile of the 1-in-N sampled requests (IST_PROFILE_SAMPLE_N).
+    speedscope JSON by default; format=folded returns flamegraph.pl input.
+    reset=true clears the aggregate after reading it.
+    """
+    _require_profile_token(x_ist_profile)
+    profile_data = request_profiler.aggregate(format, reset=reset)
+    if format == "folded":
+        return PlainTextResponse(profile_data)
+    return profile_data
+
+
+@app.get("/api/profile/{name}")
+async def saved_profile(name: str, x_ist_profile: Optional[str] = Header(None)):
+    """Download an on-demand profile named in a response's X-IST-Profile-File header."""
+    _require_profile_token(x_ist_profile)
+    path = request_profiler.profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"No profile named {name!r}")
+    return FileResponse(path)
+
+
 # ============================================================================
 # Startup Configuration
 # ============================================================================
@@ -281,6 +1212,14 @@ async def startup_event():
     try:
         print("🔧 Initializing DSPy Intent–Skill–Trajectory extractor...")
         initialize_ist_extractor()
+        if shared_cache is not None:
+            print(f"[CACHE] Shared cache: {shared_cache.store.stats()['backend']} "
+                  f"(LM tier {'on' if shared_cache.lm is not None else 'off'})")
+        if lm_cache is not None:
+            warmed = lm_cache.install(service_program_fingerprint())
+            stale = [ns for ns, info in lm_cache.namespaces().items() if not info["current"]]
+            print(f"[CACHE] LM-call cache namespace {lm_cache.namespace} ({warmed} entries warmed, "
+                  f"{len(stale)} older namespace(s); purge with POST /api/admin/lm-cache/purge)")
         print("✅ DSPy service initialized successfully")
     except Exception as e:
         print(f"❌ Failed to initialize DSPy service: {e}")
@@ -291,6 +1230,30 @@ async def startup_event():
         raise
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush and close any open capture, journal, event and trace outputs, the shadow and summary pools, assessment runs, the LM-call cache and the shared cache store."""
+    if capture_writer is not None:
+        capture_writer.close()
+    if shadow_runner is not None:
+        shadow_runner.close()
+    if thread_summarizer is not None:
+        thread_summarizer.close()
+    if assessment_runner is not None:
+        assessment_runner.close()
+    if lm_cache is not None:
+        lm_cache.close()
+    if shared_cache is not None:
+        shared_cache.close()
+    if event_sink is not None:
+        event_sink.close()
+    if idempotency_store is not None:
+        idempotency_store.close()
+    if tracing.get_tracer() is not None:
+        tracing.get_tracer().close()
+    get_accountant().close()
+
+
 if __name__ == "__main__":
     import uvicorn
     import sys
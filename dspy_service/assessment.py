@@ -0,0 +1,586 @@
+"""
+Batched personalized learning assessments (POST /api/assessment/batch).
+
+generatePersonalizedAssessment (src/features/ai/flows/personalized-learning-assessment.ts)
+puts the complete course content and the student's raw Q&A record into one
+prompt per student, so an end-of-week run over a class is N huge prompts that
+all repeat the same course content. A batch here runs in three stages:
+
+1. Course digest: one LM call condenses the course content against the
+   learning objectives. Digests are stored keyed by course, a hash of the
+   content and objectives and the digest program's fingerprint, so every
+   student of the batch, and later batches over unchanged content, reuse it.
+2. Student summaries: each student's IST events (intent, skills, trajectory)
+   are summarized without the LM: activity count and span, most frequent
+   skills, skills of the latest questions, recent intents and the open
+   trajectory. Events come from the event-sink segments (IST_EVENT_DIR, one
+   streaming pass over the course for the whole class) or inline from the
+   request.
+3. Assessments: one small LM call per student over digest + summary, on a
+   thread pool capped by a token bucket of LM calls per minute
+   (backfill.RateLimiter). Each student's LM usage is charged to the course
+   and the student, and the usual token budgets apply.
+
+Runs and per-student results are stored in SQLite. Posting a batch again
+with the same run_id resumes it: students with a stored result are skipped
+and failed ones retried. GET /api/assessment/batch/{run_id} reports progress
+(done, failed, remaining, throughput, ETA) and optionally the results; a run
+whose worker stopped before finishing shows up as "interrupted" until it is
+resumed.
+
+Environment variables:
+  - IST_ASSESSMENT_DB: SQLite file for runs, results and course digests (the endpoint is off when unset)
+  - IST_ASSESSMENT_WORKERS: students assessed concurrently per run (default 4)
+  - IST_ASSESSMENT_RPM: LM calls per minute per run (default 120, 0 = unlimited)
+  - IST_ASSESSMENT_DIGEST_CHARS: course content sent to the digest call (default 60000)
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import dspy
+
+from backfill import RateLimiter
+from event_sink import iter_events
+from lm_accounting import count_lm_calls, get_accountant
+from shared_cache import program_fingerprint
+
+DEFAULT_DIGEST_CHARS = 60_000
+SUMMARY_TOP_SKILLS = 8
+SUMMARY_RECENT_EVENTS = 5
+LEARNING_PATH_CHARS = 1500
+STALE_RUN_S = 300.0  # a "running" run without progress for this long is reported as interrupted
+
+
+class AssessmentRunConflict(Exception):
+    """The run id was already used for a different batch."""
+
+
+# ---------------------------------------------------------------------
+# DSPy programs
+# ---------------------------------------------------------------------
+
+class CourseDigestSignature(dspy.Signature):
+    """
+    Condense the course content into a compact digest for assessing students against the
+    learning objectives. For each objective, list the concepts, skills and typical
+    misconceptions it covers, in the order the course teaches them. Keep it under 400 words.
+    """
+
+    course_content = dspy.InputField(desc="The course content uploaded by the teacher")
+    learning_objectives = dspy.InputField(desc="The learning objectives defined by the teacher")
+    digest = dspy.OutputField(desc="Objective-by-objective digest of the course")
+
+
+class StudentAssessmentSignature(dspy.Signature):
+    """
+    You are an expert educational assessment tool. Based on the course digest, the learning
+    objectives and the summary of the student's tutoring activity, write a personalized
+    assessment that highlights where the student shows strong understanding and where they
+    need to focus more attention, then give specific suggestions for improvement based on the
+    student's own learning path.
+    """
+
+    course_digest = dspy.InputField(desc="Digest of the course content per learning objective")
+    learning_objectives = dspy.InputField(desc="The learning objectives defined by the teacher")
+    student_activity = dspy.InputField(desc="Summary of the student's questions, skills and learning path")
+    assessment: str = dspy.OutputField(desc="Personalized assessment: strengths and weaknesses")
+    suggested_areas_for_improvement: str = dspy.OutputField(desc="Specific areas to focus on next")
+
+
+class AssessmentProgram(dspy.Module):
+    """Course digest and per-student assessment predictors."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.digest = dspy.Predict(CourseDigestSignature)
+        self.assess = dspy.Predict(StudentAssessmentSignature)
+
+    def course_digest(self, course_content: str, learning_objectives: str) -> str:
+        pred = self.digest(course_content=course_content, learning_objectives=learning_objectives or "(none given)")
+        return str(pred.digest or "").strip()
+
+    def forward(self, course_digest: str, learning_objectives: str, student_activity: str) -> dict:
+        pred = self.assess(course_digest=course_digest, learning_objectives=learning_objectives or "(none given)",
+                           student_activity=student_activity)
+        return {
+            "assessment": str(pred.assessment or "").strip(),
+            "suggested_areas_for_improvement": str(pred.suggested_areas_for_improvement or "").strip(),
+        }
+
+
+# ---------------------------------------------------------------------
+# Student summaries from IST events
+# ---------------------------------------------------------------------
+
+def _event_ts(event: dict) -> Optional[float]:
+    ts = event.get("ts")
+    if isinstance(ts, (int, float)):
+        return float(ts)
+    created_at = event.get("created_at") or event.get("createdAt")
+    if isinstance(created_at, str) and created_at:
+        try:
+            return datetime.fromisoformat(created_at.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+def _day(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+
+
+class StudentActivity:
+    """Running aggregate of one student's IST events, oldest first; memory is bounded per student."""
+
+    def __init__(self, recent: int = SUMMARY_RECENT_EVENTS) -> None:
+        self.events = 0
+        self.first_ts: Optional[float] = None
+        self.last_ts: Optional[float] = None
+        self.skills: Counter = Counter()
+        self.recent: deque = deque(maxlen=recent)
+
+    def add(self, event: dict) -> None:
+        self.events += 1
+        ts = _event_ts(event)
+        if ts is not None:
+            self.first_ts = ts if self.first_ts is None else min(self.first_ts, ts)
+            self.last_ts = ts if self.last_ts is None else max(self.last_ts, ts)
+        self.skills.update(list(dict.fromkeys(str(skill).strip() for skill in event.get("skills") or [] if str(skill).strip())))
+        self.recent.append(event)
+
+    def summary(self, learning_path: Optional[str] = None) -> str:
+        lines = []
+        if learning_path and learning_path.strip():
+            lines.append(f"Learning path: {learning_path.strip()[:LEARNING_PATH_CHARS]}")
+        if not self.events:
+            lines.append("No tutoring questions recorded in this period.")
+            return "\n".join(lines)
+        span = ""
+        if self.first_ts is not None:
+            span = f" between {_day(self.first_ts)} and {_day(self.last_ts)}"
+        lines.append(f"{self.events} tutoring questions{span}.")
+        top = ", ".join(f"{skill} ({count})" for skill, count in self.skills.most_common(SUMMARY_TOP_SKILLS))
+        lines.append(f"Most frequent skills: {top}")
+        recent_skills = list(dict.fromkeys(skill for event in self.recent for skill in event.get("skills") or []))
+        lines.append(f"Skills in the latest questions: {', '.join(recent_skills[:SUMMARY_TOP_SKILLS])}")
+        lines.append("Latest questions (oldest first):")
+        lines.extend(f"  - {str(event.get('intent', ''))[:120]}" for event in self.recent)
+        trajectory = self.recent[-1].get("trajectory") or []
+        if trajectory:
+            lines.append(f"Open learning steps: {'; '.join(str(step) for step in trajectory[:5])}")
+        return "\n".join(lines)
+
+
+def collect_activity(
+    students: Iterable[dict],
+    course_id: str,
+    event_dir: Optional[str | os.PathLike] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+) -> Dict[str, StudentActivity]:
+    """
+    StudentActivity per user id: inline `ist_events` (most recent first, like
+    ist_history) when a student has them, otherwise one streaming pass over the
+    course's event-sink segments for everyone else.
+    """
+    activity: Dict[str, StudentActivity] = {}
+    from_sink = set()
+    for student in students:
+        user_id = student["user_id"]
+        activity[user_id] = StudentActivity()
+        if student.get("ist_events"):
+            for event in reversed(student["ist_events"]):
+                activity[user_id].add(event)
+        else:
+            from_sink.add(user_id)
+    if from_sink and event_dir:
+        for event in iter_events(event_dir, course_id=course_id, since=since, until=until):
+            if event.get("user_id") in from_sink:
+                activity[event["user_id"]].add(event)
+    return activity
+
+
+# ---------------------------------------------------------------------
+# Store
+# ---------------------------------------------------------------------
+
+def batch_hash(batch: dict) -> str:
+    """Hash of what determines a run's results; a resumed run must match it."""
+    payload = {key: batch.get(key) for key in ("course_id", "course_content", "learning_objectives", "since", "until")}
+    payload["students"] = [
+        {"user_id": s["user_id"], "learning_path": s.get("learning_path"), "ist_events": s.get("ist_events") or []}
+        for s in batch["students"]
+    ]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class AssessmentStore:
+    """SQLite tables for runs, per-student results and course digests (WAL, thread-local connections)."""
+
+    def __init__(self, path: str | os.PathLike) -> None:
+        self.path = str(path)
+        self._local = threading.local()
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS assessment_runs (
+                run_id TEXT PRIMARY KEY,
+                course_id TEXT NOT NULL,
+                batch_hash TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                digest_key TEXT,
+                started_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                finished_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS assessment_results (
+                run_id TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                lm_calls INTEGER NOT NULL DEFAULT 0,
+                total_tokens INTEGER NOT NULL DEFAULT 0,
+                latency_ms REAL NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (run_id, user_id)
+            );
+            CREATE TABLE IF NOT EXISTS course_digests (
+                key TEXT PRIMARY KEY,
+                course_id TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                total_tokens INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            );
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def open_run(self, run_id: str, course_id: str, run_hash: str, total: int) -> None:
+        """Create the run, or mark an existing one (same batch) running again."""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT batch_hash FROM assessment_runs WHERE run_id = ?", (run_id,)).fetchone()
+            if row is not None and row[0] != run_hash:
+                raise AssessmentRunConflict(f"Run {run_id!r} was started with a different batch")
+            if row is None:
+                conn.execute(
+                    "INSERT INTO assessment_runs (run_id, course_id, batch_hash, total, status, started_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, 'running', ?, ?)",
+                    (run_id, course_id, run_hash, total, now, now),
+                )
+            else:
+                conn.execute("UPDATE assessment_runs SET status = 'running', updated_at = ?, finished_at = NULL "
+                             "WHERE run_id = ?", (now, run_id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def set_run(self, run_id: str, **fields) -> None:
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self._connect().execute(f"UPDATE assessment_runs SET {columns} WHERE run_id = ?", (*fields.values(), run_id))
+
+    def run(self, run_id: str) -> Optional[dict]:
+        row = self._connect().execute(
+            "SELECT run_id, course_id, total, status, digest_key, started_at, updated_at, finished_at "
+            "FROM assessment_runs WHERE run_id = ?", (run_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("run_id", "course_id", "total", "status", "digest_key", "started_at", "updated_at",
+                         "finished_at"), row))
+
+    def completed(self, run_id: str) -> set:
+        rows = self._connect().execute(
+            "SELECT user_id FROM assessment_results WHERE run_id = ? AND error IS NULL", (run_id,)
+        ).fetchall()
+        return {user_id for (user_id,) in rows}
+
+    def save_result(self, run_id: str, user_id: str, result: Optional[dict] = None, error: Optional[str] = None,
+                    lm_calls: int = 0, total_tokens: int = 0, latency_ms: float = 0.0) -> None:
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO assessment_results "
+            "(run_id, user_id, result, error, lm_calls, total_tokens, latency_ms, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (run_id, user_id, json.dumps(result) if result is not None else None, error, lm_calls, total_tokens,
+             latency_ms, now),
+        )
+        conn.execute("UPDATE assessment_runs SET updated_at = ? WHERE run_id = ?", (now, run_id))
+
+    def counts(self, run_id: str) -> dict:
+        done, failed, tokens, lm_calls = self._connect().execute(
+            "SELECT COALESCE(SUM(error IS NULL), 0), COALESCE(SUM(error IS NOT NULL), 0), "
+            "COALESCE(SUM(total_tokens), 0), COALESCE(SUM(lm_calls), 0) FROM assessment_results WHERE run_id = ?",
+            (run_id,),
+        ).fetchone()
+        return {"done": done, "failed": failed, "total_tokens": tokens, "lm_calls": lm_calls}
+
+    def results(self, run_id: str) -> List[dict]:
+        rows = self._connect().execute(
+            "SELECT user_id, result, error, lm_calls, total_tokens, latency_ms FROM assessment_results "
+            "WHERE run_id = ? ORDER BY user_id", (run_id,),
+        ).fetchall()
+        return [
+            {"user_id": user_id, **(json.loads(result) if result else {}), "error": error, "lm_calls": lm_calls,
+             "total_tokens": tokens, "latency_ms": round(latency_ms, 1)}
+            for user_id, result, error, lm_calls, tokens, latency_ms in rows
+        ]
+
+    def digest(self, key: str) -> Optional[str]:
+        row = self._connect().execute("SELECT digest FROM course_digests WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def save_digest(self, key: str, course_id: str, digest: str, total_tokens: int) -> None:
+        self._connect().execute(
+            "INSERT OR REPLACE INTO course_digests (key, course_id, digest, total_tokens, created_at) VALUES (?, ?, ?, ?, ?)",
+            (key, course_id, digest, total_tokens, time.time()),
+        )
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# ---------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------
+
+class _ActiveRun:
+    __slots__ = ("thread", "started", "completed")
+
+    def __init__(self) -> None:
+        self.thread: Optional[threading.Thread] = None
+        self.started = time.monotonic()
+        self.completed = 0
+
+
+class AssessmentRunner:
+    """Runs assessment batches in background threads and reports their progress."""
+
+    def __init__(
+        self,
+        store: AssessmentStore,
+        workers: int = 4,
+        rpm: float = 120.0,
+        digest_chars: int = DEFAULT_DIGEST_CHARS,
+        event_dir: Optional[str | os.PathLike] = None,
+        program: Optional[AssessmentProgram] = None,
+        lm: Optional[dspy.LM] = None,
+    ) -> None:
+        self.store = store
+        self.workers = max(1, workers)
+        self.rpm = rpm
+        self.digest_chars = digest_chars
+        self.event_dir = event_dir
+        self.program = program or AssessmentProgram()
+        self.lm = lm  # default: the service's configured LM
+        self._lock = threading.Lock()
+        self._digest_locks: Dict[str, threading.Lock] = {}
+        self._active: Dict[str, _ActiveRun] = {}
+        self._stopping = threading.Event()
+        self._counts = {"runs": 0, "assessed": 0, "errors": 0, "digest_hits": 0, "digest_misses": 0}
+
+    @classmethod
+    def from_env(cls) -> Optional["AssessmentRunner"]:
+        path = os.getenv("IST_ASSESSMENT_DB", "").strip()
+        if not path:
+            return None
+        runner = cls(
+            AssessmentStore(path),
+            workers=int(os.getenv("IST_ASSESSMENT_WORKERS", "4")),
+            rpm=float(os.getenv("IST_ASSESSMENT_RPM", "120")),
+            digest_chars=int(os.getenv("IST_ASSESSMENT_DIGEST_CHARS", str(DEFAULT_DIGEST_CHARS))),
+            event_dir=os.getenv("IST_EVENT_DIR", "").strip() or None,
+        )
+        print(f"[ASSESS] Assessment batches in {path} ({runner.workers} workers, "
+              f"{runner.rpm:g} LM calls/min, events from {runner.event_dir or 'requests only'})")
+        return runner
+
+    def start(self, batch: dict) -> dict:
+        """Start or resume a batch in the background; returns its progress report."""
+        run_id = batch.get("run_id") or uuid.uuid4().hex
+        batch = {**batch, "run_id": run_id}
+        with self._lock:
+            if run_id in self._active:
+                return self.report(run_id)
+            self.store.open_run(run_id, batch["course_id"], batch_hash(batch), len(batch["students"]))
+            active = self._active[run_id] = _ActiveRun()
+            active.thread = threading.Thread(target=self._run_safely, args=(batch, active),
+                                             name=f"ist-assessment-{run_id[:8]}", daemon=True)
+            active.thread.start()
+        return self.report(run_id)
+
+    def run(self, batch: dict) -> dict:
+        """Run (or resume) a batch in the calling thread; returns its final report."""
+        run_id = batch.get("run_id") or uuid.uuid4().hex
+        batch = {**batch, "run_id": run_id}
+        self.store.open_run(run_id, batch["course_id"], batch_hash(batch), len(batch["students"]))
+        active = _ActiveRun()
+        with self._lock:
+            self._active[run_id] = active
+        self._run_safely(batch, active)
+        return self.report(run_id)
+
+    def _run_safely(self, batch: dict, active: _ActiveRun) -> None:
+        run_id = batch["run_id"]
+        try:
+            self._run(batch, active)
+        except Exception as e:
+            print(f"[ASSESS] ❌ Run {run_id} failed: {type(e).__name__}: {e}")
+            self.store.set_run(run_id, status="failed")
+        finally:
+            with self._lock:
+                self._active.pop(run_id, None)
+                self._counts["runs"] += 1
+
+    def _run(self, batch: dict, active: _ActiveRun) -> None:
+        run_id, course_id = batch["run_id"], batch["course_id"]
+        done = self.store.completed(run_id)
+        pending = [student for student in batch["students"] if student["user_id"] not in done]
+        print(f"[ASSESS] Run {run_id}: {len(pending)} of {len(batch['students'])} students to assess")
+        limiter = RateLimiter(self.rpm)
+
+        digest_key = self._digest_key(course_id, batch["course_content"], batch.get("learning_objectives") or "")
+        self.store.set_run(run_id, digest_key=digest_key)
+        digest = self._course_digest(digest_key, course_id, batch["course_content"],
+                                     batch.get("learning_objectives") or "", limiter) if pending else ""
+        activity = collect_activity(pending, course_id, self.event_dir, batch.get("since"), batch.get("until"))
+
+        def assess(student: dict) -> None:
+            if self._stopping.is_set():
+                return
+            user_id = student["user_id"]
+            started = time.perf_counter()
+            limiter.acquire()
+            try:
+                get_accountant().check_budget(course_id, user_id)
+                with self._lm_context(), get_accountant().request_scope(course_id, user_id), \
+                        count_lm_calls() as counter:
+                    result = self.program(course_digest=digest, learning_objectives=batch.get("learning_objectives") or "",
+                                          student_activity=activity[user_id].summary(student.get("learning_path")))
+                limiter.debit(counter.calls - 1)
+                if not result["assessment"]:
+                    raise ValueError("Empty assessment")
+            except Exception as e:  # TokenBudgetExceeded included; failed students are retried on resume
+                self.store.save_result(run_id, user_id, error=f"{type(e).__name__}: {e}",
+                                       latency_ms=(time.perf_counter() - started) * 1000)
+                with self._lock:
+                    self._counts["errors"] += 1
+                return
+            self.store.save_result(run_id, user_id, result, lm_calls=counter.calls,
+                                   total_tokens=counter.prompt_tokens + counter.completion_tokens,
+                                   latency_ms=(time.perf_counter() - started) * 1000)
+            with self._lock:
+                self._counts["assessed"] += 1
+                active.completed += 1
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ist-assess") as pool:
+            list(pool.map(assess, pending))
+
+        counts = self.store.counts(run_id)
+        if self._stopping.is_set() and counts["done"] + counts["failed"] < len(batch["students"]):
+            status = "interrupted"
+        else:
+            status = "done" if counts["failed"] == 0 else "done_with_errors"
+        self.store.set_run(run_id, status=status, finished_at=time.time())
+        print(f"[ASSESS] Run {run_id} {status}: {counts['done']} assessed, {counts['failed']} failed")
+
+    def _lm_context(self):
+        return dspy.context(lm=self.lm) if self.lm is not None else contextlib.nullcontext()
+
+    def _digest_key(self, course_id: str, course_content: str, learning_objectives: str) -> str:
+        content = course_content[: self.digest_chars]
+        payload = json.dumps([program_fingerprint(self.program.digest), course_id, content, learning_objectives])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    def _course_digest(self, key: str, course_id: str, course_content: str, learning_objectives: str,
+                       limiter: RateLimiter) -> str:
+        """Stored digest for the key, or one LM call; concurrent runs over the same content share it."""
+        with self._lock:
+            key_lock = self._digest_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            digest = self.store.digest(key)
+            if digest is not None:
+                with self._lock:
+                    self._counts["digest_hits"] += 1
+                return digest
+            limiter.acquire()
+            with self._lm_context(), get_accountant().request_scope(course_id), count_lm_calls() as counter:
+                digest = self.program.course_digest(course_content[: self.digest_chars], learning_objectives)
+            if not digest:
+                raise ValueError("Empty course digest")
+            self.store.save_digest(key, course_id, digest, counter.prompt_tokens + counter.completion_tokens)
+            with self._lock:
+                self._counts["digest_misses"] += 1
+            return digest
+
+    def report(self, run_id: str, include_results: bool = False) -> Optional[dict]:
+        run = self.store.run(run_id)
+        if run is None:
+            return None
+        counts = self.store.counts(run_id)
+        remaining = max(0, run["total"] - counts["done"])
+        with self._lock:
+            active = self._active.get(run_id)
+            rate = active.completed / (time.monotonic() - active.started) if active is not None else 0.0
+        status = run["status"]
+        if status == "running" and active is None and time.time() - run["updated_at"] > STALE_RUN_S:
+            status = "interrupted"
+        report = {
+            "run_id": run_id,
+            "course_id": run["course_id"],
+            "status": status,
+            "total": run["total"],
+            **counts,
+            "remaining": remaining,
+            "students_per_minute": round(rate * 60, 2),
+            "eta_s": round(remaining / rate, 1) if rate > 0 and status == "running" else None,
+            "digest_cached": run["digest_key"] is not None and self.store.digest(run["digest_key"]) is not None,
+            "started_at": run["started_at"],
+            "updated_at": run["updated_at"],
+            "finished_at": run["finished_at"],
+        }
+        if include_results:
+            report["results"] = self.store.results(run_id)
+        return report
+
+    def close(self, timeout_s: float = 5.0) -> None:
+        """Stop starting new students and wait (up to timeout_s) for running runs; they resume on the next POST."""
+        self._stopping.set()
+        with self._lock:
+            threads = [active.thread for active in self._active.values() if active.thread is not None]
+        for thread in threads:
+            thread.join(timeout=timeout_s)
+        self.store.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counts, "active_runs": len(self._active)}
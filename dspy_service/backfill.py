@@ -0,0 +1,572 @@
+"""
+Offline backfill: re-run IST over historical utterances after a prompt or
+model change.
+
+Sources are streamed one event at a time, never loaded whole:
+  - a JSON array file (the `ist_events.json` written by JsonIstEventRepository,
+    camelCase fields), or a JSON object wrapping one, e.g. a Data Connect
+    export {"data": {"istEvents": [...]}}: the first array in the file is read
+  - a JSONL file (one event per line)
+  - an IST event-sink directory (event_sink.py segments; sealed segments only,
+    the `.active` ones are still being written)
+Events need an `utterance`; `courseId`/`course_id`, `courseContext`,
+`userId` and `id`/`messageId` are carried over when present, and the old
+intent/skills/trajectory are kept under "previous" for diffing.
+
+Events run through the service's IST program (get_ist_program, so the
+pipeline, output mode and per-course programs match the service's env) on a
+thread or process pool. A global token bucket in the parent caps LM calls
+per minute across all workers: each submission takes one token and extra
+calls a request made (format retries, escalations) are debited afterwards.
+
+Results are appended to the output JSONL as they complete, one line per
+event with its `id` and source `index`. Resuming (the default when the output
+exists) skips every event already written successfully: by `id` when the
+event has one, since compaction and retention reorder and drop event-sink
+events between runs, and by `index` for id-less events, whose position in a
+plain JSONL file is stable. `<output>.checkpoint.json` records the contiguous
+prefix of indices that is done, and the sources the run was started with.
+Failed events are written with an "error" field and retried on the next
+resume.
+
+Usage (from dspy_service/, with the same env as the service):
+    python backfill.py src/mocks/ist/events.json --output ist-backfill.jsonl --workers 8 --rpm 500
+    python backfill.py ./ist-events --output out.jsonl --executor process --workers 4 --pipeline cascade
+    python backfill.py export.json --output out.jsonl --restart    # ignore previous progress
+"""
+
+from __future__ import annotations
+
+import argparse
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from event_sink import iter_events
+
+CHUNK_SIZE = 64 * 1024
+_WHITESPACE = " \t\r\n"
+
+
+# ---------------------------------------------------------------------
+# Streaming sources
+# ---------------------------------------------------------------------
+
+def _iter_json_array(handle: TextIO, buffer: str) -> Iterator:
+    """Yield the elements of a JSON array whose '[' has just been consumed."""
+    decoder = json.JSONDecoder()
+    pos = 0
+    eof = False
+    while True:
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE + ",":
+                pos += 1
+            if pos < len(buffer) or eof:
+                break
+            chunk = handle.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+        if pos >= len(buffer):
+            raise ValueError("JSON array is not closed")
+        if buffer[pos] == "]":
+            return
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError("Truncated element in JSON array")
+            chunk = handle.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield value
+        pos = end
+        if pos > CHUNK_SIZE:
+            buffer, pos = buffer[pos:], 0
+
+
+def iter_source(path: str | os.PathLike) -> Iterator[dict]:
+    """Stream raw event dicts from a JSON array / wrapped array / JSONL file or an event-sink directory."""
+    path = Path(path)
+    if path.is_dir():
+        yield from iter_events(path, include_active=False)
+        return
+    with open(path, "r", encoding="utf-8-sig") as handle:
+        head = handle.read(CHUNK_SIZE)
+        stripped = head.lstrip(_WHITESPACE)
+        if not stripped:
+            return
+        if stripped[0] == "{":
+            # JSONL when the first line is a whole event, or a whole object followed by more lines;
+            # otherwise (a pretty-printed or one-line wrapper) an object around the array.
+            first_line, _, rest = stripped.partition("\n")
+            try:
+                first_record = json.loads(first_line)
+                is_jsonl = "utterance" in first_record or bool(rest.strip())
+            except (json.JSONDecodeError, TypeError):
+                is_jsonl = False
+            if is_jsonl:
+                handle.seek(0)
+                for line in handle:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # truncated tail of a file still being written
+                    if isinstance(record, dict):
+                        yield record
+                return
+            # A wrapper object: stream the first array in it.
+            while "[" not in stripped:
+                chunk = handle.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                stripped += chunk
+        elif stripped[0] != "[":
+            raise ValueError(f"{path}: expected a JSON array, a JSON object or JSONL")
+        for record in _iter_json_array(handle, stripped[stripped.index("[") + 1:]):
+            if isinstance(record, dict):
+                yield record
+
+
+def normalize_event(raw: dict, index: int) -> Optional[dict]:
+    """Backfill item for a source event, or None when it has no utterance."""
+    utterance = raw.get("utterance")
+    if not isinstance(utterance, str) or not utterance.strip():
+        return None
+
+    def first(*keys):
+        for key in keys:
+            if raw.get(key) is not None:
+                return raw[key]
+        return None
+
+    return {
+        "index": index,
+        "id": first("id", "messageId", "message_id"),
+        "user_id": first("userId", "user_id"),
+        "course_id": first("courseId", "course_id"),
+        "course_context": first("courseContext", "course_context"),
+        "utterance": utterance,
+        "previous": {key: raw[key] for key in ("intent", "skills", "trajectory") if key in raw},
+    }
+
+
+def iter_items(sources: Iterable[str | os.PathLike]) -> Iterator[Tuple[int, Optional[dict]]]:
+    """
+    (index, item or None) over all sources in order. Indices are positions in
+    this pass: stable for files, not for event-sink directories (see the
+    module docstring), so resume prefers the item's id.
+    """
+    index = 0
+    for source in sources:
+        for raw in iter_source(source):
+            yield index, normalize_event(raw, index)
+            index += 1
+
+
+# ---------------------------------------------------------------------
+# Rate limit, checkpoint and progress
+# ---------------------------------------------------------------------
+
+class RateLimiter:
+    """Token bucket of LM calls per minute; `acquire` blocks, `debit` may go negative."""
+
+    def __init__(self, per_minute: float, burst: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep) -> None:
+        self.rate = per_minute / 60.0
+        self.capacity = burst if burst is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_s = (tokens - self.tokens) / self.rate
+            self._sleep(wait_s)
+
+    def debit(self, tokens: float) -> None:
+        if self.rate <= 0 or tokens <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self.tokens -= tokens
+
+
+def checkpoint_path(output: str | os.PathLike) -> Path:
+    return Path(f"{output}.checkpoint.json")
+
+
+def _read_done(output: Path, watermark: int) -> Tuple[set, set]:
+    """
+    Ids, and indices >= watermark of id-less events, written successfully;
+    drops a truncated last line.
+    """
+    done, done_ids = set(), set()
+    if not output.exists():
+        return done, done_ids
+    valid_bytes = 0
+    with open(output, "rb") as handle:
+        for line in handle:
+            if not line.endswith(b"\n"):
+                break
+            valid_bytes += len(line)
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "error" in record:
+                continue
+            if record.get("id") is not None:
+                done_ids.add(record["id"])
+            elif record.get("index", -1) >= watermark:
+                done.add(record["index"])
+    if valid_bytes < output.stat().st_size:
+        with open(output, "r+b") as handle:
+            handle.truncate(valid_bytes)
+    return done, done_ids
+
+
+class Checkpoint:
+    """
+    Completed event ids, plus the contiguous completed prefix of indices
+    (`watermark`) and completed indices beyond it. Ids decide for events that
+    have one; indices only for id-less events.
+    """
+
+    def __init__(self, path: Path, sources: List[str], watermark: int = 0, done: Optional[set] = None,
+                 done_ids: Optional[set] = None) -> None:
+        self.path = path
+        self.sources = sources
+        self.watermark = watermark
+        self.done = done or set()
+        self.done_ids = done_ids or set()
+
+    @classmethod
+    def load(cls, output: Path, sources: List[str], restart: bool = False) -> "Checkpoint":
+        path = checkpoint_path(output)
+        if restart:
+            output.unlink(missing_ok=True)
+            path.unlink(missing_ok=True)
+            return cls(path, sources)
+        watermark = 0
+        if path.exists():
+            state = json.loads(path.read_text(encoding="utf-8"))
+            if state.get("sources") != sources:
+                raise SystemExit(f"{path} belongs to a run over {state.get('sources')}; use --restart or another --output")
+            watermark = int(state.get("watermark", 0))
+        checkpoint = cls(path, sources, watermark, *_read_done(output, watermark))
+        checkpoint._advance()
+        return checkpoint
+
+    @property
+    def completed(self) -> int:
+        """Rough count of finished events, for progress."""
+        return max(self.watermark + len(self.done), len(self.done_ids))
+
+    def is_done(self, index: int, event_id: Optional[str] = None) -> bool:
+        if event_id is not None:
+            return event_id in self.done_ids
+        return index < self.watermark or index in self.done
+
+    def mark(self, index: int, event_id: Optional[str] = None) -> None:
+        if event_id is not None:
+            self.done_ids.add(event_id)
+        self.done.add(index)
+        self._advance()
+
+    def _advance(self) -> None:
+        while self.watermark in self.done:
+            self.done.discard(self.watermark)
+            self.watermark += 1
+
+    def save(self) -> None:
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"sources": self.sources, "watermark": self.watermark,
+                                   "updated_at": time.time()}), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class Progress:
+    """Live throughput (sliding window) and ETA, printed to stderr every `interval_s`."""
+
+    def __init__(self, total: Optional[int], already_done: int = 0, interval_s: float = 5.0,
+                 stream: TextIO = sys.stderr, window_s: float = 60.0) -> None:
+        self.total = total
+        self.already_done = already_done
+        self.interval_s = interval_s
+        self.stream = stream
+        self.window_s = window_s
+        self.started = time.monotonic()
+        self.completed = 0
+        self.counts = {"errors": 0, "fallbacks": 0, "invalid": 0, "lm_calls": 0}
+        self._recent: deque = deque()
+        self._printed = self.started
+
+    def record(self, **counts: int) -> None:
+        now = time.monotonic()
+        self.completed += 1
+        self._recent.append(now)
+        while self._recent and now - self._recent[0] > self.window_s:
+            self._recent.popleft()
+        for key, value in counts.items():
+            self.counts[key] += value
+        if now - self._printed >= self.interval_s:
+            self._printed = now
+            self.print_line()
+
+    def rate(self) -> float:
+        now = time.monotonic()
+        span = min(self.window_s, now - self.started)
+        return len(self._recent) / span if span > 0 else 0.0
+
+    def print_line(self) -> None:
+        done = self.already_done + self.completed
+        rate = self.rate()
+        if self.total:
+            remaining = max(0, self.total - done)
+            eta = _format_duration(remaining / rate) if rate > 0 else "?"
+            position = f"{done}/{self.total} ({100 * done / self.total:.1f}%)"
+        else:
+            eta, position = "?", str(done)
+        print(f"[BACKFILL] {position} {rate:.2f} ev/s ETA {eta} | fallbacks {self.counts['fallbacks']} "
+              f"errors {self.counts['errors']} lm_calls {self.counts['lm_calls']}", file=self.stream, flush=True)
+
+
+# ---------------------------------------------------------------------
+# Workers
+# ---------------------------------------------------------------------
+
+def _init_worker(quiet: bool) -> None:
+    """Process-pool initializer: configure the LM and programs from the service env."""
+    import dspy_flows
+
+    if quiet:
+        sys.stdout = open(os.devnull, "w")
+    dspy_flows.initialize_ist_extractor()
+
+
+def extract_item(item: dict, pipeline: Optional[str] = None, output_mode: Optional[str] = None) -> dict:
+    """Run the service's IST program for one item (in a worker thread or process)."""
+    from dspy_flows import get_ist_program, is_fallback_result
+    from lm_accounting import count_lm_calls
+
+    program = get_ist_program(item["course_id"], pipeline, output_mode)
+    started = time.perf_counter()
+    with count_lm_calls() as counter:
+        result = program(
+            utterance=item["utterance"],
+            course_context=item["course_context"] or "",
+            course_id=item["course_id"],
+        )
+    return {
+        "intent": result["intent"],
+        "skills": result["skills"],
+        "trajectory": result["trajectory"],
+        "fallback": is_fallback_result(result),
+        "lm_calls": counter.calls,
+        "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def run_backfill(
+    sources: List[str],
+    output: str | os.PathLike,
+    extract: Optional[Callable[[dict], dict]] = None,
+    pipeline: Optional[str] = None,
+    output_mode: Optional[str] = None,
+    workers: int = 4,
+    executor: str = "thread",
+    rpm: float = 0.0,
+    restart: bool = False,
+    limit: Optional[int] = None,
+    progress_interval_s: float = 5.0,
+    count_total: bool = True,
+    checkpoint_every: int = 50,
+    quiet: bool = True,
+    progress_stream: TextIO = sys.stderr,
+) -> dict:
+    """
+    Backfill `sources` into `output` (see module docstring). `extract(item)`
+    returns the result dict for one item; by default extract_item with
+    `pipeline` / `output_mode`, using the service's IST programs initialized
+    from the environment (per process for executor="process"). Returns the
+    run summary.
+    """
+    if executor not in ("thread", "process"):
+        raise ValueError(f"Unknown executor {executor!r} (thread or process)")
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    sources = [str(Path(source)) for source in sources]
+    checkpoint = Checkpoint.load(output, sources, restart=restart)
+    resumed_from = checkpoint.completed
+
+    total = None
+    if count_total:
+        total = sum(1 for _ in iter_items(sources))
+        if limit is not None:
+            total = min(total, limit)
+    limiter = RateLimiter(rpm)
+    progress = Progress(total, already_done=resumed_from, interval_s=progress_interval_s, stream=progress_stream)
+
+    initializer, initargs = None, ()
+    if extract is None:
+        extract = functools.partial(extract_item, pipeline=pipeline, output_mode=output_mode)
+        if executor == "process":
+            initializer, initargs = _init_worker, (quiet,)
+        else:
+            import dspy_flows
+
+            dspy_flows.initialize_ist_extractor()
+
+    pool_cls = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+    max_in_flight = max(1, workers) * 2
+    since_checkpoint = 0
+    summary = {"submitted": 0, "written": 0, "skipped_done": 0, "invalid": 0, "errors": 0, "fallbacks": 0, "lm_calls": 0}
+    started = time.monotonic()
+
+    print(f"[BACKFILL] {len(sources)} source(s) -> {output} ({executor} x{workers}, "
+          f"{'unlimited' if rpm <= 0 else f'{rpm:g} LM calls/min'}); resuming after {resumed_from} done",
+          file=progress_stream, flush=True)
+
+    saved_stdout = sys.stdout
+    if quiet and executor == "thread":
+        sys.stdout = open(os.devnull, "w")  # the IST modules log every step to stdout
+    try:
+        with open(output, "a", encoding="utf-8") as out, \
+                pool_cls(max_workers=max(1, workers), initializer=initializer, initargs=initargs) as pool:
+            pending = {}
+
+            def drain(block: bool) -> None:
+                nonlocal since_checkpoint
+                if not pending:
+                    return
+                finished, _ = wait(list(pending), timeout=None if block else 0, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    item = pending.pop(future)
+                    record = {key: item[key] for key in ("index", "id", "user_id", "course_id", "utterance")}
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        record["error"] = f"{type(e).__name__}: {e}"
+                        summary["errors"] += 1
+                        progress.record(errors=1)
+                    else:
+                        record.update(result)
+                        if item["previous"]:
+                            record["previous"] = item["previous"]
+                        calls = int(result.get("lm_calls", 1))
+                        limiter.debit(calls - 1)
+                        summary["fallbacks"] += int(bool(result.get("fallback")))
+                        summary["lm_calls"] += calls
+                        progress.record(fallbacks=int(bool(result.get("fallback"))), lm_calls=calls)
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    summary["written"] += 1
+                    if "error" not in record:
+                        checkpoint.mark(item["index"], item["id"])
+                    since_checkpoint += 1
+                if since_checkpoint >= checkpoint_every:
+                    out.flush()
+                    os.fsync(out.fileno())
+                    checkpoint.save()
+                    since_checkpoint = 0
+
+            for count, (index, item) in enumerate(iter_items(sources)):
+                if limit is not None and count >= limit:
+                    break
+                event_id = item["id"] if item is not None else None
+                if checkpoint.is_done(index, event_id):
+                    summary["skipped_done"] += 1
+                    if event_id is not None:
+                        checkpoint.mark(index)  # keeps the watermark moving past id-keyed events
+                    continue
+                if item is None:
+                    summary["invalid"] += 1
+                    checkpoint.mark(index)
+                    progress.record(invalid=1)
+                    continue
+                while len(pending) >= max_in_flight:
+                    drain(block=True)
+                limiter.acquire()
+                pending[pool.submit(extract, item)] = item
+                summary["submitted"] += 1
+                drain(block=False)
+            while pending:
+                drain(block=True)
+            out.flush()
+            os.fsync(out.fileno())
+            checkpoint.save()
+    finally:
+        if sys.stdout is not saved_stdout:
+            sys.stdout.close()
+            sys.stdout = saved_stdout
+
+    progress.print_line()
+    wall_s = time.monotonic() - started
+    summary.update(
+        wall_time_s=round(wall_s, 2),
+        throughput_per_s=round(summary["submitted"] / wall_s, 3) if wall_s > 0 else 0.0,
+        watermark=checkpoint.watermark,
+        output=str(output),
+    )
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Re-run IST over historical events (resumable).")
+    parser.add_argument("sources", nargs="+", help="JSON array / JSONL files or event-sink directories")
+    parser.add_argument("--output", required=True, help="Result JSONL (appended to; also the resume state)")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent extractions (default: 4)")
+    parser.add_argument("--executor", choices=("thread", "process"), default="thread")
+    parser.add_argument("--rpm", type=float, default=0.0, help="Global LM calls per minute (0 = unlimited)")
+    parser.add_argument("--pipeline", choices=("monolithic", "decomposed", "cascade"), default=None)
+    parser.add_argument("--output-mode", choices=("json_string", "typed"), default=None)
+    parser.add_argument("--limit", type=int, default=None, help="Only the first N source events")
+    parser.add_argument("--restart", action="store_true", help="Discard the output and checkpoint first")
+    parser.add_argument("--no-count", action="store_true", help="Skip the counting pass (no ETA)")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="Seconds between progress lines")
+    parser.add_argument("--verbose", action="store_true", help="Keep the IST modules' step logging")
+    args = parser.parse_args(argv)
+
+    summary = run_backfill(
+        args.sources, args.output, pipeline=args.pipeline, output_mode=args.output_mode,
+        workers=args.workers, executor=args.executor,
+        rpm=args.rpm, restart=args.restart, limit=args.limit, progress_interval_s=args.progress_interval,
+        count_total=not args.no_count, quiet=not args.verbose,
+    )
+    print(json.dumps(summary, indent=2))
+    return 0 if summary["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
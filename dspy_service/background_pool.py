@@ -0,0 +1,140 @@
+"""
+Bounded, droppable worker pool for background LM work that must never slow
+down primary requests (shadow comparisons, conversation summary folds).
+
+Jobs are enqueued without blocking and dropped first under load: when the
+queue is full, when too many primary requests are in flight at submit time,
+and again when a worker picks the job up. Primary IST work is wrapped in
+primary() so the pool can tell.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import queue
+import threading
+import time
+from typing import Callable, Iterator, List, Optional
+
+import dspy
+
+
+class BackgroundPool:
+    """`workers` daemon threads calling handler(*job) for queued jobs, with load shedding."""
+
+    def __init__(
+        self,
+        handler: Callable[..., None],
+        name: str,
+        workers: int = 1,
+        max_queue: int = 16,
+        max_primary_inflight: int = 8,
+        on_finished: Optional[Callable[[tuple], None]] = None,
+    ) -> None:
+        self.handler = handler
+        self.max_primary_inflight = max_primary_inflight
+        self._on_finished = on_finished
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, max_queue))
+        self._lock = threading.Lock()
+        self._primary_inflight = 0
+        self.closed = False
+        self._counts = {"dropped_queue_full": 0, "dropped_load": 0}
+        self._threads: List[threading.Thread] = [
+            threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @contextlib.contextmanager
+    def primary(self) -> Iterator[None]:
+        """Wrap primary IST work so background jobs can back off while it runs."""
+        with self._lock:
+            self._primary_inflight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._primary_inflight -= 1
+
+    def _overloaded(self) -> bool:
+        return self._primary_inflight >= self.max_primary_inflight
+
+    def submit(self, job: tuple) -> bool:
+        """Queue a job. Never blocks; False (and counted) when closed, under load or full."""
+        if self.closed:
+            return False
+        with self._lock:
+            if self._overloaded():
+                self._counts["dropped_load"] += 1
+                return False
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._counts["dropped_queue_full"] += 1
+            return False
+        return True
+
+    def _worker(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                if self._overloaded():
+                    with self._lock:
+                        self._counts["dropped_load"] += 1
+                    continue
+                self.handler(*job)
+            finally:
+                if job is not None and self._on_finished is not None:
+                    self._on_finished(job)
+                self._queue.task_done()
+
+    def drain(self, timeout_s: float = 10.0) -> bool:
+        """Wait until queued jobs have finished (tests, shutdown)."""
+        deadline = time.monotonic() + timeout_s
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout_s: float = 5.0) -> None:
+        """Stop accepting jobs, let queued ones finish (up to timeout_s) and stop the threads."""
+        if self.closed:
+            return
+        self.closed = True
+        self.drain(timeout_s)
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(timeout=timeout_s)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        return {"workers": len(self._threads), **counts, "queued": self._queue.qsize()}
+
+
+class LazyModelLM:
+    """
+    A copy of the configured LM with another model id, made on first use: the
+    LM is configured on startup, after app.py builds the background runners.
+    """
+
+    def __init__(self, model: Optional[str]) -> None:
+        self.model = model
+        self._lm = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[dspy.LM]:
+        """The copy, or None without a model id or before an LM is configured."""
+        with self._lock:
+            if self.model and self._lm is None and dspy.settings.lm is not None:
+                self._lm = dspy.settings.lm.copy(model=self.model)
+            return self._lm
@@ -0,0 +1,153 @@
+"""
+Benchmark: per-student full-content assessments vs the batched assessment run.
+
+generatePersonalizedAssessment (personalized-learning-assessment.ts) sends the
+complete course content and the student's raw Q&A record in one prompt per
+student, one student at a time. This benchmark replays that shape against the
+local LM stand-in (local_lm_server.py) with a Predict over the same four
+inputs, and compares it with AssessmentRunner: one cached course digest,
+event-based student summaries and concurrent, rate-limited per-student calls.
+A second batched run over the same content shows the digest cache hit.
+
+Reports per flow: LM calls, prompt/completion tokens and wall-clock time for
+the class.
+
+Usage (from dspy_service/):
+    python benchmarks/bench_assessment.py
+    python benchmarks/bench_assessment.py --students 60 --content-chars 40000 --workers 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVICE_DIR))
+
+import dspy  # noqa: E402
+
+from assessment import AssessmentRunner, AssessmentStore  # noqa: E402
+from lm_accounting import AccountingLM, LMAccountant  # noqa: E402
+from local_lm_server import LocalLMConfig, serve_in_thread  # noqa: E402
+
+CONTENT = (
+    "Week 4 - Recursion and divide and conquer. A recursive function solves a problem by calling itself on "
+    "smaller inputs until it reaches a base case. Merge sort splits the array in half, sorts each half "
+    "recursively and merges the sorted halves in linear time, giving O(n log n). "
+)
+OBJECTIVES = "Write recursive functions with correct base cases; analyse divide-and-conquer algorithms."
+QUESTIONS = [
+    ("Why does my recursive factorial never stop?", ["Recursion", "Base cases", "Call stack"]),
+    ("How does merge sort split and merge the array?", ["Merge sort", "Divide and conquer", "Recursion"]),
+    ("What is the time complexity of merge sort?", ["Time complexity analysis", "Merge sort"]),
+]
+
+
+class PersonalizedAssessmentSignature(dspy.Signature):
+    """
+    You are an expert educational assessment tool. Based on the student's learning path, interactions with
+    the course material, questions and answers, and the defined learning objectives, generate a personalized
+    assessment for the student. Highlight areas of strong understanding and areas that need more attention,
+    and provide specific suggestions for improvement based on the student's individual learning path.
+    """
+
+    learning_objectives = dspy.InputField()
+    course_content = dspy.InputField()
+    student_learning_path = dspy.InputField()
+    student_questions_and_answers = dspy.InputField()
+    assessment: str = dspy.OutputField()
+    suggested_areas_for_improvement: str = dspy.OutputField()
+
+
+def make_students(count: int, questions_per_student: int):
+    students, transcripts = [], {}
+    for s in range(count):
+        events, lines = [], []
+        for q in range(questions_per_student):
+            question, skills = QUESTIONS[(s + q) % len(QUESTIONS)]
+            events.append({"intent": f"Student wants to understand: {question}", "skills": skills,
+                           "trajectory": ["Trace a recursive call by hand", "Write a base case first"]})
+            lines.append(f"Q: {question}\nA: Good question! What happens on the smallest input? "
+                         f"Try tracing it step by step and tell me where it stops.")
+        students.append({"user_id": f"student-{s}", "learning_path": "Weeks 1-4", "ist_events": events})
+        transcripts[f"student-{s}"] = "\n".join(lines)
+    return students, transcripts
+
+
+def bench_per_student(lm, accountant, students, transcripts, content) -> dict:
+    predict = dspy.Predict(PersonalizedAssessmentSignature)
+    started = time.perf_counter()
+    with accountant.request_scope() as usage, dspy.context(lm=lm):
+        for student in students:
+            predict(learning_objectives=OBJECTIVES, course_content=content, student_learning_path="Weeks 1-4",
+                    student_questions_and_answers=transcripts[student["user_id"]])
+    return {"flow": "per-student", "wall_s": time.perf_counter() - started, **usage.as_dict()}
+
+
+def bench_batched(label, runner, accountant, students, content, run_id) -> dict:
+    # Worker threads run in per-student scopes, so diff the accountant's totals instead.
+    before = accountant.stats()
+    started = time.perf_counter()
+    report = runner.run({"run_id": run_id, "course_id": "cs101", "course_content": content,
+                         "learning_objectives": OBJECTIVES, "students": students})
+    wall_s = time.perf_counter() - started
+    after = accountant.stats()
+    assert report["done"] == len(students), report
+    row = {key: after[key] - before[key] for key in ("calls", "prompt_tokens", "completion_tokens", "total_tokens")}
+    return {"flow": label, "wall_s": wall_s, **row}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=30)
+    parser.add_argument("--questions", type=int, default=12, help="Questions per student this week")
+    parser.add_argument("--content-chars", type=int, default=20000, help="Course content size")
+    parser.add_argument("--workers", type=int, default=6)
+    parser.add_argument("--rpm", type=float, default=0, help="LM calls per minute for the batched run (0 = unlimited)")
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="Stand-in time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Stand-in generation speed")
+    parser.add_argument("--json", action="store_true", help="Print raw JSON rows")
+    args = parser.parse_args(argv)
+
+    content = (CONTENT * (args.content_chars // len(CONTENT) + 1))[: args.content_chars]
+    students, transcripts = make_students(args.students, args.questions)
+    server = serve_in_thread(LocalLMConfig(latency_ms=args.latency_ms, tokens_per_second=args.tokens_per_second, seed=1))
+    try:
+        accountant = LMAccountant()
+        lm = AccountingLM("openai/local-ist", api_base=server.base_url, api_key="local", cache=False,
+                          accountant=accountant)
+        with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+            runner = AssessmentRunner(AssessmentStore(Path(tmp) / "assessments.db"), workers=args.workers,
+                                      rpm=args.rpm, lm=lm)
+            rows = [
+                bench_per_student(lm, accountant, students, transcripts, content),
+                bench_batched("batched", runner, accountant, students, content, "week-1"),
+                bench_batched("batched (digest cached)", runner, accountant, students, content, "week-1-rerun"),
+            ]
+            runner.close()
+    finally:
+        server.stop()
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return 0
+
+    print(f"stand-in: {args.latency_ms:.0f} ms to first token, {args.tokens_per_second:.0f} tokens/s; "
+          f"{args.students} students x {args.questions} questions, {args.content_chars} chars of course content, "
+          f"{args.workers} workers\n")
+    print(f"{'flow':>24} {'calls':>6} {'prompt tok':>10} {'compl tok':>9} {'wall s':>7}")
+    for row in rows:
+        print(f"{row['flow']:>24} {row['calls']:>6} {row['prompt_tokens']:>10} {row['completion_tokens']:>9} "
+              f"{row['wall_s']:>7.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,139 @@
+"""
+Benchmark: cheap-model-first cascade vs the single strong-model baseline.
+
+Two local LM stand-ins (local_lm_server.py) play the tiers: a fast "cheap"
+model that corrupts a share of its replies, and a slower "strong" model.
+Each tier has its own accountant priced like gpt-4o-mini and gpt-4o. The
+baseline sends every request to the monolithic module on the strong model;
+the cascade (CascadeISTModule) tries the compact signature on the cheap model
+first and escalates on a parse failure, out-of-range field counts, an
+unrecognised intent or self-reported confidence below the threshold.
+
+Reports per row: escalation rate and reasons, p50/p95 latency, LM calls and
+mean cost per request. The stand-in's self-reported confidence is uniform in
+[0.55, 0.98], so the threshold sets the low-confidence escalation share.
+
+Usage (from dspy_service/):
+    python benchmarks/bench_cascade.py
+    python benchmarks/bench_cascade.py --requests 100 --min-confidence 0.6,0.7,0.8 --cheap-malformed-rate 0.1
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVICE_DIR))
+
+import dspy  # noqa: E402
+
+import dspy_flows  # noqa: E402
+from dspy_flows import CascadeISTModule, CascadeStats, IntentSkillTrajectoryModule  # noqa: E402
+from lm_accounting import AccountingLM, LMAccountant, count_lm_calls  # noqa: E402
+from local_lm_server import LocalLMConfig, serve_in_thread  # noqa: E402
+from latency_stats import summarize_latencies  # noqa: E402
+
+UTTERANCES = [
+    "How does merge sort split and merge the array?",
+    "Why does my recursive factorial never stop?",
+    "Can you explain dynamic programming for knapsack?",
+    "My linked list loses nodes when I insert in the middle",
+    "What is the difference between BFS and DFS?",
+    "How do hash tables handle collisions?",
+]
+
+# USD per 1k tokens (prompt, completion), list prices of the default tier pair.
+PRICES = {"cheap": (0.00015, 0.0006), "strong": (0.0025, 0.01)}
+
+
+def _lm(server, tier: str) -> AccountingLM:
+    prompt, completion = PRICES[tier]
+    accountant = LMAccountant(prompt_cost_per_1k=prompt, completion_cost_per_1k=completion)
+    return AccountingLM(f"openai/local-ist-{tier}", api_base=server.base_url, api_key="local", cache=False,
+                        accountant=accountant)
+
+
+def bench_baseline(strong_lm, requests: int) -> dict:
+    module = IntentSkillTrajectoryModule()
+    latencies, calls, cost = [], 0, 0.0
+    for i in range(requests):
+        # A unique suffix keeps the stand-in's reply (and its corruption roll) per request.
+        utterance = f"{UTTERANCES[i % len(UTTERANCES)]} (#{i})"
+        started = time.perf_counter()
+        with dspy.context(lm=strong_lm), count_lm_calls() as counter, contextlib.redirect_stdout(io.StringIO()):
+            module(utterance=utterance, course_context="Course: cs101")
+        latencies.append((time.perf_counter() - started) * 1000)
+        calls += counter.calls
+        cost += counter.cost
+    return {"requests": requests, "lm_calls": calls, "mean_cost_usd": round(cost / requests, 6),
+            "latency_ms": summarize_latencies(latencies)}
+
+
+def bench_cascade(cheap_lm, strong_lm, min_confidence: float, requests: int) -> dict:
+    stats = CascadeStats()
+    dspy_flows.cascade_stats = stats
+    module = CascadeISTModule(cheap_lm, strong_lm, min_confidence=min_confidence)
+    for i in range(requests):
+        utterance = f"{UTTERANCES[i % len(UTTERANCES)]} (#{i})"
+        with contextlib.redirect_stdout(io.StringIO()):
+            module(utterance=utterance, course_context="Course: cs101")
+    return stats.stats()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--min-confidence", default="0.6,0.7,0.8", help="Escalation thresholds to compare")
+    parser.add_argument("--cheap-latency-ms", type=float, default=80.0)
+    parser.add_argument("--cheap-tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--cheap-malformed-rate", type=float, default=0.1)
+    parser.add_argument("--strong-latency-ms", type=float, default=250.0)
+    parser.add_argument("--strong-tokens-per-second", type=float, default=120.0)
+    parser.add_argument("--json", action="store_true", help="Print raw JSON rows")
+    args = parser.parse_args(argv)
+
+    cheap_server = serve_in_thread(LocalLMConfig(
+        latency_ms=args.cheap_latency_ms, tokens_per_second=args.cheap_tokens_per_second,
+        malformed_rate=args.cheap_malformed_rate, malformed_kinds=("truncated", "prose"), seed=1))
+    strong_server = serve_in_thread(LocalLMConfig(
+        latency_ms=args.strong_latency_ms, tokens_per_second=args.strong_tokens_per_second, seed=2))
+    saved_stats = dspy_flows.cascade_stats
+    rows = []
+    try:
+        cheap_lm, strong_lm = _lm(cheap_server, "cheap"), _lm(strong_server, "strong")
+        baseline = bench_baseline(strong_lm, args.requests)
+        rows.append({"mode": "strong only", "escalation_rate": None, "reasons": {}, **baseline})
+        for threshold in (float(t) for t in args.min_confidence.split(",")):
+            stats = bench_cascade(cheap_lm, strong_lm, threshold, args.requests)
+            rows.append({"mode": f"cascade@{threshold:.2f}", "escalation_rate": stats["escalation_rate"],
+                         "reasons": stats["reasons"], **stats["blended"]})
+    finally:
+        dspy_flows.cascade_stats = saved_stats
+        cheap_server.stop()
+        strong_server.stop()
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return 0
+
+    print(f"cheap: {args.cheap_latency_ms:.0f} ms + {args.cheap_tokens_per_second:.0f} tok/s, "
+          f"{100 * args.cheap_malformed_rate:.0f}% malformed; strong: {args.strong_latency_ms:.0f} ms + "
+          f"{args.strong_tokens_per_second:.0f} tok/s; {args.requests} sequential requests per row\n")
+    print(f"{'mode':>14} {'escal%':>7} {'p50 ms':>8} {'p95 ms':>8} {'calls/req':>9} {'$/1k req':>9} {'vs base':>8}  reasons")
+    base_cost = rows[0]["mean_cost_usd"] or 1e-12
+    for row in rows:
+        escalation = "-" if row["escalation_rate"] is None else f"{100 * row['escalation_rate']:.1f}"
+        print(f"{row['mode']:>14} {escalation:>7} {row['latency_ms']['p50']:>8.1f} {row['latency_ms']['p95']:>8.1f} "
+              f"{row['lm_calls'] / row['requests']:>9.2f} {1000 * row['mean_cost_usd']:>9.3f} "
+              f"{100 * row['mean_cost_usd'] / base_cost:>7.0f}%  {row['reasons'] or ''}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
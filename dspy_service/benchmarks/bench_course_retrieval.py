@@ -0,0 +1,169 @@
+"""
+Benchmark: BM25 course-material retrieval.
+
+Generates a synthetic course (lecture-note files built from a CS topic
+lexicon), then reports:
+  - full index build time and an incremental update after one file changes
+  - retrieval latency per utterance (p50/p95), cold (first query opens the
+    mmap'd segments) and warm
+  - IST prompt tokens per request with and without retrieved passages, from
+    the real IntentSkillTrajectoryModule against the local LM stand-in
+    (local_lm_server.py), i.e. the prompt-token cost of the added context
+
+Usage (from dspy_service/):
+    python benchmarks/bench_course_retrieval.py
+    python benchmarks/bench_course_retrieval.py --lectures 200 --queries 2000 --requests 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVICE_DIR))
+
+import dspy  # noqa: E402
+
+import dspy_flows  # noqa: E402
+from course_retrieval import CourseRetriever, update_course_index  # noqa: E402
+from dspy_flows import IntentSkillTrajectoryModule  # noqa: E402
+from lm_accounting import AccountingLM, LMAccountant  # noqa: E402
+from local_lm_server import LocalLMConfig, serve_in_thread  # noqa: E402
+from latency_stats import summarize_latencies  # noqa: E402
+
+TOPICS = {
+    "Recursion": "base case recursive call stack factorial fibonacci tail recursion memoization",
+    "Sorting": "merge sort quick sort pivot partition stable comparison heap sort insertion",
+    "Linked lists": "node next pointer head tail insert delete reverse doubly linked sentinel",
+    "Hash tables": "hash function collision chaining open addressing load factor rehash bucket",
+    "Graphs": "vertex edge adjacency list bfs dfs queue stack shortest path dijkstra weighted",
+    "Dynamic programming": "subproblem overlapping optimal substructure table knapsack memo bottom up",
+    "Trees": "binary search tree insert delete traversal inorder height balanced avl rotation",
+    "Complexity": "big o asymptotic worst case average case logarithmic linear quadratic amortized",
+}
+
+UTTERANCES = [
+    "How does merge sort split and merge the array?",
+    "Why does my recursive factorial never stop?",
+    "Can you explain dynamic programming for knapsack?",
+    "My linked list loses nodes when I insert in the middle",
+    "What is the difference between BFS and DFS?",
+    "How do hash tables handle collisions?",
+    "Why is binary search O(log n)?",
+    "How do I delete a node from a binary search tree?",
+]
+
+
+def make_course(root: Path, lectures: int, seed: int = 7) -> Path:
+    rng = random.Random(seed)
+    course = root / "bench101"
+    course.mkdir(parents=True)
+    names = list(TOPICS)
+    for i in range(lectures):
+        topic = names[i % len(names)]
+        words = TOPICS[topic].split()
+        sections = []
+        for part in range(4):
+            body = " ".join(rng.choice(words) for _ in range(90))
+            sections.append(f"## {topic} part {part + 1}\n\n{body.capitalize()}.\n")
+        (course / f"lecture-{i:03d}.md").write_text(f"# Lecture {i}: {topic}\n\n" + "\n".join(sections))
+    return course
+
+
+def bench_retrieval(materials: Path, index_dir: Path, queries: int) -> dict:
+    course = materials / "bench101"
+    started = time.perf_counter()
+    build = update_course_index(course, index_dir / "bench101")
+    build_ms = (time.perf_counter() - started) * 1000
+
+    (course / "lecture-000.md").write_text("# Lecture 0: Recursion\n\nRewritten notes on tail recursion.\n")
+    update = update_course_index(course, index_dir / "bench101")
+
+    retriever = CourseRetriever(materials, index_dir=index_dir)
+    cold = []
+    started = time.perf_counter()
+    retriever.search("bench101", UTTERANCES[0])
+    cold.append((time.perf_counter() - started) * 1000)
+
+    warm = []
+    for i in range(queries):
+        started = time.perf_counter()
+        retriever.search("bench101", UTTERANCES[i % len(UTTERANCES)])
+        warm.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "passages": build["passages_indexed"],
+        "build_ms": round(build_ms, 1),
+        "incremental_update_ms": update["elapsed_ms"],
+        "cold_query_ms": round(cold[0], 3),
+        "warm_query_ms": summarize_latencies(warm),
+    }
+
+
+def bench_prompt_tokens(materials: Path, index_dir: Path, requests: int, latency_ms: float) -> dict:
+    server = serve_in_thread(LocalLMConfig(latency_ms=latency_ms, seed=1))
+    rows = {}
+    try:
+        accountant = LMAccountant()
+        lm = AccountingLM("openai/local-ist", api_base=server.base_url, api_key="local", cache=False, accountant=accountant)
+        module = IntentSkillTrajectoryModule()
+        for label, retriever in (("without", None), ("with", CourseRetriever(materials, index_dir=index_dir))):
+            dspy_flows.course_retriever = retriever
+            prompt_tokens = completion_tokens = 0
+            for i in range(requests):
+                with dspy.context(lm=lm), accountant.request_scope() as usage, \
+                        contextlib.redirect_stdout(io.StringIO()):
+                    module(utterance=UTTERANCES[i % len(UTTERANCES)], course_context="Course: bench101")
+                prompt_tokens += usage.prompt_tokens
+                completion_tokens += usage.completion_tokens
+            rows[label] = {
+                "prompt_tokens_per_request": round(prompt_tokens / requests, 1),
+                "completion_tokens_per_request": round(completion_tokens / requests, 1),
+            }
+    finally:
+        dspy_flows.course_retriever = None
+        server.stop()
+    rows["prompt_token_delta"] = round(rows["with"]["prompt_tokens_per_request"] - rows["without"]["prompt_tokens_per_request"], 1)
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lectures", type=int, default=100, help="Synthetic lecture files (4 passages each)")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=8, help="IST requests per variant for the token comparison")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Stand-in time to first token")
+    parser.add_argument("--json", action="store_true", help="Print raw JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        materials = Path(tmp) / "materials"
+        make_course(materials, args.lectures)
+        index_dir = Path(tmp) / "index"
+        retrieval = bench_retrieval(materials, index_dir, args.queries)
+        tokens = bench_prompt_tokens(materials, index_dir, args.requests, args.latency_ms)
+
+    if args.json:
+        print(json.dumps({"retrieval": retrieval, "prompt_tokens": tokens}, indent=2))
+        return 0
+
+    warm = retrieval["warm_query_ms"]
+    print(f"index: {retrieval['passages']} passages from {args.lectures} files, built in {retrieval['build_ms']} ms; "
+          f"one-file update {retrieval['incremental_update_ms']} ms")
+    print(f"retrieval: cold {retrieval['cold_query_ms']} ms, warm p50 {warm['p50']} ms, "
+          f"p95 {warm['p95']} ms over {args.queries} queries")
+    print(f"IST prompt tokens/request: {tokens['without']['prompt_tokens_per_request']} without retrieval, "
+          f"{tokens['with']['prompt_tokens_per_request']} with (delta {tokens['prompt_token_delta']:+})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
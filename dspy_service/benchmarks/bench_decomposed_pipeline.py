@@ -0,0 +1,140 @@
+"""
+Latency benchmark: monolithic vs decomposed IST pipeline.
+
+Runs the real IntentSkillTrajectoryModule (one ChainOfThought call emitting
+reasoning + a JSON blob) and DecomposedISTModule (intent, skills and
+trajectory as three concurrent Predict calls) against the local LM stand-in
+(local_lm_server.py), whose response time is a fixed latency plus
+completion_tokens / tokens_per_second, so longer generations cost more.
+
+Reported per pipeline:
+  - end-to-end latency (all three fields available)
+  - first-field latency (first field the caller could show; for the
+    monolithic module this equals end-to-end)
+  - intent+skills latency (both available)
+  - prompt / completion tokens per request
+
+Usage (from dspy_service/):
+    python benchmarks/bench_decomposed_pipeline.py
+    python benchmarks/bench_decomposed_pipeline.py --requests 50 --latency-ms 400 --tokens-per-second 80
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVICE_DIR))
+
+import dspy  # noqa: E402
+
+from dspy_flows import DecomposedISTModule, IntentSkillTrajectoryModule, is_fallback_result  # noqa: E402
+from lm_accounting import AccountingLM, LMAccountant  # noqa: E402
+from local_lm_server import LocalLMConfig, serve_in_thread  # noqa: E402
+from latency_stats import summarize_latencies  # noqa: E402
+
+UTTERANCES = [
+    "How does merge sort split and merge the array?",
+    "Why does my recursive factorial never stop?",
+    "Can you explain dynamic programming for knapsack?",
+    "My linked list loses nodes when I insert in the middle",
+    "What is the difference between BFS and DFS?",
+    "How do hash tables handle collisions?",
+    "Why is binary search O(log n)?",
+    "How do I find the shortest path in a weighted graph?",
+]
+
+
+def _run(module, utterance: str, on_field=None) -> dict:
+    kwargs = {"utterance": utterance, "course_context": "Course: cs101"}
+    if on_field is not None:
+        kwargs["on_field"] = on_field
+    with contextlib.redirect_stdout(io.StringIO()):
+        return module(**kwargs)
+
+
+def bench_pipeline(name: str, module, lm, accountant: LMAccountant, requests: int) -> dict:
+    e2e, first, intent_skills, fallbacks = [], [], [], 0
+    prompt_tokens = completion_tokens = 0
+    decomposed = isinstance(module, DecomposedISTModule)
+
+    for i in range(requests):
+        utterance = UTTERANCES[i % len(UTTERANCES)]
+        arrivals = {}
+        started = time.perf_counter()
+
+        def on_field(field, value):
+            arrivals[field] = (time.perf_counter() - started) * 1000
+
+        with dspy.context(lm=lm), accountant.request_scope() as usage:
+            result = _run(module, utterance, on_field if decomposed else None)
+        total_ms = (time.perf_counter() - started) * 1000
+
+        e2e.append(total_ms)
+        first.append(min(arrivals.values()) if arrivals else total_ms)
+        intent_skills.append(max(arrivals["intent"], arrivals["skills"]) if arrivals else total_ms)
+        fallbacks += int(is_fallback_result(result))
+        prompt_tokens += usage.prompt_tokens
+        completion_tokens += usage.completion_tokens
+
+    return {
+        "pipeline": name,
+        "requests": requests,
+        "fallbacks": fallbacks,
+        "end_to_end_ms": summarize_latencies(e2e),
+        "first_field_ms": summarize_latencies(first),
+        "intent_skills_ms": summarize_latencies(intent_skills),
+        "prompt_tokens_per_request": round(prompt_tokens / requests, 1),
+        "completion_tokens_per_request": round(completion_tokens / requests, 1),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Stand-in time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0, help="Stand-in generation speed")
+    parser.add_argument("--json", action="store_true", help="Print raw JSON rows")
+    args = parser.parse_args(argv)
+
+    server = serve_in_thread(LocalLMConfig(latency_ms=args.latency_ms, tokens_per_second=args.tokens_per_second, seed=1))
+    try:
+        accountant = LMAccountant()
+        lm = AccountingLM("openai/local-ist", api_base=server.base_url, api_key="local", cache=False, accountant=accountant)
+        # Warm up litellm and the HTTP client so the first measured request is not an outlier.
+        with dspy.context(lm=lm):
+            _run(DecomposedISTModule(), UTTERANCES[0])
+
+        rows = [
+            bench_pipeline("monolithic", IntentSkillTrajectoryModule(), lm, accountant, args.requests),
+            bench_pipeline("decomposed", DecomposedISTModule(), lm, accountant, args.requests),
+        ]
+    finally:
+        server.stop()
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return 0
+
+    print(f"stand-in: {args.latency_ms:.0f} ms to first token, {args.tokens_per_second:.0f} tokens/s; "
+          f"{args.requests} sequential requests per pipeline\n")
+    print(f"{'pipeline':>11} {'metric':>15} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9}")
+    for row in rows:
+        for metric in ("end_to_end_ms", "first_field_ms", "intent_skills_ms"):
+            stats = row[metric]
+            print(f"{row['pipeline']:>11} {metric[:-3]:>15} {stats['p50']:>9.1f} {stats['p95']:>9.1f} {stats['mean']:>9.1f}")
+    print()
+    for row in rows:
+        print(f"{row['pipeline']:>11}: {row['prompt_tokens_per_request']} prompt + "
+              f"{row['completion_tokens_per_request']} completion tokens/request, {row['fallbacks']} fallbacks")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
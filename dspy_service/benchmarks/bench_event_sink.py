@@ -0,0 +1,108 @@
+"""
+Benchmark: persisting IST events one at a time vs the write-behind sink.
+
+Compares, for N events:
+  - rewrite: the JsonIstEventRepository pattern (append to a list, rewrite the
+    whole pretty-printed JSON file on every save), O(n) per event
+  - append: one JSONL line appended and fsynced per event
+  - sink (fsync=batch|interval|off): EventSink.record() on the request path,
+    batched segment writes in the background
+
+and reports the request-path cost per event (p50/p99) and total wall time.
+
+Usage (from dspy_service/):
+    python benchmarks/bench_event_sink.py
+    python benchmarks/bench_event_sink.py --events 2000,10000
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVICE_DIR))
+
+from event_sink import EventSink, iter_events, make_event  # noqa: E402
+
+
+def _events(count: int):
+    for i in range(count):
+        yield make_event(
+            {"intent": "Understand how merge sort splits the array.",
+             "skills": ["Merge sort", "Recursion"], "trajectory": ["Trace it on paper", "Implement it"]},
+            utterance=f"How does merge sort split the array? (#{i})", course_id=f"cs10{i % 4}", user_id=f"u{i % 50}",
+        )
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def bench_rewrite(directory: Path, count: int, cap: int) -> dict:
+    path = directory / "events.json"
+    events, costs = [], []
+    for event in _events(min(count, cap)):
+        started = time.perf_counter()
+        events.append(event)
+        path.write_text(json.dumps(events, indent=2), encoding="utf-8")
+        costs.append((time.perf_counter() - started) * 1000)
+    return {"costs": costs, "events": len(costs)}
+
+
+def bench_append(directory: Path, count: int) -> dict:
+    costs = []
+    with open(directory / "events.jsonl", "ab") as handle:
+        for event in _events(count):
+            started = time.perf_counter()
+            handle.write((json.dumps(event) + "\n").encode("utf-8"))
+            handle.flush()
+            os.fsync(handle.fileno())
+            costs.append((time.perf_counter() - started) * 1000)
+    return {"costs": costs, "events": count}
+
+
+def bench_sink(directory: Path, count: int, fsync: str) -> dict:
+    sink = EventSink(directory, fsync=fsync, flush_interval_s=0.05)
+    costs = []
+    for event in _events(count):
+        started = time.perf_counter()
+        sink.record(event)
+        costs.append((time.perf_counter() - started) * 1000)
+    sink.close()
+    stored = sum(1 for _ in iter_events(directory))
+    assert stored == count, (stored, count)
+    return {"costs": costs, "events": count, "batches": sink.stats()["batches"], "fsyncs": sink.stats()["fsyncs"]}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", default="1000,5000")
+    parser.add_argument("--rewrite-cap", type=int, default=2000,
+                        help="Stop the whole-file rewrite strategy after this many events (it is quadratic)")
+    args = parser.parse_args(argv)
+
+    print(f"{'events':>7} {'strategy':>15} {'p50 ms':>8} {'p99 ms':>8} {'wall s':>7} {'batches':>8} {'fsyncs':>7}")
+    for count in [int(n) for n in args.events.split(",")]:
+        runs = [("rewrite", lambda d: bench_rewrite(d, count, args.rewrite_cap)),
+                ("append+fsync", lambda d: bench_append(d, count))]
+        runs += [(f"sink/{policy}", lambda d, p=policy: bench_sink(d, count, p)) for policy in ("batch", "interval", "off")]
+        for name, run in runs:
+            with tempfile.TemporaryDirectory() as tmp:
+                started = time.perf_counter()
+                row = run(Path(tmp))
+                wall = time.perf_counter() - started
+            costs = row["costs"]
+            print(f"{row['events']:>7} {name:>15} {_percentile(costs, 0.5):>8.3f} {_percentile(costs, 0.99):>8.3f} "
+                  f"{wall:>7.2f} {row.get('batches', '-'):>8} {row.get('fsyncs', '-'):>7}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
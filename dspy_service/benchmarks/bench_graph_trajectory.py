@@ -0,0 +1,148 @@
+"""
+Benchmark: LM-written trajectories vs trajectories from a course skill graph.
+
+Runs IntentSkillTrajectoryModule (reasoning + JSON string with intent,
+skills and trajectory), TypedISTModule and GraphTrajectoryISTModule (typed
+intent and skills only; the trajectory is planned from a prerequisite DAG)
+against the local LM stand-in (local_lm_server.py). Generation speed is
+simulated, so fewer completion tokens show up directly as lower latency.
+
+The benchmark graph covers the recursion, sorting and hash-table topics of
+the stand-in; the remaining utterances miss the graph and show the cost of
+the LM trajectory fallback (a second call).
+
+Reports per mode: p50/p95 latency, LM calls, prompt and completion tokens
+per request, and for the graph mode the hit rate and trajectory compute time.
+
+Usage (from dspy_service/):
+    python benchmarks/bench_graph_trajectory.py
+    python benchmarks/bench_graph_trajectory.py --requests 100 --tokens-per-second 60
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVICE_DIR))
+
+import dspy  # noqa: E402
+
+import dspy_flows  # noqa: E402
+from dspy_flows import (  # noqa: E402
+    GraphTrajectoryISTModule,
+    IntentSkillTrajectoryModule,
+    OutputModeStats,
+    TypedISTModule,
+)
+from lm_accounting import AccountingLM, LMAccountant  # noqa: E402
+from local_lm_server import LocalLMConfig, serve_in_thread  # noqa: E402
+from skill_graph import SkillGraphRegistry  # noqa: E402
+
+UTTERANCES = [
+    "How does merge sort split and merge the array?",
+    "Why does my recursive factorial never stop?",
+    "How do hash tables handle collisions?",
+    "Can you explain recursion with a simple example?",
+    "What is the difference between BFS and DFS?",
+    "Which sorting algorithm is stable?",
+]
+PROFILES = [
+    {"strong_skills": []},
+    {"strong_skills": ["Loops", "Functions"]},
+    {"strong_skills": ["Call stack", "Arrays"]},
+]
+
+GRAPH = [
+    {"name": "Loops", "step": "Trace nested loops on a small input"},
+    {"name": "Functions", "requires": ["Loops"], "step": "Write functions with parameters and return values"},
+    {"name": "Arrays", "requires": ["Loops"], "step": "Index, slice and iterate over arrays"},
+    {"name": "Call stack", "requires": ["Functions"], "step": "Draw the call stack for nested calls"},
+    {"name": "Base cases", "requires": ["Functions"], "step": "Identify base cases in three examples"},
+    {"name": "Recursion", "requires": ["Call stack", "Base cases"], "step": "Trace a recursive factorial by hand"},
+    {"name": "Recursive decomposition", "requires": ["Recursion"], "step": "Rewrite a loop as a recursive function"},
+    {"name": "Stack overflow debugging", "requires": ["Recursion"], "step": "Debug an infinite recursion example"},
+    {"name": "Time complexity analysis", "requires": ["Loops"], "step": "Count the operations of nested loops"},
+    {"name": "Divide and conquer", "requires": ["Recursive decomposition"], "step": "Split a problem into halves and combine"},
+    {"name": "Sorting algorithms", "requires": ["Arrays", "Time complexity analysis"],
+     "step": "Compare insertion sort and merge sort on small inputs"},
+    {"name": "Stable sorting", "requires": ["Sorting algorithms"], "step": "Check sort stability on records with equal keys"},
+    {"name": "In-place partitioning", "requires": ["Sorting algorithms", "Arrays"], "step": "Implement quicksort partitioning"},
+    {"name": "Hash functions", "requires": ["Arrays"], "step": "Implement a simple string hash function"},
+    {"name": "Hash tables", "requires": ["Hash functions"], "step": "Implement insert and lookup with chaining"},
+    {"name": "Collision resolution", "requires": ["Hash tables"], "step": "Compare chaining and open addressing"},
+    {"name": "Load factor", "requires": ["Hash tables"], "step": "Measure lookups as the load factor grows"},
+    {"name": "Amortized analysis", "requires": ["Time complexity analysis", "Load factor"],
+     "step": "Analyse resize-and-rehash with amortized cost"},
+]
+
+
+def bench_mode(module, lm, accountant: LMAccountant, requests: int) -> dict:
+    stats = OutputModeStats()
+    dspy_flows.output_mode_stats = stats
+    prompt_tokens = completion_tokens = 0
+    for i in range(requests):
+        # A unique suffix keeps each request out of any cache while the stand-in stays on topic.
+        utterance = f"{UTTERANCES[i % len(UTTERANCES)]} (#{i})"
+        with dspy.context(lm=lm), accountant.request_scope() as usage, contextlib.redirect_stdout(io.StringIO()):
+            module(utterance=utterance, course_context="Course: cs101", student_profile=PROFILES[i % len(PROFILES)])
+        prompt_tokens += usage.prompt_tokens
+        completion_tokens += usage.completion_tokens
+    row = stats.stats()[module.OUTPUT_MODE]
+    row["prompt_tokens_per_request"] = round(prompt_tokens / requests, 1)
+    row["completion_tokens_per_request"] = round(completion_tokens / requests, 1)
+    return row
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="Stand-in time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=120.0, help="Stand-in generation speed")
+    parser.add_argument("--json", action="store_true", help="Print raw JSON rows")
+    args = parser.parse_args(argv)
+
+    server = serve_in_thread(LocalLMConfig(latency_ms=args.latency_ms, tokens_per_second=args.tokens_per_second, seed=1))
+    saved_stats = dspy_flows.output_mode_stats
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as graph_dir:
+            (Path(graph_dir) / "cs101.json").write_text(json.dumps({"skills": GRAPH}), encoding="utf-8")
+            graphs = SkillGraphRegistry(graph_dir)
+            accountant = LMAccountant()
+            lm = AccountingLM("openai/local-ist", api_base=server.base_url, api_key="local", cache=False,
+                              accountant=accountant)
+            for module in (IntentSkillTrajectoryModule(), TypedISTModule(), GraphTrajectoryISTModule(graphs)):
+                row = bench_mode(module, lm, accountant, args.requests)
+                row["mode"] = module.OUTPUT_MODE
+                rows.append(row)
+            graph_stats = graphs.stats()
+    finally:
+        dspy_flows.output_mode_stats = saved_stats
+        server.stop()
+
+    if args.json:
+        print(json.dumps({"modes": rows, "skill_graph": graph_stats}, indent=2))
+        return 0
+
+    print(f"stand-in: {args.latency_ms:.0f} ms to first token, {args.tokens_per_second:.0f} tokens/s; "
+          f"{args.requests} sequential requests per row\n")
+    print(f"{'mode':>16} {'p50 ms':>8} {'p95 ms':>8} {'calls/req':>9} {'prompt tok':>10} {'compl tok':>9}")
+    for row in rows:
+        print(f"{row['mode']:>16} {row['latency_ms']['p50']:>8.1f} {row['latency_ms']['p95']:>8.1f} "
+              f"{row['lm_calls'] / (row['requests'] or 1):>9.2f} {row['prompt_tokens_per_request']:>10} "
+              f"{row['completion_tokens_per_request']:>9}")
+    planned = graph_stats["trajectories"] + graph_stats["misses"]
+    print(f"\ngraph trajectories: {graph_stats['trajectories']}/{planned} from the graph, "
+          f"compute p50 {graph_stats['compute_us']['p50']:.1f} us, p99 {graph_stats['compute_us']['p99']:.1f} us")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,146 @@
+"""
+Memory benchmark for bounded request ingestion.
+
+Posts one IST request carrying N chat-history and N IST-history items and
+reports, per request, the peak RSS growth and the peak Python heap
+(tracemalloc) in three modes:
+  - full:     no truncation, no body limit (the old behaviour)
+  - truncate: history truncated before validation, no body limit
+  - limited:  truncation plus the default IST_MAX_BODY_BYTES limit
+Each measurement runs in a fresh interpreter so peaks do not leak between runs.
+The LM is stubbed out: this measures ingestion (parse + validate + prompt
+building), not inference.
+
+Usage (from dspy_service/):
+    python benchmarks/bench_ingestion_memory.py
+    python benchmarks/bench_ingestion_memory.py --sizes 10 1000 10000 100000
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+
+
+def _request_body(n: int) -> bytes:
+    return json.dumps({
+        "utterance": "Can you explain how recursion works for tree traversal?",
+        "course_context": "Course: cs101",
+        "chat_history": [
+            {"role": "student" if i % 2 else "tutor", "content": f"Message {i} about recursion and trees.",
+             "created_at": "2026-01-01T00:00:00Z"}
+            for i in range(n)
+        ],
+        "ist_history": [
+            {"intent": f"Understand topic {i}", "skills": ["Recursion", "Trees", "Traversal"],
+             "trajectory": ["Review", "Practice", "Apply"], "created_at": "2026-01-01T00:00:00Z"}
+            for i in range(n)
+        ],
+    }).encode("utf-8")
+
+
+MODES = ("full", "truncate", "limited")
+
+
+def _child(n: int, mode: str) -> dict:
+    os.environ["IST_TRUNCATE_HISTORY"] = "0" if mode == "full" else "1"
+    if mode == "limited":
+        os.environ.pop("IST_MAX_BODY_BYTES", None)
+    else:
+        os.environ["IST_MAX_BODY_BYTES"] = "0"
+    sys.path.insert(0, str(SERVICE_DIR))
+
+    import contextlib
+    import gc
+    import io
+    import resource
+    import time
+    import tracemalloc
+
+    from fastapi.testclient import TestClient
+
+    import dspy_flows
+    from app import app
+
+    module = dspy_flows.IntentSkillTrajectoryModule()
+
+    def stub_extractor(**kwargs):
+        # Build the prompt sections exactly as forward() would, minus the LM call.
+        module._build_chat_history_section(kwargs["chat_history"], kwargs.get("chat_history_total"))
+        module._build_ist_history_section(kwargs["ist_history"], kwargs.get("ist_history_total"))
+        return {"intent": "i", "skills": ["s"], "trajectory": ["t"]}
+
+    dspy_flows.ist_extractor = stub_extractor
+    client = TestClient(app)
+    body = _request_body(n)
+    headers = {"Content-Type": "application/json"}
+
+    # Warm up the client and route with a tiny request.
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.post("/api/intent-skill-trajectory", content=_request_body(1), headers=headers)
+    gc.collect()
+
+    before_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = client.post("/api/intent-skill-trajectory", content=body, headers=headers)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    after_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    gc.collect()
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.post("/api/intent-skill-trajectory", content=body, headers=headers)
+    _, heap_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "items": n,
+        "mode": mode,
+        "status": response.status_code,
+        "body_kib": round(len(body) / 1024, 1),
+        "peak_rss_delta_kib": max(0, after_kb - before_kb),
+        "heap_peak_kib": round(heap_peak / 1024, 1),
+        "latency_ms": round(elapsed_ms, 2),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--json", action="store_true", help="Print raw JSON rows")
+    parser.add_argument("--child", nargs=2, metavar=("N", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(_child(int(args.child[0]), args.child[1])))
+        return 0
+
+    rows = []
+    for n in args.sizes:
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, __file__, "--child", str(n), mode],
+                cwd=SERVICE_DIR, capture_output=True, text=True, check=True,
+            ).stdout
+            rows.append(json.loads(output.strip().splitlines()[-1]))
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return 0
+
+    print(f"{'items':>8} {'mode':>10} {'status':>7} {'body KiB':>9} {'peak RSS +KiB':>14} {'heap peak KiB':>14} {'latency ms':>11}")
+    for row in rows:
+        print(f"{row['items']:>8} {row['mode']:>10} {row['status']:>7} {row['body_kib']:>9} {row['peak_rss_delta_kib']:>14} "
+              f"{row['heap_peak_kib']:>14} {row['latency_ms']:>11}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,135 @@
+"""
+Benchmark: IST throughput of ist_client.ISTClient vs naive per-call usage.
+
+Runs the app under uvicorn on a local port with the LM stubbed out by a
+fixed delay (--lm-ms, standing in for the model's answer time) and sends the
+same N requests three ways:
+  - naive:          one short-lived connection per call, one call at a time
+                    (an ad-hoc requests.post loop)
+  - naive threaded: the same from --threads threads
+  - client:         ISTClient.extract_many: pooled keep-alive connections and
+                    micro-batches on /api/intent-skill-trajectory/batch
+
+Reports per mode: wall-clock time, requests per second and HTTP requests
+sent.
+
+Usage (from dspy_service/):
+    python benchmarks/bench_ist_client.py
+    python benchmarks/bench_ist_client.py --requests 400 --lm-ms 50 --threads 16
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVICE_DIR))
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+
+import app as app_module  # noqa: E402
+import dspy_flows  # noqa: E402
+from ist_client import ISTClient  # noqa: E402
+
+
+def _serve():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app_module.app, host="127.0.0.1", port=port, log_level="error"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, thread, port
+
+
+def _requests(n: int):
+    return [{"utterance": f"Why does my recursive function {i} never stop?", "course_id": "cs101",
+             "course_context": "Course: cs101",
+             "chat_history": [{"role": "student", "content": "What is recursion?"},
+                              {"role": "tutor", "content": "A function that calls itself."}]}
+            for i in range(n)]
+
+
+def _naive_call(base_url: str, body: dict) -> None:
+    response = httpx.post(f"{base_url}/api/intent-skill-trajectory", json=body, timeout=60)
+    response.raise_for_status()
+
+
+def bench_naive(base_url: str, bodies, threads: int) -> dict:
+    started = time.perf_counter()
+    if threads <= 1:
+        for body in bodies:
+            _naive_call(base_url, body)
+    else:
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(lambda body: _naive_call(base_url, body), bodies))
+    wall_s = time.perf_counter() - started
+    return {"mode": "naive" if threads <= 1 else f"naive x{threads}", "wall_s": wall_s,
+            "rps": len(bodies) / wall_s, "http_requests": len(bodies)}
+
+
+def bench_client(base_url: str, bodies, max_batch: int) -> dict:
+    with ISTClient(base_url, max_batch=max_batch) as client:
+        started = time.perf_counter()
+        results = client.extract_many(bodies)
+        wall_s = time.perf_counter() - started
+        stats = client.stats()
+    assert len(results) == len(bodies)
+    return {"mode": "client", "wall_s": wall_s, "rps": len(bodies) / wall_s, "http_requests": stats["requests"]}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--lm-ms", type=float, default=20.0, help="Stubbed LM answer time per request")
+    parser.add_argument("--threads", type=int, default=8, help="Threads for the threaded naive run")
+    parser.add_argument("--max-batch", type=int, default=16, help="Client micro-batch size")
+    parser.add_argument("--json", action="store_true", help="Print raw JSON rows")
+    args = parser.parse_args(argv)
+
+    def extractor(utterance, **kwargs):
+        time.sleep(args.lm_ms / 1000)
+        return {"intent": f"Understand: {utterance[:40]}", "skills": ["Recursion"], "trajectory": ["Trace it"]}
+
+    app_module.initialize_ist_extractor = lambda: None
+    dspy_flows.ist_extractor = extractor
+    bodies = _requests(args.requests)
+    with contextlib.redirect_stdout(io.StringIO()):
+        server, thread, port = _serve()
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            rows = [
+                bench_naive(base_url, bodies, 1),
+                bench_naive(base_url, bodies, args.threads),
+                bench_client(base_url, bodies, args.max_batch),
+            ]
+        finally:
+            server.should_exit = True
+            thread.join(timeout=10)
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return 0
+
+    print(f"{args.requests} IST requests, stubbed LM {args.lm_ms:.0f} ms each, "
+          f"IST_BATCH_CONCURRENCY={app_module.BATCH_CONCURRENCY}\n")
+    print(f"{'mode':>12} {'wall s':>8} {'req/s':>8} {'HTTP requests':>14}")
+    for row in rows:
+        print(f"{row['mode']:>12} {row['wall_s']:>8.2f} {row['rps']:>8.1f} {row['http_requests']:>14}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,113 @@
+"""
+Benchmark: json_string vs typed IST output modes.
+
+Runs IntentSkillTrajectoryModule (one JSON-in-a-string field, parsed and
+repaired in forward) and TypedISTModule (typed fields decoded by DSPy's
+JSONAdapter) against the local LM stand-in (local_lm_server.py) at several
+rates of malformed replies (fenced, truncated or prose-wrapped JSON), and
+reports per mode: latency, format retry rate (extra LM calls), json_repair
+repairs, fallback rate and tokens per request.
+
+The stand-in corrupts replies regardless of response_format; a provider that
+enforces a JSON schema natively would not produce the malformed cases for
+the typed mode at all, so the typed rows are a worst case.
+
+Usage (from dspy_service/):
+    python benchmarks/bench_output_modes.py
+    python benchmarks/bench_output_modes.py --requests 100 --malformed-rates 0,0.1,0.3
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVICE_DIR))
+
+import dspy  # noqa: E402
+
+import dspy_flows  # noqa: E402
+from dspy_flows import IntentSkillTrajectoryModule, OutputModeStats, TypedISTModule  # noqa: E402
+from lm_accounting import AccountingLM, LMAccountant  # noqa: E402
+from local_lm_server import LocalLMConfig, serve_in_thread  # noqa: E402
+
+UTTERANCES = [
+    "How does merge sort split and merge the array?",
+    "Why does my recursive factorial never stop?",
+    "Can you explain dynamic programming for knapsack?",
+    "My linked list loses nodes when I insert in the middle",
+    "What is the difference between BFS and DFS?",
+    "How do hash tables handle collisions?",
+]
+
+
+def bench_mode(module, lm, accountant: LMAccountant, requests: int) -> dict:
+    stats = OutputModeStats()
+    dspy_flows.output_mode_stats = stats
+    prompt_tokens = completion_tokens = 0
+    for i in range(requests):
+        # A unique suffix keeps the stand-in's reply (and its corruption roll) per request.
+        utterance = f"{UTTERANCES[i % len(UTTERANCES)]} (#{i})"
+        with dspy.context(lm=lm), accountant.request_scope() as usage, contextlib.redirect_stdout(io.StringIO()):
+            module(utterance=utterance, course_context="Course: cs101")
+        prompt_tokens += usage.prompt_tokens
+        completion_tokens += usage.completion_tokens
+    row = stats.stats()[module.OUTPUT_MODE]
+    row["prompt_tokens_per_request"] = round(prompt_tokens / requests, 1)
+    row["completion_tokens_per_request"] = round(completion_tokens / requests, 1)
+    return row
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="Stand-in time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Stand-in generation speed")
+    parser.add_argument("--malformed-rates", default="0,0.05,0.2")
+    parser.add_argument("--json", action="store_true", help="Print raw JSON rows")
+    args = parser.parse_args(argv)
+
+    rates = [float(r) for r in args.malformed_rates.split(",")]
+    server = serve_in_thread(LocalLMConfig(latency_ms=args.latency_ms, tokens_per_second=args.tokens_per_second, seed=1))
+    rows = []
+    saved_stats = dspy_flows.output_mode_stats
+    try:
+        accountant = LMAccountant()
+        lm = AccountingLM("openai/local-ist", api_base=server.base_url, api_key="local", cache=False, accountant=accountant)
+        for rate in rates:
+            server.configure(malformed_rate=rate)
+            for module in (IntentSkillTrajectoryModule(), TypedISTModule()):
+                started = time.perf_counter()
+                row = bench_mode(module, lm, accountant, args.requests)
+                row.update(mode=module.OUTPUT_MODE, malformed_rate=rate,
+                           wall_s=round(time.perf_counter() - started, 2))
+                rows.append(row)
+    finally:
+        dspy_flows.output_mode_stats = saved_stats
+        server.stop()
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return 0
+
+    print(f"stand-in: {args.latency_ms:.0f} ms to first token, {args.tokens_per_second:.0f} tokens/s; "
+          f"{args.requests} sequential requests per row\n")
+    print(f"{'malformed':>9} {'mode':>11} {'p50 ms':>8} {'p95 ms':>8} {'retry%':>7} {'repair%':>8} "
+          f"{'fallback%':>9} {'prompt tok':>10} {'compl tok':>9}")
+    for row in rows:
+        n = row["requests"] or 1
+        print(f"{row['malformed_rate']:>9.2f} {row['mode']:>11} {row['latency_ms']['p50']:>8.1f} "
+              f"{row['latency_ms']['p95']:>8.1f} {100 * row['format_retry_rate']:>7.1f} "
+              f"{100 * row['repairs'] / n:>8.1f} {100 * row['fallback_rate']:>9.1f} "
+              f"{row['prompt_tokens_per_request']:>10} {row['completion_tokens_per_request']:>9}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,117 @@
+"""
+Benchmark: IST prompt size and thread coverage with and without rolling
+thread summaries.
+
+Replays chat threads of growing length turn by turn (a student message and a
+tutor reply per turn) against the local LM stand-in (local_lm_server.py).
+After every turn the ConversationSummarizer gets the chance to fold, as it
+would after each response; the queue is drained between turns, i.e. the
+service is never under load. The last turn of each thread then runs the
+monolithic IST module once with the raw last-10 history and once with the
+thread's summary in scope.
+
+Reports per thread length: IST prompt tokens for both, how many of the
+thread's messages the prompt covers (raw or summarized), and the folds and
+fold tokens the summary cost, amortized per turn.
+
+Usage (from dspy_service/):
+    python benchmarks/bench_thread_summary.py
+    python benchmarks/bench_thread_summary.py --lengths 20 200 1000
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVICE_DIR))
+
+import dspy  # noqa: E402
+
+from conversation_summary import ConversationSummarizer, SummaryStore, use_summary  # noqa: E402
+from dspy_flows import CHAT_HISTORY_PROMPT_LIMIT, ChatMessage, IntentSkillTrajectoryModule  # noqa: E402
+from lm_accounting import AccountingLM, LMAccountant  # noqa: E402
+from local_lm_server import LocalLMConfig, serve_in_thread  # noqa: E402
+
+QUESTIONS = [
+    "Why does my recursive factorial never stop?",
+    "How does merge sort split and merge the array?",
+    "How do hash tables handle collisions?",
+    "What is the difference between BFS and DFS?",
+]
+REPLY = "Good question. What do you expect to happen on the smallest input, and why?"
+
+
+def replay_thread(length: int, lm, accountant: LMAccountant, summarizer: ConversationSummarizer,
+                  module: IntentSkillTrajectoryModule) -> dict:
+    thread_id = f"thread-{length}"
+    history = []
+    while len(history) < length:
+        history.append(ChatMessage(role="student", content=f"{QUESTIONS[len(history) // 2 % len(QUESTIONS)]} (#{len(history)})"))
+        history.append(ChatMessage(role="tutor", content=REPLY))
+        window = history[-CHAT_HISTORY_PROMPT_LIMIT:]
+        summarizer.maybe_fold(thread_id, window, len(history))
+        summarizer.drain()
+
+    window = history[-CHAT_HISTORY_PROMPT_LIMIT:]
+    summary = summarizer.summary_for(thread_id, len(history))
+    row = {"messages": len(history), "turns": len(history) // 2}
+    for label, scope in (("raw", None), ("summary", summary)):
+        with dspy.context(lm=lm), accountant.request_scope() as usage, use_summary(scope):
+            module(utterance="Can you remind me what we covered about recursion?", course_context="Course: cs101",
+                   chat_history=window, chat_history_total=len(history))
+        row[f"{label}_prompt_tokens"] = usage.prompt_tokens
+    row["raw_covered"] = len(window)
+    row["summary_covered"] = (summary.summarized_through if summary else 0) + \
+        min(len(window), len(history) - (summary.summarized_through if summary else 0))
+    stats = summarizer.stats()
+    row["folds"] = stats["folds"]
+    row["fold_tokens_per_turn"] = round((stats["prompt_tokens"] + stats["completion_tokens"]) / row["turns"], 1)
+    return row
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[20, 100, 300], help="Thread lengths in messages")
+    parser.add_argument("--json", action="store_true", help="Print raw JSON rows")
+    args = parser.parse_args(argv)
+
+    server = serve_in_thread(LocalLMConfig(latency_ms=5, tokens_per_second=5000, seed=1))
+    rows = []
+    try:
+        accountant = LMAccountant()
+        lm = AccountingLM("openai/local-ist", api_base=server.base_url, api_key="local", cache=False,
+                          accountant=accountant)
+        module = IntentSkillTrajectoryModule()
+        with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+            for length in args.lengths:
+                summarizer = ConversationSummarizer(SummaryStore(Path(tmp) / f"{length}.db"), lm=lm)
+                try:
+                    rows.append(replay_thread(length, lm, accountant, summarizer, module))
+                finally:
+                    summarizer.close()
+    finally:
+        server.stop()
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return 0
+
+    print("IST prompt on the last turn of each thread; folds every 4 messages, 6 recent messages raw\n")
+    print(f"{'messages':>8} {'raw prompt':>10} {'covered':>8} {'summ prompt':>11} {'covered':>8} "
+          f"{'folds':>6} {'fold tok/turn':>13}")
+    for row in rows:
+        print(f"{row['messages']:>8} {row['raw_prompt_tokens']:>10} {row['raw_covered']:>8} "
+              f"{row['summary_prompt_tokens']:>11} {row['summary_covered']:>8} {row['folds']:>6} "
+              f"{row['fold_tokens_per_turn']:>13}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
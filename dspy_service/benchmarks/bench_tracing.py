@@ -0,0 +1,74 @@
+"""
+Benchmark: tracing overhead per request at different sample ratios.
+
+Simulates the span shape of one IST request (root, validation, forward,
+build_context, predict, lm.call with attributes, parse_json) without any LM
+work, and reports the added cost per request for: tracing off, ratio 0
+(trace context only), 1%, 10% and 100% sampling with the file exporter.
+
+Usage (from dspy_service/):
+    python benchmarks/bench_tracing.py
+    python benchmarks/bench_tracing.py --requests 50000
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVICE_DIR))
+
+import tracing  # noqa: E402
+from tracing import FileExporter, Tracer  # noqa: E402
+
+TRACEPARENT = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+
+def one_request() -> None:
+    with tracing.request_span("POST /api/intent-skill-trajectory", **{"http.method": "POST"}) as root:
+        with tracing.span("ist.validate_request"):
+            pass
+        root.set_attributes({"ist.course_id": "cs101", "ist.program": "IntentSkillTrajectoryModule"})
+        with tracing.span("ist.forward", **{"ist.output_mode": "json_string"}) as forward:
+            with tracing.span("ist.build_context"):
+                pass
+            with tracing.span("ist.predict"):
+                with tracing.span("lm.call", kind="client", **{"lm.model": "openai/gpt-4o-mini"}) as call:
+                    call.set_attributes({"lm.prompt_tokens": 900, "lm.completion_tokens": 180, "lm.cache_hit": False})
+            with tracing.span("ist.parse_json"):
+                pass
+            forward.set_attributes({"ist.lm_calls": 1, "ist.fallback": False})
+
+
+def run(requests: int) -> float:
+    started = time.perf_counter()
+    for _ in range(requests):
+        one_request()
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    print(f"{'setting':>18} {'us/request':>11} {'spans exported':>15}")
+    tracing.configure(None)
+    print(f"{'off':>18} {run(args.requests):>11.2f} {0:>15}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for ratio in (0.0, 0.01, 0.1, 1.0):
+            tracer = Tracer(FileExporter(Path(tmp) / f"spans-{ratio}.jsonl"), sample_ratio=ratio)
+            tracing.configure(tracer)
+            per_request = run(args.requests)
+            tracer.close()
+            tracing.configure(None)
+            print(f"{f'file, ratio {ratio:g}':>18} {per_request:>11.2f} {tracer.stats()['exported']:>15}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,159 @@
+"""
+Benchmark: fused tutor turn vs the two-call flow.
+
+socraticCourseChat (src/features/ai/flows/socratic-course-chat.ts) fires the
+IST extraction and, concurrently, a separate tutor generation over the same
+question and course material. This benchmark replays that flow against the
+local LM stand-in (local_lm_server.py): the monolithic IST module and a
+tutor-only Predict (standing in for the Genkit socraticPrompt) run in
+parallel threads. It compares that with TutorTurnModule, which returns the
+reply and the IST fields from one streamed call.
+
+Reports per flow: prompt/completion tokens and LM calls per turn, time to
+the first reply text (the fused reply streams; the two-call reply arrives
+whole) and wall-clock time until both reply and IST are available.
+
+Usage (from dspy_service/):
+    python benchmarks/bench_tutor_turn.py
+    python benchmarks/bench_tutor_turn.py --turns 40 --material-chars 3000
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import contextvars
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVICE_DIR))
+
+import dspy  # noqa: E402
+
+from dspy_flows import IntentSkillTrajectoryModule, TutorTurnModule  # noqa: E402
+from lm_accounting import AccountingLM, LMAccountant  # noqa: E402
+from local_lm_server import LocalLMConfig, serve_in_thread  # noqa: E402
+from latency_stats import summarize_latencies  # noqa: E402
+
+UTTERANCES = [
+    "How does merge sort split and merge the array?",
+    "Why does my recursive factorial never stop?",
+    "Can you explain dynamic programming for knapsack?",
+    "My linked list loses nodes when I insert in the middle",
+    "What is the difference between BFS and DFS?",
+    "How do hash tables handle collisions?",
+]
+MATERIAL = (
+    "Week 4 - Recursion and divide and conquer. A recursive function solves a problem by calling itself on "
+    "smaller inputs until it reaches a base case. Merge sort splits the array in half, sorts each half "
+    "recursively and merges the sorted halves in linear time, giving O(n log n). "
+)
+
+
+class SocraticReplySignature(dspy.Signature):
+    """
+    You are a Socratic tutor guiding a student through course material. Ask questions that
+    encourage critical thinking and deeper understanding, referencing only the provided course material.
+    """
+
+    course_material = dspy.InputField()
+    student_question = dspy.InputField()
+    response = dspy.OutputField()
+
+
+def two_call_turn(ist_module, tutor, lm, pool, utterance: str, material: str) -> dict:
+    def run(fn):
+        with dspy.context(lm=lm), contextlib.redirect_stdout(io.StringIO()):
+            fn()
+        return time.perf_counter()
+
+    started = time.perf_counter()
+    # Copied contexts carry the usage scope into the worker threads.
+    ist = pool.submit(contextvars.copy_context().run, run,
+                      lambda: ist_module(utterance=utterance, course_context=material[:200] + "..."))
+    reply = pool.submit(contextvars.copy_context().run, run,
+                        lambda: tutor(course_material=material, student_question=utterance))
+    reply_at = reply.result()
+    done_at = max(reply_at, ist.result())
+    return {"first_reply_ms": (reply_at - started) * 1000, "total_ms": (done_at - started) * 1000}
+
+
+def fused_turn(module, lm, utterance: str, material: str) -> dict:
+    started = time.perf_counter()
+    first = []
+
+    def on_chunk(chunk):
+        if not first:
+            first.append(time.perf_counter())
+
+    with dspy.context(lm=lm), contextlib.redirect_stdout(io.StringIO()):
+        module(utterance=utterance, course_context="Course: cs101", course_material=material, on_reply_chunk=on_chunk)
+    done_at = time.perf_counter()
+    return {"first_reply_ms": (first[0] - started) * 1000, "total_ms": (done_at - started) * 1000}
+
+
+def bench(flow: str, turn, accountant: LMAccountant, turns: int, material: str) -> dict:
+    timings = []
+    with accountant.request_scope() as usage:
+        for i in range(turns):
+            # A unique suffix keeps each turn's prompt distinct, as real messages are.
+            timings.append(turn(f"{UTTERANCES[i % len(UTTERANCES)]} (#{i})", material))
+    return {
+        "flow": flow,
+        "turns": turns,
+        "lm_calls_per_turn": round(usage.calls / turns, 2),
+        "prompt_tokens_per_turn": round(usage.prompt_tokens / turns, 1),
+        "completion_tokens_per_turn": round(usage.completion_tokens / turns, 1),
+        "total_tokens_per_turn": round(usage.total_tokens / turns, 1),
+        "first_reply_ms": summarize_latencies([t["first_reply_ms"] for t in timings]),
+        "total_ms": summarize_latencies([t["total_ms"] for t in timings]),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Stand-in time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=120.0, help="Stand-in generation speed")
+    parser.add_argument("--material-chars", type=int, default=1500, help="Course material size per turn")
+    parser.add_argument("--json", action="store_true", help="Print raw JSON rows")
+    args = parser.parse_args(argv)
+
+    material = (MATERIAL * (args.material_chars // len(MATERIAL) + 1))[: args.material_chars]
+    server = serve_in_thread(LocalLMConfig(latency_ms=args.latency_ms, tokens_per_second=args.tokens_per_second, seed=1))
+    try:
+        accountant = LMAccountant()
+        lm = AccountingLM("openai/local-ist", api_base=server.base_url, api_key="local", cache=False,
+                          accountant=accountant)
+        ist_module, tutor, fused = IntentSkillTrajectoryModule(), dspy.Predict(SocraticReplySignature), TutorTurnModule()
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            rows = [
+                bench("two calls", lambda u, m: two_call_turn(ist_module, tutor, lm, pool, u, m),
+                      accountant, args.turns, material),
+                bench("fused", lambda u, m: fused_turn(fused, lm, u, m), accountant, args.turns, material),
+            ]
+    finally:
+        server.stop()
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return 0
+
+    print(f"stand-in: {args.latency_ms:.0f} ms to first token, {args.tokens_per_second:.0f} tokens/s; "
+          f"{args.material_chars} chars of course material; {args.turns} sequential turns per flow\n")
+    print(f"{'flow':>10} {'calls':>6} {'prompt tok':>10} {'compl tok':>9} {'total tok':>9} "
+          f"{'1st reply p50':>13} {'done p50':>9} {'done p95':>9}")
+    for row in rows:
+        print(f"{row['flow']:>10} {row['lm_calls_per_turn']:>6.2f} {row['prompt_tokens_per_turn']:>10} "
+              f"{row['completion_tokens_per_turn']:>9} {row['total_tokens_per_turn']:>9} "
+              f"{row['first_reply_ms']['p50']:>13.1f} {row['total_ms']['p50']:>9.1f} {row['total_ms']['p95']:>9.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
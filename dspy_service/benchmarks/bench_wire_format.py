@@ -0,0 +1,152 @@
+"""
+Benchmark: JSON vs MessagePack on the IST wire (wire_format.py).
+
+Builds IST requests with realistic chat and IST histories and measures, per
+history size and format:
+  - payload bytes of the request and of a response
+  - client encode: request dict -> bytes
+  - server decode: bytes -> validated IntentSkillRequest (what FastAPI does
+    with the body: parse, then model validation)
+  - server render: response dict -> bytes (NegotiatedJSONResponse.render)
+  - client decode: response bytes -> dict
+  - end to end: POST through the app in-process (TestClient, stubbed LM), so
+    framework overhead is included
+
+CPU times are per call, best of --repeat rounds of --number calls.
+
+Usage (from dspy_service/):
+    python benchmarks/bench_wire_format.py
+    python benchmarks/bench_wire_format.py --history 5 50 500 2000 --number 500
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+import timeit
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVICE_DIR))
+
+import msgpack  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+import app as app_module  # noqa: E402
+import dspy_flows  # noqa: E402
+from app import IntentSkillRequest  # noqa: E402
+from wire_format import NegotiatedJSONResponse, _accepts_msgpack  # noqa: E402
+
+RESULT = {
+    "intent": "Understand why a recursive function without a base case never terminates",
+    "skills": ["Recursion", "Base cases", "Call stack"],
+    "trajectory": ["Trace factorial(3) by hand", "Identify the base case", "Write sum_list recursively"],
+}
+
+
+def _request(n: int) -> dict:
+    chat = [{"role": "student" if i % 2 == 0 else "tutor",
+             "content": f"Message {i}: how does the recursive call reach the base case when the list is empty?"}
+            for i in range(n)]
+    ist = [{"intent": f"Understand recursion step {i}", "skills": ["Recursion", "Call stack"],
+            "trajectory": ["Trace a small input", "Write the base case"]} for i in range(n)]
+    return {"utterance": "Why does my recursive function never stop?", "course_id": "cs101",
+            "course_context": "Course: cs101 - Intro to Programming", "chat_history": chat, "ist_history": ist,
+            "student_profile": {"strong_skills": ["Loops"], "weak_skills": ["Recursion"]}}
+
+
+def _time_us(fn, number: int, repeat: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+def _render(content, msgpack_wanted: bool) -> bytes:
+    token = _accepts_msgpack.set(msgpack_wanted)
+    try:
+        return NegotiatedJSONResponse(content).body
+    finally:
+        _accepts_msgpack.reset(token)
+
+
+def bench_cpu(history: int, number: int, repeat: int) -> list:
+    request = _request(history)
+    formats = {
+        "json": (lambda obj: json.dumps(obj).encode("utf-8"), json.loads, False),
+        "msgpack": (lambda obj: msgpack.packb(obj, use_bin_type=True), lambda b: msgpack.unpackb(b, raw=False), True),
+    }
+    rows = []
+    for name, (encode, decode, wants_msgpack) in formats.items():
+        request_bytes = encode(request)
+        response_bytes = _render(RESULT, wants_msgpack)
+        rows.append({
+            "history": history,
+            "format": name,
+            "request_bytes": len(request_bytes),
+            "response_bytes": len(response_bytes),
+            "encode_us": _time_us(lambda: encode(request), number, repeat),
+            "server_decode_us": _time_us(lambda: IntentSkillRequest.model_validate(decode(request_bytes)),
+                                         number, repeat),
+            "render_us": _time_us(lambda: _render(RESULT, wants_msgpack), number, repeat),
+            "client_decode_us": _time_us(lambda: decode(response_bytes), number, repeat),
+        })
+    return rows
+
+
+def bench_end_to_end(client: TestClient, history: int, number: int) -> dict:
+    request = _request(history)
+    bodies = {
+        "json": (json.dumps(request).encode("utf-8"), {"Content-Type": "application/json"}),
+        "msgpack": (msgpack.packb(request, use_bin_type=True),
+                    {"Content-Type": "application/msgpack", "Accept": "application/msgpack"}),
+    }
+    timings = {}
+    for name, (body, headers) in bodies.items():
+        client.post("/api/intent-skill-trajectory", content=body, headers=headers)  # warm up
+        started = time.perf_counter()
+        for _ in range(number):
+            response = client.post("/api/intent-skill-trajectory", content=body, headers=headers)
+            assert response.status_code == 200, response.text
+        timings[name] = (time.perf_counter() - started) / number * 1000
+    return timings
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--history", type=int, nargs="+", default=[5, 50, 500],
+                        help="Chat messages and IST history items per request")
+    parser.add_argument("--number", type=int, default=200, help="Calls per timing round")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing rounds (best is kept)")
+    parser.add_argument("--json", action="store_true", help="Print raw JSON rows")
+    args = parser.parse_args(argv)
+
+    app_module.initialize_ist_extractor = lambda: None
+    dspy_flows.ist_extractor = lambda utterance, **kwargs: dict(RESULT)
+    rows = []
+    with contextlib.redirect_stdout(io.StringIO()), TestClient(app_module.app) as client:
+        for history in args.history:
+            cpu_rows = bench_cpu(history, args.number, args.repeat)
+            end_to_end = bench_end_to_end(client, history, max(20, args.number // 4))
+            for row in cpu_rows:
+                row["end_to_end_ms"] = end_to_end[row["format"]]
+            rows += cpu_rows
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return 0
+
+    print(f"per call, best of {args.repeat} x {args.number}; "
+          f"histories are chat and IST items (prompt limits truncate after validation)\n")
+    print(f"{'history':>7} {'format':>8} {'req bytes':>10} {'resp bytes':>10} {'encode us':>10} "
+          f"{'srv decode us':>13} {'render us':>10} {'cli decode us':>13} {'e2e ms':>8}")
+    for row in rows:
+        print(f"{row['history']:>7} {row['format']:>8} {row['request_bytes']:>10} {row['response_bytes']:>10} "
+              f"{row['encode_us']:>10.1f} {row['server_decode_us']:>13.1f} {row['render_us']:>10.1f} "
+              f"{row['client_decode_us']:>13.1f} {row['end_to_end_ms']:>8.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
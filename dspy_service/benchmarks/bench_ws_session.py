@@ -0,0 +1,165 @@
+"""
+Benchmark: per-message overhead of the HTTP IST endpoint vs a WebSocket chat
+session.
+
+Runs the app under uvicorn on a local port and replays one chat thread turn
+by turn, each turn a student utterance (IST) followed by a tutor reply:
+  - http: POST /api/intent-skill-trajectory over a keep-alive connection,
+          each request carrying the thread's history so far
+  - ws:   one /ws/chat/{thread_id} connection seeded once with the same
+          starting history, then only the utterance and the tutor reply
+The LM is stubbed out (the stub formats the prompt sections as forward()
+would, minus the LM call), so this measures transport, parsing, validation
+and prompt building per message, not inference.
+
+Reports per starting history length: p50/p95 latency of an IST message and
+the request bytes the client sends per turn.
+
+Usage (from dspy_service/):
+    python benchmarks/bench_ws_session.py
+    python benchmarks/bench_ws_session.py --history 10 200 2000 --turns 300
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import socket
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVICE_DIR))
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+from websockets.sync.client import connect  # noqa: E402
+
+import app as app_module  # noqa: E402
+import dspy_flows  # noqa: E402
+
+REPLY = "Good question. What do you expect to happen on the smallest input, and why?"
+
+
+def _history(n: int):
+    chat = [{"role": "student" if i % 2 == 0 else "tutor", "content": f"Message {i} about recursion and trees."}
+            for i in range(n)]
+    ist = [{"intent": f"Understand topic {i}", "skills": ["Recursion", "Trees"], "trajectory": ["Review", "Practice"]}
+           for i in range(n // 2)]
+    return chat, ist
+
+
+def _stub_extractor():
+    module = dspy_flows.IntentSkillTrajectoryModule()
+
+    def extractor(**kwargs):
+        module._build_chat_history_section(kwargs["chat_history"], kwargs.get("chat_history_total"))
+        module._build_ist_history_section(kwargs["ist_history"], kwargs.get("ist_history_total"))
+        module._build_profile_section(kwargs.get("student_profile"))
+        return {"intent": "Understand recursion", "skills": ["Recursion"], "trajectory": ["Trace factorial"]}
+
+    return extractor
+
+
+def _serve():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app_module.app, host="127.0.0.1", port=port, log_level="error"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, thread, port
+
+
+def _percentiles(samples):
+    ordered = sorted(samples)
+    return statistics.median(ordered), ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+def bench_http(port: int, history: int, turns: int) -> dict:
+    chat, ist = _history(history)
+    latencies, sent = [], 0
+    with httpx.Client(base_url=f"http://127.0.0.1:{port}") as client:
+        for turn in range(turns):
+            body = json.dumps({"utterance": f"Why does my recursion never stop? ({turn})", "course_id": "cs101",
+                               "course_context": "Course: cs101", "chat_history": chat,
+                               "ist_history": ist}).encode("utf-8")
+            started = time.perf_counter()
+            response = client.post("/api/intent-skill-trajectory", content=body,
+                                   headers={"Content-Type": "application/json"})
+            latencies.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.text
+            sent += len(body)
+            result = response.json()
+            chat += [{"role": "student", "content": f"Why does my recursion never stop? ({turn})"},
+                     {"role": "tutor", "content": REPLY}]
+            ist.insert(0, result)
+    p50, p95 = _percentiles(latencies)
+    return {"transport": "http", "history": history, "p50_ms": p50, "p95_ms": p95, "bytes_per_turn": sent / turns}
+
+
+def bench_ws(port: int, history: int, turns: int) -> dict:
+    chat, ist = _history(history)
+    latencies, sent = [], 0
+    with connect(f"ws://127.0.0.1:{port}/ws/chat/bench-{history}") as ws:
+        json.loads(ws.recv())
+        ws.send(json.dumps({"type": "init", "course_id": "cs101", "course_context": "Course: cs101",
+                            "chat_history": chat, "ist_history": ist}))
+        assert json.loads(ws.recv())["type"] == "ready"
+        for turn in range(turns):
+            frames = [json.dumps({"type": "utterance", "id": turn,
+                                  "utterance": f"Why does my recursion never stop? ({turn})"}),
+                      json.dumps({"type": "message", "role": "tutor", "content": REPLY})]
+            started = time.perf_counter()
+            ws.send(frames[0])
+            message = json.loads(ws.recv())
+            latencies.append((time.perf_counter() - started) * 1000)
+            assert message["type"] == "result", message
+            ws.send(frames[1])
+            sent += sum(len(frame.encode("utf-8")) for frame in frames)
+    p50, p95 = _percentiles(latencies)
+    return {"transport": "ws", "history": history, "p50_ms": p50, "p95_ms": p95, "bytes_per_turn": sent / turns}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--history", type=int, nargs="+", default=[10, 200, 2000],
+                        help="Chat messages in the thread before the first measured turn")
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="Print raw JSON rows")
+    args = parser.parse_args(argv)
+
+    app_module.initialize_ist_extractor = lambda: None
+    dspy_flows.ist_extractor = _stub_extractor()
+    rows = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        server, thread, port = _serve()
+        try:
+            for history in args.history:
+                rows.append(bench_http(port, history, args.turns))
+                rows.append(bench_ws(port, history, args.turns))
+        finally:
+            server.should_exit = True
+            thread.join(timeout=10)
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return 0
+
+    print(f"stubbed LM; {args.turns} IST messages per run after the starting history\n")
+    print(f"{'history':>8} {'transport':>9} {'p50 ms':>8} {'p95 ms':>8} {'bytes/turn':>11}")
+    for row in rows:
+        print(f"{row['history']:>8} {row['transport']:>9} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} "
+              f"{row['bytes_per_turn']:>11.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,401 @@
+"""
+WebSocket chat sessions (WS /ws/chat/{thread_id}).
+
+Over HTTP every chat message is a new request that reloads the thread's
+history, re-serializes it and has it validated again. A chat session keeps
+the thread's context in the worker instead: the client seeds it once, then
+sends only new utterances. The validated history lists and their formatted
+prompt sections stay warm in memory (sections are re-formatted only when the
+history changes, and handed to the IST modules via use_context_sections),
+and IST results, plus streaming partials from the decomposed pipeline, are
+pushed back on the same connection.
+
+Protocol (JSON text frames):
+  client -> server
+    {"type": "init", "course_id", "user_id", "course_context", "chat_history",
+     "ist_history", "student_profile", "pipeline", "output_mode", "trajectory_source"}
+                                            seed (or replace) the thread's context
+    {"type": "utterance", "id", "utterance"} run IST on a new student message
+    {"type": "message", "role", "content"}  record a tutor/system message (no IST)
+    {"type": "ping"}
+  server -> client
+    {"type": "ready", "thread_id", "warm", "chat_history_total", "ist_history_total"}
+                                            on connect (warm: context survived from
+                                            an earlier connection) and after init
+    {"type": "field", "id", "name", "value"} streaming partial (decomposed pipeline)
+    {"type": "result", "id", "result", "lm_usage"}
+    {"type": "error", "id", "detail"}
+    {"type": "pong"}
+
+Resource limits, per worker:
+  - at most `max_sessions` connections; further connections are closed with
+    code 1013 (try again later) right after the handshake
+  - a connection idle for `idle_ttl_s` is closed, and a thread's state is
+    dropped once it has been disconnected that long (least recently used
+    threads go first beyond `max_retained`)
+  - outgoing messages go through a bounded per-connection queue. Streaming
+    partials are dropped when it is full; a result or error waits up to
+    `send_timeout_s` for room and otherwise the slow reader is disconnected.
+    Utterances are handled one at a time, so a client that keeps sending is
+    held back by TCP flow control.
+  - a new connection for a thread that is already connected takes it over:
+    the old connection stops reading and is closed with code 4000, and the
+    new one waits (up to `takeover_wait_s`) for an utterance the old one is
+    still handling before it uses the thread's context, so two connections
+    never run IST on the same session at once.
+
+Environment variables:
+  - IST_WS_MAX_SESSIONS: concurrent chat connections per worker (default 200)
+  - IST_WS_IDLE_TTL_S: idle timeout for connections and disconnected thread state (default 900)
+  - IST_WS_MAX_RETAINED: disconnected threads kept warm per worker (default 1000)
+  - IST_WS_SEND_QUEUE: outgoing messages buffered per connection (default 32)
+  - IST_WS_SEND_TIMEOUT_S: how long a result waits for a slow reader (default 10)
+  - IST_WS_TAKEOVER_WAIT_S: how long a takeover waits for the old connection (default 30)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pydantic import BaseModel
+
+from dspy_flows import (
+    CHAT_HISTORY_PROMPT_LIMIT,
+    IST_HISTORY_PROMPT_LIMIT,
+    PROFILE_SKILLS_PROMPT_LIMIT,
+    ChatMessage,
+    IntentSkillTrajectoryModule,
+    IstHistoryItem,
+    StudentProfile,
+)
+
+CLOSE_TRY_AGAIN_LATER = 1013
+CLOSE_SUPERSEDED = 4000
+
+
+class SlowConsumer(Exception):
+    """The client did not read a result within the send timeout."""
+
+
+class SessionInit(BaseModel):
+    """Context sent by the client when it (re)seeds a thread."""
+    course_id: Optional[str] = None
+    user_id: Optional[str] = None
+    course_context: Optional[str] = None
+    pipeline: Optional[str] = None
+    output_mode: Optional[str] = None
+    trajectory_source: Optional[str] = None
+    chat_history: List[ChatMessage] = []
+    ist_history: List[IstHistoryItem] = []
+    student_profile: Optional[StudentProfile] = None
+
+    @classmethod
+    def from_message(cls, data: dict) -> tuple["SessionInit", int, int]:
+        """(init, chat total, IST total); lists are cut to the prompt limits before validation."""
+        data = dict(data)
+        chat, ist = data.get("chat_history") or [], data.get("ist_history") or []
+        data["chat_history"] = chat[-CHAT_HISTORY_PROMPT_LIMIT:] if isinstance(chat, list) else chat
+        data["ist_history"] = ist[:IST_HISTORY_PROMPT_LIMIT] if isinstance(ist, list) else ist
+        profile = data.get("student_profile")
+        if isinstance(profile, dict):
+            data["student_profile"] = {
+                key: value[:PROFILE_SKILLS_PROMPT_LIMIT] if key in ("strong_skills", "weak_skills") and isinstance(value, list) else value
+                for key, value in profile.items()
+            }
+        data.pop("type", None)
+        return cls.model_validate(data), len(chat) if isinstance(chat, list) else 0, len(ist) if isinstance(ist, list) else 0
+
+
+class ChatSession:
+    """Warm context of one chat thread; the history lists hold only what the prompt uses."""
+
+    _formatter: Optional[IntentSkillTrajectoryModule] = None
+
+    def __init__(self, thread_id: str, clock: Callable[[], float] = time.monotonic) -> None:
+        self.thread_id = thread_id
+        self.course_id: Optional[str] = None
+        self.user_id: Optional[str] = None
+        self.course_context = ""
+        self.pipeline: Optional[str] = None
+        self.output_mode: Optional[str] = None
+        self.trajectory_source: Optional[str] = None
+        self.chat_history: deque = deque(maxlen=CHAT_HISTORY_PROMPT_LIMIT)
+        self.chat_total = 0
+        self.ist_history: deque = deque(maxlen=IST_HISTORY_PROMPT_LIMIT)  # most recent first
+        self.ist_total = 0
+        self.student_profile: Optional[StudentProfile] = None
+        self.owner: Optional[object] = None
+        self.seeded = False
+        self._clock = clock
+        self.last_active = clock()
+        self._revision = 0
+        self._sections_key = None
+        self._sections: Dict[str, str] = {}
+
+    def touch(self) -> None:
+        self.last_active = self._clock()
+
+    def seed(self, init: SessionInit, chat_total: int, ist_total: int) -> None:
+        self.course_id, self.user_id = init.course_id, init.user_id
+        self.course_context = init.course_context or ""
+        self.pipeline, self.output_mode = init.pipeline, init.output_mode
+        self.trajectory_source = init.trajectory_source
+        self.chat_history.clear()
+        self.chat_history.extend(init.chat_history)
+        self.chat_total = max(chat_total, len(init.chat_history))
+        self.ist_history.clear()
+        self.ist_history.extend(init.ist_history)
+        self.ist_total = max(ist_total, len(init.ist_history))
+        self.student_profile = init.student_profile
+        self.seeded = True
+        self._revision += 1
+
+    def add_message(self, role: str, content: str) -> None:
+        self.chat_history.append(ChatMessage(role=role, content=content))
+        self.chat_total += 1
+        self._revision += 1
+
+    def add_ist(self, result: dict) -> None:
+        self.ist_history.appendleft(IstHistoryItem(intent=result["intent"], skills=list(result["skills"]),
+                                                   trajectory=list(result["trajectory"])))
+        self.ist_total += 1
+        self._revision += 1
+
+    def sections(self, summary=None) -> Dict[str, str]:
+        """Formatted chat/IST/profile sections, re-built only after the context (or summary) changed."""
+        from conversation_summary import use_summary
+
+        key = (self._revision, summary.version if summary is not None else None)
+        if key != self._sections_key:
+            if ChatSession._formatter is None:
+                ChatSession._formatter = IntentSkillTrajectoryModule()
+            formatter = ChatSession._formatter
+            with use_summary(summary):
+                self._sections = {
+                    "chat_history": formatter._build_chat_history_section(list(self.chat_history), self.chat_total),
+                    "ist_history": formatter._build_ist_history_section(list(self.ist_history), self.ist_total),
+                    "student_profile": formatter._build_profile_section(self.student_profile),
+                }
+            self._sections_key = key
+        return self._sections
+
+    def extractor_inputs(self, utterance: str) -> dict:
+        return dict(
+            utterance=utterance,
+            course_context=self.course_context,
+            chat_history=list(self.chat_history),
+            ist_history=list(self.ist_history),
+            student_profile=self.student_profile,
+            chat_history_total=self.chat_total,
+            ist_history_total=self.ist_total,
+            course_id=self.course_id,
+        )
+
+
+class SessionOwner:
+    """
+    One connection's claim on a thread. Created inside the connection's event
+    loop; supersede() and finish() may be called from any thread.
+    """
+
+    def __init__(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self.superseded = asyncio.Event()
+        self.predecessor: Optional["SessionOwner"] = None
+        self._finished: concurrent.futures.Future = concurrent.futures.Future()
+
+    def supersede(self) -> None:
+        """Tell the connection another one has taken its thread over."""
+        try:
+            self._loop.call_soon_threadsafe(self.superseded.set)
+        except RuntimeError:
+            pass  # its loop is already closed
+
+    def finish(self) -> None:
+        """Mark the connection as no longer using its session."""
+        if not self._finished.done():
+            self._finished.set_result(None)
+
+    async def wait_finished(self, timeout_s: float) -> bool:
+        """Wait until finish() was called; False after timeout_s."""
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self._finished)), timeout=timeout_s)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def receive(self, receive_text: Callable[[], Awaitable[str]], timeout_s: float) -> Optional[str]:
+        """The next text frame, or None once superseded; asyncio.TimeoutError after timeout_s idle."""
+        if self.superseded.is_set():
+            return None
+        receiving = asyncio.ensure_future(receive_text())
+        superseded = asyncio.ensure_future(self.superseded.wait())
+        try:
+            done, _ = await asyncio.wait({receiving, superseded}, timeout=timeout_s,
+                                         return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            superseded.cancel()
+        if receiving in done:
+            return receiving.result()
+        receiving.cancel()
+        if superseded in done:
+            return None
+        raise asyncio.TimeoutError
+
+
+class SessionChannel:
+    """Bounded outgoing queue for one connection, drained by its own sender task."""
+
+    def __init__(self, send: Callable[[dict], Awaitable[None]], max_queue: int = 32,
+                 send_timeout_s: float = 10.0, on_drop: Optional[Callable[[], None]] = None) -> None:
+        self._send = send
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, max_queue))
+        self.send_timeout_s = send_timeout_s
+        self._on_drop = on_drop
+        self._task: Optional[asyncio.Task] = None
+        self.dropped = 0
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._sender())
+
+    async def _sender(self) -> None:
+        while (message := await self._queue.get()) is not None:
+            await self._send(message)
+
+    def offer(self, message: dict) -> bool:
+        """Queue a droppable message (a streaming partial); False when it was dropped."""
+        try:
+            self._queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self._on_drop is not None:
+                self._on_drop()
+            return False
+
+    async def send(self, message: dict) -> None:
+        """Queue a message that must arrive; SlowConsumer if there is no room within the timeout."""
+        if self._task is not None and self._task.done():
+            self._task.result()  # the connection is gone: re-raise the sender's error
+        try:
+            await asyncio.wait_for(self._queue.put(message), timeout=self.send_timeout_s)
+        except asyncio.TimeoutError:
+            raise SlowConsumer(f"client did not read for {self.send_timeout_s:g}s")
+
+    async def close(self, timeout_s: float = 1.0) -> None:
+        """Flush what is queued (up to timeout_s) and stop the sender."""
+        if self._task is None:
+            return
+        try:
+            self._queue.put_nowait(None)
+            await asyncio.wait_for(asyncio.shield(self._task), timeout=timeout_s)
+        except (asyncio.QueueFull, asyncio.TimeoutError, Exception):
+            self._task.cancel()
+
+
+class ChatSessionManager:
+    """Per-worker registry of chat sessions with a connection cap and idle eviction."""
+
+    def __init__(
+        self,
+        max_sessions: int = 200,
+        idle_ttl_s: float = 900.0,
+        max_retained: int = 1000,
+        send_queue: int = 32,
+        send_timeout_s: float = 10.0,
+        takeover_wait_s: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_sessions = max(1, max_sessions)
+        self.idle_ttl_s = idle_ttl_s
+        self.max_retained = max(0, max_retained)
+        self.send_queue = send_queue
+        self.send_timeout_s = send_timeout_s
+        self.takeover_wait_s = takeover_wait_s
+        self._clock = clock
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {"connections": 0, "rejected": 0, "superseded": 0, "evicted": 0, "idle_closed": 0,
+                        "slow_consumer_closed": 0, "utterances": 0, "partials_dropped": 0}
+
+    @classmethod
+    def from_env(cls) -> "ChatSessionManager":
+        return cls(
+            max_sessions=int(os.getenv("IST_WS_MAX_SESSIONS", "200")),
+            idle_ttl_s=float(os.getenv("IST_WS_IDLE_TTL_S", "900")),
+            max_retained=int(os.getenv("IST_WS_MAX_RETAINED", "1000")),
+            send_queue=int(os.getenv("IST_WS_SEND_QUEUE", "32")),
+            send_timeout_s=float(os.getenv("IST_WS_SEND_TIMEOUT_S", "10")),
+            takeover_wait_s=float(os.getenv("IST_WS_TAKEOVER_WAIT_S", "30")),
+        )
+
+    def _connected(self) -> int:
+        return sum(1 for session in self._sessions.values() if session.owner is not None)
+
+    def evict_idle(self) -> int:
+        """Drop disconnected threads idle longer than idle_ttl_s, then the oldest beyond max_retained."""
+        with self._lock:
+            now = self._clock()
+            idle = [tid for tid, s in self._sessions.items() if s.owner is None and now - s.last_active > self.idle_ttl_s]
+            for thread_id in idle:
+                del self._sessions[thread_id]
+            retained = [tid for tid, s in self._sessions.items() if s.owner is None]
+            overflow = retained[: max(0, len(retained) - self.max_retained)]
+            for thread_id in overflow:
+                del self._sessions[thread_id]
+            self._counts["evicted"] += len(idle) + len(overflow)
+            return len(idle) + len(overflow)
+
+    def connect(self, thread_id: str, owner: object) -> Optional[ChatSession]:
+        """
+        The thread's session, now owned by `owner`; None when the worker is at
+        its connection cap. A SessionOwner already holding the thread is
+        superseded and becomes the new owner's predecessor.
+        """
+        self.evict_idle()
+        with self._lock:
+            session = self._sessions.get(thread_id)
+            if (session is None or session.owner is None) and self._connected() >= self.max_sessions:
+                self._counts["rejected"] += 1
+                return None
+            if session is None:
+                session = self._sessions[thread_id] = ChatSession(thread_id, clock=self._clock)
+            elif session.owner is not None:
+                self._counts["superseded"] += 1
+                if isinstance(session.owner, SessionOwner):
+                    session.owner.supersede()
+                    if isinstance(owner, SessionOwner):
+                        owner.predecessor = session.owner
+            self._sessions.move_to_end(thread_id)
+            session.owner = owner
+            session.touch()
+            self._counts["connections"] += 1
+            return session
+
+    def owns(self, session: ChatSession, owner: object) -> bool:
+        return session.owner is owner
+
+    def release(self, session: ChatSession, owner: object) -> None:
+        with self._lock:
+            if session.owner is owner:
+                session.owner = None
+                session.touch()
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counts[name] += amount
+
+    def channel(self, send: Callable[[dict], Awaitable[None]]) -> SessionChannel:
+        return SessionChannel(send, self.send_queue, self.send_timeout_s,
+                              on_drop=lambda: self.count("partials_dropped"))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"connected": self._connected(), "retained": len(self._sessions),
+                    "max_sessions": self.max_sessions, **self._counts}
@@ -4,9 +4,12 @@ Pytest configuration and shared fixtures for CourseLLM DSPy Service tests.
 This module provides:
 - TestClient setup for FastAPI endpoints
 - Mock fixtures for DSPy module initialization
+- Local LM stand-in servers (local_lm_server.py) for integration tests
 - Stateless test fixtures with proper cleanup
 """
 
+import contextlib
+import io
 import pytest
 import sys
 from pathlib import Path
@@ -17,6 +20,7 @@ from fastapi.testclient import TestClient
 sys.path.insert(0, str(Path(__file__).parent))
 
 from app import app
+from local_lm_server import LocalLMConfig, serve_in_thread
 
 
 @pytest.fixture(scope="session")
@@ -38,6 +42,47 @@ def client():
     # Cleanup after test - TestClient handles internal cleanup
 
 
+@pytest.fixture(scope="session")
+def quiet():
+    """
+    Call fn(*args, **kwargs) with stdout discarded (the IST modules log every step).
+
+    Returns the callable, so tests write quiet(module, utterance="...").
+    """
+    def call(fn, *args, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn(*args, **kwargs)
+    return call
+
+
+@pytest.fixture(scope="module")
+def serve_local_lm():
+    """
+    Start local LM stand-ins for a test module: serve_local_lm(**LocalLMConfig fields).
+
+    Cleanup: every server started through it is stopped after the module.
+    """
+    servers = []
+
+    def serve(**config):
+        servers.append(serve_in_thread(LocalLMConfig(**config)))
+        return servers[-1]
+
+    yield serve
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture(scope="module")
+def lm_server(serve_local_lm):
+    """
+    A well-behaved local LM stand-in (no latency, errors or malformed replies) shared by a test module.
+
+    Modules that need other behaviour override this fixture with serve_local_lm(...).
+    """
+    return serve_local_lm(seed=3)
+
+
 @pytest.fixture(autouse=True)
 def mock_ist_extractor():
     """
@@ -54,6 +99,7 @@ def mock_ist_extractor():
         chat_history=None,
         ist_history=None,
         student_profile=None,
+        **kwargs,
     ):
         """Mock IST extractor that returns test data."""
         # Return consistent test data based on utterance
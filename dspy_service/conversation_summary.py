@@ -0,0 +1,390 @@
+"""
+Rolling per-thread conversation summaries for long chat threads.
+
+A request only carries the last CHAT_HISTORY_PROMPT_LIMIT chat messages, so
+everything earlier in a long thread used to be lost to the IST prompt. With
+a `thread_id` on the request the service keeps a compact summary of the
+thread's older turns: the prompt then carries that summary plus only the
+raw messages it does not cover yet, so its size stays flat however long the
+thread gets.
+
+The summary is maintained off the request path. After a response has been
+sent, ConversationSummarizer.maybe_fold() checks whether at least `every`
+messages have fallen out of the `recent` raw window since the last fold and,
+if so, enqueues a fold: one small LM call that merges those messages into
+the previous summary. Folds run on the summarizer's own BackgroundPool
+(background_pool.py) and are skipped under load, or when a fold for the
+thread is already pending; a skipped fold is simply retried by the thread's
+next request. Summarization LM calls run
+outside the request's accounting scope and are never charged to a student.
+
+Summaries are stored in a SQLite file (WAL mode, shared by the workers on
+the host) as numbered versions per thread; a fold saves version n+1 only if
+n is still the latest, so two workers folding the same thread cannot
+interleave. The last `keep_versions` versions of each thread are kept.
+
+Environment variables:
+  - IST_THREAD_SUMMARY_DB: SQLite file for summaries (rolling summaries are off when unset)
+  - IST_THREAD_SUMMARY_EVERY: fold once this many messages are waiting (default 4)
+  - IST_THREAD_SUMMARY_RECENT: newest messages always sent raw, never folded (default 6)
+  - IST_THREAD_SUMMARY_MODEL: model for folds, a copy of the configured LM (default: the IST model)
+  - IST_THREAD_SUMMARY_MAX_CHARS: summary length cap (default 800)
+  - IST_THREAD_SUMMARY_WORKERS: summarizer threads (default 1)
+  - IST_THREAD_SUMMARY_QUEUE: folds waiting for the summarizer before new ones are skipped (default 32)
+  - IST_THREAD_SUMMARY_MAX_PRIMARY_INFLIGHT: skip folds while this many primary requests run (default 8)
+"""
+
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional
+
+import dspy
+
+from background_pool import BackgroundPool, LazyModelLM
+from lm_accounting import count_lm_calls
+
+DEFAULT_EVERY = 4
+DEFAULT_RECENT = 6
+DEFAULT_MAX_CHARS = 800
+FOLD_MESSAGE_CHARS = 400  # per message in the fold prompt
+
+
+@dataclass
+class ThreadSummary:
+    """One stored version of a thread's summary, covering its first `summarized_through` messages."""
+    thread_id: str
+    version: int
+    summary: str
+    summarized_through: int
+    updated_at: float
+
+
+# ---------------------------------------------------------------------
+# Summary for the current request (read by the prompt builders)
+# ---------------------------------------------------------------------
+
+_current_summary: contextvars.ContextVar[Optional[ThreadSummary]] = contextvars.ContextVar(
+    "ist_thread_summary", default=None
+)
+
+
+@contextlib.contextmanager
+def use_summary(summary: Optional[ThreadSummary]) -> Iterator[None]:
+    """Make `summary` visible to _build_chat_history_section for the enclosed IST call."""
+    token = _current_summary.set(summary)
+    try:
+        yield
+    finally:
+        _current_summary.reset(token)
+
+
+def current_summary() -> Optional[ThreadSummary]:
+    return _current_summary.get()
+
+
+# ---------------------------------------------------------------------
+# Versioned store
+# ---------------------------------------------------------------------
+
+class SummaryStore:
+    """SQLite table of summary versions keyed by (thread_id, version)."""
+
+    def __init__(self, path: str | os.PathLike, keep_versions: int = 5,
+                 clock: Callable[[], float] = time.time) -> None:
+        self.path = str(path)
+        self.keep_versions = max(1, keep_versions)
+        self._clock = clock
+        self._local = threading.local()
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS thread_summaries (
+                thread_id TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                summary TEXT NOT NULL,
+                summarized_through INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (thread_id, version)
+            );
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def latest(self, thread_id: str) -> Optional[ThreadSummary]:
+        row = self._connect().execute(
+            "SELECT thread_id, version, summary, summarized_through, updated_at FROM thread_summaries "
+            "WHERE thread_id = ? ORDER BY version DESC LIMIT 1",
+            (thread_id,),
+        ).fetchone()
+        return ThreadSummary(*row) if row is not None else None
+
+    def versions(self, thread_id: str) -> List[ThreadSummary]:
+        rows = self._connect().execute(
+            "SELECT thread_id, version, summary, summarized_through, updated_at FROM thread_summaries "
+            "WHERE thread_id = ? ORDER BY version",
+            (thread_id,),
+        ).fetchall()
+        return [ThreadSummary(*row) for row in rows]
+
+    def save(self, thread_id: str, expected_version: int, summary: str,
+             summarized_through: int) -> Optional[ThreadSummary]:
+        """Store version expected_version + 1; None (a conflict) if another fold got there first."""
+        conn = self._connect()
+        version = expected_version + 1
+        now = self._clock()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            (latest,) = conn.execute(
+                "SELECT COALESCE(MAX(version), 0) FROM thread_summaries WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+            if latest != expected_version:
+                conn.execute("ROLLBACK")
+                return None
+            conn.execute(
+                "INSERT INTO thread_summaries (thread_id, version, summary, summarized_through, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (thread_id, version, summary, summarized_through, now),
+            )
+            conn.execute(
+                "DELETE FROM thread_summaries WHERE thread_id = ? AND version <= ?",
+                (thread_id, version - self.keep_versions),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return ThreadSummary(thread_id, version, summary, summarized_through, now)
+
+    def stats(self) -> dict:
+        threads, rows = self._connect().execute(
+            "SELECT COUNT(DISTINCT thread_id), COUNT(*) FROM thread_summaries"
+        ).fetchone()
+        return {"threads": threads, "stored_versions": rows}
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# ---------------------------------------------------------------------
+# Summarizer
+# ---------------------------------------------------------------------
+
+class ThreadSummarySignature(dspy.Signature):
+    """
+    Maintain a compact running summary of a tutoring chat between a student and a tutor.
+    Merge the new messages into the previous summary. Keep what the student asked about,
+    what they struggled with or misunderstood, what the tutor explained and any open questions.
+    Drop greetings and repetition. Write at most a short paragraph.
+    """
+
+    previous_summary = dspy.InputField(desc="Summary of the earlier part of the chat (may be empty)")
+    new_messages = dspy.InputField(desc="The next messages of the chat, oldest first")
+    summary = dspy.OutputField(desc="Updated summary of the whole chat so far")
+
+
+def format_messages(messages) -> str:
+    """One line per message; accepts app.py/dspy_flows ChatMessage models or dicts."""
+    lines = []
+    for msg in messages:
+        role = msg.get("role") if isinstance(msg, dict) else msg.role
+        content = (msg.get("content") if isinstance(msg, dict) else msg.content) or ""
+        if len(content) > FOLD_MESSAGE_CHARS:
+            content = content[:FOLD_MESSAGE_CHARS] + "..."
+        lines.append(f"[{role}]: {content}")
+    return "\n".join(lines)
+
+
+class ConversationSummarizer:
+    """Decides when a thread needs a fold and runs folds on a bounded, droppable worker."""
+
+    def __init__(
+        self,
+        store: SummaryStore,
+        every: int = DEFAULT_EVERY,
+        recent: int = DEFAULT_RECENT,
+        max_chars: int = DEFAULT_MAX_CHARS,
+        workers: int = 1,
+        max_queue: int = 32,
+        max_primary_inflight: int = 8,
+        model: Optional[str] = None,
+        lm: Optional[dspy.LM] = None,
+        summarize: Optional[Callable[[str, str], str]] = None,
+    ) -> None:
+        self.store = store
+        self.every = max(1, every)
+        self.recent = max(0, recent)
+        self.max_chars = max_chars
+        self.model = model
+        self._summarize = summarize
+        self._predict = dspy.Predict(ThreadSummarySignature)
+        self._lm = lm
+        self._model_lm = LazyModelLM(model)
+        self._lock = threading.Lock()
+        self._pending: set = set()
+        self._counts = {
+            "summaries_used": 0, "folds_scheduled": 0, "folds": 0, "messages_folded": 0, "gap_messages": 0,
+            "skipped_pending": 0, "conflicts": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+        }
+        self._pool = BackgroundPool(self._fold, "ist-thread-summary", workers=workers, max_queue=max_queue,
+                                    max_primary_inflight=max_primary_inflight, on_finished=self._finished)
+
+    @classmethod
+    def from_env(cls) -> Optional["ConversationSummarizer"]:
+        path = os.getenv("IST_THREAD_SUMMARY_DB", "").strip()
+        if not path:
+            return None
+        summarizer = cls(
+            SummaryStore(path),
+            every=int(os.getenv("IST_THREAD_SUMMARY_EVERY", str(DEFAULT_EVERY))),
+            recent=int(os.getenv("IST_THREAD_SUMMARY_RECENT", str(DEFAULT_RECENT))),
+            max_chars=int(os.getenv("IST_THREAD_SUMMARY_MAX_CHARS", str(DEFAULT_MAX_CHARS))),
+            workers=int(os.getenv("IST_THREAD_SUMMARY_WORKERS", "1")),
+            max_queue=int(os.getenv("IST_THREAD_SUMMARY_QUEUE", "32")),
+            max_primary_inflight=int(os.getenv("IST_THREAD_SUMMARY_MAX_PRIMARY_INFLIGHT", "8")),
+            model=os.getenv("IST_THREAD_SUMMARY_MODEL", "").strip() or None,
+        )
+        from dspy_flows import CHAT_HISTORY_PROMPT_LIMIT
+
+        if summarizer.recent + summarizer.every > CHAT_HISTORY_PROMPT_LIMIT:
+            # Requests only keep the last CHAT_HISTORY_PROMPT_LIMIT messages, so older ones can't be folded.
+            print(f"[SUMMARY] ⚠️ IST_THREAD_SUMMARY_RECENT + IST_THREAD_SUMMARY_EVERY exceeds the "
+                  f"{CHAT_HISTORY_PROMPT_LIMIT} messages a request keeps; some messages will never be summarized")
+        print(f"[SUMMARY] Rolling thread summaries in {path} (fold every {summarizer.every}, "
+              f"{summarizer.recent} recent messages raw)")
+        return summarizer
+
+    # ------------------------------------------------------------------
+    # Request path
+    # ------------------------------------------------------------------
+
+    def primary(self) -> contextlib.AbstractContextManager:
+        """Wrap primary IST work so folds can back off while it runs."""
+        return self._pool.primary()
+
+    def summary_for(self, thread_id: Optional[str], total: int) -> Optional[ThreadSummary]:
+        """The latest summary of the thread, unless the caller's history no longer covers it."""
+        if not thread_id:
+            return None
+        summary = self.store.latest(thread_id)
+        # A thread that shrank (edited or restarted) no longer matches its summary.
+        if summary is None or summary.summarized_through > total:
+            return None
+        with self._lock:
+            self._counts["summaries_used"] += 1
+        return summary
+
+    def maybe_fold(self, thread_id: Optional[str], chat_history, total: int) -> bool:
+        """
+        Enqueue a fold when `every` messages are waiting outside the recent window
+        (called after the response went out). Never blocks; False when nothing was queued.
+
+        chat_history is the request's (truncated) list: the last len(chat_history)
+        of the thread's `total` messages.
+        """
+        if self._pool.closed or not thread_id:
+            return False
+        latest = self.store.latest(thread_id)
+        expected_version = latest.version if latest is not None else 0
+        previous, through = "", 0
+        if latest is not None and latest.summarized_through <= total:
+            previous, through = latest.summary, latest.summarized_through
+        fold_end = total - self.recent
+        if fold_end - through < self.every:
+            return False
+        start = total - len(chat_history)
+        messages = list(chat_history)[max(through, start) - start: fold_end - start]
+        if not messages:
+            return False
+        with self._lock:
+            if thread_id in self._pending:
+                self._counts["skipped_pending"] += 1
+                return False
+            self._pending.add(thread_id)
+        job = (thread_id, expected_version, previous, format_messages(messages), len(messages),
+               max(0, start - through), fold_end)
+        if not self._pool.submit(job):
+            with self._lock:
+                self._pending.discard(thread_id)
+            return False
+        with self._lock:
+            self._counts["folds_scheduled"] += 1
+        return True
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    def _resolve_lm(self):
+        return self._lm if self._lm is not None else self._model_lm.get()
+
+    def summarize(self, previous_summary: str, new_messages: str) -> str:
+        if self._summarize is not None:
+            return self._summarize(previous_summary, new_messages)
+        lm = self._resolve_lm()
+        with dspy.context(lm=lm) if lm is not None else contextlib.nullcontext():
+            return str(self._predict(previous_summary=previous_summary or "(none)",
+                                     new_messages=new_messages).summary)
+
+    def _finished(self, job: tuple) -> None:
+        with self._lock:
+            self._pending.discard(job[0])
+
+    def _fold(self, thread_id: str, expected_version: int, previous: str, new_messages: str,
+              message_count: int, gap: int, fold_end: int) -> None:
+        if gap:
+            new_messages = f"({gap} earlier messages were not summarized)\n{new_messages}"
+        try:
+            with count_lm_calls() as counter:
+                summary = self.summarize(previous, new_messages).strip()
+        except Exception as e:
+            print(f"[SUMMARY] ⚠️ Fold failed for thread {thread_id}: {type(e).__name__}: {e}")
+            with self._lock:
+                self._counts["errors"] += 1
+            return
+        if len(summary) > self.max_chars:
+            summary = summary[: self.max_chars].rsplit(" ", 1)[0] + "..."
+        saved = self.store.save(thread_id, expected_version, summary, fold_end)
+        with self._lock:
+            self._counts["prompt_tokens"] += counter.prompt_tokens
+            self._counts["completion_tokens"] += counter.completion_tokens
+            if saved is None:
+                self._counts["conflicts"] += 1
+                return
+            self._counts["folds"] += 1
+            self._counts["messages_folded"] += message_count
+            self._counts["gap_messages"] += gap
+
+    def drain(self, timeout_s: float = 10.0) -> bool:
+        """Wait until queued folds have finished (tests, shutdown)."""
+        return self._pool.drain(timeout_s)
+
+    def close(self, timeout_s: float = 5.0) -> None:
+        """Stop accepting folds, let queued ones finish (up to timeout_s) and stop the threads."""
+        if self._pool.closed:
+            return
+        self._pool.close(timeout_s)
+        self.store.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        return {"every": self.every, "recent": self.recent, **counts, **self._pool.stats(),
+                **self.store.stats()}
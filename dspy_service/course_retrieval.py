@@ -0,0 +1,683 @@
+"""
+Local BM25 retrieval over course materials.
+
+`course_context` from analyzeMessage.ts is only "Course: <id>", so the model
+has to guess the syllabus. This module indexes each course's materials
+(syllabus, lecture notes: .md / .markdown / .txt files under
+<materials_dir>/<course_id>/) and returns the top-k passages for an
+utterance in milliseconds; dspy_flows puts them into the IST signature as
+compact context.
+
+On-disk layout (<index_dir>/<course_id>/):
+  - manifest.json: live segments, their deleted (tombstoned) passages and,
+    per source file, its content hash and passage ids
+  - seg-NNNNNN.bin: immutable segment - sorted term dictionary, postings,
+    passage lengths, sources and text, in one file read through mmap so
+    every worker process shares the same page-cache copy
+
+Updates are incremental: new or changed files are written to a new segment,
+passages of changed or removed files are tombstoned, and segments are merged
+once there are too many or too much is deleted. The manifest is replaced
+atomically; readers pick up a new manifest on their next check.
+
+Segments use native byte order (they are built and read on the same host).
+
+Environment variables (read by dspy_flows.initialize_ist_extractor):
+  - COURSE_MATERIALS_DIR: root of per-course material folders (retrieval is off when unset)
+  - COURSE_INDEX_DIR: where indexes are stored (default <COURSE_MATERIALS_DIR>/.index)
+  - COURSE_RETRIEVAL_TOP_K: passages per utterance (default 3)
+  - COURSE_RETRIEVAL_SNIPPET_CHARS: max characters per passage in the prompt (default 280)
+
+Build or update indexes from the command line:
+    python course_retrieval.py build ./course_materials [--index-dir ./course_materials/.index] [--course cs101]
+    python course_retrieval.py search ./course_materials cs101 "how does merge sort work"
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from latency_stats import summarize_latencies
+
+try:
+    import fcntl  # POSIX only; used to serialize index writers across workers
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+
+MATERIAL_SUFFIXES = (".md", ".markdown", ".txt")
+MANIFEST_NAME = "manifest.json"
+SEGMENT_MAGIC = b"CRSEG01\0"
+MAX_SEGMENTS = 8
+PASSAGE_WORDS = 120
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[+#]+)?")
+_HEADING_RE = re.compile(r"^\s{0,3}#{1,6}\s+(.*)$")
+_STOPWORDS = frozenset("""
+a an the is are was were be been am do does did how what why when where which who can could would should
+i me my we you your it its this that these those to of for in on at by with and or but if so as about
+into from than then there here please help explain understand work works just really very
+""".split())
+
+
+def _stem(word: str) -> str:
+    for suffix in ("ing", "es", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            return word[: -len(suffix)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased, stop-word-filtered, lightly stemmed terms."""
+    return [_stem(t) for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LM token count (~4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def split_passages(text: str, max_words: int = PASSAGE_WORDS) -> List[str]:
+    """
+    Split a text/markdown document into passages of about `max_words` words.
+    Paragraphs are kept whole where possible and each passage is prefixed with
+    the nearest markdown heading so snippets stay self-explanatory.
+    """
+    passages: List[str] = []
+    heading = ""
+    current: List[str] = []
+    current_words = 0
+
+    def flush():
+        nonlocal current, current_words
+        if current:
+            body = " ".join(current)
+            passages.append(f"{heading}: {body}" if heading else body)
+        current, current_words = [], 0
+
+    for block in re.split(r"\n\s*\n", text):
+        lines = [line for line in block.strip().splitlines() if line.strip()]
+        if not lines:
+            continue
+        match = _HEADING_RE.match(lines[0])
+        if match:
+            flush()
+            heading = match.group(1).strip()
+            lines = lines[1:]
+            if not lines:
+                continue
+        words = " ".join(line.strip(" -*\t") for line in lines).split()
+        while words:
+            room = max_words - current_words
+            if room <= 0:
+                flush()
+                room = max_words
+            chunk, words = words[:room], words[room:]
+            current.append(" ".join(chunk))
+            current_words += len(chunk)
+    flush()
+    return passages
+
+
+# ---------------------------------------------------------------------
+# Segment files
+# ---------------------------------------------------------------------
+
+def _pad(handle) -> None:
+    handle.write(b"\0" * (-handle.tell() % 8))
+
+
+def write_segment(path: Path, passages: List[Tuple[str, str]]) -> None:
+    """Write an immutable segment for `passages` [(source, text)] at `path`."""
+    sources = sorted({source for source, _ in passages})
+    source_ids = {source: i for i, source in enumerate(sources)}
+
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    doc_lengths = array("I")
+    doc_sources = array("I")
+    text_offsets = array("Q", [0])
+    text_blob = bytearray()
+    for doc_id, (source, text) in enumerate(passages):
+        terms = tokenize(text)
+        doc_lengths.append(len(terms))
+        doc_sources.append(source_ids[source])
+        for term, tf in Counter(terms).items():
+            postings.setdefault(term, []).append((doc_id, tf))
+        text_blob += text.encode("utf-8")
+        text_offsets.append(len(text_blob))
+
+    term_list = sorted(postings)
+    term_offsets = array("Q", [0])
+    term_blob = bytearray()
+    posting_offsets = array("Q", [0])
+    posting_data = array("I")
+    for term in term_list:
+        term_blob += term.encode("utf-8")
+        term_offsets.append(len(term_blob))
+        for doc_id, tf in postings[term]:
+            posting_data.extend((doc_id, tf))
+        posting_offsets.append(len(posting_data) // 2)
+
+    sections = [
+        ("term_offsets", term_offsets.tobytes()),
+        ("terms", bytes(term_blob)),
+        ("posting_offsets", posting_offsets.tobytes()),
+        ("postings", posting_data.tobytes()),
+        ("doc_lengths", doc_lengths.tobytes()),
+        ("doc_sources", doc_sources.tobytes()),
+        ("text_offsets", text_offsets.tobytes()),
+        ("text", bytes(text_blob)),
+    ]
+    # Section offsets depend on the header size, so lay the header out with
+    # fixed-width placeholders first and fill them in once sizes are known.
+    layout = {}
+    header = {"docs": len(passages), "terms": len(term_list), "total_len": sum(doc_lengths),
+              "sources": sources, "sections": {name: [0, len(data)] for name, data in sections}}
+    header_bytes = json.dumps(header).encode("utf-8")
+    reserve = len(header_bytes) + 32 * len(sections)
+    offset = len(SEGMENT_MAGIC) + 4 + reserve
+    for name, data in sections:
+        offset += -offset % 8
+        layout[name] = [offset, len(data)]
+        offset += len(data)
+    header["sections"] = layout
+    header_bytes = json.dumps(header).encode("utf-8").ljust(reserve)
+
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as handle:
+        handle.write(SEGMENT_MAGIC)
+        handle.write(len(header_bytes).to_bytes(4, "little"))
+        handle.write(header_bytes)
+        for name, data in sections:
+            _pad(handle)
+            assert handle.tell() == layout[name][0]
+            handle.write(data)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp, path)
+
+
+class Segment:
+    """Read-only, memory-mapped view of one segment file."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+            raise ValueError(f"{self.path} is not a course index segment")
+        header_len = int.from_bytes(self._mm[8:12], "little")
+        header = json.loads(bytes(self._mm[12:12 + header_len]))
+        self.doc_count: int = header["docs"]
+        self.term_count: int = header["terms"]
+        self.total_len: int = header["total_len"]
+        self.sources: List[str] = header["sources"]
+
+        view = memoryview(self._mm)
+        self._views = []
+
+        def section(name, fmt=None):
+            start, length = header["sections"][name]
+            part = view[start:start + length]
+            if fmt:
+                part = part.cast(fmt)
+            self._views.append(part)
+            return part
+
+        self._term_offsets = section("term_offsets", "Q")
+        self._terms = section("terms")
+        self._posting_offsets = section("posting_offsets", "Q")
+        self._postings = section("postings", "I")
+        self.doc_lengths = section("doc_lengths", "I")
+        self._doc_sources = section("doc_sources", "I")
+        self._text_offsets = section("text_offsets", "Q")
+        self._text = section("text")
+        self._views.append(view)
+
+    def _term(self, i: int) -> bytes:
+        return bytes(self._terms[self._term_offsets[i]:self._term_offsets[i + 1]])
+
+    def term_id(self, term: str) -> int:
+        """Binary search of the sorted term dictionary; -1 when absent."""
+        key = term.encode("utf-8")
+        lo, hi = 0, self.term_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.term_count and self._term(lo) == key else -1
+
+    def postings(self, term_id: int) -> Iterable[Tuple[int, int]]:
+        start, end = self._posting_offsets[term_id], self._posting_offsets[term_id + 1]
+        data = self._postings
+        for i in range(start, end):
+            yield data[2 * i], data[2 * i + 1]
+
+    def text(self, doc_id: int) -> str:
+        return bytes(self._text[self._text_offsets[doc_id]:self._text_offsets[doc_id + 1]]).decode("utf-8")
+
+    def source(self, doc_id: int) -> str:
+        return self.sources[self._doc_sources[doc_id]]
+
+    def close(self) -> None:
+        for part in reversed(self._views):
+            part.release()
+        self._views = []
+        self._mm.close()
+        self._file.close()
+
+
+# ---------------------------------------------------------------------
+# Building and updating a course index
+# ---------------------------------------------------------------------
+
+def _load_manifest(index_dir: Path) -> dict:
+    path = index_dir / MANIFEST_NAME
+    if not path.exists():
+        return {"version": 1, "next_segment": 1, "segments": [], "files": {}}
+    with open(path, "r", encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def _save_manifest(index_dir: Path, manifest: dict) -> None:
+    tmp = index_dir / (MANIFEST_NAME + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as handle:
+        json.dump(manifest, handle, indent=1)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp, index_dir / MANIFEST_NAME)
+
+
+def _scan_materials(course_dir: Path) -> Dict[str, Path]:
+    files = {}
+    if course_dir.is_dir():
+        for path in sorted(course_dir.rglob("*")):
+            relative = path.relative_to(course_dir)
+            if path.is_file() and path.suffix.lower() in MATERIAL_SUFFIXES and not any(
+                part.startswith(".") for part in relative.parts
+            ):
+                files[relative.as_posix()] = path
+    return files
+
+
+class _WriterLock:
+    """Exclusive lock on <index_dir>/.lock (a process-local no-op without fcntl)."""
+
+    def __init__(self, index_dir: Path) -> None:
+        self.path = index_dir / ".lock"
+
+    def __enter__(self):
+        self._handle = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+        self._handle.close()
+
+
+def update_course_index(course_dir: str | os.PathLike, index_dir: str | os.PathLike,
+                        max_segments: int = MAX_SEGMENTS) -> dict:
+    """
+    Bring the index at `index_dir` up to date with the files in `course_dir`.
+
+    Only new or changed files are tokenized; passages of changed or removed
+    files are tombstoned. Returns a summary of what changed.
+    """
+    course_dir, index_dir = Path(course_dir), Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+
+    with _WriterLock(index_dir):
+        manifest = _load_manifest(index_dir)
+        segments = {seg["name"]: seg for seg in manifest["segments"]}
+        current = _scan_materials(course_dir)
+
+        added, changed, removed = [], [], []
+        new_passages: List[Tuple[str, str]] = []
+        new_files: Dict[str, dict] = {}
+        for name, path in current.items():
+            content = path.read_bytes()
+            digest = hashlib.sha1(content).hexdigest()
+            known = manifest["files"].get(name)
+            if known and known["sha1"] == digest:
+                continue
+            (changed if known else added).append(name)
+            passages = split_passages(content.decode("utf-8", errors="replace"))
+            new_files[name] = {"sha1": digest, "first": len(new_passages), "count": len(passages)}
+            new_passages.extend((name, text) for text in passages)
+        removed = [name for name in manifest["files"] if name not in current]
+
+        # Tombstone the old passages of changed and removed files.
+        for name in changed + removed:
+            entry = manifest["files"].pop(name)
+            segment = segments.get(entry["segment"])
+            if segment is not None:
+                segment["deleted"] = sorted(set(segment["deleted"]) | set(entry["docs"]))
+
+        if new_passages:
+            seg_name = f"seg-{manifest['next_segment']:06d}.bin"
+            manifest["next_segment"] += 1
+            write_segment(index_dir / seg_name, new_passages)
+            manifest["segments"].append({"name": seg_name, "docs": len(new_passages), "deleted": []})
+            for name, info in new_files.items():
+                manifest["files"][name] = {
+                    "sha1": info["sha1"], "segment": seg_name,
+                    "docs": list(range(info["first"], info["first"] + info["count"])),
+                }
+
+        # Drop fully deleted segments; merge when there are too many or too much is deleted.
+        manifest["segments"] = [s for s in manifest["segments"] if len(s["deleted"]) < s["docs"]]
+        total = sum(s["docs"] for s in manifest["segments"])
+        deleted = sum(len(s["deleted"]) for s in manifest["segments"])
+        compacted = False
+        if len(manifest["segments"]) > max_segments or (total and deleted / total > 0.5):
+            manifest = _compact(index_dir, manifest)
+            compacted = True
+
+        _save_manifest(index_dir, manifest)
+        live = {s["name"] for s in manifest["segments"]}
+        for stale in index_dir.glob("seg-*.bin"):
+            if stale.name not in live:
+                try:
+                    stale.unlink()  # open readers keep their mapping on POSIX
+                except OSError:
+                    pass
+
+    return {
+        "added": added, "changed": changed, "removed": removed,
+        "passages_indexed": len(new_passages), "segments": len(manifest["segments"]),
+        "compacted": compacted, "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+def _compact(index_dir: Path, manifest: dict) -> dict:
+    """Merge all live passages into one segment."""
+    passages: List[Tuple[str, str]] = []
+    remap: Dict[Tuple[str, int], int] = {}
+    for seg in manifest["segments"]:
+        segment = Segment(index_dir / seg["name"])
+        try:
+            deleted = set(seg["deleted"])
+            for doc_id in range(segment.doc_count):
+                if doc_id not in deleted:
+                    remap[(seg["name"], doc_id)] = len(passages)
+                    passages.append((segment.source(doc_id), segment.text(doc_id)))
+        finally:
+            segment.close()
+
+    seg_name = f"seg-{manifest['next_segment']:06d}.bin"
+    manifest["next_segment"] += 1
+    write_segment(index_dir / seg_name, passages)
+    for entry in manifest["files"].values():
+        entry["docs"] = [remap[(entry["segment"], d)] for d in entry["docs"] if (entry["segment"], d) in remap]
+        entry["segment"] = seg_name
+    manifest["segments"] = [{"name": seg_name, "docs": len(passages), "deleted": []}]
+    return manifest
+
+
+# ---------------------------------------------------------------------
+# Searching
+# ---------------------------------------------------------------------
+
+@dataclass
+class Passage:
+    source: str
+    text: str
+    score: float
+
+
+class CourseIndex:
+    """Reader over a course's live segments, reopened when the manifest changes."""
+
+    def __init__(self, index_dir: str | os.PathLike) -> None:
+        self.index_dir = Path(index_dir)
+        self._manifest_key: Optional[Tuple[int, int]] = None
+        self._segments: List[Tuple[Segment, frozenset]] = []
+        self._doc_count = 0
+        self._avg_len = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self) -> bool:
+        """(Re)open segments if the manifest changed. Returns True when reopened."""
+        path = self.index_dir / MANIFEST_NAME
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return False
+        # The manifest is replaced atomically, so a new inode means a new version.
+        key = (stat.st_ino, stat.st_mtime_ns)
+        with self._lock:
+            if key == self._manifest_key:
+                return False
+            manifest = _load_manifest(self.index_dir)
+            segments = []
+            for seg in manifest["segments"]:
+                segments.append((Segment(self.index_dir / seg["name"]), frozenset(seg["deleted"])))
+            live = sum(s.doc_count - len(d) for s, d in segments)
+            total_len = sum(s.total_len for s, _ in segments)
+            total_docs = sum(s.doc_count for s, _ in segments)
+            # Old segments are left to the garbage collector: a concurrent search may still hold them.
+            self._segments = segments
+            self._doc_count = live
+            self._avg_len = total_len / total_docs if total_docs else 0.0
+            self._manifest_key = key
+            return True
+
+    @property
+    def doc_count(self) -> int:
+        return self._doc_count
+
+    def search(self, query: str, k: int = 3) -> List[Passage]:
+        """Top-k passages for `query` by BM25 (k1=1.2, b=0.75)."""
+        terms = set(tokenize(query))
+        segments, n_docs, avg_len = self._segments, self._doc_count, self._avg_len
+        if not terms or not n_docs:
+            return []
+
+        located = []
+        df: Counter = Counter()
+        for segment, deleted in segments:
+            for term in terms:
+                term_id = segment.term_id(term)
+                if term_id >= 0:
+                    located.append((segment, deleted, term, term_id))
+                    df[term] += sum(1 for doc, _ in segment.postings(term_id) if doc not in deleted)
+
+        scores: Dict[Tuple[int, int], float] = {}
+        for segment, deleted, term, term_id in located:
+            idf = math.log(1 + (n_docs - df[term] + 0.5) / (df[term] + 0.5))
+            lengths = segment.doc_lengths
+            for doc, tf in segment.postings(term_id):
+                if doc in deleted:
+                    continue
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * lengths[doc] / (avg_len or 1))
+                key = (id(segment), doc)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+
+        by_id = {id(segment): segment for segment, _ in segments}
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [
+            Passage(source=by_id[seg_id].source(doc), text=by_id[seg_id].text(doc), score=round(score, 4))
+            for (seg_id, doc), score in top
+        ]
+
+
+class CourseRetriever:
+    """
+    Per-course BM25 retrieval for the IST module.
+
+    A course's index is built from <materials_dir>/<course_id>/ on first use
+    if it does not exist yet; afterwards `update(course_id)` (or the CLI)
+    applies incremental changes and readers notice the new manifest within
+    `check_interval_s`. Open course indexes are LRU-bounded.
+    """
+
+    def __init__(self, materials_dir: str | os.PathLike, index_dir: Optional[str | os.PathLike] = None,
+                 top_k: int = 3, snippet_chars: int = 280, max_courses: int = 32,
+                 check_interval_s: float = 5.0) -> None:
+        self.materials_dir = Path(materials_dir)
+        self.index_dir = Path(index_dir) if index_dir else self.materials_dir / ".index"
+        self.top_k = top_k
+        self.snippet_chars = snippet_chars
+        self.max_courses = max(1, int(max_courses))
+        self.check_interval_s = check_interval_s
+        self._lock = threading.Lock()
+        self._indexes: "OrderedDict[str, Tuple[CourseIndex, float]]" = OrderedDict()
+        self._latencies_ms: deque = deque(maxlen=1000)
+        self._stats = {"retrievals": 0, "empty": 0, "builds": 0, "prompt_tokens_added": 0}
+
+    @classmethod
+    def from_env(cls) -> Optional["CourseRetriever"]:
+        materials_dir = os.getenv("COURSE_MATERIALS_DIR", "").strip()
+        if not materials_dir:
+            return None
+        return cls(
+            materials_dir,
+            index_dir=os.getenv("COURSE_INDEX_DIR", "").strip() or None,
+            top_k=int(os.getenv("COURSE_RETRIEVAL_TOP_K", "3")),
+            snippet_chars=int(os.getenv("COURSE_RETRIEVAL_SNIPPET_CHARS", "280")),
+        )
+
+    def _safe_id(self, course_id: str) -> str:
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", course_id)
+
+    def update(self, course_id: str) -> dict:
+        """Incrementally re-index one course's materials."""
+        safe = self._safe_id(course_id)
+        summary = update_course_index(self.materials_dir / safe, self.index_dir / safe)
+        with self._lock:
+            entry = self._indexes.get(safe)
+            if entry is not None:
+                entry[0].refresh()
+        return summary
+
+    def _index(self, course_id: str) -> Optional[CourseIndex]:
+        safe = self._safe_id(course_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._indexes.get(safe)
+            if entry is not None:
+                self._indexes.move_to_end(safe)
+                index, checked_at = entry
+                if now - checked_at >= self.check_interval_s:
+                    self._indexes[safe] = (index, now)
+                    index.refresh()
+                return index
+
+        if not (self.materials_dir / safe).is_dir():
+            return None
+        index = CourseIndex(self.index_dir / safe)
+        if not (self.index_dir / safe / MANIFEST_NAME).exists():
+            summary = update_course_index(self.materials_dir / safe, self.index_dir / safe)
+            self._stats["builds"] += 1
+            print(f"[RAG] Built index for course {course_id}: {summary['passages_indexed']} passages "
+                  f"in {summary['elapsed_ms']} ms")
+        index.refresh()
+        with self._lock:
+            self._indexes[safe] = (index, now)
+            while len(self._indexes) > self.max_courses:
+                self._indexes.popitem(last=False)
+        return index
+
+    def search(self, course_id: Optional[str], query: str, k: Optional[int] = None) -> List[Passage]:
+        if not course_id:
+            return []
+        index = self._index(course_id)
+        return index.search(query, k or self.top_k) if index is not None else []
+
+    def context_for(self, course_id: Optional[str], utterance: str) -> str:
+        """Compact prompt section with the top passages for `utterance` ("" when nothing matches)."""
+        started = time.perf_counter()
+        passages = self.search(course_id, utterance)
+        lines = []
+        for i, passage in enumerate(passages, 1):
+            text = " ".join(passage.text.split())
+            if len(text) > self.snippet_chars:
+                text = text[: self.snippet_chars].rsplit(" ", 1)[0] + "..."
+            lines.append(f"[{i}] ({passage.source}) {text}")
+        section = "\n".join(lines)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        added = estimate_tokens(section)
+
+        with self._lock:
+            self._latencies_ms.append(elapsed_ms)
+            self._stats["retrievals"] += 1
+            self._stats["empty"] += int(not passages)
+            self._stats["prompt_tokens_added"] += added
+        print(f"[RAG] {len(passages)} passages for course {course_id or '(none)'} in {elapsed_ms:.2f} ms (+~{added} prompt tokens)")
+        return section
+
+    def stats(self) -> dict:
+        with self._lock:
+            retrievals = self._stats["retrievals"]
+            return {
+                **self._stats,
+                "mean_prompt_tokens_added": round(self._stats["prompt_tokens_added"] / retrievals, 1) if retrievals else 0.0,
+                "latency_ms": summarize_latencies(list(self._latencies_ms)),
+                "courses_open": list(self._indexes),
+            }
+
+
+# ---------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build and query local BM25 course-material indexes.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Build or incrementally update course indexes")
+    build.add_argument("materials_dir")
+    build.add_argument("--index-dir")
+    build.add_argument("--course", action="append", help="Only this course (repeatable)")
+
+    search = sub.add_parser("search", help="Show the top passages for a query")
+    search.add_argument("materials_dir")
+    search.add_argument("course")
+    search.add_argument("query")
+    search.add_argument("--index-dir")
+    search.add_argument("-k", type=int, default=3)
+
+    args = parser.parse_args(argv)
+    retriever = CourseRetriever(args.materials_dir, index_dir=args.index_dir)
+
+    if args.command == "build":
+        courses = args.course or sorted(
+            p.name for p in retriever.materials_dir.iterdir() if p.is_dir() and not p.name.startswith(".")
+        )
+        for course in courses:
+            print(f"{course}: {json.dumps(retriever.update(course))}")
+        return 0
+
+    started = time.perf_counter()
+    passages = retriever.search(args.course, args.query, args.k)
+    print(f"{len(passages)} passages in {(time.perf_counter() - started) * 1000:.2f} ms")
+    for passage in passages:
+        print(f"\n[{passage.score}] {passage.source}\n{passage.text}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
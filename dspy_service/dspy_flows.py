@@ -1,12 +1,29 @@
 from __future__ import annotations
 
+import contextlib
+import contextvars
+import hashlib
 import os
 import json
 import re
-from typing import List, Optional, Literal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional, Literal
 from pydantic import BaseModel
 
 import dspy
+from dspy.streaming import StreamListener, StreamResponse
+from dspy.utils.exceptions import AdapterParseError
+
+from conversation_summary import current_summary
+from course_retrieval import CourseRetriever
+from latency_stats import summarize_latencies
+from lm_accounting import AccountingLM, count_lm_calls
+import request_profiler
+from skill_graph import SkillGraphRegistry
+import tracing
 
 try:
     import json_repair
@@ -26,10 +43,12 @@ def _configure_lm_once() -> None:
     Configure DSPy with an LM instance exactly once.
 
     Provider is controlled via env vars:
-      - LLM_PROVIDER: "openai" (default) or "gemini"
+      - LLM_PROVIDER: "openai" (default), "gemini" or "local"
       - LLM_MODEL: optional, overrides the default model string
       - OPENAI_API_KEY: for OpenAI
       - GEMINI_API_KEY or GOOGLE_API_KEY: for Gemini
+      - LOCAL_LM_BASE_URL: for local (the stand-in in local_lm_server.py,
+        default http://127.0.0.1:8100/v1); no API key required
     """
     global _LM_CONFIGURED
     if _LM_CONFIGURED:
@@ -58,7 +77,7 @@ def _configure_lm_once() -> None:
         if not model:
             model = "openai/gpt-4o-mini"
 
-        lm = dspy.LM(model=model, api_key=api_key)
+        lm = AccountingLM(model=model, api_key=api_key)
 
     elif provider == "gemini":
         api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
@@ -80,12 +99,20 @@ def _configure_lm_once() -> None:
         if not model:
             model = "gemini/gemini-1.5-flash"
 
-        lm = dspy.LM(model=model, api_key=api_key)
+        lm = AccountingLM(model=model, api_key=api_key)
+
+    elif provider == "local":
+        # OpenAI-compatible stand-in (local_lm_server.py) for offline load and chaos testing.
+        api_base = os.getenv("LOCAL_LM_BASE_URL", "").strip() or "http://127.0.0.1:8100/v1"
+        if not model:
+            model = "openai/local-ist"
+
+        lm = AccountingLM(model=model, api_base=api_base, api_key=os.getenv("LOCAL_LM_API_KEY", "local"))
 
     else:
         raise RuntimeError(
             f"Unsupported LLM_PROVIDER '{provider}'. "
-            "Use 'openai' (default) or 'gemini'."
+            "Use 'openai' (default), 'gemini' or 'local'."
         )
 
     dspy.configure(lm=lm)
@@ -96,6 +123,34 @@ def _configure_lm_once() -> None:
 # Data models for rich context (mirrors Pydantic models in app.py)
 # ---------------------------------------------------------------------
 
+# How much history the prompt builders actually use. app.py truncates incoming
+# request lists to these sizes before validating them.
+CHAT_HISTORY_PROMPT_LIMIT = 10  # most recent chat messages
+IST_HISTORY_PROMPT_LIMIT = 5  # first (most recent) IST events
+PROFILE_SKILLS_PROMPT_LIMIT = 10  # strong/weak skills each
+
+# Context sections already formatted by a long-lived caller (chat_sessions.py keeps
+# them per thread); the _build_*_section methods return these instead of
+# formatting the lists again.
+_prebuilt_sections: contextvars.ContextVar[Optional[Dict[str, str]]] = contextvars.ContextVar(
+    "ist_prebuilt_sections", default=None
+)
+
+
+@contextlib.contextmanager
+def use_context_sections(sections: Optional[Dict[str, str]]):
+    """Serve "chat_history", "ist_history" and/or "student_profile" sections as given for the enclosed IST call."""
+    token = _prebuilt_sections.set(sections)
+    try:
+        yield
+    finally:
+        _prebuilt_sections.reset(token)
+
+
+def _prebuilt_section(name: str) -> Optional[str]:
+    sections = _prebuilt_sections.get()
+    return sections.get(name) if sections else None
+
 class ChatMessage(BaseModel):
     """Represents a single message in the chat conversation history."""
     role: Literal["student", "tutor", "system"]
@@ -122,6 +177,50 @@ class StudentProfile(BaseModel):
 # Intent – Skill – Trajectory Signature and Module
 # ---------------------------------------------------------------------
 
+# Result returned whenever the LM call or its output parsing fails.
+FALLBACK_RESULT = {
+    "intent": "Student is asking for help with a course concept.",
+    "skills": ["Concept understanding", "Problem-solving"],
+    "trajectory": ["Review lecture materials", "Practice problems", "Ask clarifying questions"],
+}
+
+
+def is_fallback_result(result: dict) -> bool:
+    """True when `result` is the canned fallback rather than a parsed LM answer."""
+    return (
+        isinstance(result, dict)
+        and result.get("skills") == FALLBACK_RESULT["skills"]
+        and result.get("trajectory") == FALLBACK_RESULT["trajectory"]
+    )
+
+
+# Keywords that place a free-text intent in one of the VALID_INTENTS categories.
+INTENT_CATEGORY_KEYWORDS = (
+    ("conceptual_question", ("understand", "explain", "clarify", "confused", "what is")),
+    ("debugging", ("debug", "error", "fix", "wrong", "broken")),
+    ("practice_request", ("practice", "solve", "problem", "exercise", "try")),
+    ("platform_issue", ("platform", "tool", "system", "can't access", "not working")),
+)
+
+
+def intent_category(intent: str) -> Optional[str]:
+    """The first intent category whose keywords appear in `intent`, or None when none match."""
+    intent_lower = (intent or "").lower()
+    for category, keywords in INTENT_CATEGORY_KEYWORDS:
+        if any(keyword in intent_lower for keyword in keywords):
+            return category
+    return None
+
+
+def skill_set_jaccard(a: List[str], b: List[str]) -> float:
+    """Case-insensitive Jaccard similarity of two skill (or step) lists."""
+    set_a = {str(x).strip().lower() for x in a or [] if str(x).strip()}
+    set_b = {str(x).strip().lower() for x in b or [] if str(x).strip()}
+    if not set_a and not set_b:
+        return 1.0
+    return len(set_a & set_b) / len(set_a | set_b)
+
+
 
 class IntentSkillTrajectorySignature(dspy.Signature):
     """
@@ -137,6 +236,8 @@ class IntentSkillTrajectorySignature(dspy.Signature):
     - The student_profile shows their strengths and weaknesses (personalize your suggestions).
     - The ist_history shows previous learning patterns (DO NOT repeat identical trajectories).
     - The chat_history shows the conversation flow (use recent messages for context).
+    - The course_materials are excerpts from this course's syllabus and lecture notes
+      (prefer their topics and terminology for skills and trajectory steps).
 
     Intent Categories (pick the most relevant):
     - "Clarification": Student asks for explanation of a concept
@@ -190,6 +291,10 @@ class IntentSkillTrajectorySignature(dspy.Signature):
         desc="Student profile (strong/weak skills, progress). Use to personalize recommendations.",
         default="",
     )
+    course_materials = dspy.InputField(
+        desc="Excerpts from this course's syllabus and lecture notes that match the utterance. Use their topics and terms.",
+        default="",
+    )
 
     structured_analysis = dspy.OutputField(
         desc="Raw JSON object (no markdown) with exactly these keys: 'intent' (string), 'skills' (array), 'trajectory' (array). Output ONLY the JSON."
@@ -202,6 +307,9 @@ class IntentSkillTrajectoryModule(dspy.Module):
     Extracts intent, skills, and trajectory from student utterances.
     """
 
+    # Output mode this module implements (see TypedISTModule for "typed")
+    OUTPUT_MODE = "json_string"
+
     def __init__(self) -> None:
         super().__init__()
         # Use ChainOfThought instead of basic Predict for better reasoning
@@ -222,11 +330,50 @@ class IntentSkillTrajectoryModule(dspy.Module):
         chat_history: List[ChatMessage] = None,
         ist_history: List[IstHistoryItem] = None,
         student_profile: Optional[StudentProfile] = None,
+        chat_history_total: Optional[int] = None,
+        ist_history_total: Optional[int] = None,
+        course_id: Optional[str] = None,
     ) -> dict:
         """
-        Run the LM with ChainOfThought reasoning, then parse the JSON output.
+        Run the LM with ChainOfThought reasoning, then parse the output.
         Returns a clean dict: {"intent": str, "skills": List[str], "trajectory": List[str]}
-        
+
+        chat_history_total / ist_history_total are the history sizes the caller
+        received before truncating to the prompt limits; they default to the
+        lengths of the lists passed in. course_id selects the course materials
+        to retrieve from (parsed from course_context when omitted).
+
+        Latency, format retries (extra LM calls made by the adapter) and
+        fallbacks are recorded per output mode in `output_mode_stats`.
+        """
+        started = time.perf_counter()
+        with tracing.span("ist.forward", **{"ist.output_mode": self.OUTPUT_MODE}) as span, count_lm_calls() as counter:
+            result = self._extract(
+                utterance, course_context, chat_history, ist_history, student_profile,
+                chat_history_total, ist_history_total, course_id,
+            )
+            span.set_attributes({"ist.lm_calls": counter.calls, "ist.fallback": is_fallback_result(result)})
+        output_mode_stats.record(
+            self.OUTPUT_MODE,
+            latency_ms=(time.perf_counter() - started) * 1000,
+            lm_calls=counter.calls,
+            fallback=is_fallback_result(result),
+        )
+        return result
+
+    def _extract(
+        self,
+        utterance: str,
+        course_context: Optional[str],
+        chat_history: Optional[List[ChatMessage]],
+        ist_history: Optional[List[IstHistoryItem]],
+        student_profile: Optional[StudentProfile],
+        chat_history_total: Optional[int],
+        ist_history_total: Optional[int],
+        course_id: Optional[str],
+    ) -> dict:
+        """
+        JSON-in-a-string extraction: parse `structured_analysis` in four steps.
         This method implements comprehensive error handling with full traceback exposure.
         """
         import traceback
@@ -237,60 +384,28 @@ class IntentSkillTrajectoryModule(dspy.Module):
         print(f"[IST] Course context: {course_context or '(none)'}")
         
         # Normalize inputs
-        if chat_history is None:
-            chat_history = []
-        else:
-            try:
-                chat_history = [
-                    ChatMessage(**msg.model_dump() if hasattr(msg, 'model_dump') else msg.dict())
-                    if not isinstance(msg, ChatMessage) else msg
-                    for msg in chat_history
-                ]
-            except Exception as e:
-                print(f"[IST] ⚠️ Error normalizing chat_history: {type(e).__name__}: {e}")
-                chat_history = []
-        
-        if ist_history is None:
-            ist_history = []
-        else:
-            try:
-                ist_history = [
-                    IstHistoryItem(**item.model_dump() if hasattr(item, 'model_dump') else item.dict())
-                    if not isinstance(item, IstHistoryItem) else item
-                    for item in ist_history
-                ]
-            except Exception as e:
-                print(f"[IST] ⚠️ Error normalizing ist_history: {type(e).__name__}: {e}")
-                ist_history = []
-        
-        if student_profile is not None and not isinstance(student_profile, StudentProfile):
-            try:
-                if hasattr(student_profile, 'model_dump'):
-                    student_profile = StudentProfile(**student_profile.model_dump())
-                elif hasattr(student_profile, 'dict'):
-                    student_profile = StudentProfile(**student_profile.dict())
-                elif isinstance(student_profile, dict):
-                    student_profile = StudentProfile(**student_profile)
-            except Exception as e:
-                print(f"[IST] ⚠️ Error normalizing student_profile: {type(e).__name__}: {e}")
-                student_profile = None
+        chat_history, ist_history, student_profile = self._coerce_context(chat_history, ist_history, student_profile)
         
         # Build formatted context sections
-        profile_section = self._build_profile_section(student_profile)
-        ist_history_section = self._build_ist_history_section(ist_history)
-        chat_history_section = self._build_chat_history_section(chat_history)
+        with tracing.span("ist.build_context"):
+            profile_section = self._build_profile_section(student_profile)
+            ist_history_section = self._build_ist_history_section(ist_history, ist_history_total)
+            chat_history_section = self._build_chat_history_section(chat_history, chat_history_total)
+            materials_section = self._build_materials_section(utterance, course_context, course_id)
         
         # ===== STEP 1: Call ChainOfThought =====
         pred = None
         try:
             print(f"[IST] Step 1: Calling dspy.ChainOfThought...")
-            pred = self.predict(
-                utterance=utterance,
-                course_context=course_context or "",
-                chat_history=chat_history_section,
-                ist_history=ist_history_section,
-                student_profile=profile_section,
-            )
+            with tracing.span("ist.predict"):
+                pred = self.predict(
+                    utterance=utterance,
+                    course_context=course_context or "",
+                    chat_history=chat_history_section,
+                    ist_history=ist_history_section,
+                    student_profile=profile_section,
+                    course_materials=materials_section,
+                )
             print(f"[IST] ✓ ChainOfThought returned successfully")
             print(f"[IST]   Type: {type(pred).__name__}")
             print(f"[IST]   Is dict: {isinstance(pred, dict)}")
@@ -367,7 +482,8 @@ class IntentSkillTrajectoryModule(dspy.Module):
             print(f"[IST] Raw JSON (first 200 chars): {structured_output[:200]}")
             
             # Parse JSON with explicit error handling
-            parsed = json.loads(structured_output)
+            with tracing.span("ist.parse_json", **{"ist.output_chars": len(structured_output)}):
+                parsed = json.loads(structured_output)
             print(f"[IST] ✓ JSON parsed successfully")
             
             if not isinstance(parsed, dict):
@@ -388,8 +504,10 @@ class IntentSkillTrajectoryModule(dspy.Module):
             if json_repair is not None:
                 try:
                     print(f"[IST] Attempting json_repair...")
-                    repaired = json_repair.repair_json(structured_output)
-                    parsed = json.loads(repaired)
+                    with tracing.span("ist.json_repair"):
+                        repaired = json_repair.repair_json(structured_output)
+                        parsed = json.loads(repaired)
+                    output_mode_stats.record_repair(self.OUTPUT_MODE)
                     print(f"[IST] ✓ json_repair succeeded")
                 except Exception as repair_err:
                     print(f"[IST] json_repair failed: {type(repair_err).__name__}")
@@ -459,37 +577,67 @@ class IntentSkillTrajectoryModule(dspy.Module):
             print(traceback.format_exc())
             return self._fallback_response("Field validation failed")
 
+    def _coerce_context(self, chat_history, ist_history, student_profile):
+        """Coerce history/profile inputs (models from app.py or dicts) into this module's models."""
+        if chat_history is None:
+            chat_history = []
+        else:
+            try:
+                chat_history = [
+                    ChatMessage(**msg.model_dump() if hasattr(msg, 'model_dump') else msg.dict())
+                    if not isinstance(msg, ChatMessage) else msg
+                    for msg in chat_history
+                ]
+            except Exception as e:
+                print(f"[IST] ⚠️ Error normalizing chat_history: {type(e).__name__}: {e}")
+                chat_history = []
+        
+        if ist_history is None:
+            ist_history = []
+        else:
+            try:
+                ist_history = [
+                    IstHistoryItem(**item.model_dump() if hasattr(item, 'model_dump') else item.dict())
+                    if not isinstance(item, IstHistoryItem) else item
+                    for item in ist_history
+                ]
+            except Exception as e:
+                print(f"[IST] ⚠️ Error normalizing ist_history: {type(e).__name__}: {e}")
+                ist_history = []
+        
+        if student_profile is not None and not isinstance(student_profile, StudentProfile):
+            try:
+                if hasattr(student_profile, 'model_dump'):
+                    student_profile = StudentProfile(**student_profile.model_dump())
+                elif hasattr(student_profile, 'dict'):
+                    student_profile = StudentProfile(**student_profile.dict())
+                elif isinstance(student_profile, dict):
+                    student_profile = StudentProfile(**student_profile)
+            except Exception as e:
+                print(f"[IST] ⚠️ Error normalizing student_profile: {type(e).__name__}: {e}")
+                student_profile = None
+        
+        return chat_history, ist_history, student_profile
+
     def _fallback_response(self, reason: str) -> dict:
         """Return a safe fallback response."""
         print(f"[IST] Using fallback response - Reason: {reason}")
+        tracing.current_span().add_event("ist.fallback", reason=reason)
         return {
-            "intent": "Student is asking for help with a course concept.",
-            "skills": ["Concept understanding", "Problem-solving"],
-            "trajectory": ["Review lecture materials", "Practice problems", "Ask clarifying questions"],
+            "intent": FALLBACK_RESULT["intent"],
+            "skills": list(FALLBACK_RESULT["skills"]),
+            "trajectory": list(FALLBACK_RESULT["trajectory"]),
         }
     
     def _validate_intent(self, intent: str, course_context: str) -> str:
         """
         Validate intent against glossary categories.
-        Returns the matched category or the original intent if no match.
+        Returns the matched category, defaulting to conceptual_question.
         """
         if not intent:
             return "unknown"
         
-        intent_lower = intent.lower()
-        course_lower = (course_context or "").lower()
-        
-        # Check against valid categories
-        if any(keyword in intent_lower for keyword in ["understand", "explain", "clarify", "confused", "what is"]):
-            return "conceptual_question"
-        elif any(keyword in intent_lower for keyword in ["debug", "error", "fix", "wrong", "broken"]):
-            return "debugging"
-        elif any(keyword in intent_lower for keyword in ["practice", "solve", "problem", "exercise", "try"]):
-            return "practice_request"
-        elif any(keyword in intent_lower for keyword in ["platform", "tool", "system", "can't access", "not working"]):
-            return "platform_issue"
-        else:
-            return "conceptual_question"  # Default to conceptual
+        return intent_category(intent) or "conceptual_question"  # Default to conceptual
     
     def _remove_markdown_formatting(self, text: str) -> str:
         """Strip markdown code block wrappers (```json ... ``` or ``` ... ```)."""
@@ -557,43 +705,1199 @@ class IntentSkillTrajectoryModule(dspy.Module):
     
     def _build_profile_section(self, student_profile: Optional[StudentProfile]) -> str:
         """Build formatted student profile string."""
+        prebuilt = _prebuilt_section("student_profile")
+        if prebuilt is not None:
+            return prebuilt
         if not student_profile:
             return "Student learning profile: (no data available)"
         
         parts = []
         if student_profile.strong_skills:
-            parts.append(f"Strong skills: {', '.join(student_profile.strong_skills[:10])}")
+            parts.append(f"Strong skills: {', '.join(student_profile.strong_skills[:PROFILE_SKILLS_PROMPT_LIMIT])}")
         if student_profile.weak_skills:
-            parts.append(f"Weak skills: {', '.join(student_profile.weak_skills[:10])}")
+            parts.append(f"Weak skills: {', '.join(student_profile.weak_skills[:PROFILE_SKILLS_PROMPT_LIMIT])}")
         if student_profile.course_progress:
             parts.append(f"Course progress: {student_profile.course_progress}")
         
         return "Student learning profile:\n  " + "\n  ".join(parts) if parts else "Student learning profile: (no detailed data)"
     
-    def _build_ist_history_section(self, ist_history: List[IstHistoryItem]) -> str:
+    def _build_ist_history_section(self, ist_history: List[IstHistoryItem], total: Optional[int] = None) -> str:
         """Build formatted IST history string."""
+        prebuilt = _prebuilt_section("ist_history")
+        if prebuilt is not None:
+            return prebuilt
         if not ist_history:
             return "Recent IST events: (none available)"
         
         parts = []
-        for i, event in enumerate(ist_history[:5], 1):
+        for i, event in enumerate(ist_history[:IST_HISTORY_PROMPT_LIMIT], 1):
             skills_str = ", ".join(event.skills[:5])
             parts.append(f"{i}. Intent: {event.intent[:80]}\n     Skills: {skills_str}")
         
-        return f"Recent IST events ({len(ist_history)} total):\n  " + "\n  ".join(parts)
+        return f"Recent IST events ({total or len(ist_history)} total):\n  " + "\n  ".join(parts)
     
-    def _build_chat_history_section(self, chat_history: List[ChatMessage]) -> str:
-        """Build formatted chat history string."""
-        if not chat_history:
-            return "Recent chat history: (none available)"
+    def _build_materials_section(self, utterance: str, course_context: Optional[str], course_id: Optional[str] = None) -> str:
+        """Build the retrieved course-materials string (top BM25 passages for the utterance)."""
+        if course_retriever is None:
+            return "Course materials: (none indexed)"
+        try:
+            passages = course_retriever.context_for(resolve_course_id(course_id, course_context), utterance)
+        except Exception as e:
+            print(f"[RAG] ⚠️ Retrieval failed: {type(e).__name__}: {e}")
+            passages = ""
+        return f"Course materials:\n{passages}" if passages else "Course materials: (no matching passages)"
+
+    def _build_chat_history_section(self, chat_history: List[ChatMessage], total: Optional[int] = None) -> str:
+        """
+        Build formatted chat history string.
+
+        With a rolling thread summary in scope (conversation_summary.use_summary),
+        the summary stands in for the messages it covers and only the newer
+        messages are listed raw.
+        """
+        prebuilt = _prebuilt_section("chat_history")
+        if prebuilt is not None:
+            return prebuilt
+        total = total or len(chat_history)
+        summary = current_summary()
+        header = ""
+        recent = chat_history[-CHAT_HISTORY_PROMPT_LIMIT:]
+        if summary is not None and summary.summarized_through:
+            header = f"Conversation summary (messages 1-{summary.summarized_through} of {total}): {summary.summary}\n"
+            unsummarized = max(0, total - summary.summarized_through)
+            recent = recent[len(recent) - min(unsummarized, len(recent)):]
+        if not recent:
+            return header + "Recent chat history: (none available)"
         
         parts = []
-        for msg in chat_history[-10:]:
+        for msg in recent:
             role_emoji = {"student": "👤", "tutor": "🤖", "system": "⚙️"}.get(msg.role, "•")
             content_preview = msg.content[:100] + "..." if len(msg.content) > 100 else msg.content
             parts.append(f"{role_emoji} [{msg.role}]: {content_preview}")
         
-        return f"Recent chat history ({len(chat_history)} messages):\n  " + "\n  ".join(parts)
+        return header + f"Recent chat history ({total} messages):\n  " + "\n  ".join(parts)
+
+
+# ---------------------------------------------------------------------
+# Output modes (IST_OUTPUT_MODE=json_string | typed)
+# ---------------------------------------------------------------------
+
+IST_OUTPUT_MODES = ("json_string", "typed")
+
+
+class OutputModeStats:
+    """
+    Per output mode: requests, latency, format retries (LM calls beyond the
+    first, e.g. DSPy's ChatAdapter falling back to JSONAdapter), json_repair
+    repairs and fallback answers. Served under "output_modes" in /api/metrics.
+    """
+
+    def __init__(self, window: int = 1000) -> None:
+        self._lock = threading.Lock()
+        self._window = window
+        self._modes: Dict[str, dict] = {}
+
+    def _mode(self, mode: str) -> dict:
+        if mode not in self._modes:
+            self._modes[mode] = {
+                "requests": 0, "lm_calls": 0, "format_retries": 0, "repairs": 0, "fallbacks": 0,
+                "latencies_ms": deque(maxlen=self._window),
+            }
+        return self._modes[mode]
+
+    def record(self, mode: str, latency_ms: float, lm_calls: int, fallback: bool, base_calls: int = 1) -> None:
+        """`base_calls`: LM calls the mode makes without retries (3 for the decomposed pipeline)."""
+        with self._lock:
+            entry = self._mode(mode)
+            entry["requests"] += 1
+            entry["lm_calls"] += lm_calls
+            entry["format_retries"] += max(0, lm_calls - base_calls)
+            entry["fallbacks"] += int(fallback)
+            entry["latencies_ms"].append(latency_ms)
+
+    def record_repair(self, mode: str) -> None:
+        with self._lock:
+            self._mode(mode)["repairs"] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._modes.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshot = {mode: dict(entry, latencies_ms=list(entry["latencies_ms"])) for mode, entry in self._modes.items()}
+        result = {}
+        for mode, entry in snapshot.items():
+            requests = entry["requests"] or 1
+            result[mode] = {
+                "requests": entry["requests"],
+                "lm_calls": entry["lm_calls"],
+                "format_retries": entry["format_retries"],
+                "format_retry_rate": round(entry["format_retries"] / requests, 4),
+                "repairs": entry["repairs"],
+                "fallbacks": entry["fallbacks"],
+                "fallback_rate": round(entry["fallbacks"] / requests, 4),
+                "latency_ms": summarize_latencies(entry["latencies_ms"]),
+            }
+        return result
+
+
+output_mode_stats = OutputModeStats()
+
+
+class TypedISTSignature(dspy.Signature):
+    """
+    You are an IST (Intent–Skills–Trajectory) extractor for a CS tutoring system.
+
+    - intent: what the student is trying to achieve right now, in one short English sentence.
+    - skills: the specific CS skills or concepts involved (never generic ones like "thinking").
+    - trajectory: next learning steps that build on this student's history and profile
+      without repeating previous trajectories.
+
+    Use the course_context and course_materials to interpret the utterance, the
+    student_profile to personalize, and the chat_history for conversational context.
+    """
+
+    utterance = dspy.InputField(desc="Current student question/utterance in their own words (may be in Hebrew or English).")
+    course_context = dspy.InputField(desc="Current course/topic context.", default="")
+    chat_history = dspy.InputField(desc="Recent conversation history (student and tutor messages).", default="")
+    ist_history = dspy.InputField(desc="Previous IST events extracted from this student.", default="")
+    student_profile = dspy.InputField(desc="Student profile (strong/weak skills, progress).", default="")
+    course_materials = dspy.InputField(desc="Matching excerpts from the course syllabus and lecture notes.", default="")
+
+    intent: str = dspy.OutputField(desc="One short English sentence (under 100 characters) describing what the student needs.")
+    skills: List[str] = dspy.OutputField(desc="4-7 specific CS concepts.")
+    trajectory: List[str] = dspy.OutputField(desc="4-5 actionable learning steps.")
+
+
+class TypedISTModule(IntentSkillTrajectoryModule):
+    """
+    IST extraction with typed output fields decoded by DSPy's JSONAdapter.
+
+    The adapter sends the provider a JSON-schema response format when the
+    model supports structured outputs (JSON mode otherwise) and decodes the
+    reply against the field types, so there is no markdown stripping or JSON
+    repair step. A reply that does not decode is re-requested up to
+    IST_TYPED_FORMAT_RETRIES times (default 1, bypassing the LM cache), then
+    answered with the fallback.
+    """
+
+    OUTPUT_MODE = "typed"
+
+    def __init__(self, format_retries: Optional[int] = None) -> None:
+        # Skip IntentSkillTrajectoryModule.__init__: different signature.
+        dspy.Module.__init__(self)
+        self.predict = dspy.ChainOfThought(TypedISTSignature)
+        self.adapter = dspy.JSONAdapter()
+        if format_retries is None:
+            format_retries = int(os.getenv("IST_TYPED_FORMAT_RETRIES", "1"))
+        self.format_retries = max(0, format_retries)
+
+    def _extract(
+        self,
+        utterance: str,
+        course_context: Optional[str],
+        chat_history: Optional[List[ChatMessage]],
+        ist_history: Optional[List[IstHistoryItem]],
+        student_profile: Optional[StudentProfile],
+        chat_history_total: Optional[int],
+        ist_history_total: Optional[int],
+        course_id: Optional[str],
+    ) -> dict:
+        print(f"\n[IST] ===== STARTING TYPED IST EXTRACTION =====")
+        print(f"[IST] Utterance: {utterance[:80]}")
+
+        chat_history, ist_history, student_profile = self._coerce_context(chat_history, ist_history, student_profile)
+        inputs = dict(
+            utterance=utterance,
+            course_context=course_context or "",
+            chat_history=self._build_chat_history_section(chat_history, chat_history_total),
+            ist_history=self._build_ist_history_section(ist_history, ist_history_total),
+            student_profile=self._build_profile_section(student_profile),
+            course_materials=self._build_materials_section(utterance, course_context, course_id),
+        )
+
+        pred = None
+        for attempt in range(1 + self.format_retries):
+            try:
+                # A new rollout_id gives a retry its own LM cache entry instead of the bad reply.
+                config = {"rollout_id": attempt} if attempt else {}
+                with dspy.context(adapter=self.adapter):
+                    pred = self.predict(**inputs, config=config)
+                break
+            except AdapterParseError as e:
+                print(f"[IST] ⚠️ Typed output did not decode (attempt {attempt + 1}): {str(e)[:200]}")
+                tracing.current_span().add_event("ist.format_retry", attempt=attempt + 1)
+            except Exception as e:
+                print(f"[IST] ❌ Typed prediction failed: {type(e).__name__}: {str(e)[:300]}")
+                break
+        if pred is None:
+            return self._fallback_response("Typed output decode failed")
+
+        intent = str(pred.intent or "").strip()
+        skills = [str(s).strip() for s in pred.skills or [] if str(s).strip()]
+        trajectory = [str(s).strip() for s in pred.trajectory or [] if str(s).strip()]
+        if not (intent and skills and trajectory):
+            return self._fallback_response("Typed output had empty fields")
+
+        print(f"[IST] ✅ Typed extraction: intent={intent[:60]!r}, {len(skills)} skills, {len(trajectory)} steps")
+        return {"intent": intent, "skills": skills, "trajectory": trajectory}
+
+
+typed_extractor: Optional[TypedISTModule] = None
+
+
+def resolve_output_mode(requested: Optional[str] = None) -> str:
+    """The output mode for a request: its explicit choice, else IST_OUTPUT_MODE (default json_string)."""
+    mode = (requested or os.getenv("IST_OUTPUT_MODE", "") or "json_string").strip().lower()
+    if mode not in IST_OUTPUT_MODES:
+        print(f"[IST] ⚠️ Unknown IST output mode '{mode}', using json_string")
+        return "json_string"
+    return mode
+
+
+def get_typed_extractor() -> TypedISTModule:
+    """Shared TypedISTModule, created on first use."""
+    global typed_extractor
+    if typed_extractor is None:
+        typed_extractor = TypedISTModule()
+    return typed_extractor
+
+
+# ---------------------------------------------------------------------
+# Decomposed pipeline (IST_PIPELINE=decomposed)
+# ---------------------------------------------------------------------
+
+IST_PIPELINES = ("monolithic", "decomposed", "cascade")
+
+
+class ISTIntentSignature(dspy.Signature):
+    """
+    Identify what a CS student is trying to achieve right now.
+
+    Answer with ONE short English sentence (under 100 characters), e.g. a request
+    for clarification, debugging help, review, a new topic, or feedback on a solution.
+    """
+
+    utterance = dspy.InputField(desc="Current student question/utterance in their own words (may be in Hebrew or English).")
+    course_context = dspy.InputField(desc="Current course/topic context.", default="")
+    chat_history = dspy.InputField(desc="Recent conversation history (student and tutor messages).", default="")
+
+    intent = dspy.OutputField(desc="One short English sentence describing what the student needs. No markdown.")
+
+
+class ISTSkillsSignature(dspy.Signature):
+    """
+    List the CS skills or concepts a student needs for their current question.
+
+    Return 4-7 specific CS concepts. NEVER use generic skills like "thinking" or "learning".
+    """
+
+    utterance = dspy.InputField(desc="Current student question/utterance in their own words (may be in Hebrew or English).")
+    course_context = dspy.InputField(desc="Current course/topic context.", default="")
+    student_profile = dspy.InputField(desc="Student profile (strong/weak skills, progress).", default="")
+    course_materials = dspy.InputField(desc="Matching excerpts from the course syllabus and lecture notes.", default="")
+
+    skills = dspy.OutputField(desc="JSON array of 4-7 strings, e.g. [\"Recursion\", \"Base cases\"]. No markdown.")
+
+
+class ISTTrajectorySignature(dspy.Signature):
+    """
+    Suggest the next learning steps for a CS student's current question.
+
+    Return 4-5 actionable steps that build on the student's previous IST events
+    and profile. Do NOT repeat identical trajectories from the history.
+    """
+
+    utterance = dspy.InputField(desc="Current student question/utterance in their own words (may be in Hebrew or English).")
+    course_context = dspy.InputField(desc="Current course/topic context.", default="")
+    ist_history = dspy.InputField(desc="Previous IST events extracted from this student.", default="")
+    student_profile = dspy.InputField(desc="Student profile (strong/weak skills, progress).", default="")
+    course_materials = dspy.InputField(desc="Matching excerpts from the course syllabus and lecture notes.", default="")
+
+    trajectory = dspy.OutputField(desc="JSON array of 4-5 strings, each an actionable learning step. No markdown.")
+
+
+_decomposed_executor: Optional[ThreadPoolExecutor] = None
+_decomposed_executor_lock = threading.Lock()
+
+
+def _get_decomposed_executor() -> ThreadPoolExecutor:
+    global _decomposed_executor
+    if _decomposed_executor is None:
+        with _decomposed_executor_lock:
+            if _decomposed_executor is None:
+                _decomposed_executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv("IST_DECOMPOSED_WORKERS", "32")),
+                    thread_name_prefix="ist-decomposed",
+                )
+    return _decomposed_executor
+
+
+class DecomposedISTModule(IntentSkillTrajectoryModule):
+    """
+    IST extraction as three small predictors run concurrently: intent
+    (one sentence), skills and trajectory. Latency is the slowest of the three
+    short generations instead of one long reasoning + JSON generation.
+
+    Fields are handed to `on_field(name, value)` as soon as each predictor
+    finishes (intent and skills, being short, normally arrive first). A failed
+    sub-predictor falls back for its own field only.
+    """
+
+    FIELDS = ("intent", "skills", "trajectory")
+    OUTPUT_MODE = "decomposed"
+
+    def __init__(self) -> None:
+        # Skip IntentSkillTrajectoryModule.__init__: this module has no monolithic predictor.
+        dspy.Module.__init__(self)
+        self.intent_predict = dspy.Predict(ISTIntentSignature)
+        self.skills_predict = dspy.Predict(ISTSkillsSignature)
+        self.trajectory_predict = dspy.Predict(ISTTrajectorySignature)
+
+    def forward(
+        self,
+        utterance: str,
+        course_context: Optional[str] = "",
+        chat_history: List[ChatMessage] = None,
+        ist_history: List[IstHistoryItem] = None,
+        student_profile: Optional[StudentProfile] = None,
+        chat_history_total: Optional[int] = None,
+        ist_history_total: Optional[int] = None,
+        course_id: Optional[str] = None,
+        on_field: Optional[Callable[[str, object], None]] = None,
+    ) -> dict:
+        """
+        Run the three sub-predictors concurrently and merge their outputs.
+        Returns {"intent": str, "skills": List[str], "trajectory": List[str]}.
+        Recorded in `output_mode_stats` under "decomposed", like the other modes.
+        """
+        print(f"\n[IST] ===== STARTING DECOMPOSED IST EXTRACTION =====")
+        print(f"[IST] Utterance: {utterance[:80]}")
+
+        started = time.perf_counter()
+        with tracing.span("ist.forward", **{"ist.pipeline": "decomposed"}), count_lm_calls() as counter:
+            chat_history, ist_history, student_profile = self._coerce_context(chat_history, ist_history, student_profile)
+            course_context = course_context or ""
+            profile_section = self._build_profile_section(student_profile)
+            materials_section = self._build_materials_section(utterance, course_context, course_id)
+
+            calls = {
+                "intent": (self.intent_predict, {
+                    "chat_history": self._build_chat_history_section(chat_history, chat_history_total),
+                }),
+                "skills": (self.skills_predict, {
+                    "student_profile": profile_section,
+                    "course_materials": materials_section,
+                }),
+                "trajectory": (self.trajectory_predict, {
+                    "ist_history": self._build_ist_history_section(ist_history, ist_history_total),
+                    "student_profile": profile_section,
+                    "course_materials": materials_section,
+                }),
+            }
+
+            executor = _get_decomposed_executor()
+            futures = {}
+            for name, (predictor, inputs) in calls.items():
+                # Each worker runs in a copy of this context so dspy.context()
+                # overrides, the LM accounting scope and the trace span carry over.
+                context = contextvars.copy_context()
+                future = executor.submit(
+                    context.run, self._run_field, name, predictor,
+                    dict(inputs, utterance=utterance, course_context=course_context),
+                )
+                futures[future] = name
+
+            result = {}
+            for future in as_completed(futures):
+                name = futures[future]
+                result[name] = future.result()
+                if on_field is not None:
+                    on_field(name, result[name])
+
+            print(f"[IST] ✅ Decomposed extraction merged: intent={result['intent'][:60]!r}, "
+                  f"{len(result['skills'])} skills, {len(result['trajectory'])} steps")
+            result = {field: result[field] for field in self.FIELDS}
+        output_mode_stats.record(self.OUTPUT_MODE, latency_ms=(time.perf_counter() - started) * 1000,
+                                 lm_calls=counter.calls, fallback=is_fallback_result(result),
+                                 base_calls=len(self.FIELDS))
+        return result
+
+    def _run_field(self, name: str, predictor, inputs: dict):
+        """Call one sub-predictor; never raises, falls back for this field only."""
+        try:
+            with request_profiler.follow(), tracing.span(f"ist.field.{name}"):
+                raw = getattr(predictor(**inputs), name, None)
+            if name == "intent":
+                value = self._remove_markdown_formatting(str(raw or "")).strip().strip('"')
+            else:
+                value = self._normalize_list(self._remove_markdown_formatting(raw) if isinstance(raw, str) else raw)
+        except Exception as e:
+            print(f"[IST] ⚠️ Decomposed {name} predictor failed: {type(e).__name__}: {e}")
+            value = None
+
+        if not value:
+            print(f"[IST] Using fallback {name}")
+            fallback = FALLBACK_RESULT[name]
+            value = list(fallback) if isinstance(fallback, list) else fallback
+        return value
+
+
+decomposed_extractor: Optional[DecomposedISTModule] = None
+
+
+def resolve_pipeline(requested: Optional[str] = None) -> str:
+    """The IST pipeline for a request: its explicit choice, else IST_PIPELINE (default monolithic)."""
+    pipeline = (requested or os.getenv("IST_PIPELINE", "") or "monolithic").strip().lower()
+    if pipeline not in IST_PIPELINES:
+        print(f"[IST] ⚠️ Unknown IST pipeline '{pipeline}', using monolithic")
+        return "monolithic"
+    return pipeline
+
+
+def get_decomposed_extractor() -> DecomposedISTModule:
+    """Shared DecomposedISTModule, created on first use."""
+    global decomposed_extractor
+    if decomposed_extractor is None:
+        decomposed_extractor = DecomposedISTModule()
+    return decomposed_extractor
+
+
+# ---------------------------------------------------------------------
+# Cascade pipeline (IST_PIPELINE=cascade)
+# ---------------------------------------------------------------------
+
+# Stronger model escalated to by default, keyed by the configured (cheap) model.
+CASCADE_STRONG_MODELS = {
+    "openai/gpt-4o-mini": "openai/gpt-4o",
+    "gemini/gemini-1.5-flash": "gemini/gemini-1.5-pro",
+}
+CASCADE_SKILLS_RANGE = (4, 7)  # the "4-7 specific CS concepts" of the IST signatures
+CASCADE_STEPS_RANGE = (4, 5)  # the "4-5 actionable learning steps"
+
+
+class CompactISTSignature(dspy.Signature):
+    """
+    Extract a CS student's intent, the skills involved and their next learning steps.
+
+    Also rate your confidence (0-1) that the answer is specific and correct; use a
+    low value when the question is ambiguous, off-topic or needs the student's history.
+    """
+
+    utterance = dspy.InputField(desc="Current student question/utterance in their own words (may be in Hebrew or English).")
+    course_context = dspy.InputField(desc="Current course/topic context.", default="")
+    chat_history = dspy.InputField(desc="Recent conversation history (student and tutor messages).", default="")
+    course_materials = dspy.InputField(desc="Matching excerpts from the course syllabus and lecture notes.", default="")
+
+    intent: str = dspy.OutputField(desc="One short English sentence: understand/explain a concept, debug/fix an error, practice/solve problems, or a platform/tool issue.")
+    skills: List[str] = dspy.OutputField(desc="4-7 specific CS concepts.")
+    trajectory: List[str] = dspy.OutputField(desc="4-5 actionable learning steps.")
+    confidence: float = dspy.OutputField(desc="Confidence in this answer, from 0 to 1.")
+
+
+def cascade_rejections(result: dict, confidence: Optional[float], min_confidence: float) -> List[str]:
+    """
+    Reasons to escalate a cheap-model answer (empty when it is accepted):
+    skill or step counts outside the signature's ranges, an intent that matches
+    no intent category, or self-reported confidence below `min_confidence`.
+    """
+    reasons = []
+    if not CASCADE_SKILLS_RANGE[0] <= len(result.get("skills") or []) <= CASCADE_SKILLS_RANGE[1]:
+        reasons.append("skill_count")
+    if not CASCADE_STEPS_RANGE[0] <= len(result.get("trajectory") or []) <= CASCADE_STEPS_RANGE[1]:
+        reasons.append("step_count")
+    if intent_category(result.get("intent") or "") is None:
+        reasons.append("intent_category")
+    if confidence is None or confidence < min_confidence:
+        reasons.append("low_confidence")
+    return reasons
+
+
+class CascadeStats:
+    """
+    Cascade outcomes: requests, escalations and their reasons, and latency,
+    LM calls and cost for requests answered by the cheap model alone vs
+    escalated ones, plus the blended figures over both. Served under
+    "cascade" in /api/metrics.
+    """
+
+    PATHS = ("cheap", "escalated")
+
+    def __init__(self, window: int = 1000) -> None:
+        self._lock = threading.Lock()
+        self._window = window
+        self._clear()
+
+    def _clear(self) -> None:
+        self._reasons: Dict[str, int] = {}
+        self._escalation_fallbacks = 0
+        self._paths = {
+            path: {"requests": 0, "lm_calls": 0, "cost": 0.0, "latencies_ms": deque(maxlen=self._window)}
+            for path in self.PATHS
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def record(self, reasons: List[str], latency_ms: float, lm_calls: int, cost: float,
+               escalation_fallback: bool = False) -> None:
+        with self._lock:
+            entry = self._paths["escalated" if reasons else "cheap"]
+            entry["requests"] += 1
+            entry["lm_calls"] += lm_calls
+            entry["cost"] += cost
+            entry["latencies_ms"].append(latency_ms)
+            for reason in reasons:
+                self._reasons[reason] = self._reasons.get(reason, 0) + 1
+            self._escalation_fallbacks += int(escalation_fallback)
+
+    def stats(self) -> dict:
+        with self._lock:
+            paths = {path: dict(entry, latencies_ms=list(entry["latencies_ms"])) for path, entry in self._paths.items()}
+            reasons = dict(self._reasons)
+            escalation_fallbacks = self._escalation_fallbacks
+
+        def summary(entries: List[dict]) -> dict:
+            requests = sum(entry["requests"] for entry in entries)
+            return {
+                "requests": requests,
+                "lm_calls": sum(entry["lm_calls"] for entry in entries),
+                "mean_cost_usd": round(sum(entry["cost"] for entry in entries) / (requests or 1), 6),
+                "latency_ms": summarize_latencies([ms for entry in entries for ms in entry["latencies_ms"]]),
+            }
+
+        requests = sum(entry["requests"] for entry in paths.values())
+        escalations = paths["escalated"]["requests"]
+        return {
+            "requests": requests,
+            "escalations": escalations,
+            "escalation_rate": round(escalations / (requests or 1), 4),
+            "reasons": reasons,
+            "escalation_fallbacks": escalation_fallbacks,
+            "cheap": summary([paths["cheap"]]),
+            "escalated": summary([paths["escalated"]]),
+            "blended": summary(list(paths.values())),
+        }
+
+
+cascade_stats = CascadeStats()
+
+
+class CascadeISTModule(IntentSkillTrajectoryModule):
+    """
+    Cheap-model-first IST extraction. A compact typed predictor (no reasoning,
+    no IST history or profile) runs on the cheap LM; its answer is kept when it
+    decodes and passes cascade_rejections(). Otherwise the request escalates to
+    the full monolithic module on the strong LM. If the escalated call falls
+    back too, a decoded cheap answer is returned rather than the fallback.
+
+    LMs left as None resolve to the configured dspy LM at call time, so a
+    module built without them escalates to the same model with the full prompt.
+    """
+
+    OUTPUT_MODE = "cascade"
+
+    def __init__(self, cheap_lm: Optional[dspy.LM] = None, strong_lm: Optional[dspy.LM] = None,
+                 min_confidence: Optional[float] = None) -> None:
+        # Skip IntentSkillTrajectoryModule.__init__: the monolithic predictor lives in self.strong.
+        dspy.Module.__init__(self)
+        self.cheap_predict = dspy.Predict(CompactISTSignature)
+        self.strong = IntentSkillTrajectoryModule()
+        self.adapter = dspy.JSONAdapter()
+        self.cheap_lm = cheap_lm
+        self.strong_lm = strong_lm
+        if min_confidence is None:
+            min_confidence = float(os.getenv("IST_CASCADE_MIN_CONFIDENCE", "0.7"))
+        self.min_confidence = min_confidence
+
+    def cascade_models(self) -> tuple:
+        """(cheap, strong) model ids, for the shared cache's program fingerprint."""
+        configured = getattr(dspy.settings.lm, "model", None)
+        return (getattr(self.cheap_lm, "model", configured), getattr(self.strong_lm, "model", configured))
+
+    def _extract(
+        self,
+        utterance: str,
+        course_context: Optional[str],
+        chat_history: Optional[List[ChatMessage]],
+        ist_history: Optional[List[IstHistoryItem]],
+        student_profile: Optional[StudentProfile],
+        chat_history_total: Optional[int],
+        ist_history_total: Optional[int],
+        course_id: Optional[str],
+    ) -> dict:
+        print(f"\n[IST] ===== STARTING CASCADE IST EXTRACTION =====")
+        print(f"[IST] Utterance: {utterance[:80]}")
+
+        started = time.perf_counter()
+        escalation_fallback = False
+        with count_lm_calls() as counter:
+            cheap_result, reasons = self._cheap_attempt(utterance, course_context, chat_history,
+                                                        chat_history_total, course_id)
+            result = cheap_result
+            if reasons:
+                print(f"[IST] Cascade escalating to the strong model: {', '.join(reasons)}")
+                tracing.current_span().add_event("ist.cascade_escalation", reasons=",".join(reasons))
+                with tracing.span("ist.cascade.strong"), dspy.context(lm=self.strong_lm or dspy.settings.lm):
+                    result = self.strong._extract(
+                        utterance, course_context, chat_history, ist_history, student_profile,
+                        chat_history_total, ist_history_total, course_id,
+                    )
+                if is_fallback_result(result) and cheap_result is not None:
+                    print(f"[IST] Escalated call fell back; keeping the cheap model's answer")
+                    escalation_fallback = True
+                    result = cheap_result
+            else:
+                print(f"[IST] ✅ Cascade accepted the cheap model's answer")
+
+        tracing.current_span().set_attribute("ist.cascade.escalated", bool(reasons))
+        cascade_stats.record(reasons, latency_ms=(time.perf_counter() - started) * 1000,
+                             lm_calls=counter.calls, cost=counter.cost, escalation_fallback=escalation_fallback)
+        return result
+
+    def _cheap_attempt(self, utterance, course_context, chat_history, chat_history_total, course_id):
+        """Run the compact predictor on the cheap LM: (result or None, escalation reasons)."""
+        chat_history, _, _ = self._coerce_context(chat_history, None, None)
+        inputs = dict(
+            utterance=utterance,
+            course_context=course_context or "",
+            chat_history=self._build_chat_history_section(chat_history, chat_history_total),
+            course_materials=self._build_materials_section(utterance, course_context, course_id),
+        )
+        try:
+            with tracing.span("ist.cascade.cheap"), \
+                    dspy.context(lm=self.cheap_lm or dspy.settings.lm, adapter=self.adapter):
+                pred = self.cheap_predict(**inputs)
+        except AdapterParseError as e:
+            print(f"[IST] ⚠️ Cheap model output did not decode: {str(e)[:200]}")
+            return None, ["parse_failure"]
+        except Exception as e:
+            print(f"[IST] ⚠️ Cheap model call failed: {type(e).__name__}: {str(e)[:200]}")
+            return None, ["lm_error"]
+
+        result = {
+            "intent": str(pred.intent or "").strip(),
+            "skills": [str(s).strip() for s in pred.skills or [] if str(s).strip()],
+            "trajectory": [str(s).strip() for s in pred.trajectory or [] if str(s).strip()],
+        }
+        if not (result["intent"] and result["skills"] and result["trajectory"]):
+            return None, ["parse_failure"]
+        confidence = pred.confidence if isinstance(pred.confidence, (int, float)) else None
+        print(f"[IST] Cheap answer: intent={result['intent'][:60]!r}, {len(result['skills'])} skills, "
+              f"{len(result['trajectory'])} steps, confidence={confidence}")
+        return result, cascade_rejections(result, confidence, self.min_confidence)
+
+
+cascade_extractor: Optional[CascadeISTModule] = None
+
+
+def _cascade_lms() -> tuple:
+    """
+    (cheap, strong) LMs from IST_CASCADE_CHEAP_MODEL / IST_CASCADE_STRONG_MODEL,
+    as copies of the configured LM (same provider credentials and base URL).
+    The cheap tier defaults to the configured model; the strong tier to
+    CASCADE_STRONG_MODELS for it, else the configured model as well.
+    """
+    base = dspy.settings.lm
+    if base is None:
+        return None, None
+    cheap_model = os.getenv("IST_CASCADE_CHEAP_MODEL", "").strip() or base.model
+    strong_model = os.getenv("IST_CASCADE_STRONG_MODEL", "").strip() or CASCADE_STRONG_MODELS.get(base.model, base.model)
+
+    def tier(model: str):
+        return base if model == base.model else base.copy(model=model)
+
+    return tier(cheap_model), tier(strong_model)
+
+
+def get_cascade_extractor() -> CascadeISTModule:
+    """Shared CascadeISTModule, created on first use."""
+    global cascade_extractor
+    if cascade_extractor is None:
+        cheap_lm, strong_lm = _cascade_lms()
+        cascade_extractor = CascadeISTModule(cheap_lm, strong_lm)
+        print(f"[IST] Cascade models: cheap={cascade_extractor.cascade_models()[0]}, "
+              f"strong={cascade_extractor.cascade_models()[1]}")
+    return cascade_extractor
+
+
+# ---------------------------------------------------------------------
+# Graph trajectories (IST_TRAJECTORY_SOURCE=graph)
+# ---------------------------------------------------------------------
+
+IST_TRAJECTORY_SOURCES = ("llm", "graph")
+SKILL_CATALOG_PROMPT_LIMIT = 60  # course graph skill names listed in the prompt
+
+
+class ISTIntentSkillsSignature(dspy.Signature):
+    """
+    Identify what a CS student is trying to achieve right now and the skills involved.
+
+    Prefer skill names from the course's skill_catalog when they fit; the learning
+    steps are planned separately from the course's prerequisite graph.
+    """
+
+    utterance = dspy.InputField(desc="Current student question/utterance in their own words (may be in Hebrew or English).")
+    course_context = dspy.InputField(desc="Current course/topic context.", default="")
+    chat_history = dspy.InputField(desc="Recent conversation history (student and tutor messages).", default="")
+    student_profile = dspy.InputField(desc="Student profile (strong/weak skills, progress).", default="")
+    course_materials = dspy.InputField(desc="Matching excerpts from the course syllabus and lecture notes.", default="")
+    skill_catalog = dspy.InputField(desc="Skills in this course's prerequisite graph.", default="")
+
+    intent: str = dspy.OutputField(desc="One short English sentence (under 100 characters) describing what the student needs.")
+    skills: List[str] = dspy.OutputField(desc="4-7 specific CS concepts, using skill_catalog names where they fit.")
+
+
+class GraphTrajectoryISTModule(IntentSkillTrajectoryModule):
+    """
+    IST extraction where the LM writes only the intent and the skills (typed
+    fields, no reasoning) and the trajectory comes from the course's
+    prerequisite skill graph (skill_graph.py): the identified skills and
+    their prerequisites, minus the student's strong skills, in prerequisite
+    order. When no identified skill is in the graph, the trajectory falls
+    back to the decomposed pipeline's trajectory predictor.
+    """
+
+    OUTPUT_MODE = "graph_trajectory"
+
+    def __init__(self, graphs: Optional[SkillGraphRegistry] = None) -> None:
+        # Skip IntentSkillTrajectoryModule.__init__: different signature.
+        dspy.Module.__init__(self)
+        self.predict = dspy.Predict(ISTIntentSkillsSignature)
+        self.trajectory_predict = dspy.Predict(ISTTrajectorySignature)
+        self.adapter = dspy.JSONAdapter()
+        self.graphs = graphs
+
+    def skill_graph_versions(self) -> Dict[str, str]:
+        """course_id -> graph hash, for the shared cache's program fingerprint."""
+        graphs = self.graphs or skill_graphs
+        return graphs.versions() if graphs is not None else {}
+
+    def _extract(
+        self,
+        utterance: str,
+        course_context: Optional[str],
+        chat_history: Optional[List[ChatMessage]],
+        ist_history: Optional[List[IstHistoryItem]],
+        student_profile: Optional[StudentProfile],
+        chat_history_total: Optional[int],
+        ist_history_total: Optional[int],
+        course_id: Optional[str],
+    ) -> dict:
+        print(f"\n[IST] ===== STARTING GRAPH-TRAJECTORY IST EXTRACTION =====")
+        print(f"[IST] Utterance: {utterance[:80]}")
+
+        graphs = self.graphs or skill_graphs
+        course_id = resolve_course_id(course_id, course_context)
+        graph = graphs.get(course_id) if graphs is not None else None
+        chat_history, ist_history, student_profile = self._coerce_context(chat_history, ist_history, student_profile)
+        profile_section = self._build_profile_section(student_profile)
+        materials_section = self._build_materials_section(utterance, course_context, course_id)
+        catalog = ", ".join(graph.skill_names()[:SKILL_CATALOG_PROMPT_LIMIT]) if graph is not None else ""
+
+        try:
+            with tracing.span("ist.predict"), dspy.context(adapter=self.adapter):
+                pred = self.predict(
+                    utterance=utterance,
+                    course_context=course_context or "",
+                    chat_history=self._build_chat_history_section(chat_history, chat_history_total),
+                    student_profile=profile_section,
+                    course_materials=materials_section,
+                    skill_catalog=catalog or "(no course skill graph)",
+                )
+        except Exception as e:
+            print(f"[IST] ❌ Intent/skills prediction failed: {type(e).__name__}: {str(e)[:300]}")
+            return self._fallback_response("Intent/skills prediction failed")
+
+        intent = str(pred.intent or "").strip()
+        skills = [str(s).strip() for s in pred.skills or [] if str(s).strip()]
+        if not (intent and skills):
+            return self._fallback_response("Intent/skills output had empty fields")
+
+        mastered = student_profile.strong_skills if student_profile is not None else []
+        with tracing.span("ist.graph_trajectory") as span:
+            trajectory = graphs.trajectory(course_id, skills, mastered) if graphs is not None else []
+            span.set_attribute("ist.graph_hit", bool(trajectory))
+        if trajectory:
+            print(f"[IST] ✅ Graph trajectory for course {course_id}: {len(trajectory)} steps")
+        else:
+            print(f"[IST] No identified skill in the skill graph for course {course_id or '(none)'}; asking the LM")
+            trajectory = self._llm_trajectory(utterance, course_context, ist_history, ist_history_total,
+                                              profile_section, materials_section)
+        return {"intent": intent, "skills": skills, "trajectory": trajectory}
+
+    def _llm_trajectory(self, utterance, course_context, ist_history, ist_history_total,
+                        profile_section, materials_section) -> List[str]:
+        try:
+            with tracing.span("ist.field.trajectory"):
+                raw = self.trajectory_predict(
+                    utterance=utterance,
+                    course_context=course_context or "",
+                    ist_history=self._build_ist_history_section(ist_history, ist_history_total),
+                    student_profile=profile_section,
+                    course_materials=materials_section,
+                ).trajectory
+            steps = self._normalize_list(self._remove_markdown_formatting(raw) if isinstance(raw, str) else raw)
+        except Exception as e:
+            print(f"[IST] ⚠️ Trajectory predictor failed: {type(e).__name__}: {e}")
+            steps = []
+        return steps or list(FALLBACK_RESULT["trajectory"])
+
+
+graph_trajectory_extractor: Optional[GraphTrajectoryISTModule] = None
+
+
+def resolve_trajectory_source(requested: Optional[str] = None) -> str:
+    """The trajectory source for a request: its explicit choice, else IST_TRAJECTORY_SOURCE (default llm)."""
+    source = (requested or os.getenv("IST_TRAJECTORY_SOURCE", "") or "llm").strip().lower()
+    if source not in IST_TRAJECTORY_SOURCES:
+        print(f"[IST] ⚠️ Unknown IST trajectory source '{source}', using llm")
+        return "llm"
+    return source
+
+
+def get_graph_trajectory_extractor() -> GraphTrajectoryISTModule:
+    """Shared GraphTrajectoryISTModule, created on first use."""
+    global graph_trajectory_extractor
+    if graph_trajectory_extractor is None:
+        graph_trajectory_extractor = GraphTrajectoryISTModule()
+    return graph_trajectory_extractor
+
+
+# ---------------------------------------------------------------------
+# Fused tutor turn (POST /api/tutor-turn)
+# ---------------------------------------------------------------------
+
+# Same wording as the Genkit socraticCourseChat flow's fallback message.
+TUTOR_FALLBACK_REPLY = (
+    "The AI tutor is temporarily unavailable due to high load. "
+    "Please try asking your question again in a moment."
+)
+TUTOR_MATERIAL_PROMPT_CHARS = 4000  # caller-supplied course material kept in the prompt
+
+
+class TutorTurnSignature(dspy.Signature):
+    """
+    You are a Socratic tutor guiding a student through course material, and you
+    also record what the student is working on for the tutoring system.
+
+    - reply: ask questions that encourage critical thinking and deeper understanding,
+      referencing only the provided course material. Do not just give the answer.
+    - intent: what the student is trying to achieve right now, in one short English sentence.
+    - skills: the specific CS skills or concepts involved (never generic ones like "thinking").
+    - trajectory: next learning steps that build on this student's history and profile
+      without repeating previous trajectories.
+    """
+
+    utterance = dspy.InputField(desc="Current student question/utterance in their own words (may be in Hebrew or English).")
+    course_context = dspy.InputField(desc="Current course/topic context.", default="")
+    course_materials = dspy.InputField(desc="The course material to tutor from.", default="")
+    chat_history = dspy.InputField(desc="Recent conversation history (student and tutor messages).", default="")
+    ist_history = dspy.InputField(desc="Previous IST events extracted from this student.", default="")
+    student_profile = dspy.InputField(desc="Student profile (strong/weak skills, progress).", default="")
+
+    # Output order is generation order: the reply comes first so it can be streamed.
+    reply: str = dspy.OutputField(desc="The Socratic tutor reply to the student, in the student's language.")
+    intent: str = dspy.OutputField(desc="One short English sentence (under 100 characters) describing what the student needs.")
+    skills: List[str] = dspy.OutputField(desc="4-7 specific CS concepts.")
+    trajectory: List[str] = dspy.OutputField(desc="4-5 actionable learning steps.")
+
+
+class TutorTurnModule(IntentSkillTrajectoryModule):
+    """
+    One LM call for a chat turn: the Socratic tutor reply and the IST fields,
+    instead of a tutor generation plus a separate IST extraction that both
+    ingest the same question and course material.
+
+    With `on_reply_chunk`, the reply is streamed through it as the LM
+    generates it (it is the first output field); the IST fields are only
+    known when the call completes. A reply served from the LM cache is passed
+    in one chunk. If the call fails, the reply falls back to
+    TUTOR_FALLBACK_REPLY (or whatever was streamed) and the IST fields to
+    FALLBACK_RESULT.
+    """
+
+    OUTPUT_MODE = "tutor_turn"
+
+    def __init__(self) -> None:
+        # Skip IntentSkillTrajectoryModule.__init__: different signature, and no reasoning
+        # field so the reply is the first thing generated.
+        dspy.Module.__init__(self)
+        self.predict = dspy.Predict(TutorTurnSignature)
+
+    def forward(
+        self,
+        utterance: str,
+        course_context: Optional[str] = "",
+        chat_history: List[ChatMessage] = None,
+        ist_history: List[IstHistoryItem] = None,
+        student_profile: Optional[StudentProfile] = None,
+        chat_history_total: Optional[int] = None,
+        ist_history_total: Optional[int] = None,
+        course_id: Optional[str] = None,
+        course_material: Optional[str] = None,
+        on_reply_chunk: Optional[Callable[[str], None]] = None,
+    ) -> dict:
+        """
+        Returns {"reply": str, "intent": str, "skills": List[str], "trajectory": List[str]}.
+        `course_material` is the caller's material for this turn; without it the
+        retrieved course passages are used.
+        """
+        print(f"\n[IST] ===== STARTING TUTOR TURN =====")
+        print(f"[IST] Utterance: {utterance[:80]}")
+
+        started = time.perf_counter()
+        with tracing.span("ist.forward", **{"ist.output_mode": self.OUTPUT_MODE}) as span, count_lm_calls() as counter:
+            chat_history, ist_history, student_profile = self._coerce_context(chat_history, ist_history, student_profile)
+            if course_material and course_material.strip():
+                materials = course_material.strip()[:TUTOR_MATERIAL_PROMPT_CHARS]
+            else:
+                materials = self._build_materials_section(utterance, course_context, course_id)
+            inputs = dict(
+                utterance=utterance,
+                course_context=course_context or "",
+                course_materials=materials,
+                chat_history=self._build_chat_history_section(chat_history, chat_history_total),
+                ist_history=self._build_ist_history_section(ist_history, ist_history_total),
+                student_profile=self._build_profile_section(student_profile),
+            )
+            pred, streamed = self._predict(inputs, on_reply_chunk)
+
+            reply = str(getattr(pred, "reply", "") or "").strip() or "".join(streamed).strip()
+            if not reply:
+                reply = TUTOR_FALLBACK_REPLY
+            if on_reply_chunk is not None and not streamed:
+                on_reply_chunk(reply)
+
+            ist = None
+            if pred is not None:
+                ist = {
+                    "intent": str(pred.intent or "").strip(),
+                    "skills": [str(s).strip() for s in pred.skills or [] if str(s).strip()],
+                    "trajectory": [str(s).strip() for s in pred.trajectory or [] if str(s).strip()],
+                }
+            if not (ist and ist["intent"] and ist["skills"] and ist["trajectory"]):
+                ist = self._fallback_response("Tutor turn had no usable IST fields")
+            span.set_attributes({"ist.lm_calls": counter.calls, "ist.fallback": is_fallback_result(ist),
+                                 "ist.reply_chars": len(reply)})
+
+        output_mode_stats.record(self.OUTPUT_MODE, latency_ms=(time.perf_counter() - started) * 1000,
+                                 lm_calls=counter.calls, fallback=is_fallback_result(ist))
+        print(f"[IST] ✅ Tutor turn: {len(reply)} reply chars, intent={ist['intent'][:60]!r}")
+        return {"reply": reply, **ist}
+
+    def _predict(self, inputs: dict, on_reply_chunk: Optional[Callable[[str], None]]):
+        """(prediction or None, streamed reply chunks); never raises."""
+        streamed: List[str] = []
+        try:
+            with tracing.span("ist.predict"):
+                if on_reply_chunk is None:
+                    return self.predict(**inputs), streamed
+                stream = dspy.streamify(self.predict, stream_listeners=[StreamListener(signature_field_name="reply")],
+                                        async_streaming=False)
+                pred = None
+                for item in stream(**inputs):
+                    if isinstance(item, StreamResponse):
+                        if item.chunk:
+                            streamed.append(item.chunk)
+                            on_reply_chunk(item.chunk)
+                    elif isinstance(item, dspy.Prediction):
+                        pred = item
+                return pred, streamed
+        except Exception as e:
+            print(f"[IST] ❌ Tutor turn prediction failed: {type(e).__name__}: {str(e)[:300]}")
+            return None, streamed
+
+
+tutor_turn_module: Optional[TutorTurnModule] = None
+
+
+def get_tutor_turn_program() -> TutorTurnModule:
+    """Shared TutorTurnModule, created on first use."""
+    global tutor_turn_module
+    if tutor_turn_module is None:
+        tutor_turn_module = TutorTurnModule()
+    return tutor_turn_module
+
+
+# ---------------------------------------------------------------------
+# Per-course program registry
+# ---------------------------------------------------------------------
+
+_COURSE_CONTEXT_RE = re.compile(r"^\s*Course:\s*(\S+)", re.IGNORECASE)
+_SAFE_COURSE_ID_RE = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def resolve_course_id(course_id: Optional[str], course_context: Optional[str] = None) -> Optional[str]:
+    """
+    Return the explicit course id, or parse it from a "Course: <id>" context
+    string (the format analyzeMessage.ts sends). None when neither is present.
+    """
+    if course_id and course_id.strip():
+        return course_id.strip()
+    match = _COURSE_CONTEXT_RE.match(course_context or "")
+    return match.group(1) if match else None
+
+
+def program_artifact_path(directory: str, course_id: str) -> str:
+    """Path of the saved program (module.save() JSON) for a course."""
+    safe_id = _SAFE_COURSE_ID_RE.sub("_", course_id)
+    return os.path.join(directory, f"{safe_id}.json")
+
+
+class _RegistryEntry:
+    __slots__ = ("program", "mtime", "checked_at")
+
+    def __init__(self, program, mtime: float, checked_at: float) -> None:
+        self.program = program
+        self.mtime = mtime
+        self.checked_at = checked_at
+
+
+class ProgramRegistry:
+    """
+    Lazily loaded, LRU-bounded registry of course-specific IST programs.
+
+    Each course may have a compiled program saved with `module.save(path)` at
+    program_artifact_path(artifact_dir, course_id), e.g. with course-tuned
+    few-shot demos. Programs are loaded on first use, at most `capacity` are
+    held in memory, and courses without an artifact get None so the caller
+    falls back to the shared default program.
+
+    Concurrency: loads happen outside the registry lock under a load lock
+    picked from a fixed set by course id, so concurrent first requests for
+    one course load it exactly once while most other courses stay unblocked.
+    An artifact whose mtime changes is re-loaded and swapped in atomically;
+    requests already holding the old program object finish with it. A load
+    that fails is not retried for `failure_ttl_s`: the course keeps its
+    previous program, or the default when it never had one.
+    """
+
+    LOAD_LOCK_STRIPES = 64
+
+    def __init__(
+        self,
+        artifact_dir: str,
+        capacity: int = 8,
+        check_interval_s: float = 5.0,
+        program_factory: Callable[[], dspy.Module] = None,
+        failure_ttl_s: float = 30.0,
+    ) -> None:
+        self.artifact_dir = artifact_dir
+        self.capacity = max(1, capacity)
+        self.check_interval_s = check_interval_s
+        self.failure_ttl_s = failure_ttl_s
+        self.program_factory = program_factory or IntentSkillTrajectoryModule
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _RegistryEntry]" = OrderedDict()
+        self._missing: "OrderedDict[str, float]" = OrderedDict()  # course_id -> last checked
+        self._failed: "OrderedDict[str, float]" = OrderedDict()  # course_id -> last failed load
+        # Striped rather than per course: bounded however many course ids
+        # requests name, and never dropped while a loader may hold one.
+        self._load_locks = [threading.Lock() for _ in range(self.LOAD_LOCK_STRIPES)]
+        self._stats = {"hits": 0, "loads": 0, "reloads": 0, "evictions": 0, "defaults": 0, "load_errors": 0}
+
+    def get(self, course_id: Optional[str]):
+        """Return the course's program, or None when it should use the default."""
+        if not course_id:
+            return None
+        now = time.monotonic()
+
+        with self._lock:
+            cached, program = self._cached(course_id, now)
+            if cached:
+                return program
+
+        with self._load_locks[hash(course_id) % self.LOAD_LOCK_STRIPES]:
+            return self._load_or_refresh(course_id, now)
+
+    def _cached(self, course_id: str, now: float):
+        """(True, program) when no disk check is due; call with self._lock held."""
+        entry = self._entries.get(course_id)
+        if entry is not None:
+            self._entries.move_to_end(course_id)
+            if now - entry.checked_at < self.check_interval_s:
+                self._stats["hits"] += 1
+                return True, entry.program
+        else:
+            checked_at = self._missing.get(course_id)
+            if checked_at is not None and now - checked_at < self.check_interval_s:
+                self._stats["defaults"] += 1
+                return True, None
+        failed_at = self._failed.get(course_id)
+        if failed_at is not None and now - failed_at < self.failure_ttl_s:
+            self._stats["hits" if entry is not None else "defaults"] += 1
+            return True, entry.program if entry is not None else None
+        return False, None
+
+    def _load_or_refresh(self, course_id: str, now: float):
+        with self._lock:
+            # Another thread may have loaded it, or failed to, while we waited.
+            failed_at = self._failed.get(course_id)
+            if failed_at is not None and now - failed_at < self.failure_ttl_s:
+                return self._cached(course_id, now)[1]
+        path = program_artifact_path(self.artifact_dir, course_id)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+
+        with self._lock:
+            entry = self._entries.get(course_id)
+            if mtime is None:
+                # Artifact gone (or never existed): serve the default from now on.
+                self._entries.pop(course_id, None)
+                self._failed.pop(course_id, None)
+                self._missing[course_id] = now
+                self._missing.move_to_end(course_id)
+                while len(self._missing) > self.capacity * 128:
+                    self._missing.popitem(last=False)
+                self._stats["defaults"] += 1
+                return None
+            if entry is not None and entry.mtime == mtime:
+                # Another thread refreshed it while we waited, or it is unchanged.
+                entry.checked_at = now
+                self._stats["hits"] += 1
+                return entry.program
+
+        try:
+            program = self.program_factory()
+            program.load(path)
+        except Exception as e:
+            print(f"[IST] ⚠️ Failed to load program for course '{course_id}' from {path}: {type(e).__name__}: {e}")
+            with self._lock:
+                self._stats["load_errors"] += 1
+                self._failed[course_id] = now
+                self._failed.move_to_end(course_id)
+                while len(self._failed) > self.capacity * 128:
+                    self._failed.popitem(last=False)
+                # Keep serving the previous version if there was one.
+                return entry.program if entry is not None else None
+
+        with self._lock:
+            self._missing.pop(course_id, None)
+            self._failed.pop(course_id, None)
+            self._stats["reloads" if entry is not None else "loads"] += 1
+            self._entries[course_id] = _RegistryEntry(program, mtime, now)
+            self._entries.move_to_end(course_id)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+        print(f"[IST] Loaded program for course '{course_id}' from {path}")
+        return program
+
+    def invalidate(self, course_id: str) -> None:
+        """Forget a course so its artifact is re-read on next use."""
+        with self._lock:
+            self._entries.pop(course_id, None)
+            self._missing.pop(course_id, None)
+            self._failed.pop(course_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "loaded": list(self._entries.keys()), "capacity": self.capacity}
 
 
 # ---------------------------------------------------------------------
@@ -601,15 +1905,95 @@ class IntentSkillTrajectoryModule(dspy.Module):
 # ---------------------------------------------------------------------
 
 ist_extractor: Optional[IntentSkillTrajectoryModule] = None
+program_registry: Optional[ProgramRegistry] = None
+course_retriever: Optional[CourseRetriever] = None
+skill_graphs: Optional[SkillGraphRegistry] = None
+
+
+def get_ist_program(course_id: Optional[str] = None, pipeline: Optional[str] = None,
+                    output_mode: Optional[str] = None, trajectory_source: Optional[str] = None):
+    """
+    Program to use for a request: the decomposed or cascade module when that
+    pipeline is selected, the graph-trajectory module when the "graph"
+    trajectory source is and the course has a skill graph, the typed module
+    when the "typed" output mode is, else the course's compiled program when
+    the registry has one, otherwise the shared default `ist_extractor`.
+    Course artifacts are monolithic json_string programs, so the other
+    pipelines and modes do not use them.
+    """
+    pipeline = resolve_pipeline(pipeline)
+    if pipeline == "decomposed":
+        return get_decomposed_extractor()
+    if pipeline == "cascade":
+        return get_cascade_extractor()
+    if (resolve_trajectory_source(trajectory_source) == "graph"
+            and skill_graphs is not None and skill_graphs.get(course_id) is not None):
+        return get_graph_trajectory_extractor()
+    if resolve_output_mode(output_mode) == "typed":
+        return get_typed_extractor()
+    if course_id and program_registry is not None:
+        program = program_registry.get(course_id)
+        if program is not None:
+            return program
+    return ist_extractor
 
 
 def initialize_ist_extractor() -> IntentSkillTrajectoryModule:
     """
     Configure the LM (once) and create the global IST extractor module.
 
+    When IST_PROGRAM_DIR is set, also create the per-course program registry
+    (IST_PROGRAM_CACHE_SIZE programs held in memory, default 8). When
+    COURSE_MATERIALS_DIR is set, also create the BM25 course-material retriever.
+    When IST_SKILL_GRAPH_DIR is set, also load the per-course skill graphs.
+
     This function is called from app.py on startup.
     """
-    global ist_extractor
+    global ist_extractor, program_registry, course_retriever, skill_graphs
     _configure_lm_once()
     ist_extractor = IntentSkillTrajectoryModule()
+
+    artifact_dir = os.getenv("IST_PROGRAM_DIR", "").strip()
+    if artifact_dir:
+        program_registry = ProgramRegistry(
+            artifact_dir,
+            capacity=int(os.getenv("IST_PROGRAM_CACHE_SIZE", "8")),
+            check_interval_s=float(os.getenv("IST_PROGRAM_CHECK_INTERVAL_S", "5")),
+            failure_ttl_s=float(os.getenv("IST_PROGRAM_FAILURE_TTL_S", "30")),
+        )
+        print(f"[IST] Per-course program registry enabled: {artifact_dir}")
+
+    course_retriever = CourseRetriever.from_env()
+    if course_retriever is not None:
+        print(f"[RAG] Course-material retrieval enabled: {course_retriever.materials_dir} "
+              f"(index: {course_retriever.index_dir}, top {course_retriever.top_k})")
+
+    skill_graphs = SkillGraphRegistry.from_env()
+    if skill_graphs is not None:
+        print(f"[IST] Skill graphs loaded from {skill_graphs.graph_dir}: "
+              f"{', '.join(skill_graphs.versions()) or '(none)'}")
     return ist_extractor
+
+
+def service_program_fingerprint() -> str:
+    """
+    Fingerprint of every built-in IST program (monolithic, typed, decomposed,
+    cascade, graph-trajectory and tutor turn) with the configured LM and
+    adapter: shared_cache.program_fingerprint() of each, hashed together.
+    Versions the LM-call cache (shared_cache.LMCallCache), so editing any
+    signature or switching models starts a fresh namespace. Per-course
+    artifacts carry their own demos, and with them their own cache keys.
+    """
+    from shared_cache import program_fingerprint
+
+    cheap_lm, strong_lm = _cascade_lms()
+    programs = (
+        IntentSkillTrajectoryModule(),
+        TypedISTModule(format_retries=0),
+        DecomposedISTModule(),
+        CascadeISTModule(cheap_lm, strong_lm),
+        GraphTrajectoryISTModule(),
+        TutorTurnModule(),
+    )
+    fingerprints = [program_fingerprint(program) for program in programs]
+    return hashlib.sha256("|".join(fingerprints).encode("utf-8")).hexdigest()[:16]
@@ -0,0 +1,525 @@
+"""
+Write-behind sink for IST events (every IST result the service produces).
+
+record() only appends to an in-memory buffer; a background thread writes
+the buffer in batches to append-only JSONL segment files, so persisting an
+event costs O(1) on the request path instead of a per-event database call or
+rewriting a whole JSON file.
+
+Segment layout (one directory, shared by all workers):
+  - events-<UTC stamp>-<pid>-<seq>.jsonl.active   segment being written
+  - events-<UTC stamp>-<pid>-<seq>.jsonl          sealed (size rotation or close)
+  - events-<UTC stamp>-c<seq>.jsonl               written by compact()
+
+Durability (IST_EVENT_FSYNC):
+  - batch: fsync after every batch write (default)
+  - interval: fsync at most every IST_EVENT_FSYNC_INTERVAL_S
+  - off: leave it to the OS
+Buffered events not yet flushed are lost if the process is killed; close()
+(called on shutdown) flushes them. When the buffer is full, new events are
+dropped and counted rather than blocking requests.
+
+Readers (reports, student profiles, backfill) use iter_events(), which
+streams records one at a time from sealed and active segments, skipping the
+truncated last line a killed worker can leave behind.
+
+compact() merges small sealed segments into larger ones, drops duplicates
+and events older than a retention window, and seals `.active` segments of
+workers that are no longer running. Before it swaps merged segments in, it
+writes a `.compact.pending` manifest of inputs and outputs; readers hide
+whichever side is not yet complete, and the next compaction finishes or
+rolls back an interrupted one, so a crash never exposes an event twice:
+    python event_sink.py compact ./ist-events --retention-days 365
+    python event_sink.py scan ./ist-events --course cs101
+
+Environment variables:
+  - IST_EVENT_DIR: segment directory (the sink is off when unset)
+  - IST_EVENT_SEGMENT_BYTES: rotate segments after this many bytes (default 64 MB)
+  - IST_EVENT_BATCH_SIZE: events per write (default 256)
+  - IST_EVENT_FLUSH_INTERVAL_S: maximum time an event waits in the buffer (default 1.0)
+  - IST_EVENT_MAX_BUFFER: buffered events before new ones are dropped (default 50000)
+  - IST_EVENT_FSYNC: batch | interval | off (default batch)
+  - IST_EVENT_FSYNC_INTERVAL_S: fsync interval for IST_EVENT_FSYNC=interval (default 5)
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+try:
+    import fcntl  # POSIX only; used to serialize compaction across workers
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+FSYNC_POLICIES = ("batch", "interval", "off")
+SEGMENT_GLOB = "events-*.jsonl*"
+PENDING_MANIFEST = ".compact.pending"
+_SEGMENT_RE = re.compile(r"^events-(\d{8}T\d{6})-(?:(\d+)-(\d+)|c(\d+))\.jsonl(\.active)?$")
+
+
+def _stamp(ts: Optional[float] = None) -> str:
+    return datetime.fromtimestamp(ts if ts is not None else time.time(), timezone.utc).strftime("%Y%m%dT%H%M%S")
+
+
+def make_event(result: dict, *, utterance: str, course_id: Optional[str] = None, user_id: Optional[str] = None,
+               course_context: Optional[str] = None, source: str = "lm", **extra) -> dict:
+    """Event record for an IST result (field names follow the app's IstEvent, in snake_case)."""
+    return {
+        "id": uuid.uuid4().hex,
+        "ts": round(time.time(), 3),
+        "course_id": course_id,
+        "user_id": user_id,
+        "utterance": utterance,
+        "course_context": course_context,
+        "intent": result.get("intent", ""),
+        "skills": list(result.get("skills") or []),
+        "trajectory": list(result.get("trajectory") or []),
+        "source": source,
+        **extra,
+    }
+
+
+# ---------------------------------------------------------------------
+# Writer
+# ---------------------------------------------------------------------
+
+class EventSink:
+    """Buffered, batched, size-rotated JSONL segment writer (one per process)."""
+
+    def __init__(
+        self,
+        directory: str | os.PathLike,
+        segment_bytes: int = 64 * 1024 * 1024,
+        batch_size: int = 256,
+        flush_interval_s: float = 1.0,
+        max_buffer: int = 50_000,
+        fsync: str = "batch",
+        fsync_interval_s: float = 5.0,
+        start: bool = True,
+    ) -> None:
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}, got {fsync!r}")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = max(1, int(segment_bytes))
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval_s = flush_interval_s
+        self.max_buffer = max(1, int(max_buffer))
+        self.fsync = fsync
+        self.fsync_interval_s = fsync_interval_s
+
+        self._buffer: deque = deque()
+        self._lock = threading.Lock()          # guards the buffer and counters
+        self._write_lock = threading.Lock()    # serializes flushes
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._file = None
+        self._path: Optional[Path] = None
+        self._size = 0
+        self._seq = 0
+        self._last_fsync = time.monotonic()
+        self._stats = {"recorded": 0, "written": 0, "batches": 0, "dropped": 0, "fsyncs": 0,
+                       "segments": 0, "bytes": 0, "write_errors": 0}
+        self._thread = None
+        if start:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="ist-event-sink")
+            self._thread.start()
+
+    @classmethod
+    def from_env(cls) -> Optional["EventSink"]:
+        directory = os.getenv("IST_EVENT_DIR", "").strip()
+        if not directory:
+            return None
+        return cls(
+            directory,
+            segment_bytes=int(os.getenv("IST_EVENT_SEGMENT_BYTES", str(64 * 1024 * 1024))),
+            batch_size=int(os.getenv("IST_EVENT_BATCH_SIZE", "256")),
+            flush_interval_s=float(os.getenv("IST_EVENT_FLUSH_INTERVAL_S", "1.0")),
+            max_buffer=int(os.getenv("IST_EVENT_MAX_BUFFER", "50000")),
+            fsync=os.getenv("IST_EVENT_FSYNC", "batch").strip().lower(),
+            fsync_interval_s=float(os.getenv("IST_EVENT_FSYNC_INTERVAL_S", "5")),
+        )
+
+    def record(self, event: dict) -> bool:
+        """Queue an event; returns False if it was dropped (buffer full or sink closed)."""
+        with self._lock:
+            if self._closed or len(self._buffer) >= self.max_buffer:
+                self._stats["dropped"] += 1
+                return False
+            self._buffer.append(event)
+            self._stats["recorded"] += 1
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wakeup.set()
+        return True
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_interval_s)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:  # keep the writer alive; the batch stays counted as an error
+                print(f"[EVENTS] ⚠️ Flush failed: {type(e).__name__}: {e}")
+            with self._lock:
+                if self._closed and not self._buffer:
+                    return
+
+    def flush(self) -> int:
+        """Write everything buffered so far; returns the number of events written."""
+        written = 0
+        with self._write_lock:
+            while True:
+                with self._lock:
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                if not batch:
+                    break
+                data = "".join(json.dumps(event, ensure_ascii=False) + "\n" for event in batch).encode("utf-8")
+                try:
+                    self._write(data)
+                except OSError:
+                    with self._lock:
+                        self._stats["write_errors"] += 1
+                        self._stats["dropped"] += len(batch)
+                    raise
+                written += len(batch)
+                with self._lock:
+                    self._stats["written"] += len(batch)
+                    self._stats["batches"] += 1
+                    self._stats["bytes"] += len(data)
+        return written
+
+    def _write(self, data: bytes) -> None:
+        if self._file is None or (self._size and self._size + len(data) > self.segment_bytes):
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+        now = time.monotonic()
+        if self.fsync == "batch" or (self.fsync == "interval" and now - self._last_fsync >= self.fsync_interval_s):
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+            with self._lock:
+                self._stats["fsyncs"] += 1
+
+    def _seal(self) -> None:
+        if self._file is None:
+            return
+        if self.fsync != "off":
+            os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        os.replace(self._path, self._path.with_suffix(""))  # drop ".active"
+
+    def _rotate(self) -> None:
+        self._seal()
+        self._seq += 1
+        self._path = self.directory / f"events-{_stamp()}-{os.getpid()}-{self._seq:04d}.jsonl.active"
+        self._file = open(self._path, "ab")
+        self._size = 0
+        with self._lock:
+            self._stats["segments"] += 1
+
+    def close(self) -> None:
+        """Flush the buffer and seal the current segment."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+        self.flush()
+        with self._write_lock:
+            self._seal()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, buffered=len(self._buffer), fsync=self.fsync, directory=str(self.directory))
+
+
+# ---------------------------------------------------------------------
+# Readers
+# ---------------------------------------------------------------------
+
+def _read_pending(directory: Path) -> Optional[dict]:
+    try:
+        with open(directory / PENDING_MANIFEST, "r", encoding="utf-8") as handle:
+            return json.load(handle)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _pending_hidden(directory: Path) -> set:
+    """
+    Segment names readers must skip while a compaction is being published:
+    its inputs once every output is in place, its outputs until then.
+    """
+    pending = _read_pending(directory)
+    if pending is None:
+        return set()
+    published = all((directory / name).exists() for name in pending["outputs"])
+    return set(pending["inputs"] if published else pending["outputs"])
+
+
+def list_segments(directory: str | os.PathLike, include_active: bool = True) -> List[Path]:
+    """Segment files in (approximately) chronological order: by start stamp, then name."""
+    directory = Path(directory)
+    hidden = _pending_hidden(directory)
+    segments = []
+    for path in directory.glob(SEGMENT_GLOB):
+        match = _SEGMENT_RE.match(path.name)
+        if match is None or (match.group(5) and not include_active) or path.name in hidden:
+            continue
+        segments.append((match.group(1), path.name, path))
+    return [path for _, _, path in sorted(segments)]
+
+
+def iter_segment(path: str | os.PathLike) -> Iterator[dict]:
+    """Records of one segment, skipping blank and truncated lines."""
+    with open(path, "r", encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def iter_events(
+    directory: str | os.PathLike,
+    course_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    include_active: bool = True,
+) -> Iterator[dict]:
+    """
+    Stream events from every segment in `directory`, optionally filtered by
+    course, user and [since, until) timestamp. Memory use is one record at a
+    time. Events are not deduplicated here: each event is stored once, and a
+    compaction in progress (or interrupted) is hidden by list_segments().
+    """
+    for path in list_segments(directory, include_active=include_active):
+        try:
+            records = iter_segment(path)
+            for event in records:
+                if course_id is not None and event.get("course_id") != course_id:
+                    continue
+                if user_id is not None and event.get("user_id") != user_id:
+                    continue
+                ts = event.get("ts", 0)
+                if (since is not None and ts < since) or (until is not None and ts >= until):
+                    continue
+                yield event
+        except FileNotFoundError:
+            # Sealed or compacted away between listing and opening.
+            continue
+
+
+# ---------------------------------------------------------------------
+# Compaction
+# ---------------------------------------------------------------------
+
+class _CompactionLock:
+    """Exclusive lock on <directory>/.compact.lock (a process-local no-op without fcntl)."""
+
+    def __init__(self, directory: Path) -> None:
+        self.path = directory / ".compact.lock"
+
+    def __enter__(self):
+        self._handle = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+        self._handle.close()
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _write_pending(directory: Path, inputs: List[Path], outputs: List[str]) -> None:
+    tmp = directory / f"{PENDING_MANIFEST}.tmp"
+    with open(tmp, "w", encoding="utf-8") as handle:
+        json.dump({"inputs": [path.name for path in inputs], "outputs": outputs}, handle)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp, directory / PENDING_MANIFEST)
+
+
+def _resolve_pending(directory: Path) -> Optional[str]:
+    """Finish (all outputs published) or roll back an interrupted compaction; call under the lock."""
+    pending = _read_pending(directory)
+    if pending is None:
+        return None
+    published = all((directory / name).exists() for name in pending["outputs"])
+    for name in pending["inputs"] if published else pending["outputs"]:
+        (directory / name).unlink(missing_ok=True)
+    for name in pending["outputs"]:
+        (directory / f".{name}.tmp").unlink(missing_ok=True)  # merged but never published
+    (directory / PENDING_MANIFEST).unlink()
+    return "finished" if published else "rolled_back"
+
+
+def compact(
+    directory: str | os.PathLike,
+    target_bytes: int = 256 * 1024 * 1024,
+    retention_s: Optional[float] = None,
+    now: Optional[float] = None,
+    dedupe_window: int = 200_000,
+) -> dict:
+    """
+    Merge sealed segments into segments of up to `target_bytes`, dropping
+    undecodable lines, (with `retention_s`) events older than the retention
+    window, and duplicate event ids among the last `dedupe_window` events
+    (bounded memory; compaction itself no longer creates duplicates). Without
+    retention, segments already at `target_bytes` are left as they are.
+    `.active` segments of dead workers are sealed first; live workers'
+    segments are left alone. An interrupted earlier compaction is finished or
+    rolled back first. Safe to run while workers are writing.
+    """
+    directory = Path(directory)
+    now = now if now is not None else time.time()
+    cutoff = now - retention_s if retention_s else None
+    summary = {"segments_in": 0, "segments_out": 0, "events_in": 0, "events_out": 0,
+               "duplicates": 0, "expired": 0, "orphans_sealed": 0, "interrupted": None}
+
+    with _CompactionLock(directory):
+        summary["interrupted"] = _resolve_pending(directory)
+        for path in list_segments(directory):
+            match = _SEGMENT_RE.match(path.name)
+            if match.group(5) and match.group(2) and not _pid_alive(int(match.group(2))):
+                os.replace(path, path.with_suffix(""))
+                summary["orphans_sealed"] += 1
+
+        inputs = list_segments(directory, include_active=False)
+        if retention_s is None:
+            # Without retention, full-size segments have nothing to gain from a rewrite.
+            inputs = [path for path in inputs if path.stat().st_size < target_bytes]
+            if len(inputs) < 2:
+                return summary
+        if not inputs:
+            return summary
+        seen = set()
+        recent = deque()
+        outputs: List[Path] = []
+        out = None
+        out_size = 0
+        seq = 0
+
+        def open_output(first_ts: float):
+            nonlocal out, out_size, seq
+            if out is not None:
+                out.flush()
+                os.fsync(out.fileno())
+                out.close()
+            seq += 1
+            tmp = directory / f".events-{_stamp(first_ts)}-c{int(now)}{seq:04d}.jsonl.tmp"
+            outputs.append(tmp)
+            out = open(tmp, "wb")
+            out_size = 0
+
+        try:
+            for path in inputs:
+                summary["segments_in"] += 1
+                for event in iter_segment(path):
+                    summary["events_in"] += 1
+                    event_id = event.get("id")
+                    if event_id is not None:
+                        if event_id in seen:
+                            summary["duplicates"] += 1
+                            continue
+                        seen.add(event_id)
+                        recent.append(event_id)
+                        if len(recent) > dedupe_window:
+                            seen.discard(recent.popleft())
+                    if cutoff is not None and event.get("ts", now) < cutoff:
+                        summary["expired"] += 1
+                        continue
+                    line = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+                    if out is None or (out_size and out_size + len(line) > target_bytes):
+                        open_output(event.get("ts", now))
+                    out.write(line)
+                    out_size += len(line)
+                    summary["events_out"] += 1
+            if out is not None:
+                out.flush()
+                os.fsync(out.fileno())
+                out.close()
+        except BaseException:
+            if out is not None:
+                out.close()
+            for tmp in outputs:
+                tmp.unlink(missing_ok=True)
+            raise
+
+        # Record the swap, publish the merged segments, then remove their
+        # inputs. Until the manifest is gone readers see exactly one side (see
+        # list_segments); after a crash the next compaction finishes the swap
+        # or rolls it back. Never a gap and never a duplicate.
+        names = [tmp.name[1:-len(".tmp")] for tmp in outputs]
+        _write_pending(directory, inputs, names)
+        for tmp, name in zip(outputs, names):
+            os.replace(tmp, directory / name)
+        for path in inputs:
+            path.unlink(missing_ok=True)
+        (directory / PENDING_MANIFEST).unlink()
+        summary["segments_out"] = len(outputs)
+    return summary
+
+
+def main(argv: Optional[Iterable[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compact or scan IST event segments.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    compact_parser = sub.add_parser("compact", help="Merge sealed segments and apply retention")
+    compact_parser.add_argument("directory")
+    compact_parser.add_argument("--target-mb", type=float, default=256.0)
+    compact_parser.add_argument("--retention-days", type=float)
+    scan_parser = sub.add_parser("scan", help="Count events (optionally per course/user/time range)")
+    scan_parser.add_argument("directory")
+    scan_parser.add_argument("--course")
+    scan_parser.add_argument("--user")
+    scan_parser.add_argument("--since-days", type=float, help="Only events from the last N days")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    if args.command == "compact":
+        retention_s = args.retention_days * 86_400 if args.retention_days else None
+        print(json.dumps(compact(args.directory, int(args.target_mb * 1024 * 1024), retention_s), indent=2))
+        return 0
+
+    since = time.time() - args.since_days * 86_400 if args.since_days else None
+    count = 0
+    courses: dict = {}
+    for event in iter_events(args.directory, course_id=args.course, user_id=args.user, since=since):
+        count += 1
+        key = event.get("course_id") or "(none)"
+        courses[key] = courses.get(key, 0) + 1
+    print(json.dumps({"events": count, "per_course": courses}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
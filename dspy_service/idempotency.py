@@ -0,0 +1,210 @@
+"""
+Idempotent IST processing keyed on a caller-supplied idempotency key.
+
+The Cloud Function sends the chat message id as `idempotency_key`. The first
+request with a key claims it (a durable "pending" marker) and stores its
+result when done; a repeat (Firebase retry, double submit) gets the stored
+result without touching the LM, and a concurrent duplicate waits for the
+first request instead of computing the same analysis again.
+
+State lives in a SQLite file (WAL mode), so it survives restarts and is
+shared by every worker on the host:
+  - pending markers older than `pending_ttl_s` (a crashed or hung worker) may
+    be taken over by the next request with the key
+  - completed results are kept for `result_ttl_s`
+  - keys are scoped per user, and a key reused with a different request body
+    is rejected rather than answered with another request's result
+  - per-UTC-day counters of replays and LM calls avoided feed GET /api/metrics
+
+Environment variables:
+  - IST_IDEMPOTENCY_DB: SQLite file for keys and results (idempotency is off when unset)
+  - IST_IDEMPOTENCY_RESULT_TTL_S: how long results are replayable (default 7 days)
+  - IST_IDEMPOTENCY_PENDING_TTL_S: age after which a pending marker is stale (default 120)
+  - IST_IDEMPOTENCY_WAIT_S: how long a duplicate waits for the first request (default 60)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Optional
+
+DEFAULT_RESULT_TTL_S = 7 * 86_400.0
+DEFAULT_PENDING_TTL_S = 120.0
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used for a request with a different body."""
+
+
+@dataclass
+class Claim:
+    """
+    Outcome of claiming a key:
+      - "owner": this request computes the result (then complete() or release())
+      - "done": `result` is the stored result
+      - "pending": another request holds the key
+    """
+    state: str
+    key: str
+    owner: Optional[str] = None
+    result: Optional[dict] = None
+    took_over: bool = False
+
+
+def request_hash(body: dict) -> str:
+    """Stable hash of the request fields that determine the result."""
+    return hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _utc_day(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+
+
+class IdempotencyStore:
+    """Durable key -> pending marker / result store (see module docstring)."""
+
+    def __init__(self, path: str | os.PathLike, result_ttl_s: float = DEFAULT_RESULT_TTL_S,
+                 pending_ttl_s: float = DEFAULT_PENDING_TTL_S, clock: Callable[[], float] = time.time) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.result_ttl_s = result_ttl_s
+        self.pending_ttl_s = pending_ttl_s
+        self._clock = clock
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS idempotency (
+                    key TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    owner TEXT,
+                    request_hash TEXT NOT NULL,
+                    result TEXT,
+                    lm_calls INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idempotency_expires ON idempotency (expires_at);
+                CREATE TABLE IF NOT EXISTS idempotency_daily (
+                    day TEXT PRIMARY KEY,
+                    requests INTEGER NOT NULL DEFAULT 0,
+                    replays INTEGER NOT NULL DEFAULT 0,
+                    waits INTEGER NOT NULL DEFAULT 0,
+                    lm_calls_avoided INTEGER NOT NULL DEFAULT 0,
+                    stale_takeovers INTEGER NOT NULL DEFAULT 0
+                );
+            """)
+
+    @classmethod
+    def from_env(cls) -> Optional["IdempotencyStore"]:
+        path = os.getenv("IST_IDEMPOTENCY_DB", "").strip()
+        if not path:
+            return None
+        return cls(
+            path,
+            result_ttl_s=float(os.getenv("IST_IDEMPOTENCY_RESULT_TTL_S", str(DEFAULT_RESULT_TTL_S))),
+            pending_ttl_s=float(os.getenv("IST_IDEMPOTENCY_PENDING_TTL_S", str(DEFAULT_PENDING_TTL_S))),
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, conn: sqlite3.Connection, now: float, **increments: int) -> None:
+        columns = ", ".join(f"{name} = {name} + ?" for name in increments)
+        day = _utc_day(now)
+        conn.execute("INSERT OR IGNORE INTO idempotency_daily (day) VALUES (?)", (day,))
+        conn.execute(f"UPDATE idempotency_daily SET {columns} WHERE day = ?", (*increments.values(), day))
+
+    def claim(self, key: str, body_hash: str, count_wait: bool = True) -> Claim:
+        """Claim `key` for this request, or report the stored result / pending owner."""
+        now = self._clock()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT state, owner, request_hash, result, lm_calls, updated_at, expires_at FROM idempotency WHERE key = ?",
+                (key,),
+            ).fetchone()
+            took_over = False
+            if row is not None:
+                state, owner, stored_hash, result, lm_calls, updated_at, expires_at = row
+                live = expires_at > now
+                if live and stored_hash != body_hash:
+                    raise IdempotencyKeyReused(f"Idempotency key {key!r} was already used for a different request")
+                if live and state == "done":
+                    self._count(conn, now, replays=1, lm_calls_avoided=lm_calls)
+                    conn.execute("COMMIT")
+                    return Claim("done", key, result=json.loads(result))
+                if live and state == "pending":
+                    if count_wait:
+                        self._count(conn, now, waits=1)
+                    conn.execute("COMMIT")
+                    return Claim("pending", key, owner=owner)
+                took_over = state == "pending"
+            owner = uuid.uuid4().hex
+            conn.execute(
+                "INSERT OR REPLACE INTO idempotency (key, state, owner, request_hash, result, lm_calls, updated_at, expires_at) "
+                "VALUES (?, 'pending', ?, ?, NULL, 0, ?, ?)",
+                (key, owner, body_hash, now, now + self.pending_ttl_s),
+            )
+            self._count(conn, now, requests=1, stale_takeovers=int(took_over))
+            conn.execute("COMMIT")
+            return Claim("owner", key, owner=owner, took_over=took_over)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def complete(self, claim: Claim, result: dict, lm_calls: int = 0) -> bool:
+        """Store the owner's result; False if the claim was taken over in the meantime."""
+        now = self._clock()
+        updated = self._connect().execute(
+            "UPDATE idempotency SET state = 'done', result = ?, lm_calls = ?, updated_at = ?, expires_at = ? "
+            "WHERE key = ? AND owner = ? AND state = 'pending'",
+            (json.dumps(result), lm_calls, now, now + self.result_ttl_s, claim.key, claim.owner),
+        ).rowcount
+        return bool(updated)
+
+    def release(self, claim: Claim) -> None:
+        """Drop the owner's pending marker (the request failed) so a retry can run."""
+        self._connect().execute(
+            "DELETE FROM idempotency WHERE key = ? AND owner = ? AND state = 'pending'", (claim.key, claim.owner)
+        )
+
+    def purge_expired(self) -> int:
+        return self._connect().execute("DELETE FROM idempotency WHERE expires_at <= ?", (self._clock(),)).rowcount
+
+    def stats(self, days: int = 7) -> dict:
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT day, requests, replays, waits, lm_calls_avoided, stale_takeovers FROM idempotency_daily "
+            "ORDER BY day DESC LIMIT ?", (days,),
+        ).fetchall()
+        columns = ("requests", "replays", "waits", "lm_calls_avoided", "stale_takeovers")
+        per_day = {day: dict(zip(columns, values)) for day, *values in rows}
+        pending, done = conn.execute(
+            "SELECT COALESCE(SUM(state = 'pending'), 0), COALESCE(SUM(state = 'done'), 0) FROM idempotency WHERE expires_at > ?",
+            (self._clock(),),
+        ).fetchone()
+        return {"keys_pending": pending, "keys_done": done, "per_day": per_day,
+                "totals": {column: sum(day[column] for day in per_day.values()) for column in columns}}
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
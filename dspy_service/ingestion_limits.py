@@ -0,0 +1,134 @@
+"""
+Request-size limits enforced while the body is still streaming in.
+
+BodySizeLimitMiddleware rejects a request with a structured HTTP 413 as soon
+as its declared Content-Length, or the bytes actually received so far, exceed
+the limit. Oversized bodies are never fully buffered, parsed or validated.
+Routes whose payloads are large by design get their own limit: the longest
+matching path prefix in `route_limits` wins over the default.
+
+Environment variables:
+  - IST_MAX_BODY_BYTES: maximum request body size in bytes (default 1 MiB, 0 disables)
+  - IST_ASSESSMENT_MAX_BODY_BYTES: limit for /api/assessment/ (default 32 MiB, 0 disables),
+    whose batches carry the full course content and a class's IST events
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from typing import Dict, Optional
+
+
+DEFAULT_MAX_BODY_BYTES = 1024 * 1024
+DEFAULT_ASSESSMENT_MAX_BODY_BYTES = 32 * 1024 * 1024
+
+
+class _BodyTooLarge(Exception):
+    """Raised from the wrapped `receive` to abort reading the body."""
+
+
+def payload_too_large_body(max_bytes: int, received_bytes: Optional[int] = None) -> bytes:
+    """Structured 413 payload, shaped like FastAPI's HTTPException responses."""
+    detail = {
+        "error": "payload_too_large",
+        "message": f"Request body exceeds the {max_bytes}-byte limit.",
+        "max_bytes": max_bytes,
+    }
+    if received_bytes is not None:
+        detail["received_bytes"] = received_bytes
+    return json.dumps({"detail": detail}).encode("utf-8")
+
+
+class BodySizeLimitMiddleware:
+    """
+    Pure ASGI middleware enforcing a maximum request body size.
+
+    The Content-Length header is checked before anything is read; chunked or
+    mislabelled bodies are counted as they arrive and reading stops at the
+    first chunk that crosses the limit. Whatever the inner app tried to send
+    after that point is discarded in favour of the 413.
+
+    `route_limits` maps path prefixes to their own limit (0 disables it).
+    """
+
+    def __init__(self, app, max_bytes: int = DEFAULT_MAX_BODY_BYTES,
+                 route_limits: Optional[Dict[str, int]] = None) -> None:
+        self.app = app
+        self.max_bytes = max_bytes
+        # Longest prefix first, so the most specific route wins.
+        self.route_limits = sorted((route_limits or {}).items(), key=lambda item: len(item[0]), reverse=True)
+
+    def limit_for(self, path: str) -> int:
+        for prefix, limit in self.route_limits:
+            if path.startswith(prefix):
+                return limit
+        return self.max_bytes
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = self.limit_for(scope.get("path", "")) if scope["type"] == "http" else 0
+        if max_bytes <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    break
+                if declared > max_bytes:
+                    await self._send_413(send, max_bytes, declared)
+                    return
+                break
+
+        state = {"received": 0, "exceeded": False, "response_started": False}
+
+        async def limited_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+                if state["received"] > max_bytes:
+                    state["exceeded"] = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            if state["exceeded"]:
+                return
+            if message["type"] == "http.response.start":
+                state["response_started"] = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            pass
+
+        if state["exceeded"] and not state["response_started"]:
+            await self._send_413(send, max_bytes, state["received"])
+
+    async def _send_413(self, send, max_bytes: int, received_bytes: int) -> None:
+        body = payload_too_large_body(max_bytes, received_bytes)
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("ascii")),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def max_body_bytes_from_env() -> int:
+    """IST_MAX_BODY_BYTES, defaulting to 1 MiB (0 disables the limit)."""
+    return int(os.getenv("IST_MAX_BODY_BYTES", str(DEFAULT_MAX_BODY_BYTES)))
+
+
+def route_limits_from_env() -> Dict[str, int]:
+    """Per-route limits: IST_ASSESSMENT_MAX_BODY_BYTES for /api/assessment/ (default 32 MiB)."""
+    return {
+        "/api/assessment/": int(os.getenv("IST_ASSESSMENT_MAX_BODY_BYTES", str(DEFAULT_ASSESSMENT_MAX_BODY_BYTES))),
+    }
@@ -0,0 +1,393 @@
+"""
+Python client for the DSPy service's IST endpoint.
+
+For evaluation scripts, backfills and notebooks that call
+/api/intent-skill-trajectory. It needs only httpx and pydantic; the service
+itself (DSPy, app.py) is not imported.
+
+  - one pooled keep-alive connection pool per client; HTTP/2 is used when the
+    optional `h2` package is installed (pip install "httpx[http2]") and the
+    server negotiates it
+  - concurrent calls are micro-batched: calls that arrive within
+    `batch_window_ms` of each other (up to `max_batch`) go out as one
+    POST /api/intent-skill-trajectory/batch; a lone call uses the plain
+    endpoint. Against a service without the batch endpoint the client falls
+    back to one request per call.
+  - transient failures (connection errors, timeouts, 429, 502, 503, 504) are
+    retried with full-jitter exponential backoff, waiting at least as long as
+    the server's Retry-After. Every call carries an idempotency key (unless
+    it has one), so with IST_IDEMPOTENCY_DB set on the service a retry never
+    runs the LM twice.
+  - requests and results are the service's IntentSkillRequest and
+    IntentSkillResponse models, mirrored here
+  - encoding="msgpack" sends and accepts MessagePack instead of JSON
+    (needs the optional `msgpack` package); smaller bodies and cheaper
+    encode/decode for long histories
+
+Usage:
+    from ist_client import ISTClient
+
+    with ISTClient("http://localhost:8000") as client:
+        result = client.extract(utterance="How does merge sort work?", course_id="cs101")
+        results = client.extract_many([{"utterance": q, "course_id": "cs101"} for q in questions])
+
+    async with AsyncISTClient("http://localhost:8000") as client:
+        result = await client.extract(utterance="How does merge sort work?")
+"""
+
+from __future__ import annotations
+
+import asyncio
+import email.utils
+import importlib.util
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Iterable, List, Literal, Optional, Union
+
+import httpx
+from pydantic import BaseModel, Field
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None  # Optional dependency
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+
+# ---------------------------------------------------------------------
+# Models (mirror app.py)
+# ---------------------------------------------------------------------
+
+class ChatMessage(BaseModel):
+    """Represents a single message in the chat conversation history."""
+    role: Literal["student", "tutor", "system"]
+    content: str
+    created_at: Optional[str] = None  # ISO timestamp string
+
+
+class IstHistoryItem(BaseModel):
+    """Represents a single IST event from history."""
+    intent: str
+    skills: List[str]
+    trajectory: List[str]
+    created_at: Optional[str] = None  # ISO timestamp string
+
+
+class StudentProfile(BaseModel):
+    """Student profile with skill assessments."""
+    strong_skills: List[str] = []
+    weak_skills: List[str] = []
+    course_progress: Optional[str] = None
+
+
+class IntentSkillRequest(BaseModel):
+    """Request model for intent-skill-trajectory extraction endpoint."""
+    utterance: str = Field(..., min_length=1)
+    course_context: Optional[str] = None
+    course_id: Optional[str] = None
+    user_id: Optional[str] = None
+    pipeline: Optional[Literal["monolithic", "decomposed", "cascade"]] = None
+    output_mode: Optional[Literal["json_string", "typed"]] = None
+    trajectory_source: Optional[Literal["llm", "graph"]] = None
+    idempotency_key: Optional[str] = Field(None, max_length=256)
+    thread_id: Optional[str] = Field(None, max_length=256)
+    chat_history: List[ChatMessage] = []
+    ist_history: List[IstHistoryItem] = []
+    student_profile: Optional[StudentProfile] = None
+
+
+class IntentSkillResponse(BaseModel):
+    """Response model for intent-skill-trajectory extraction endpoint."""
+    intent: str
+    skills: List[str]
+    trajectory: List[str]
+
+
+RequestLike = Union[IntentSkillRequest, dict]
+
+
+class ISTServiceError(Exception):
+    """The service answered a call with an error (status_code None: the call never got an answer)."""
+
+    def __init__(self, status_code: Optional[int], detail, retry_after: Optional[float] = None) -> None:
+        super().__init__(f"{status_code or 'transport error'}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    @property
+    def transient(self) -> bool:
+        return self.status_code is None or self.status_code in RETRY_STATUSES
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After in seconds, from delta-seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _error_from_response(response: httpx.Response) -> ISTServiceError:
+    try:
+        detail = response.json().get("detail", response.text)
+    except ValueError:
+        detail = response.text
+    return ISTServiceError(response.status_code, detail, _retry_after(response.headers.get("Retry-After")))
+
+
+@dataclass
+class RetryPolicy:
+    """Full-jitter exponential backoff; never sooner than the server's Retry-After (capped at max_retry_after_s)."""
+    max_attempts: int = 4
+    base_delay_s: float = 0.2
+    max_delay_s: float = 5.0
+    max_retry_after_s: float = 60.0
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        backoff = random.uniform(0, min(self.max_delay_s, self.base_delay_s * (2 ** attempt)))
+        if retry_after is not None:
+            return max(backoff, min(retry_after, self.max_retry_after_s))
+        return backoff
+
+
+def _as_request(request: Optional[RequestLike], fields: dict) -> IntentSkillRequest:
+    if request is None:
+        request = IntentSkillRequest(**fields)
+    elif isinstance(request, dict):
+        request = IntentSkillRequest(**{**request, **fields})
+    elif fields:
+        request = request.model_copy(update=fields)
+    if request.idempotency_key is None:
+        request = request.model_copy(update={"idempotency_key": uuid.uuid4().hex})
+    return request
+
+
+# ---------------------------------------------------------------------
+# Async client
+# ---------------------------------------------------------------------
+
+class AsyncISTClient:
+    """Pooled, micro-batching, retrying client; use one per event loop."""
+
+    def __init__(
+        self,
+        base_url: str = "http://localhost:8000",
+        *,
+        timeout_s: float = 60.0,
+        max_connections: int = 16,
+        max_batch: int = 16,
+        batch_window_ms: float = 5.0,
+        retry: Optional[RetryPolicy] = None,
+        http2: Optional[bool] = None,
+        encoding: Literal["json", "msgpack"] = "json",
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ) -> None:
+        if encoding not in ("json", "msgpack"):
+            raise ValueError(f"encoding must be 'json' or 'msgpack', got {encoding!r}")
+        if encoding == "msgpack" and msgpack is None:
+            raise ValueError("encoding='msgpack' needs the msgpack package (pip install msgpack)")
+        if http2 is None:
+            http2 = importlib.util.find_spec("h2") is not None
+        self._http = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            timeout=timeout_s,
+            http2=http2,
+            transport=transport,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self.max_batch = max(1, max_batch)
+        self.batch_window_s = batch_window_ms / 1000
+        self.retry = retry or RetryPolicy()
+        self.encoding = encoding
+        self._in_flight = asyncio.Semaphore(max(1, max_connections))
+        self._pending: list = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+        self._batch_supported = True
+        self._counts = {"calls": 0, "requests": 0, "batches": 0, "batched_calls": 0, "retries": 0, "errors": 0}
+
+    async def __aenter__(self) -> "AsyncISTClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._http.aclose()
+
+    async def extract(self, request: Optional[RequestLike] = None, **fields) -> IntentSkillResponse:
+        """IST for one request (a model, a dict, or keyword fields)."""
+        request = _as_request(request, fields)
+        self._counts["calls"] += 1
+        for attempt in range(self.retry.max_attempts):
+            try:
+                return await self._submit(request)
+            except ISTServiceError as exc:
+                if not exc.transient or attempt + 1 >= self.retry.max_attempts:
+                    self._counts["errors"] += 1
+                    raise
+                self._counts["retries"] += 1
+                await asyncio.sleep(self.retry.delay(attempt, exc.retry_after))
+        raise AssertionError("unreachable")
+
+    async def extract_many(self, requests: Iterable[RequestLike],
+                           return_exceptions: bool = False) -> List[Union[IntentSkillResponse, ISTServiceError]]:
+        """IST for many requests, in order; they are batched together as they arrive."""
+        return await asyncio.gather(*(self.extract(request) for request in requests),
+                                    return_exceptions=return_exceptions)
+
+    def stats(self) -> dict:
+        return dict(self._counts, batch_endpoint=self._batch_supported)
+
+    # Micro-batching ------------------------------------------------------
+
+    async def _submit(self, request: IntentSkillRequest) -> IntentSkillResponse:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((request, future))
+        if len(self._pending) >= self.max_batch or not self._batch_supported:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.batch_window_s, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            items, self._pending = self._pending[: self.max_batch], self._pending[self.max_batch:]
+            task = asyncio.ensure_future(self._send(items))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, items: list) -> None:
+        async with self._in_flight:
+            try:
+                if len(items) > 1 and self._batch_supported:
+                    await self._send_batch(items)
+                    return
+                for request, future in items:
+                    await self._send_one(request, future)
+            except Exception as exc:  # resolve every waiter, whatever went wrong
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(exc)
+
+    async def _post(self, path: str, body: dict) -> httpx.Response:
+        self._counts["requests"] += 1
+        try:
+            if self.encoding == "msgpack":
+                headers = {"Content-Type": MSGPACK_MEDIA_TYPE, "Accept": MSGPACK_MEDIA_TYPE}
+                return await self._http.post(path, content=msgpack.packb(body, use_bin_type=True), headers=headers)
+            return await self._http.post(path, json=body)
+        except httpx.TransportError as exc:
+            raise ISTServiceError(None, f"{type(exc).__name__}: {exc}") from exc
+
+    @staticmethod
+    def _decode(response: httpx.Response):
+        """Response body as Python objects: msgpack when the service answered in it, JSON otherwise."""
+        if response.headers.get("content-type", "").split(";", 1)[0].strip() == MSGPACK_MEDIA_TYPE:
+            return msgpack.unpackb(response.content, raw=False)
+        return response.json()
+
+    async def _send_one(self, request: IntentSkillRequest, future: asyncio.Future) -> None:
+        try:
+            response = await self._post("/api/intent-skill-trajectory", request.model_dump(exclude_none=True))
+            if response.status_code != 200:
+                raise _error_from_response(response)
+            result = IntentSkillResponse.model_validate(self._decode(response))
+        except ISTServiceError as exc:
+            if not future.done():
+                future.set_exception(exc)
+            return
+        if not future.done():
+            future.set_result(result)
+
+    async def _send_batch(self, items: list) -> None:
+        body = {"requests": [request.model_dump(exclude_none=True) for request, _ in items]}
+        response = await self._post("/api/intent-skill-trajectory/batch", body)
+        if response.status_code in (404, 405):
+            self._batch_supported = False  # older service: one request per call from now on
+            for request, future in items:
+                await self._send_one(request, future)
+            return
+        if response.status_code != 200:
+            error = _error_from_response(response)
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        self._counts["batches"] += 1
+        self._counts["batched_calls"] += len(items)
+        for (_, future), item in zip(items, self._decode(response)["results"]):
+            if future.done():
+                continue
+            if "error" in item:
+                error = item["error"]
+                future.set_exception(ISTServiceError(error.get("status_code"), error.get("detail"), error.get("retry_after")))
+            else:
+                future.set_result(IntentSkillResponse.model_validate(item["result"]))
+
+
+# ---------------------------------------------------------------------
+# Sync client
+# ---------------------------------------------------------------------
+
+class ISTClient:
+    """
+    Blocking facade over AsyncISTClient, which runs on a private event-loop
+    thread. Safe to share between threads; calls made concurrently from
+    several threads are batched together.
+    """
+
+    def __init__(self, base_url: str = "http://localhost:8000", **kwargs) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="ist-client", daemon=True)
+        self._thread.start()
+
+        async def make() -> AsyncISTClient:
+            return AsyncISTClient(base_url, **kwargs)
+
+        self._client = self._run(make())
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def __enter__(self) -> "ISTClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def extract(self, request: Optional[RequestLike] = None, **fields) -> IntentSkillResponse:
+        return self._run(self._client.extract(request, **fields))
+
+    def extract_many(self, requests: Iterable[RequestLike],
+                     return_exceptions: bool = False) -> List[Union[IntentSkillResponse, ISTServiceError]]:
+        return self._run(self._client.extract_many(list(requests), return_exceptions=return_exceptions))
+
+    def stats(self) -> dict:
+        return self._client.stats()
+
+    def close(self) -> None:
+        if self._loop.is_closed():
+            return
+        self._run(self._client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
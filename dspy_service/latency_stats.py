@@ -0,0 +1,31 @@
+"""
+Latency summaries shared by the runtime stats endpoints, replay.py and the
+benchmarks. Kept free of service imports so anything can use it.
+"""
+
+from __future__ import annotations
+
+import math
+from typing import List
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize_latencies(values_ms: List[float]) -> dict:
+    """Mean and p50/p90/p95/p99/max of a list of latencies in milliseconds."""
+    ordered = sorted(values_ms)
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 3) if ordered else 0.0,
+        "p50": round(percentile(ordered, 50), 3),
+        "p90": round(percentile(ordered, 90), 3),
+        "p95": round(percentile(ordered, 95), 3),
+        "p99": round(percentile(ordered, 99), 3),
+        "max": round(ordered[-1], 3) if ordered else 0.0,
+    }
@@ -0,0 +1,467 @@
+"""
+Token and cost accounting for LM calls made by the IST service.
+
+AccountingLM is a drop-in dspy.LM that records every call (model, prompt and
+completion tokens, cost, latency, cache status) into an LMAccountant instead
+of DSPy's in-memory history, which keeps full prompts and responses for the
+last 10k calls of every LM and calling module.
+
+The accountant keeps:
+  - a fixed-size ring buffer of recent call records (optionally spilled to
+    rotating JSONL files for offline analysis),
+  - per-request totals, exposed as X-LM-* response headers,
+  - running totals per course and per user (LRU-bounded), and
+  - per-tenant token budgets over a fixed window.
+
+Environment variables:
+  - LM_JOURNAL_SIZE: number of recent call records kept in memory (default 1000)
+  - LM_JOURNAL_DIR: also append every call record to rotating JSONL files here
+  - LM_JOURNAL_MAX_BYTES: rotate journal files after this many bytes (default 50 MB)
+  - LM_JOURNAL_MAX_FILES: number of journal files to keep (default 20)
+  - LM_TOKEN_BUDGET_PER_COURSE: tokens a course may use per window (0 = unlimited)
+  - LM_TOKEN_BUDGET_PER_USER: tokens a user may use per window (0 = unlimited)
+  - LM_TOKEN_BUDGET_WINDOW_S: budget window length in seconds (default 86400)
+  - LM_PROMPT_COST_PER_1K / LM_COMPLETION_COST_PER_1K: USD prices used when the
+    provider does not report a cost (default 0)
+"""
+
+from __future__ import annotations
+
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+import dspy
+
+import tracing
+from traffic_capture import CaptureWriter
+
+
+DEFAULT_JOURNAL_SIZE = 1000
+DEFAULT_MAX_TENANTS = 10_000
+DEFAULT_BUDGET_WINDOW_S = 86_400.0
+
+# Set by AccountingLM around each call so update_history can compute latency.
+_call_started: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("lm_call_started", default=None)
+# The usage accumulator of the HTTP request currently being served, if any.
+_current_request: contextvars.ContextVar[Optional["RequestUsage"]] = contextvars.ContextVar(
+    "lm_request_usage", default=None
+)
+# Open count_lm_calls() counters (nested blocks each see the calls made inside them).
+_call_counters: contextvars.ContextVar[tuple] = contextvars.ContextVar("lm_call_counters", default=())
+
+
+class LMCallCounter:
+    """LM calls, tokens and cost recorded inside a count_lm_calls() block."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+
+@contextmanager
+def count_lm_calls() -> Iterator[LMCallCounter]:
+    """
+    Count the LM calls made inside the block, e.g. to see whether an adapter
+    retried a call after a format error. Independent of request_scope().
+    """
+    counter = LMCallCounter()
+    token = _call_counters.set(_call_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _call_counters.reset(token)
+
+
+class TokenBudgetExceeded(Exception):
+    """Raised by LMAccountant.check_budget when a tenant has used up its window."""
+
+    def __init__(self, tenant: str, limit: int, used: int, retry_after_s: int) -> None:
+        super().__init__(f"Token budget exceeded for {tenant}: {used}/{limit} tokens used in the current window.")
+        self.tenant = tenant
+        self.limit = limit
+        self.used = used
+        self.retry_after_s = retry_after_s
+
+    def to_detail(self) -> dict:
+        return {
+            "error": "token_budget_exceeded",
+            "message": str(self),
+            "tenant": self.tenant,
+            "limit": self.limit,
+            "used": self.used,
+            "retry_after_s": self.retry_after_s,
+        }
+
+
+@dataclass
+class RequestUsage:
+    """LM usage accumulated while serving one HTTP request."""
+
+    course_id: Optional[str] = None
+    user_id: Optional[str] = None
+    calls: int = 0
+    cache_hits: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    latency_ms: float = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, record: dict) -> None:
+        self.calls += 1
+        self.cache_hits += int(record["cache_hit"])
+        self.prompt_tokens += record["prompt_tokens"]
+        self.completion_tokens += record["completion_tokens"]
+        self.cost += record["cost"]
+        self.latency_ms += record["latency_ms"] or 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "cache_hits": self.cache_hits,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "cost": round(self.cost, 6),
+        }
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "X-LM-Calls": str(self.calls),
+            "X-LM-Cache-Hits": str(self.cache_hits),
+            "X-LM-Prompt-Tokens": str(self.prompt_tokens),
+            "X-LM-Completion-Tokens": str(self.completion_tokens),
+            "X-LM-Total-Tokens": str(self.total_tokens),
+            "X-LM-Cost-USD": f"{self.cost:.6f}",
+        }
+
+
+@dataclass
+class TenantTotals:
+    """Running totals for one course or user, plus its current budget window."""
+
+    calls: int = 0
+    cache_hits: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    window_start: float = 0.0
+    window_tokens: int = 0
+
+    def as_dict(self) -> dict:
+        data = asdict(self)
+        data["total_tokens"] = self.prompt_tokens + self.completion_tokens
+        return data
+
+
+@dataclass
+class BudgetConfig:
+    per_course: int = 0
+    per_user: int = 0
+    window_s: float = DEFAULT_BUDGET_WINDOW_S
+
+    @classmethod
+    def from_env(cls) -> "BudgetConfig":
+        return cls(
+            per_course=int(os.getenv("LM_TOKEN_BUDGET_PER_COURSE", "0")),
+            per_user=int(os.getenv("LM_TOKEN_BUDGET_PER_USER", "0")),
+            window_s=float(os.getenv("LM_TOKEN_BUDGET_WINDOW_S", str(DEFAULT_BUDGET_WINDOW_S))),
+        )
+
+
+def _usage_int(usage: dict, key: str) -> int:
+    value = usage.get(key)
+    return int(value) if isinstance(value, (int, float)) else 0
+
+
+def _entry_cache_hit(entry: dict) -> bool:
+    """DSPy's cache flag for a history entry (set on the cached response object)."""
+    if "cache_hit" in entry:
+        return bool(entry["cache_hit"])
+    return bool(getattr(entry.get("response"), "cache_hit", False))
+
+
+class LMAccountant:
+    """
+    Thread-safe sink for LM call records.
+
+    Memory is bounded regardless of traffic: the journal is a fixed-size deque
+    and the per-course/per-user tables keep at most `max_tenants` entries each
+    (least recently charged first out; an evicted tenant's budget window
+    starts over).
+    """
+
+    def __init__(
+        self,
+        journal_size: int = DEFAULT_JOURNAL_SIZE,
+        spill: Optional[CaptureWriter] = None,
+        budgets: Optional[BudgetConfig] = None,
+        max_tenants: int = DEFAULT_MAX_TENANTS,
+        prompt_cost_per_1k: float = 0.0,
+        completion_cost_per_1k: float = 0.0,
+        clock=time.time,
+    ) -> None:
+        self.journal: deque = deque(maxlen=max(1, int(journal_size)))
+        self.spill = spill
+        self.budgets = budgets or BudgetConfig()
+        self.max_tenants = max(1, int(max_tenants))
+        self.prompt_cost_per_1k = prompt_cost_per_1k
+        self.completion_cost_per_1k = completion_cost_per_1k
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._courses: "OrderedDict[str, TenantTotals]" = OrderedDict()
+        self._users: "OrderedDict[str, TenantTotals]" = OrderedDict()
+        self._totals = TenantTotals()
+
+    @classmethod
+    def from_env(cls) -> "LMAccountant":
+        spill = None
+        journal_dir = os.getenv("LM_JOURNAL_DIR", "").strip()
+        if journal_dir:
+            spill = CaptureWriter(
+                journal_dir,
+                max_bytes=int(os.getenv("LM_JOURNAL_MAX_BYTES", str(50 * 1024 * 1024))),
+                max_files=int(os.getenv("LM_JOURNAL_MAX_FILES", "20")),
+                prefix="lm-journal",
+            )
+            print(f"[LM] Call journal spilling to {journal_dir}")
+        return cls(
+            journal_size=int(os.getenv("LM_JOURNAL_SIZE", str(DEFAULT_JOURNAL_SIZE))),
+            spill=spill,
+            budgets=BudgetConfig.from_env(),
+            prompt_cost_per_1k=float(os.getenv("LM_PROMPT_COST_PER_1K", "0")),
+            completion_cost_per_1k=float(os.getenv("LM_COMPLETION_COST_PER_1K", "0")),
+        )
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+
+    def record_call(
+        self,
+        model: str,
+        usage: Optional[dict],
+        cost: Optional[float] = None,
+        latency_ms: Optional[float] = None,
+        cache_hit: bool = False,
+    ) -> dict:
+        """Record one LM call and charge it to the current request, course and user."""
+        usage = usage or {}
+        prompt_tokens = _usage_int(usage, "prompt_tokens")
+        completion_tokens = _usage_int(usage, "completion_tokens")
+        if cost is None:
+            cost = (prompt_tokens * self.prompt_cost_per_1k + completion_tokens * self.completion_cost_per_1k) / 1000
+
+        request = _current_request.get()
+        record = {
+            "ts": self._clock(),
+            "model": model,
+            "course_id": request.course_id if request else None,
+            "user_id": request.user_id if request else None,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost": float(cost),
+            "latency_ms": round(latency_ms, 3) if latency_ms is not None else None,
+            "cache_hit": bool(cache_hit),
+        }
+
+        with self._lock:
+            # The decomposed pipeline makes a request's calls from several
+            # threads, so its usage and counters are updated under the lock too.
+            if request is not None:
+                request.add(record)
+            for counter in _call_counters.get():
+                counter.calls += 1
+                counter.prompt_tokens += prompt_tokens
+                counter.completion_tokens += completion_tokens
+                counter.cost += record["cost"]
+            self.journal.append(record)
+            self._charge(self._totals, record)
+            if record["course_id"]:
+                self._charge(self._tenant(self._courses, record["course_id"]), record)
+            if record["user_id"]:
+                self._charge(self._tenant(self._users, record["user_id"]), record)
+
+        if self.spill is not None:
+            self.spill.write(record)
+        return record
+
+    def _tenant(self, table: "OrderedDict[str, TenantTotals]", key: str) -> TenantTotals:
+        totals = table.get(key)
+        if totals is None:
+            totals = table[key] = TenantTotals()
+            while len(table) > self.max_tenants:
+                table.popitem(last=False)
+        else:
+            table.move_to_end(key)
+        return totals
+
+    def _charge(self, totals: TenantTotals, record: dict) -> None:
+        tokens = record["prompt_tokens"] + record["completion_tokens"]
+        totals.calls += 1
+        totals.cache_hits += int(record["cache_hit"])
+        totals.prompt_tokens += record["prompt_tokens"]
+        totals.completion_tokens += record["completion_tokens"]
+        totals.cost += record["cost"]
+        self._roll_window(totals, record["ts"])
+        totals.window_tokens += tokens
+
+    def _roll_window(self, totals: TenantTotals, now: float) -> None:
+        window = self.budgets.window_s
+        start = now - (now % window) if window > 0 else 0.0
+        if start != totals.window_start:
+            totals.window_start = start
+            totals.window_tokens = 0
+
+    # ------------------------------------------------------------------
+    # Request scope and budgets
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def request_scope(self, course_id: Optional[str] = None, user_id: Optional[str] = None) -> Iterator[RequestUsage]:
+        """Attribute every LM call made inside the block to this request, course and user."""
+        usage = RequestUsage(course_id=course_id, user_id=user_id)
+        token = _current_request.set(usage)
+        try:
+            yield usage
+        finally:
+            _current_request.reset(token)
+
+    def check_budget(self, course_id: Optional[str] = None, user_id: Optional[str] = None) -> None:
+        """
+        Raise TokenBudgetExceeded if the course or user has already used its
+        budget for the current window. Checked before a request runs, so a
+        tenant can overshoot by at most one request's worth of tokens.
+        """
+        now = self._clock()
+        checks = (
+            (self._courses, course_id, self.budgets.per_course, "course"),
+            (self._users, user_id, self.budgets.per_user, "user"),
+        )
+        with self._lock:
+            for table, key, limit, kind in checks:
+                if not key or limit <= 0 or key not in table:
+                    continue
+                totals = table[key]
+                self._roll_window(totals, now)
+                if totals.window_tokens >= limit:
+                    window = self.budgets.window_s
+                    retry_after = int(totals.window_start + window - now) + 1 if window > 0 else 0
+                    raise TokenBudgetExceeded(f"{kind}:{key}", limit, totals.window_tokens, max(1, retry_after))
+
+    # ------------------------------------------------------------------
+    # Reporting
+    # ------------------------------------------------------------------
+
+    def recent(self, limit: Optional[int] = None) -> List[dict]:
+        with self._lock:
+            records = list(self.journal)
+        return records[-limit:] if limit else records
+
+    def course_totals(self, course_id: str) -> Optional[dict]:
+        with self._lock:
+            totals = self._courses.get(course_id)
+            return totals.as_dict() if totals else None
+
+    def user_totals(self, user_id: str) -> Optional[dict]:
+        with self._lock:
+            totals = self._users.get(user_id)
+            return totals.as_dict() if totals else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            totals = self._totals.as_dict()
+            for key in ("window_start", "window_tokens"):
+                totals.pop(key)
+            return {
+                **totals,
+                "journal_size": len(self.journal),
+                "journal_capacity": self.journal.maxlen,
+                "courses": {key: value.as_dict() for key, value in self._courses.items()},
+                "users_tracked": len(self._users),
+                "budgets": asdict(self.budgets),
+            }
+
+    def close(self) -> None:
+        if self.spill is not None:
+            self.spill.close()
+
+
+_default_accountant: Optional[LMAccountant] = None
+_default_lock = threading.Lock()
+
+
+def get_accountant() -> LMAccountant:
+    """Process-wide accountant, configured from the environment on first use."""
+    global _default_accountant
+    if _default_accountant is None:
+        with _default_lock:
+            if _default_accountant is None:
+                _default_accountant = LMAccountant.from_env()
+    return _default_accountant
+
+
+class AccountingLM(dspy.LM):
+    """
+    dspy.LM that reports each call to an LMAccountant instead of keeping it in
+    DSPy's history (so `lm.inspect_history()` stays empty; use the journal).
+
+    DSPy serves cached completions with empty usage and flags the response
+    as a cache hit; those calls are recorded with cache_hit=True and zero
+    tokens. A provider response that reports no usage is not a cache hit. Each call is an "lm.call" trace span
+    carrying the model, token counts and cache status.
+    """
+
+    def __init__(self, *args: Any, accountant: Optional[LMAccountant] = None, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.accountant = accountant
+
+    def __call__(self, *args: Any, **kwargs: Any):
+        token = _call_started.set(time.perf_counter())
+        try:
+            with tracing.span("lm.call", kind="client", **self._span_attributes()):
+                return super().__call__(*args, **kwargs)
+        finally:
+            _call_started.reset(token)
+
+    async def acall(self, *args: Any, **kwargs: Any):
+        token = _call_started.set(time.perf_counter())
+        try:
+            with tracing.span("lm.call", kind="client", **self._span_attributes()):
+                return await super().acall(*args, **kwargs)
+        finally:
+            _call_started.reset(token)
+
+    def _span_attributes(self) -> dict:
+        return {"lm.model": self.model, "lm.max_retries": getattr(self, "num_retries", None)}
+
+    def update_history(self, entry: dict) -> None:
+        started = _call_started.get()
+        latency_ms = (time.perf_counter() - started) * 1000 if started is not None else None
+        usage = entry.get("usage") or {}
+        cache_hit = _entry_cache_hit(entry)
+        accountant = self.accountant or get_accountant()
+        accountant.record_call(
+            model=entry.get("model") or self.model,
+            usage=usage,
+            cost=entry.get("cost"),
+            latency_ms=latency_ms,
+            cache_hit=cache_hit,
+        )
+        tracing.current_span().set_attributes({
+            "lm.prompt_tokens": _usage_int(usage, "prompt_tokens"),
+            "lm.completion_tokens": _usage_int(usage, "completion_tokens"),
+            "lm.cache_hit": cache_hit,
+            "lm.cost": entry.get("cost"),
+        })
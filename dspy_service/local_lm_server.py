@@ -0,0 +1,572 @@
+"""
+Local OpenAI-compatible LM stand-in for load, chaos and parser-robustness testing.
+
+Speaks the chat-completions API that dspy.LM (via litellm) uses and answers
+DSPy ChatAdapter and JSONAdapter prompts with realistic, IST-shaped output:
+it reads the requested output fields from the prompt (or the JSON schema in
+`response_format`) and fills each one with topic-appropriate content derived
+deterministically from the student's utterance.
+
+Everything about the responses is configurable, so concurrency, hedging,
+timeouts and JSON-repair paths can be benchmarked without network or keys:
+  - latency distribution (fixed / uniform / lognormal) before the first token
+  - token streaming speed (also applied to non-streamed responses)
+  - HTTP 500 error rate and HTTP 429 rate-limit rate (with Retry-After)
+  - malformed JSON rate and kinds: fenced, truncated, prose-wrapped
+
+Run standalone:
+    python local_lm_server.py --port 8100 --latency-ms 400 --tokens-per-second 80
+
+and start the service with LLM_PROVIDER=local (LOCAL_LM_BASE_URL defaults to
+http://127.0.0.1:8100/v1). Tests and benchmarks can use serve_in_thread().
+
+Environment variables (read by LocalLMConfig.from_env):
+  LOCAL_LM_LATENCY_MS, LOCAL_LM_LATENCY_DISTRIBUTION, LOCAL_LM_LATENCY_SPREAD,
+  LOCAL_LM_TOKENS_PER_SECOND, LOCAL_LM_ERROR_RATE, LOCAL_LM_RATE_LIMIT_RATE,
+  LOCAL_LM_RETRY_AFTER_S, LOCAL_LM_MALFORMED_RATE, LOCAL_LM_MALFORMED_KINDS,
+  LOCAL_LM_SEED
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+MALFORMED_KINDS = ("fenced", "truncated", "prose")
+
+
+@dataclass
+class LocalLMConfig:
+    """Behaviour knobs for the stand-in server. All rates are in [0, 1]."""
+    latency_ms: float = 0.0
+    latency_distribution: str = "fixed"  # fixed | uniform | lognormal
+    latency_spread: float = 0.5  # uniform: +/- fraction of latency_ms; lognormal: sigma
+    tokens_per_second: float = 0.0  # 0 = emit the whole completion at once
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after_s: float = 1.0
+    malformed_rate: float = 0.0
+    malformed_kinds: List[str] = field(default_factory=lambda: list(MALFORMED_KINDS))
+    seed: Optional[int] = None
+
+    @classmethod
+    def from_env(cls) -> "LocalLMConfig":
+        config = cls()
+        env_map = {
+            "latency_ms": "LOCAL_LM_LATENCY_MS",
+            "latency_distribution": "LOCAL_LM_LATENCY_DISTRIBUTION",
+            "latency_spread": "LOCAL_LM_LATENCY_SPREAD",
+            "tokens_per_second": "LOCAL_LM_TOKENS_PER_SECOND",
+            "error_rate": "LOCAL_LM_ERROR_RATE",
+            "rate_limit_rate": "LOCAL_LM_RATE_LIMIT_RATE",
+            "retry_after_s": "LOCAL_LM_RETRY_AFTER_S",
+            "malformed_rate": "LOCAL_LM_MALFORMED_RATE",
+            "malformed_kinds": "LOCAL_LM_MALFORMED_KINDS",
+            "seed": "LOCAL_LM_SEED",
+        }
+        updates = {}
+        for attr, env_name in env_map.items():
+            value = os.getenv(env_name, "").strip()
+            if value:
+                updates[attr] = value
+        return config.updated(updates)
+
+    def updated(self, updates: Dict[str, Any]) -> "LocalLMConfig":
+        """Return a copy with `updates` applied (string values are coerced)."""
+        values = asdict(self)
+        known = {f.name for f in fields(self)}
+        for key, value in updates.items():
+            if key not in known:
+                raise ValueError(f"Unknown local LM config key '{key}'")
+            if key == "malformed_kinds":
+                kinds = value.split(",") if isinstance(value, str) else list(value)
+                kinds = [k.strip() for k in kinds if k.strip()]
+                unknown = set(kinds) - set(MALFORMED_KINDS)
+                if unknown:
+                    raise ValueError(f"Unknown malformed kinds: {sorted(unknown)}")
+                values[key] = kinds
+            elif key == "latency_distribution":
+                if value not in ("fixed", "uniform", "lognormal"):
+                    raise ValueError(f"Unknown latency distribution '{value}'")
+                values[key] = value
+            elif key == "seed":
+                values[key] = None if value is None else int(value)
+            else:
+                values[key] = float(value)
+        return LocalLMConfig(**values)
+
+    def sample_latency_s(self, rng: random.Random) -> float:
+        base = max(0.0, self.latency_ms) / 1000.0
+        if base == 0.0:
+            return 0.0
+        if self.latency_distribution == "uniform":
+            return max(0.0, rng.uniform(base * (1 - self.latency_spread), base * (1 + self.latency_spread)))
+        if self.latency_distribution == "lognormal":
+            # Median equals latency_ms; spread is sigma of the underlying normal.
+            return rng.lognormvariate(math.log(base), max(1e-6, self.latency_spread))
+        return base
+
+
+# ---------------------------------------------------------------------
+# Content generation
+# ---------------------------------------------------------------------
+
+# Topic lexicon: keyword -> (skills, trajectory steps). Matched against the utterance.
+_TOPICS: List[Tuple[Tuple[str, ...], List[str], List[str]]] = [
+    (("recurs",), ["Recursion", "Base cases", "Call stack", "Recursive decomposition", "Stack overflow debugging"],
+     ["Trace a recursive factorial by hand", "Identify base and recursive cases in three examples",
+      "Rewrite a loop as a recursive function", "Debug an infinite recursion example", "Convert recursion to iteration"]),
+    (("dynamic programming", "dp", "knapsack", "memoiz"),
+     ["Dynamic programming", "Overlapping subproblems", "Optimal substructure", "Memoization", "Tabulation"],
+     ["Review overlapping subproblems with Fibonacci", "Write the knapsack recurrence relation",
+      "Implement a top-down memoized solution", "Convert it to a bottom-up table", "Solve two DP practice problems"]),
+    (("linked list", "pointer", "node"),
+     ["Linked lists", "Pointer manipulation", "Node insertion and deletion", "Traversal", "Edge cases with null"],
+     ["Draw a linked list with three nodes", "Implement insert at head and tail", "Implement deletion by value",
+      "Reverse a linked list in place", "Test edge cases with empty lists"]),
+    (("sort", "merge", "quick"),
+     ["Sorting algorithms", "Divide and conquer", "Time complexity analysis", "Stable sorting", "In-place partitioning"],
+     ["Compare insertion sort and merge sort on small inputs", "Trace merge sort on an 8-element array",
+      "Analyse the recurrence T(n) = 2T(n/2) + n", "Implement quicksort partitioning", "Benchmark sorts on random data"]),
+    (("graph", "bfs", "dfs", "dijkstra", "shortest path"),
+     ["Graph representation", "Breadth-first search", "Depth-first search", "Shortest paths", "Priority queues"],
+     ["Represent a graph as an adjacency list", "Run BFS by hand on a small graph", "Implement DFS recursively",
+      "Trace Dijkstra's algorithm with a priority queue", "Solve a shortest-path exercise"]),
+    (("tree", "bst", "heap"),
+     ["Binary trees", "Binary search trees", "Tree traversal", "Heap property", "Balanced trees"],
+     ["Draw a BST from an insertion sequence", "Implement in-order traversal", "Implement BST search and insert",
+      "Build a min-heap from an array", "Compare balanced and unbalanced tree heights"]),
+    (("hash", "dictionary", "map"),
+     ["Hash tables", "Hash functions", "Collision resolution", "Load factor", "Amortized analysis"],
+     ["Implement a simple hash function", "Compare chaining and open addressing", "Measure load factor effects",
+      "Implement resize and rehash", "Solve a two-sum problem with a hash map"]),
+    (("big o", "complexity", "runtime", "asymptotic"),
+     ["Asymptotic notation", "Time complexity analysis", "Space complexity", "Loop analysis", "Recurrence relations"],
+     ["Classify common functions by growth rate", "Analyse nested loops", "Compare best, worst and average cases",
+      "Solve recurrences with the master theorem", "Analyse space usage of recursive code"]),
+]
+_DEFAULT_TOPIC = (
+    ["Problem decomposition", "Algorithmic thinking", "Data structure selection", "Code tracing", "Testing strategies"],
+    ["Restate the problem in your own words", "Work through a small example by hand",
+     "Choose an appropriate data structure", "Implement and test a first solution", "Review edge cases and complexity"],
+)
+
+_INTENT_TEMPLATES = {
+    "debugging": "Student is trying to fix an error in their {topic} code.",
+    "practice": "Student wants to practice solving {topic} problems.",
+    "conceptual": "Student wants to understand how {topic} works.",
+}
+
+
+def _extract_input(messages: List[dict], name: str) -> str:
+    """Find the value of a DSPy input field `[[ ## name ## ]]` in the user messages."""
+    pattern = re.compile(r"\[\[ ## " + re.escape(name) + r" ## \]\]\n(.*?)(?=\n\n\[\[ ## |\n\nRespond with|\Z)", re.S)
+    for message in reversed(messages):
+        if message.get("role") != "user":
+            continue
+        content = _message_text(message)
+        match = pattern.search(content)
+        if match:
+            return match.group(1).strip()
+    return ""
+
+
+def _message_text(message: dict) -> str:
+    content = message.get("content", "")
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return str(content or "")
+
+
+def requested_output_fields(body: dict) -> Tuple[List[Tuple[str, bool]], str]:
+    """
+    Work out which output fields the caller wants and in which format.
+
+    Returns ([(field_name, is_list), ...], format) where format is "json" for
+    JSONAdapter-style requests and "chat" for ChatAdapter `[[ ## field ## ]]`
+    requests.
+    """
+    response_format = body.get("response_format") or {}
+    schema = None
+    if isinstance(response_format, dict) and response_format.get("type") == "json_schema":
+        schema = (response_format.get("json_schema") or {}).get("schema")
+    if schema and schema.get("properties"):
+        props = schema["properties"]
+        return [(name, props[name].get("type") == "array") for name in props], "json"
+
+    messages = body.get("messages") or []
+    last_user = next((_message_text(m) for m in reversed(messages) if m.get("role") == "user"), "")
+
+    if "Respond with a JSON object" in last_user:
+        tail = last_user.split("Respond with a JSON object", 1)[1]
+        specs = re.findall(r"`(\w+)`( \(must be formatted as a valid Python ([^)]*)\))?", tail)
+        return [(name, "list" in (type_name or "")) for name, _, type_name in specs], "json"
+
+    if "Respond with the corresponding output fields" in last_user:
+        tail = last_user.split("Respond with the corresponding output fields", 1)[1]
+        specs = re.findall(r"`\[\[ ## (\w+) ## \]\]`( \(must be formatted as a valid Python ([^)]*)\))?", tail)
+        return [(name, "list" in (type_name or "")) for name, _, type_name in specs if name != "completed"], "chat"
+
+    if isinstance(response_format, dict) and response_format.get("type") == "json_object":
+        return [("intent", False), ("skills", True), ("trajectory", True)], "json"
+    return [], "text"
+
+
+class ContentGenerator:
+    """Builds deterministic, IST-shaped field values from the prompt."""
+
+    def __init__(self, messages: List[dict]) -> None:
+        self.utterance = _extract_input(messages, "utterance") or _extract_input(messages, "question")
+        seed_text = self.utterance or json.dumps(messages[-1:], sort_keys=True)
+        self.rng = random.Random(hashlib.sha256(seed_text.encode("utf-8")).hexdigest())
+        self.topic, self.skills, self.steps = self._match_topic(self.utterance.lower())
+
+    def _match_topic(self, text: str) -> Tuple[str, List[str], List[str]]:
+        for keywords, skills, steps in _TOPICS:
+            if any(keyword in text for keyword in keywords):
+                return skills[0].lower(), skills, steps
+        return "this concept", _DEFAULT_TOPIC[0], _DEFAULT_TOPIC[1]
+
+    def intent(self) -> str:
+        text = self.utterance.lower()
+        if any(k in text for k in ("error", "bug", "fix", "wrong", "crash", "broken")):
+            kind = "debugging"
+        elif any(k in text for k in ("practice", "exercise", "solve", "problem")):
+            kind = "practice"
+        else:
+            kind = "conceptual"
+        return _INTENT_TEMPLATES[kind].format(topic=self.topic)
+
+    def skill_list(self) -> List[str]:
+        count = self.rng.randint(4, min(5, len(self.skills)))
+        return self.skills[:count]
+
+    def step_list(self) -> List[str]:
+        count = self.rng.randint(4, min(5, len(self.steps)))
+        return self.steps[:count]
+
+    def value_for(self, name: str, is_list: bool) -> Any:
+        lowered = name.lower()
+        if lowered == "reasoning":
+            return (
+                f"The student is asking about {self.topic}. Their message suggests they need "
+                f"a clear explanation grounded in the course material, followed by practice."
+            )
+        if lowered == "intent":
+            return self.intent()
+        if lowered == "skills":
+            return self.skill_list()
+        if lowered in ("trajectory", "steps"):
+            return self.step_list()
+        if lowered == "structured_analysis":
+            return json.dumps({"intent": self.intent(), "skills": self.skill_list(), "trajectory": self.step_list()})
+        if "confidence" in lowered:
+            return round(self.rng.uniform(0.55, 0.98), 2)
+        if lowered in ("reply", "response", "answer", "tutor_reply"):
+            return (
+                f"Good question! Before I explain {self.topic}, what do you already know about it? "
+                f"Try describing, in your own words, what problem {self.topic} is meant to solve."
+            )
+        if "summary" in lowered or "digest" in lowered:
+            return f"The discussion so far has focused on {self.topic}: " + ", ".join(self.skills[:3]) + "."
+        if is_list:
+            return self.skill_list()
+        return f"Generated {name.replace('_', ' ')} about {self.topic}."
+
+
+def _malform(text: str, kind: str) -> str:
+    if kind == "fenced":
+        return f"```json\n{text}\n```"
+    if kind == "truncated":
+        return text[: max(1, int(len(text) * 0.6))]
+    return f"Sure! Here is the analysis you asked for:\n{text}\nLet me know if you need anything else."
+
+
+def build_completion_text(body: dict, malformed_kind: Optional[str] = None) -> str:
+    """Produce the assistant message content for a chat-completions request body."""
+    messages = body.get("messages") or []
+    output_fields, fmt = requested_output_fields(body)
+    generator = ContentGenerator(messages)
+
+    if fmt == "json":
+        payload = {name: generator.value_for(name, is_list) for name, is_list in output_fields}
+        text = json.dumps(payload)
+        return _malform(text, malformed_kind) if malformed_kind else text
+
+    if fmt == "chat":
+        parts = []
+        for name, is_list in output_fields:
+            value = generator.value_for(name, is_list)
+            if isinstance(value, (list, dict)):
+                value = json.dumps(value)
+            value = str(value)
+            if malformed_kind and name == "structured_analysis":
+                value = _malform(value, malformed_kind)
+            parts.append(f"[[ ## {name} ## ]]\n{value}")
+        parts.append("[[ ## completed ## ]]")
+        return "\n\n".join(parts)
+
+    return generator.value_for("reply", False)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), good enough for accounting tests."""
+    return max(1, len(text) // 4) if text else 0
+
+
+def _prompt_tokens(body: dict) -> int:
+    return sum(estimate_tokens(_message_text(m)) for m in body.get("messages") or [])
+
+
+def _split_tokens(text: str) -> List[str]:
+    """Split into ~4-character chunks that concatenate back to `text`."""
+    return [text[i:i + 4] for i in range(0, len(text), 4)] or [""]
+
+
+# ---------------------------------------------------------------------
+# HTTP server
+# ---------------------------------------------------------------------
+
+class LocalLMState:
+    """Mutable server state: current config, RNG and counters."""
+
+    def __init__(self, config: LocalLMConfig) -> None:
+        self.lock = threading.Lock()
+        self.configure(config)
+        self.stats = {"requests": 0, "errors": 0, "rate_limited": 0, "malformed": 0, "streamed": 0, "completion_tokens": 0}
+
+    def configure(self, config: LocalLMConfig) -> None:
+        with self.lock:
+            self.config = config
+            self.rng = random.Random(config.seed)
+
+    def bump(self, key: str, amount: int = 1) -> None:
+        with self.lock:
+            self.stats[key] += amount
+
+
+def create_app(config: Optional[LocalLMConfig] = None) -> FastAPI:
+    """Build the stand-in FastAPI app (config defaults to LocalLMConfig.from_env())."""
+    state = LocalLMState(config or LocalLMConfig.from_env())
+    app = FastAPI(title="Local LM stand-in", version="0.1.0")
+    app.state.lm = state
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "local-ist", "object": "model", "owned_by": "local"}]}
+
+    @app.get("/admin/config")
+    async def get_config():
+        return asdict(state.config)
+
+    @app.post("/admin/config")
+    async def update_config(updates: Dict[str, Any]):
+        try:
+            state.configure(state.config.updated(updates))
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+        return asdict(state.config)
+
+    @app.get("/admin/stats")
+    async def get_stats():
+        return dict(state.stats)
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        state.bump("requests")
+        with state.lock:
+            config = state.config
+            latency = config.sample_latency_s(state.rng)
+            roll_error = state.rng.random()
+            roll_limit = state.rng.random()
+            roll_malformed = state.rng.random()
+            malformed_kind = state.rng.choice(config.malformed_kinds) if config.malformed_kinds else None
+
+        if roll_limit < config.rate_limit_rate:
+            state.bump("rate_limited")
+            return JSONResponse(
+                status_code=429,
+                headers={"Retry-After": f"{config.retry_after_s:g}"},
+                content={"error": {"message": "Rate limit reached (local stand-in)", "type": "rate_limit_error", "code": "rate_limit_exceeded"}},
+            )
+
+        if latency > 0:
+            await asyncio.sleep(latency)
+
+        if roll_error < config.error_rate:
+            state.bump("errors")
+            return JSONResponse(
+                status_code=500,
+                content={"error": {"message": "Injected server error (local stand-in)", "type": "server_error", "code": None}},
+            )
+
+        if roll_malformed >= config.malformed_rate:
+            malformed_kind = None
+        else:
+            state.bump("malformed")
+
+        text = build_completion_text(body, malformed_kind)
+        model = body.get("model") or "local-ist"
+        prompt_tokens = _prompt_tokens(body)
+        completion_tokens = estimate_tokens(text)
+        state.bump("completion_tokens", completion_tokens)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+        if body.get("stream"):
+            state.bump("streamed")
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            return StreamingResponse(
+                _stream_chunks(text, model, completion_id, created, config.tokens_per_second, usage if include_usage else None),
+                media_type="text/event-stream",
+            )
+
+        if config.tokens_per_second > 0:
+            await asyncio.sleep(completion_tokens / config.tokens_per_second)
+
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        }
+
+    return app
+
+
+async def _stream_chunks(text, model, completion_id, created, tokens_per_second, usage):
+    def chunk(delta, finish_reason=None, extra=None):
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        if extra:
+            payload.update(extra)
+        return f"data: {json.dumps(payload)}\n\n"
+
+    yield chunk({"role": "assistant", "content": ""})
+    delay = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+    for piece in _split_tokens(text):
+        if delay:
+            await asyncio.sleep(delay)
+        yield chunk({"content": piece})
+    yield chunk({}, finish_reason="stop")
+    if usage is not None:
+        yield f"data: {json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model, 'choices': [], 'usage': usage})}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+class LocalLMServer:
+    """Handle for a stand-in server running in a background thread."""
+
+    def __init__(self, server, thread: threading.Thread, host: str, port: int, app: FastAPI) -> None:
+        self._server = server
+        self._thread = thread
+        self.host = host
+        self.port = port
+        self.app = app
+
+    @property
+    def base_url(self) -> str:
+        """OpenAI-style base URL, suitable for LOCAL_LM_BASE_URL / dspy.LM(api_base=...)."""
+        return f"http://{self.host}:{self.port}/v1"
+
+    def configure(self, **updates) -> LocalLMConfig:
+        """Change behaviour on the fly (e.g. error_rate=0.2) without restarting."""
+        state = self.app.state.lm
+        state.configure(state.config.updated(updates))
+        return state.config
+
+    @property
+    def stats(self) -> dict:
+        return dict(self.app.state.lm.stats)
+
+    def stop(self) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=10)
+
+
+def serve_in_thread(config: Optional[LocalLMConfig] = None, host: str = "127.0.0.1", port: int = 0) -> LocalLMServer:
+    """Start the stand-in on a background thread (port 0 picks a free port)."""
+    import uvicorn
+
+    app = create_app(config or LocalLMConfig())
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    actual_port = sock.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True, name="local-lm-server")
+    thread.start()
+
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline or not thread.is_alive():
+            raise RuntimeError("Local LM stand-in failed to start")
+        time.sleep(0.01)
+    return LocalLMServer(server, thread, host, actual_port, app)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible LM stand-in for the DSPy service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float)
+    parser.add_argument("--latency-distribution", choices=["fixed", "uniform", "lognormal"])
+    parser.add_argument("--latency-spread", type=float)
+    parser.add_argument("--tokens-per-second", type=float)
+    parser.add_argument("--error-rate", type=float)
+    parser.add_argument("--rate-limit-rate", type=float)
+    parser.add_argument("--retry-after-s", type=float)
+    parser.add_argument("--malformed-rate", type=float)
+    parser.add_argument("--malformed-kinds", help="Comma-separated subset of: " + ",".join(MALFORMED_KINDS))
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    updates = {
+        key: value for key, value in vars(args).items()
+        if key not in ("host", "port") and value is not None
+    }
+    config = LocalLMConfig.from_env().updated(updates)
+
+    import uvicorn
+
+    print(f"🧪 Local LM stand-in on http://{args.host}:{args.port}/v1 with {asdict(config)}")
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
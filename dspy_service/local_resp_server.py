@@ -0,0 +1,223 @@
+"""
+Local Redis-protocol (RESP2) stand-in for the shared cache.
+
+Implements the handful of commands shared_cache.RespStore uses (PING, GET,
+SET with EX/PX, DEL, EXISTS, DBSIZE, FLUSHDB, KEYS, SELECT) in memory, with
+per-key expiry and an optional byte limit enforced by evicting the least
+recently used keys (like maxmemory + allkeys-lru). It is meant for tests and
+local multi-worker runs, not production.
+
+Run standalone:
+    python local_resp_server.py --port 6390 --max-bytes 268435456
+
+and start the service with SHARED_CACHE_URL=redis://127.0.0.1:6390/0.
+Tests can use serve_in_thread().
+"""
+
+from __future__ import annotations
+
+import argparse
+import fnmatch
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional
+
+
+class KeyValueState:
+    """In-memory keyspace with expiry and LRU byte limit, shared by all connections."""
+
+    def __init__(self, max_bytes: int = 0) -> None:
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[bytes, tuple]" = OrderedDict()  # key -> (value, expires_at or None)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _live(self, key: bytes):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.time():
+            self._remove(key)
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def _remove(self, key: bytes) -> bool:
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return False
+        self._bytes -= len(key) + len(entry[0])
+        return True
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        with self._lock:
+            entry = self._live(key)
+            return entry[0] if entry else None
+
+    def set(self, key: bytes, value: bytes, ttl_s: Optional[float]) -> None:
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (value, time.time() + ttl_s if ttl_s else None)
+            self._bytes += len(key) + len(value)
+            while self.max_bytes and self._bytes > self.max_bytes and len(self._data) > 1:
+                self._remove(next(iter(self._data)))
+
+    def delete(self, keys: List[bytes]) -> int:
+        with self._lock:
+            return sum(self._remove(key) for key in keys)
+
+    def exists(self, keys: List[bytes]) -> int:
+        with self._lock:
+            return sum(self._live(key) is not None for key in keys)
+
+    def keys(self, pattern: bytes) -> List[bytes]:
+        with self._lock:
+            candidates = [key for key in list(self._data) if fnmatch.fnmatchcase(key.decode(), pattern.decode())]
+            return [key for key in candidates if self._live(key) is not None]
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def flush(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        while True:
+            try:
+                args = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if args is None:
+                return
+            try:
+                reply = self.server.execute(args)
+            except Exception as e:  # malformed arguments -> RESP error, keep the connection
+                reply = RespErrorReply(f"ERR {e}")
+            self.wfile.write(_encode(reply))
+
+    def _read_command(self) -> Optional[List[bytes]]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.strip().split()  # inline command (e.g. from telnet)
+        args = []
+        for _ in range(int(line[1:-2])):
+            header = self.rfile.readline()
+            length = int(header[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+
+class RespErrorReply(str):
+    pass
+
+
+def _encode(reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, RespErrorReply):
+        return b"-" + reply.encode() + b"\r\n"
+    if isinstance(reply, str):
+        return b"+" + reply.encode() + b"\r\n"
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    if isinstance(reply, list):
+        return b"*%d\r\n" % len(reply) + b"".join(_encode(item) for item in reply)
+    raise TypeError(f"Cannot encode {type(reply).__name__}")
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, max_bytes: int = 0) -> None:
+        super().__init__(address, _Handler)
+        self.state = KeyValueState(max_bytes)
+
+    def execute(self, args: List[bytes]):
+        command, rest = args[0].upper(), args[1:]
+        if command == b"PING":
+            return "PONG"
+        if command == b"GET":
+            return self.state.get(rest[0])
+        if command == b"SET":
+            ttl_s = None
+            options = [arg.upper() for arg in rest[2:]]
+            if b"EX" in options:
+                ttl_s = float(rest[2 + options.index(b"EX") + 1])
+            elif b"PX" in options:
+                ttl_s = float(rest[2 + options.index(b"PX") + 1]) / 1000
+            self.state.set(rest[0], rest[1], ttl_s)
+            return "OK"
+        if command == b"DEL":
+            return self.state.delete(rest)
+        if command == b"EXISTS":
+            return self.state.exists(rest)
+        if command == b"KEYS":
+            return self.state.keys(rest[0])
+        if command == b"DBSIZE":
+            return self.state.size()
+        if command == b"FLUSHDB":
+            self.state.flush()
+            return "OK"
+        if command == b"SELECT":
+            return "OK"  # single keyspace
+        return RespErrorReply(f"ERR unknown command '{command.decode(errors='replace')}'")
+
+
+@dataclass
+class LocalRespServer:
+    server: RespServer
+    thread: threading.Thread
+    host: str
+    port: int
+
+    @property
+    def url(self) -> str:
+        return f"redis://{self.host}:{self.port}/0"
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join(timeout=5)
+
+
+def serve_in_thread(host: str = "127.0.0.1", port: int = 0, max_bytes: int = 0) -> LocalRespServer:
+    """Start the stand-in on a background thread (port 0 picks a free port)."""
+    server = RespServer((host, port), max_bytes=max_bytes)
+    thread = threading.Thread(target=server.serve_forever, daemon=True, name="local-resp-server")
+    thread.start()
+    return LocalRespServer(server, thread, host, server.server_address[1])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Local Redis-protocol stand-in for the shared cache.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    parser.add_argument("--max-bytes", type=int, default=0, help="LRU byte limit (0 = unlimited)")
+    args = parser.parse_args(argv)
+
+    server = RespServer((args.host, args.port), max_bytes=args.max_bytes)
+    print(f"[CACHE] RESP stand-in listening on redis://{args.host}:{args.port}/0")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
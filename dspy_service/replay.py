@@ -0,0 +1,262 @@
+"""
+Replay captured IST traffic against a running DSPy service.
+
+Reads capture files written by traffic_capture.py and re-issues every request
+with its original inter-arrival timing, scaled by a speed factor, or as fast
+as the concurrency limit allows. Reports throughput, latency percentiles,
+error and fallback rates, and output drift against the recorded responses.
+
+Usage:
+    python replay.py captures/ --target http://127.0.0.1:8000 --speed 1x
+    python replay.py captures/capture-....jsonl --speed 10x --report report.json
+    python replay.py captures/ --speed max --concurrency 32
+
+Point the target service at the local LM stand-in to run fully offline.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import httpx
+
+from dspy_flows import intent_category, is_fallback_result, skill_set_jaccard
+from latency_stats import summarize_latencies
+from traffic_capture import iter_capture_records
+
+
+def parse_speed(value: str) -> Optional[float]:
+    """Parse '1x', '10x', '2.5' or 'max' into a speed factor (None means max)."""
+    text = str(value).strip().lower()
+    if text == "max":
+        return None
+    if text.endswith("x"):
+        text = text[:-1]
+    speed = float(text)
+    if speed <= 0:
+        raise ValueError("speed must be positive or 'max'")
+    return speed
+
+
+@dataclass
+class ReplayResult:
+    """Outcome of one replayed request."""
+    latency_ms: float
+    status: Optional[int]
+    error: Optional[str] = None
+    fallback: bool = False
+    schedule_lag_ms: float = 0.0
+    intent_exact: Optional[bool] = None
+    intent_category_match: Optional[bool] = None
+    skills_jaccard: Optional[float] = None
+    trajectory_jaccard: Optional[float] = None
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None or self.status is None or self.status >= 400
+
+
+@dataclass
+class ReplayReport:
+    """Aggregate replay statistics."""
+    results: List[ReplayResult] = field(default_factory=list)
+    skipped: int = 0
+    wall_time_s: float = 0.0
+    speed: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        total = len(self.results)
+        errors = [r for r in self.results if r.failed]
+        ok = [r for r in self.results if not r.failed]
+        compared = [r for r in ok if r.intent_exact is not None]
+
+        def rate(items, attr):
+            values = [getattr(r, attr) for r in items]
+            return round(sum(1 for v in values if v) / len(values), 4) if values else None
+
+        def mean(items, attr):
+            values = [getattr(r, attr) for r in items]
+            return round(sum(values) / len(values), 4) if values else None
+
+        return {
+            "requests": total,
+            "skipped": self.skipped,
+            "speed": "max" if self.speed is None else f"{self.speed:g}x",
+            "wall_time_s": round(self.wall_time_s, 3),
+            "throughput_rps": round(total / self.wall_time_s, 3) if self.wall_time_s > 0 else 0.0,
+            "latency_ms": summarize_latencies([r.latency_ms for r in ok]),
+            "schedule_lag_ms": summarize_latencies([r.schedule_lag_ms for r in self.results]),
+            "error_rate": round(len(errors) / total, 4) if total else 0.0,
+            "fallback_rate": round(sum(1 for r in ok if r.fallback) / len(ok), 4) if ok else 0.0,
+            "drift": {
+                "compared": len(compared),
+                "intent_exact_rate": rate(compared, "intent_exact"),
+                "intent_category_agreement": rate(compared, "intent_category_match"),
+                "mean_skills_jaccard": mean(compared, "skills_jaccard"),
+                "mean_trajectory_jaccard": mean(compared, "trajectory_jaccard"),
+            },
+        }
+
+
+def _compare(result: ReplayResult, recorded: dict, replayed: dict) -> None:
+    recorded_intent = str(recorded.get("intent", ""))
+    replayed_intent = str(replayed.get("intent", ""))
+    result.intent_exact = recorded_intent.strip() == replayed_intent.strip()
+    result.intent_category_match = (
+        (intent_category(recorded_intent) or "conceptual_question")
+        == (intent_category(replayed_intent) or "conceptual_question")
+    )
+    result.skills_jaccard = skill_set_jaccard(recorded.get("skills", []), replayed.get("skills", []))
+    result.trajectory_jaccard = skill_set_jaccard(recorded.get("trajectory", []), replayed.get("trajectory", []))
+
+
+def _request_for_run(request: dict, run_id: str) -> dict:
+    """The captured request body with its idempotency key (if any) scoped to this replay run."""
+    key = request.get("idempotency_key")
+    if not key:
+        return request
+    return {**request, "idempotency_key": f"{run_id}:{key}"}
+
+
+async def replay_capture(
+    records: List[dict],
+    target: str,
+    speed: Optional[float] = 1.0,
+    concurrency: int = 64,
+    timeout: float = 60.0,
+    transport: Optional[httpx.AsyncBaseTransport] = None,
+    run_id: Optional[str] = None,
+) -> ReplayReport:
+    """
+    Re-issue captured records against `target`.
+
+    Requests are scheduled at (ts - first_ts) / speed seconds after the start;
+    with speed=None every request is released immediately and only
+    `concurrency` bounds the load. Lateness against the schedule is reported
+    as schedule_lag_ms so a saturated client is distinguishable from a slow
+    service.
+
+    Captured idempotency keys are rewritten to "<run_id>:<key>" (run_id is
+    random unless given), so a replay is not answered from the idempotency
+    records of the original traffic or of an earlier replay, while requests
+    that shared a key within the capture still share it.
+    """
+    replayable = [r for r in records if isinstance(r.get("request"), dict)]
+    report = ReplayReport(skipped=len(records) - len(replayable), speed=speed)
+    if not replayable:
+        return report
+
+    replayable.sort(key=lambda r: r.get("ts", 0.0))
+    first_ts = replayable[0].get("ts", 0.0)
+    run_id = run_id or uuid.uuid4().hex[:12]
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    limits = httpx.Limits(max_connections=max(1, concurrency), max_keepalive_connections=max(1, concurrency))
+
+    async with httpx.AsyncClient(base_url=target, timeout=timeout, transport=transport, limits=limits) as client:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        async def issue(record: dict) -> ReplayResult:
+            offset = 0.0 if speed is None else (record.get("ts", first_ts) - first_ts) / speed
+            delay = start + offset - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with semaphore:
+                lag_ms = max(0.0, (loop.time() - start - offset) * 1000)
+                sent = time.perf_counter()
+                try:
+                    response = await client.post(
+                        record.get("path") or "/api/intent-skill-trajectory",
+                        json=_request_for_run(record["request"], run_id),
+                    )
+                except httpx.HTTPError as e:
+                    return ReplayResult(
+                        latency_ms=(time.perf_counter() - sent) * 1000,
+                        status=None,
+                        error=f"{type(e).__name__}: {e}",
+                        schedule_lag_ms=lag_ms,
+                    )
+                result = ReplayResult(
+                    latency_ms=(time.perf_counter() - sent) * 1000,
+                    status=response.status_code,
+                    schedule_lag_ms=lag_ms,
+                )
+
+            if response.status_code < 400:
+                try:
+                    body = response.json()
+                except ValueError:
+                    result.error = "invalid JSON response"
+                    return result
+                result.fallback = is_fallback_result(body)
+                recorded = record.get("response")
+                if isinstance(recorded, dict) and (record.get("status") or 200) < 400:
+                    _compare(result, recorded, body)
+            return result
+
+        report.results = list(await asyncio.gather(*(issue(r) for r in replayable)))
+        report.wall_time_s = loop.time() - start
+
+    return report
+
+
+def format_report(summary: dict) -> str:
+    lat = summary["latency_ms"]
+    drift = summary["drift"]
+    lines = [
+        f"Replayed {summary['requests']} requests at {summary['speed']} "
+        f"({summary['skipped']} skipped) in {summary['wall_time_s']}s",
+        f"  Throughput:    {summary['throughput_rps']} req/s",
+        f"  Latency (ms):  p50={lat['p50']} p90={lat['p90']} p95={lat['p95']} p99={lat['p99']} max={lat['max']}",
+        f"  Schedule lag:  p95={summary['schedule_lag_ms']['p95']} ms",
+        f"  Error rate:    {summary['error_rate']:.2%}",
+        f"  Fallback rate: {summary['fallback_rate']:.2%}",
+        f"  Drift vs recorded ({drift['compared']} compared):",
+        f"    intent exact:       {drift['intent_exact_rate']}",
+        f"    intent category:    {drift['intent_category_agreement']}",
+        f"    skills Jaccard:     {drift['mean_skills_jaccard']}",
+        f"    trajectory Jaccard: {drift['mean_trajectory_jaccard']}",
+    ]
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay captured IST traffic against a DSPy service.")
+    parser.add_argument("captures", nargs="+", help="Capture file(s) or directories written by traffic_capture.py")
+    parser.add_argument("--target", default="http://127.0.0.1:8000", help="Base URL of the service under test")
+    parser.add_argument("--speed", default="1x", help="Replay speed: 1x, Nx or max (default: 1x)")
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum in-flight requests (default: 64)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--limit", type=int, default=None, help="Replay only the first N records")
+    parser.add_argument("--report", default=None, help="Write the JSON summary to this path")
+    args = parser.parse_args(argv)
+
+    records = list(iter_capture_records(args.captures))
+    if args.limit is not None:
+        records = records[: args.limit]
+
+    report = asyncio.run(replay_capture(
+        records,
+        target=args.target,
+        speed=parse_speed(args.speed),
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+    ))
+    summary = report.to_dict()
+    print(format_report(summary))
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as handle:
+            json.dump(summary, handle, indent=2)
+    return 0 if summary["error_rate"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
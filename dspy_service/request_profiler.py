@@ -0,0 +1,304 @@
+"""
+On-demand and sampled profiling of IST requests.
+
+A wall-clock sampling profiler (no dependencies): while a request is being
+profiled, a background thread reads the stacks of the threads working on it
+(`sys._current_frames()`) every IST_PROFILE_INTERVAL_MS and counts them. Time
+blocked in the LM HTTP call shows up as litellm/httpx frames, next to DSPy
+adapter formatting, Pydantic validation and JSON repair.
+
+Two modes, both off by default:
+  - On demand: a request to /api/intent-skill-trajectory carrying the
+    profiling token (X-IST-Profile header or ?profile= query flag) is profiled
+    on its own; the result is saved to IST_PROFILE_DIR as a speedscope file
+    (open at https://www.speedscope.app) plus folded stacks (for flamegraph.pl
+    / inferno), and its name is returned in X-IST-Profile-File.
+  - Sampled: every IST_PROFILE_SAMPLE_N-th request is profiled continuously
+    and merged into one aggregate profile, downloadable from GET /api/profile.
+
+Only threads registered to a profiled request are sampled: the thread that
+opened the session, plus worker threads that enter `follow()` (used by the
+decomposed pipeline's sub-predictors). With no session active the sampler
+thread sleeps and `follow()` is one context-variable read.
+
+Environment variables:
+  - IST_PROFILE_TOKEN: secret required for on-demand profiling and downloads (unset = disabled)
+  - IST_PROFILE_SAMPLE_N: profile 1 in N requests into the aggregate (default 0 = off)
+  - IST_PROFILE_DIR: where on-demand profiles are written (default ./profiles)
+  - IST_PROFILE_INTERVAL_MS: sampling interval (default 5)
+"""
+
+from __future__ import annotations
+
+import contextvars
+import hmac
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set
+
+MAX_STACK_DEPTH = 128
+
+_current_session: contextvars.ContextVar[Optional["ProfileSession"]] = contextvars.ContextVar(
+    "ist_profile_session", default=None
+)
+
+
+def _frame_label(code) -> str:
+    path = code.co_filename.replace("\\", "/").rsplit("/", 2)
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+def folded_stack(frame, max_depth: int = MAX_STACK_DEPTH) -> str:
+    """Root-to-leaf "a;b;c" stack for `frame` (flamegraph.pl folded format)."""
+    labels: List[str] = []
+    while frame is not None and len(labels) < max_depth:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class ProfileSession:
+    """Stacks sampled for one profiled request."""
+
+    def __init__(self, profiler: "RequestProfiler", label: str, explicit: bool) -> None:
+        self.profiler = profiler
+        self.label = label
+        self.explicit = explicit
+        self.started = time.perf_counter()
+        self.elapsed_ms = 0.0
+        self.threads: Set[int] = {threading.get_ident()}
+        self.samples: Counter = Counter()
+        self.saved_as: Optional[str] = None
+
+
+def to_folded(samples: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+
+def to_speedscope(samples: Counter, interval_ms: float, name: str) -> dict:
+    """Speedscope "sampled" profile; weights are milliseconds."""
+    frames: List[dict] = []
+    index: Dict[str, int] = {}
+    stacks, weights = [], []
+    for stack, count in samples.most_common():
+        ids = []
+        for label in stack.split(";") if stack else []:
+            if label not in index:
+                index[label] = len(frames)
+                func, _, location = label.rpartition(" (")
+                file, _, line = location.rstrip(")").rpartition(":")
+                frames.append({"name": func, "file": file, "line": int(line) if line.isdigit() else None})
+            ids.append(index[label])
+        stacks.append(ids)
+        weights.append(round(count * interval_ms, 3))
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "dspy_service request_profiler",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": round(sum(weights), 3),
+            "samples": stacks,
+            "weights": weights,
+        }],
+    }
+
+
+class RequestProfiler:
+    """
+    Process-wide sampling profiler for IST requests (see module docstring).
+
+    `session()` profiles the current request when it is explicitly requested
+    with a valid token or picked by 1-in-N sampling; otherwise it yields None.
+    """
+
+    def __init__(self, token: str = "", directory: str | os.PathLike = "./profiles",
+                 sample_every: int = 0, interval_ms: float = 5.0, max_stacks: int = 20000) -> None:
+        self.token = token or ""
+        self.directory = Path(directory)
+        self.sample_every = max(0, int(sample_every))
+        self.interval_ms = max(0.5, float(interval_ms))
+        self.max_stacks = max_stacks
+        self._counter = itertools.count(1)
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._sessions: List[ProfileSession] = []
+        self._sampler: Optional[threading.Thread] = None
+        self._aggregate: Counter = Counter()
+        self._stats = {"explicit": 0, "sampled": 0, "samples": 0, "dropped_stacks": 0, "denied": 0}
+
+    @classmethod
+    def from_env(cls) -> "RequestProfiler":
+        return cls(
+            token=os.getenv("IST_PROFILE_TOKEN", "").strip(),
+            directory=os.getenv("IST_PROFILE_DIR", "").strip() or "./profiles",
+            sample_every=int(os.getenv("IST_PROFILE_SAMPLE_N", "0")),
+            interval_ms=float(os.getenv("IST_PROFILE_INTERVAL_MS", "5")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token) or self.sample_every > 0
+
+    def authorized(self, supplied: Optional[str]) -> bool:
+        """True when `supplied` matches the configured token (always False without one)."""
+        if not supplied:
+            return False
+        if self.token and hmac.compare_digest(supplied.encode(), self.token.encode()):
+            return True
+        with self._lock:
+            self._stats["denied"] += 1
+        print("[PROFILE] ⚠️ Profiling requested with an invalid token; ignoring")
+        return False
+
+    # -----------------------------------------------------------------
+    # Sessions
+    # -----------------------------------------------------------------
+
+    @contextmanager
+    def session(self, label: str, explicit: bool = False) -> Iterator[Optional[ProfileSession]]:
+        if not explicit and not (self.sample_every and next(self._counter) % self.sample_every == 0):
+            yield None
+            return
+
+        session = ProfileSession(self, label, explicit)
+        token = _current_session.set(session)
+        with self._lock:
+            self._sessions.append(session)
+            self._ensure_sampler()
+            self._wake.notify()
+        try:
+            yield session
+        finally:
+            _current_session.reset(token)
+            with self._lock:
+                self._sessions.remove(session)
+            session.elapsed_ms = (time.perf_counter() - session.started) * 1000
+            self._finish(session)
+
+    def _finish(self, session: ProfileSession) -> None:
+        samples = sum(session.samples.values())
+        with self._lock:
+            self._stats["samples"] += samples
+            if not session.explicit:
+                self._stats["sampled"] += 1
+                for stack, count in session.samples.items():
+                    if stack in self._aggregate or len(self._aggregate) < self.max_stacks:
+                        self._aggregate[stack] += count
+                    else:
+                        self._stats["dropped_stacks"] += 1
+                return
+            self._stats["explicit"] += 1
+
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        name = f"ist-{stamp}-{os.getpid()}-{next(self._seq)}"
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            title = f"{session.label} ({session.elapsed_ms:.0f} ms)"
+            with open(self.directory / f"{name}.speedscope.json", "w", encoding="utf-8") as handle:
+                json.dump(to_speedscope(session.samples, self.interval_ms, title), handle)
+            with open(self.directory / f"{name}.folded", "w", encoding="utf-8") as handle:
+                handle.write(to_folded(session.samples))
+            session.saved_as = f"{name}.speedscope.json"
+            print(f"[PROFILE] {session.label}: {samples} samples over {session.elapsed_ms:.0f} ms -> "
+                  f"{self.directory / session.saved_as}")
+        except OSError as e:
+            print(f"[PROFILE] ⚠️ Could not save profile: {type(e).__name__}: {e}")
+
+    # -----------------------------------------------------------------
+    # Sampler thread
+    # -----------------------------------------------------------------
+
+    def _ensure_sampler(self) -> None:
+        if self._sampler is None or not self._sampler.is_alive():
+            self._sampler = threading.Thread(target=self._run, name="ist-profiler", daemon=True)
+            self._sampler.start()
+
+    def _run(self) -> None:
+        interval = self.interval_ms / 1000
+        while True:
+            with self._lock:
+                while not self._sessions:
+                    self._wake.wait()
+                targets = [(session, list(session.threads)) for session in self._sessions]
+            frames = sys._current_frames()
+            stacks = [
+                (session, folded_stack(frames[ident]))
+                for session, idents in targets for ident in idents if ident in frames
+            ]
+            del frames
+            with self._lock:
+                for session, stack in stacks:
+                    session.samples[stack] += 1
+            time.sleep(interval)
+
+    # -----------------------------------------------------------------
+    # Aggregate profile
+    # -----------------------------------------------------------------
+
+    def aggregate(self, fmt: str = "speedscope", reset: bool = False):
+        """The merged profile of all sampled requests (speedscope dict or folded text)."""
+        with self._lock:
+            samples = Counter(self._aggregate)
+            requests = self._stats["sampled"]
+            if reset:
+                self._aggregate.clear()
+        if fmt == "folded":
+            return to_folded(samples)
+        return to_speedscope(samples, self.interval_ms, f"IST requests (1 in {self.sample_every}, {requests} profiled)")
+
+    def profile_path(self, name: str) -> Optional[Path]:
+        """Path of a saved on-demand profile, or None for unknown or unsafe names."""
+        if not name or "/" in name or "\\" in name or name.startswith("."):
+            return None
+        path = self.directory / name
+        return path if path.is_file() else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "enabled": self.enabled,
+                "on_demand": bool(self.token),
+                "sample_every": self.sample_every,
+                "interval_ms": self.interval_ms,
+                "active_sessions": len(self._sessions),
+                "aggregate_stacks": len(self._aggregate),
+            }
+
+
+@contextmanager
+def follow() -> Iterator[None]:
+    """
+    Sample the calling thread as part of the current profiled request, if any.
+    Worker threads must run in a copy of the request's context for this to
+    find the session (as the decomposed pipeline's executor does).
+    """
+    session = _current_session.get()
+    if session is None:
+        yield
+        return
+    ident = threading.get_ident()
+    lock = session.profiler._lock
+    with lock:
+        added = ident not in session.threads
+        session.threads.add(ident)
+    try:
+        yield
+    finally:
+        if added:
+            with lock:
+                session.threads.discard(ident)
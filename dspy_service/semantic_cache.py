@@ -0,0 +1,531 @@
+"""
+Near-duplicate (semantic) cache for IST results.
+
+Exact-match caching misses most of the redundancy in student traffic:
+"how does DP work for knapsack?" and "explain knapsack dynamic programming"
+yield interchangeable intent/skills/trajectory. This cache sits in front of
+the IST module and reuses a recent result for a *similar* utterance in the
+same course, without calling an embedding API:
+
+  - utterances are normalized (stop words dropped, common CS abbreviations
+    expanded, light suffix stemming) and turned into a feature set of words
+    plus character 3-grams;
+  - a MinHash signature of that set estimates Jaccard similarity;
+  - a per-course LSH index (banded signatures) finds candidates in O(1);
+  - a candidate is reused when its estimated similarity is at least
+    `threshold` and the student's context is compatible: same program
+    (fingerprint and pipeline/output-mode/trajectory selectors) and course
+    context, similar profile and recent-topic skills, and a similar recent
+    conversation (MinHash of the last few student turns). Short,
+    context-dependent follow-ups ("can you give an example?") are only
+    reused within the same conversation state: they need the exact last
+    few chat messages.
+
+Each course index is LRU-bounded with a TTL, and the number of course
+indexes is bounded too. Fallback results are never stored.
+
+Environment variables:
+  - IST_SEMANTIC_CACHE: set to 1 to enable the cache (default off)
+  - IST_SEMANTIC_CACHE_THRESHOLD: minimum estimated similarity (default 0.7)
+  - IST_SEMANTIC_CACHE_CONTEXT_THRESHOLD: minimum skill-set similarity for
+    context compatibility (default 0.5)
+  - IST_SEMANTIC_CACHE_CHAT_THRESHOLD: minimum similarity of the recent
+    student turns (default 0.25)
+  - IST_SEMANTIC_CACHE_PER_COURSE: entries kept per course (default 2000)
+  - IST_SEMANTIC_CACHE_MAX_COURSES: course indexes kept (default 64)
+  - IST_SEMANTIC_CACHE_TTL_S: entry lifetime in seconds (default 86400)
+
+Evaluate thresholds against captured traffic (see traffic_capture.py):
+    python semantic_cache.py ./captures --thresholds 0.5 0.6 0.7 0.8
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+from dspy_flows import is_fallback_result, resolve_course_id, skill_set_jaccard
+
+
+# Chat messages (most recent) that make up the conversation context: their
+# student turns are compared by similarity, and a follow-up needs all of
+# them to match exactly.
+CONTEXT_CHAT_MESSAGES = 4
+# An utterance without content words ("why?", "and then?") or with a word
+# that refers back to the conversation is a follow-up.
+_REFERRING_WORDS = frozenset(
+    "it its this that these those them they above previous earlier again another example examples more else "
+    "same instead one ones".split()
+)
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+_WORD_RE = re.compile(r"[a-z0-9+#]+")
+
+_STOPWORDS = frozenset("""
+a an the is are was were be been being am do does did doing how what why when where which who whom
+can could would should will shall may might must i me my we our you your it its this that these those
+to of for in on at by with and or but if so as about into from than then there here please help
+explain understand understanding work works working mean means tell show get got know need want
+just really very some any much many also still like way ways thing things use using used
+""".split())
+
+# Common course abbreviations, expanded so "DP" and "dynamic programming" share features.
+_ABBREVIATIONS = {
+    "dp": "dynamic programming",
+    "bfs": "breadth first search",
+    "dfs": "depth first search",
+    "bst": "binary search tree",
+    "oop": "object oriented programming",
+    "ll": "linked list",
+    "dsa": "data structures algorithms",
+    "os": "operating systems",
+    "db": "database",
+    "sql": "sql query",
+    "regex": "regular expression",
+    "recursive": "recursion",
+    "recursively": "recursion",
+}
+
+_SUFFIXES = ("ations", "ation", "ings", "ing", "ies", "es", "ed", "s")
+
+
+def _stem(word: str) -> str:
+    if len(word) <= 4:
+        return word
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            return word[: -len(suffix)]
+    return word
+
+
+def utterance_features(utterance: str) -> FrozenSet[str]:
+    """Normalized word and character-3-gram features of an utterance."""
+    words: List[str] = []
+    for token in _WORD_RE.findall(utterance.lower()):
+        for word in _ABBREVIATIONS.get(token, token).split():
+            if word not in _STOPWORDS:
+                words.append(_stem(word))
+
+    features = set()
+    for word in words:
+        features.add("w:" + word)
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            features.add("c:" + padded[i:i + 3])
+    return frozenset(features)
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class MinHasher:
+    """Fixed-seed MinHash over `num_perm` universal hash permutations."""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1) -> None:
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self._perms = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)]
+
+    def signature(self, features: Iterable[str]) -> Tuple[int, ...]:
+        hashes = [_feature_hash(f) for f in features]
+        if not hashes:
+            return tuple([_MAX_HASH] * self.num_perm)
+        return tuple(
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self._perms
+        )
+
+    @staticmethod
+    def similarity(sig_a: Sequence[int], sig_b: Sequence[int]) -> float:
+        return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+# ---------------------------------------------------------------------
+# Context compatibility
+# ---------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class CacheContext:
+    """The parts of a request, besides the utterance, that shape the IST result."""
+
+    course_context: str = ""
+    profile_skills: Tuple[str, ...] = ()
+    recent_skills: Tuple[str, ...] = ()
+    program: str = ""  # program fingerprint and request selectors; see app.py
+    chat_digest: str = ""
+    chat_signature: Tuple[int, ...] = ()  # MinHash of the recent student turns; () without any
+    follow_up: bool = False
+
+    def compatible_with(self, other: "CacheContext", threshold: float, chat_threshold: float = 0.25) -> bool:
+        if self.follow_up or other.follow_up:
+            same_conversation = self.chat_digest == other.chat_digest
+        elif self.chat_signature and other.chat_signature:
+            same_conversation = MinHasher.similarity(self.chat_signature, other.chat_signature) >= chat_threshold
+        else:
+            same_conversation = self.chat_signature == other.chat_signature
+        return (
+            self.program == other.program
+            and same_conversation
+            and self.course_context == other.course_context
+            and skill_set_jaccard(list(self.profile_skills), list(other.profile_skills)) >= threshold
+            and skill_set_jaccard(list(self.recent_skills), list(other.recent_skills)) >= threshold
+        )
+
+
+def _get(obj: Any, name: str, default=None):
+    return obj.get(name, default) if isinstance(obj, dict) else getattr(obj, name, default)
+
+
+def chat_digest(chat_history: Any) -> str:
+    """Digest of the last CONTEXT_CHAT_MESSAGES chat messages (role and normalized text); "" without history."""
+    recent = list(chat_history or [])[-CONTEXT_CHAT_MESSAGES:]
+    if not recent:
+        return ""
+    payload = json.dumps([[_get(m, "role"), " ".join(str(_get(m, "content") or "").lower().split())] for m in recent])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+_chat_hasher = MinHasher(num_perm=32, seed=2)
+
+
+def chat_signature(chat_history: Any) -> Tuple[int, ...]:
+    """MinHash of the student turns among the last CONTEXT_CHAT_MESSAGES messages; () without any."""
+    features = set()
+    for message in list(chat_history or [])[-CONTEXT_CHAT_MESSAGES:]:
+        if _get(message, "role") == "student":
+            features |= utterance_features(str(_get(message, "content") or ""))
+    return _chat_hasher.signature(features) if features else ()
+
+
+def is_follow_up(utterance: str) -> bool:
+    """Whether an utterance only makes sense with the conversation before it."""
+    tokens = _WORD_RE.findall((utterance or "").lower())
+    content = [token for token in tokens if token not in _STOPWORDS]
+    return not content or any(token in _REFERRING_WORDS for token in tokens)
+
+
+def context_from_request(course_context: Optional[str], ist_history: Any = None, student_profile: Any = None,
+                         chat_history: Any = None, program: str = "", utterance: Optional[str] = None) -> CacheContext:
+    """
+    Build a CacheContext from request fields (pydantic models or plain dicts).
+    Recent skills come from the most recent IST event, which is what the
+    prompt leans on for continuity. `program` identifies what would answer
+    the request; entries are only reused by requests with the same one.
+    With chat history, an `utterance` that is a follow-up is keyed on the
+    exact recent messages.
+    """
+    profile_skills: List[str] = []
+    if student_profile:
+        profile_skills = list(_get(student_profile, "strong_skills") or []) + list(_get(student_profile, "weak_skills") or [])
+    recent_skills: List[str] = []
+    if ist_history:
+        recent_skills = list(_get(ist_history[0], "skills") or [])
+    return CacheContext(
+        course_context=" ".join((course_context or "").lower().split()),
+        profile_skills=tuple(profile_skills),
+        recent_skills=tuple(recent_skills),
+        program=program,
+        chat_digest=chat_digest(chat_history),
+        chat_signature=chat_signature(chat_history),
+        follow_up=bool(chat_history) and utterance is not None and is_follow_up(utterance),
+    )
+
+
+# ---------------------------------------------------------------------
+# Cache
+# ---------------------------------------------------------------------
+
+@dataclass
+class _Entry:
+    signature: Tuple[int, ...]
+    context: CacheContext
+    result: Dict[str, Any]
+    stored_at: float
+
+
+@dataclass
+class CacheHit:
+    result: Dict[str, Any]
+    similarity: float
+
+
+@dataclass
+class _CourseIndex:
+    entries: "OrderedDict[int, _Entry]" = field(default_factory=OrderedDict)
+    buckets: List[Dict[Tuple[int, ...], set]] = field(default_factory=list)
+
+
+class SemanticISTCache:
+    """
+    Per-course MinHash/LSH index of recent IST results.
+
+    With `bands` bands of `num_perm // bands` rows, a pair with true Jaccard
+    s becomes a candidate with probability 1 - (1 - s^rows)^bands; the
+    defaults (16 x 4) make that ~0.99 at s=0.7 and ~0.34 at s=0.4.
+
+    Features are lexical, so close-but-different topics ("insert into a
+    BST" / "delete from a BST") can score ~0.6; the default threshold leans
+    towards precision. Tune it per deployment with the evaluation tool.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.7,
+        context_threshold: float = 0.5,
+        chat_threshold: float = 0.25,
+        per_course_capacity: int = 2000,
+        max_courses: int = 64,
+        ttl_s: float = 86_400.0,
+        num_perm: int = 64,
+        bands: int = 16,
+        clock=time.time,
+    ) -> None:
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.context_threshold = context_threshold
+        self.chat_threshold = chat_threshold
+        self.per_course_capacity = max(1, int(per_course_capacity))
+        self.max_courses = max(1, int(max_courses))
+        self.ttl_s = ttl_s
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._courses: "OrderedDict[str, _CourseIndex]" = OrderedDict()
+        self._next_id = 0
+        self._stats = {"lookups": 0, "hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+    @classmethod
+    def from_env(cls) -> Optional["SemanticISTCache"]:
+        """Cache configured from IST_SEMANTIC_CACHE_* env vars, or None when disabled."""
+        if os.getenv("IST_SEMANTIC_CACHE", "0").strip().lower() not in ("1", "true", "yes"):
+            return None
+        cache = cls(
+            threshold=float(os.getenv("IST_SEMANTIC_CACHE_THRESHOLD", "0.7")),
+            context_threshold=float(os.getenv("IST_SEMANTIC_CACHE_CONTEXT_THRESHOLD", "0.5")),
+            chat_threshold=float(os.getenv("IST_SEMANTIC_CACHE_CHAT_THRESHOLD", "0.25")),
+            per_course_capacity=int(os.getenv("IST_SEMANTIC_CACHE_PER_COURSE", "2000")),
+            max_courses=int(os.getenv("IST_SEMANTIC_CACHE_MAX_COURSES", "64")),
+            ttl_s=float(os.getenv("IST_SEMANTIC_CACHE_TTL_S", "86400")),
+        )
+        print(f"[IST][CACHE] Semantic cache enabled (threshold {cache.threshold})")
+        return cache
+
+    def _band_keys(self, signature: Tuple[int, ...]) -> List[Tuple[int, ...]]:
+        return [signature[i * self.rows:(i + 1) * self.rows] for i in range(self.bands)]
+
+    def _remove(self, index: _CourseIndex, entry_id: int) -> None:
+        entry = index.entries.pop(entry_id)
+        for band, key in enumerate(self._band_keys(entry.signature)):
+            bucket = index.buckets[band].get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del index.buckets[band][key]
+
+    def lookup(self, course_id: Optional[str], utterance: str, context: CacheContext) -> Optional[CacheHit]:
+        """Best stored result for a similar utterance with a compatible context, if any."""
+        signature = self.hasher.signature(utterance_features(utterance))
+        now = self._clock()
+        with self._lock:
+            self._stats["lookups"] += 1
+            index = self._courses.get(course_id or "")
+            best: Optional[Tuple[float, int]] = None
+            if index is not None:
+                candidates = set()
+                for band, key in enumerate(self._band_keys(signature)):
+                    candidates.update(index.buckets[band].get(key, ()))
+                for entry_id in candidates:
+                    entry = index.entries[entry_id]
+                    if self.ttl_s > 0 and now - entry.stored_at > self.ttl_s:
+                        self._remove(index, entry_id)
+                        self._stats["expired"] += 1
+                        continue
+                    similarity = self.hasher.similarity(signature, entry.signature)
+                    if similarity < self.threshold or not context.compatible_with(
+                            entry.context, self.context_threshold, self.chat_threshold):
+                        continue
+                    if best is None or similarity > best[0]:
+                        best = (similarity, entry_id)
+
+            if best is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            index.entries.move_to_end(best[1])
+            result = index.entries[best[1]].result
+            return CacheHit(
+                result={"intent": result["intent"], "skills": list(result["skills"]), "trajectory": list(result["trajectory"])},
+                similarity=best[0],
+            )
+
+    def store(self, course_id: Optional[str], utterance: str, context: CacheContext, result: Dict[str, Any]) -> bool:
+        """Index `result` for future lookups. Fallback results are skipped."""
+        if not isinstance(result, dict) or is_fallback_result(result):
+            return False
+        signature = self.hasher.signature(utterance_features(utterance))
+        entry = _Entry(
+            signature=signature,
+            context=context,
+            result={"intent": result.get("intent", ""), "skills": list(result.get("skills") or []),
+                    "trajectory": list(result.get("trajectory") or [])},
+            stored_at=self._clock(),
+        )
+        key = course_id or ""
+        with self._lock:
+            index = self._courses.get(key)
+            if index is None:
+                index = self._courses[key] = _CourseIndex(buckets=[{} for _ in range(self.bands)])
+                while len(self._courses) > self.max_courses:
+                    _, dropped = self._courses.popitem(last=False)
+                    self._stats["evictions"] += len(dropped.entries)
+            else:
+                self._courses.move_to_end(key)
+
+            entry_id = self._next_id
+            self._next_id += 1
+            index.entries[entry_id] = entry
+            for band, band_key in enumerate(self._band_keys(signature)):
+                index.buckets[band].setdefault(band_key, set()).add(entry_id)
+            while len(index.entries) > self.per_course_capacity:
+                self._remove(index, next(iter(index.entries)))
+                self._stats["evictions"] += 1
+            self._stats["stores"] += 1
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._courses.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["lookups"]
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "threshold": self.threshold,
+                "entries": {course or "(none)": len(index.entries) for course, index in self._courses.items()},
+            }
+
+
+# ---------------------------------------------------------------------
+# Offline evaluation on captured traffic
+# ---------------------------------------------------------------------
+
+def _eval_samples(records: Iterable[dict]) -> List[dict]:
+    samples = []
+    for record in records:
+        request, response = record.get("request"), record.get("response")
+        if record.get("status") != 200 or not isinstance(request, dict) or not isinstance(response, dict):
+            continue
+        if not request.get("utterance") or not isinstance(response.get("skills"), list):
+            continue
+        samples.append({
+            "course_id": resolve_course_id(request.get("course_id"), request.get("course_context")),
+            "utterance": request["utterance"],
+            "context": context_from_request(
+                request.get("course_context"), request.get("ist_history"), request.get("student_profile"),
+                request.get("chat_history"),
+                # Offline there is no program object: the recorded selectors stand in for it.
+                "/".join(str(request.get(k) or "") for k in ("pipeline", "output_mode", "trajectory_source")),
+                request["utterance"],
+            ),
+            "result": response,
+        })
+    return samples
+
+
+def interchangeable(a: dict, b: dict, agreement: float = 0.5) -> bool:
+    """Whether two IST results are close enough that serving one for the other is acceptable."""
+    return (
+        skill_set_jaccard(a.get("skills"), b.get("skills")) >= agreement
+        and skill_set_jaccard(a.get("trajectory"), b.get("trajectory")) >= agreement / 2
+    )
+
+
+def evaluate(records: Iterable[dict], thresholds: Sequence[float], agreement: float = 0.5,
+             context_threshold: float = 0.5) -> List[dict]:
+    """
+    Replay captured requests, in order, through a fresh cache per threshold.
+
+    A hit is correct when the served result is interchangeable with the one
+    the model actually returned. Recall is measured against requests for
+    which *some* earlier request in the same course, with a compatible
+    context, had an interchangeable result (i.e. a perfect cache could have
+    served it).
+    """
+    samples = _eval_samples(records)
+
+    servable = 0
+    for i, sample in enumerate(samples):
+        for earlier in samples[:i]:
+            if (earlier["course_id"] == sample["course_id"]
+                    and sample["context"].compatible_with(earlier["context"], context_threshold)
+                    and interchangeable(earlier["result"], sample["result"], agreement)):
+                servable += 1
+                break
+
+    rows = []
+    for threshold in thresholds:
+        cache = SemanticISTCache(threshold=threshold, context_threshold=context_threshold,
+                                 per_course_capacity=max(1, len(samples)), ttl_s=0)
+        hits = correct = 0
+        for sample in samples:
+            hit = cache.lookup(sample["course_id"], sample["utterance"], sample["context"])
+            if hit is not None:
+                hits += 1
+                correct += int(interchangeable(hit.result, sample["result"], agreement))
+            else:
+                cache.store(sample["course_id"], sample["utterance"], sample["context"], sample["result"])
+        rows.append({
+            "threshold": threshold,
+            "requests": len(samples),
+            "hits": hits,
+            "hit_rate": round(hits / len(samples), 4) if samples else 0.0,
+            "precision": round(correct / hits, 4) if hits else 1.0,
+            "recall": round(correct / servable, 4) if servable else 0.0,
+            "servable": servable,
+        })
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from traffic_capture import iter_capture_records
+
+    parser = argparse.ArgumentParser(description="Evaluate semantic IST cache thresholds on captured traffic.")
+    parser.add_argument("captures", nargs="+", help="Capture files or directories")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.4, 0.5, 0.6, 0.7, 0.8])
+    parser.add_argument("--agreement", type=float, default=0.5,
+                        help="Minimum skill-set Jaccard for two results to count as interchangeable")
+    parser.add_argument("--context-threshold", type=float, default=0.5)
+    parser.add_argument("--json", action="store_true", help="Print raw JSON rows")
+    args = parser.parse_args(argv)
+
+    rows = evaluate(iter_capture_records(args.captures), args.thresholds, args.agreement, args.context_threshold)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return 0
+
+    print(f"{'threshold':>9} {'requests':>9} {'hits':>6} {'hit rate':>9} {'precision':>10} {'recall':>7}")
+    for row in rows:
+        print(f"{row['threshold']:>9} {row['requests']:>9} {row['hits']:>6} {row['hit_rate']:>9} "
+              f"{row['precision']:>10} {row['recall']:>7}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
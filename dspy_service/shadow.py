@@ -0,0 +1,276 @@
+"""
+Shadow traffic: mirror a fraction of live IST requests to a candidate model
+or program variant and compare the answers, without touching the primary
+response.
+
+The endpoint hands a sampled request to ShadowRunner.submit() as a
+background task, i.e. after the response has been sent. submit() only
+enqueues; the candidate runs on the runner's own BackgroundPool
+(background_pool.py), so shadow work is dropped first under load. Shadow LM
+calls run outside the request's
+accounting scope, so they are never charged to the student's course or
+token budget.
+
+Each comparison records both results, latencies and token counts and the
+agreement between them: intent category via _validate_intent, exact intent,
+and skill-set / trajectory Jaccard. Aggregates are served under "shadow" in
+GET /api/metrics; with IST_SHADOW_LOG every comparison is also appended to
+a JSONL file for offline analysis.
+
+Environment variables:
+  - IST_SHADOW_RATE: fraction of LM-computed requests to mirror (default 0 = off)
+  - IST_SHADOW_MODEL: candidate model id, a copy of the configured LM (same credentials)
+  - IST_SHADOW_PIPELINE / IST_SHADOW_OUTPUT_MODE: candidate program variant
+  - IST_SHADOW_PROGRAM: candidate program saved with module.save() (monolithic json_string)
+  - IST_SHADOW_WORKERS: shadow threads (default 2)
+  - IST_SHADOW_QUEUE: jobs waiting for a shadow thread before new ones are dropped (default 16)
+  - IST_SHADOW_MAX_PRIMARY_INFLIGHT: drop shadow work while this many primary requests run (default 8)
+  - IST_SHADOW_LOG: JSONL file for per-request comparisons
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Optional
+
+import dspy
+
+from background_pool import BackgroundPool, LazyModelLM
+from latency_stats import summarize_latencies
+from lm_accounting import count_lm_calls
+
+
+class Candidate:
+    """
+    The shadow side: the service's program for the request (optionally another
+    pipeline / output mode) or a saved program, run on the configured LM or a
+    copy of it with another model id.
+    """
+
+    def __init__(self, model: Optional[str] = None, pipeline: Optional[str] = None,
+                 output_mode: Optional[str] = None, program_path: Optional[str] = None) -> None:
+        self.model = model
+        self.pipeline = pipeline
+        self.output_mode = output_mode
+        self.program_path = program_path
+        self._program = None
+        self._lm = LazyModelLM(model)
+        self._lock = threading.Lock()
+
+    def label(self) -> str:
+        parts = [f"model={self.model}" if self.model else None,
+                 f"pipeline={self.pipeline}" if self.pipeline else None,
+                 f"output_mode={self.output_mode}" if self.output_mode else None,
+                 f"program={Path(self.program_path).name}" if self.program_path else None]
+        return ", ".join(part for part in parts if part) or "primary"
+
+    def _resolve(self):
+        lm = self._lm.get()
+        with self._lock:
+            if self.program_path and self._program is None:
+                from dspy_flows import IntentSkillTrajectoryModule
+
+                program = IntentSkillTrajectoryModule()
+                program.load(self.program_path)
+                self._program = program
+        return lm, self._program
+
+    def __call__(self, inputs: dict) -> dict:
+        from dspy_flows import get_ist_program
+
+        lm, program = self._resolve()
+        if program is None:
+            program = get_ist_program(inputs.get("course_id"), self.pipeline, self.output_mode)
+        with dspy.context(lm=lm) if lm is not None else contextlib.nullcontext():
+            return program(**inputs)
+
+
+def _mean(values) -> Optional[float]:
+    values = list(values)
+    return round(sum(values) / len(values), 4) if values else None
+
+
+class ShadowRunner:
+    """Bounded, droppable pool that runs the candidate and compares it with the primary."""
+
+    def __init__(
+        self,
+        candidate: Callable[[dict], dict],
+        rate: float,
+        workers: int = 2,
+        max_queue: int = 16,
+        max_primary_inflight: int = 8,
+        log_path: Optional[str | os.PathLike] = None,
+        label: Optional[str] = None,
+        window: int = 1000,
+    ) -> None:
+        self.candidate = candidate
+        self.rate = max(0.0, min(1.0, rate))
+        self.label = label or getattr(candidate, "label", lambda: "candidate")()
+        self._lock = threading.Lock()
+        self._counts = {"sampled": 0, "completed": 0, "errors": 0}
+        self._comparisons: deque = deque(maxlen=window)
+        self._log = None
+        if log_path:
+            Path(log_path).parent.mkdir(parents=True, exist_ok=True)
+            self._log = open(log_path, "a", encoding="utf-8")
+        self._pool = BackgroundPool(self._run, "ist-shadow", workers=workers, max_queue=max_queue,
+                                    max_primary_inflight=max_primary_inflight)
+
+    @classmethod
+    def from_env(cls) -> Optional["ShadowRunner"]:
+        rate = float(os.getenv("IST_SHADOW_RATE", "0") or 0)
+        candidate = Candidate(
+            model=os.getenv("IST_SHADOW_MODEL", "").strip() or None,
+            pipeline=os.getenv("IST_SHADOW_PIPELINE", "").strip() or None,
+            output_mode=os.getenv("IST_SHADOW_OUTPUT_MODE", "").strip() or None,
+            program_path=os.getenv("IST_SHADOW_PROGRAM", "").strip() or None,
+        )
+        if rate <= 0:
+            return None
+        if candidate.label() == "primary":
+            print("[SHADOW] ⚠️ IST_SHADOW_RATE is set but no candidate (IST_SHADOW_MODEL/PIPELINE/OUTPUT_MODE/PROGRAM); shadow mode off")
+            return None
+        print(f"[SHADOW] Mirroring {rate:.1%} of IST requests to {candidate.label()}")
+        return cls(
+            candidate,
+            rate=rate,
+            workers=int(os.getenv("IST_SHADOW_WORKERS", "2")),
+            max_queue=int(os.getenv("IST_SHADOW_QUEUE", "16")),
+            max_primary_inflight=int(os.getenv("IST_SHADOW_MAX_PRIMARY_INFLIGHT", "8")),
+            log_path=os.getenv("IST_SHADOW_LOG", "").strip() or None,
+        )
+
+    # ------------------------------------------------------------------
+    # Request path
+    # ------------------------------------------------------------------
+
+    def primary(self) -> contextlib.AbstractContextManager:
+        """Wrap primary IST work so shadow jobs can back off while it runs."""
+        return self._pool.primary()
+
+    def submit(self, inputs: dict, primary_result: dict, primary_latency_ms: float,
+               primary_usage: Optional[dict] = None) -> bool:
+        """Maybe mirror a request (after its response went out). Never blocks; False when not queued."""
+        if self._pool.closed or random.random() >= self.rate:
+            return False
+        with self._lock:
+            self._counts["sampled"] += 1
+        return self._pool.submit((inputs, primary_result, primary_latency_ms, primary_usage or {}, time.time()))
+
+    # ------------------------------------------------------------------
+    # Shadow pool
+    # ------------------------------------------------------------------
+
+    def _run(self, inputs: dict, primary_result: dict, primary_latency_ms: float,
+             primary_usage: dict, submitted_at: float) -> None:
+        started = time.perf_counter()
+        try:
+            with count_lm_calls() as counter:
+                shadow_result = self.candidate(inputs)
+        except Exception as e:
+            print(f"[SHADOW] ⚠️ Candidate failed: {type(e).__name__}: {e}")
+            with self._lock:
+                self._counts["errors"] += 1
+            return
+        shadow_latency_ms = (time.perf_counter() - started) * 1000
+        comparison = compare(primary_result, shadow_result, inputs.get("course_context") or "")
+        record = {
+            "ts": submitted_at,
+            "candidate": self.label,
+            "course_id": inputs.get("course_id"),
+            "utterance": inputs.get("utterance"),
+            "primary": {
+                "result": primary_result,
+                "latency_ms": round(primary_latency_ms, 1),
+                "prompt_tokens": primary_usage.get("prompt_tokens", 0),
+                "completion_tokens": primary_usage.get("completion_tokens", 0),
+            },
+            "shadow": {
+                "result": {key: shadow_result.get(key) for key in ("intent", "skills", "trajectory")},
+                "latency_ms": round(shadow_latency_ms, 1),
+                "prompt_tokens": counter.prompt_tokens,
+                "completion_tokens": counter.completion_tokens,
+                "lm_calls": counter.calls,
+            },
+            **comparison,
+        }
+        with self._lock:
+            self._counts["completed"] += 1
+            self._comparisons.append(record)
+            if self._log is not None:
+                self._log.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                self._log.flush()
+
+    def drain(self, timeout_s: float = 10.0) -> bool:
+        """Wait until queued shadow jobs have finished (tests, shutdown)."""
+        return self._pool.drain(timeout_s)
+
+    def close(self, timeout_s: float = 5.0) -> None:
+        """Stop accepting work, let queued jobs finish (up to timeout_s) and stop the threads."""
+        self._pool.close(timeout_s)
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+            comparisons = list(self._comparisons)
+        primary_tokens = [c["primary"]["prompt_tokens"] + c["primary"]["completion_tokens"] for c in comparisons]
+        shadow_tokens = [c["shadow"]["prompt_tokens"] + c["shadow"]["completion_tokens"] for c in comparisons]
+        return {
+            "candidate": self.label,
+            "rate": self.rate,
+            **counts,
+            **self._pool.stats(),
+            "compared": len(comparisons),
+            "agreement": {
+                "intent_category": _mean(float(c["intent_category_agreement"]) for c in comparisons),
+                "intent_exact": _mean(float(c["intent_exact"]) for c in comparisons),
+                "mean_skills_jaccard": _mean(c["skills_jaccard"] for c in comparisons),
+                "mean_trajectory_jaccard": _mean(c["trajectory_jaccard"] for c in comparisons),
+            },
+            "latency_ms": {
+                "primary": summarize_latencies([c["primary"]["latency_ms"] for c in comparisons]),
+                "shadow": summarize_latencies([c["shadow"]["latency_ms"] for c in comparisons]),
+            },
+            "tokens_per_request": {"primary": _mean(primary_tokens), "shadow": _mean(shadow_tokens)},
+            "fallback_rate": {
+                "primary": _mean(float(c["primary_fallback"]) for c in comparisons),
+                "shadow": _mean(float(c["shadow_fallback"]) for c in comparisons),
+            },
+        }
+
+
+_intent_classifier = None
+
+
+def compare(primary: dict, shadow: dict, course_context: str = "") -> dict:
+    """Agreement between two IST results (intent category via _validate_intent, Jaccard of skills/steps)."""
+    global _intent_classifier
+    from dspy_flows import IntentSkillTrajectoryModule, is_fallback_result, skill_set_jaccard
+
+    if _intent_classifier is None:
+        _intent_classifier = IntentSkillTrajectoryModule()
+    primary_intent = str(primary.get("intent", ""))
+    shadow_intent = str(shadow.get("intent", ""))
+    return {
+        "intent_category_agreement": (
+            _intent_classifier._validate_intent(primary_intent, course_context)
+            == _intent_classifier._validate_intent(shadow_intent, course_context)
+        ),
+        "intent_exact": primary_intent.strip() == shadow_intent.strip(),
+        "skills_jaccard": round(skill_set_jaccard(primary.get("skills", []), shadow.get("skills", [])), 4),
+        "trajectory_jaccard": round(skill_set_jaccard(primary.get("trajectory", []), shadow.get("trajectory", [])), 4),
+        "primary_fallback": is_fallback_result(primary),
+        "shadow_fallback": is_fallback_result(shadow),
+    }
@@ -0,0 +1,709 @@
+"""
+Cross-worker shared cache for IST results and DSPy LM calls.
+
+In-process caches are duplicated per uvicorn worker and lost on every
+deploy. This tier lives outside the process so every worker on a host (and
+the next deploy) shares it:
+
+  - SQLiteStore: one SQLite file in WAL mode (concurrent readers, one writer
+    at a time across processes), size-bounded with approximate-LRU eviction
+    and per-entry TTL. The default backend.
+  - RespStore: any Redis-protocol server (RESP2). TTL is per entry (SET EX);
+    size eviction is the server's maxmemory policy. local_resp_server.py is
+    a stand-in for tests and local runs.
+
+On top of a store:
+  - SharedISTCache: final IST results keyed by a hash of the request inputs
+    and versioned by `program_fingerprint()` (signature instructions, fields,
+    demos, model, adapter), so a prompt change never serves old results.
+  - LMCacheTier: plugged in as DSPy's on-disk LM-call cache layer (behind
+    its in-memory LRU). warm() preloads the most recently used entries into
+    that in-memory layer at startup so a restarted worker starts warm.
+  - LMCallCache: configures DSPy's LM-call cache explicitly at startup: a
+    bounded in-memory LRU in front of an LMCacheTier (the shared store, or a
+    dedicated SQLite file under IST_LM_CACHE_DIR) whose namespace is
+    "lm:<fingerprint of the service's programs>". Entries written under an
+    older prompt, model or adapter are never read again; purge() deletes them.
+
+Values are pickled (LM responses) or JSON (IST results); only point the
+cache at a store the service alone writes to.
+
+Environment variables:
+  - SHARED_CACHE_URL: sqlite:///path/to/cache.db or redis://host:port/db (unset = disabled)
+  - SHARED_CACHE_MAX_BYTES: SQLite size limit before LRU eviction (default 512 MB)
+  - SHARED_CACHE_IST_TTL_S: IST result lifetime (default 7 days)
+  - SHARED_CACHE_LM: route DSPy LM-call caching through the store (default 1)
+  - SHARED_CACHE_LM_TTL_S: LM-call entry lifetime (default 30 days)
+  - SHARED_CACHE_WARM_ENTRIES: LM entries preloaded into memory at startup (default 1000)
+  - IST_LM_CACHE_DIR: directory of a dedicated LM-call cache when SHARED_CACHE_URL is unset
+    (unset too = DSPy's default cache, unmanaged)
+  - IST_LM_CACHE_MAX_BYTES: size limit of that cache before LRU eviction (default 512 MB)
+  - IST_LM_CACHE_TTL_S: its entry lifetime (default 30 days)
+  - IST_LM_CACHE_MEMORY_ENTRIES: in-memory LRU entries in front of either store (default 10000)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import dspy
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_IST_TTL_S = 7 * 86_400.0
+DEFAULT_LM_TTL_S = 30 * 86_400.0
+DEFAULT_LM_MEMORY_ENTRIES = 10_000
+LM_NAMESPACE = "lm"
+# Bump when the layout of cached values changes.
+CACHE_FORMAT_VERSION = 1
+
+
+# ---------------------------------------------------------------------
+# Stores
+# ---------------------------------------------------------------------
+
+class SQLiteStore:
+    """
+    Key/value store in one SQLite file (WAL mode), shared by every process
+    that opens the same path.
+
+    Entries carry a namespace, an optional expiry and an access time. Once
+    the total value size passes `max_bytes`, expired entries and then the
+    least recently used ones are deleted down to 90% of the limit. Access
+    times are refreshed at most every `touch_interval_s` so reads rarely
+    write.
+    """
+
+    def __init__(self, path: str | os.PathLike, max_bytes: int = DEFAULT_MAX_BYTES,
+                 touch_interval_s: float = 60.0, clock: Callable[[], float] = time.time) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.touch_interval_s = touch_interval_s
+        self._clock = clock
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {"evictions": 0, "expired": 0}
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    namespace TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL,
+                    accessed_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at);
+                CREATE INDEX IF NOT EXISTS entries_namespace ON entries (namespace, accessed_at);
+                CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+                INSERT OR IGNORE INTO meta (name, value) VALUES ('total_bytes', 0);
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        conn = self._connect()
+        row = conn.execute("SELECT value, expires_at, accessed_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at, accessed_at = row
+        now = self._clock()
+        if expires_at is not None and expires_at <= now:
+            self._delete_where("key = ?", (key,))
+            with self._lock:
+                self._stats["expired"] += 1
+            return None
+        if now - accessed_at >= self.touch_interval_s:
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return bytes(value)
+
+    def set(self, key: str, value: bytes, ttl_s: Optional[float] = None, namespace: str = "") -> None:
+        now = self._clock()
+        expires_at = now + ttl_s if ttl_s else None
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            old = conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, namespace, value, size, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, namespace, sqlite3.Binary(value), len(value), expires_at, now),
+            )
+            conn.execute("UPDATE meta SET value = value + ? WHERE name = 'total_bytes'",
+                         (len(value) - (old[0] if old else 0),))
+            total = conn.execute("SELECT value FROM meta WHERE name = 'total_bytes'").fetchone()[0]
+            if total > self.max_bytes:
+                self._evict(conn, now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        """Drop expired entries, then LRU ones, down to 90% of max_bytes (inside the caller's transaction)."""
+        expired = conn.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)).rowcount
+        target = int(self.max_bytes * 0.9)
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        evicted = 0
+        while total > target:
+            rows = conn.execute("SELECT key, size FROM entries ORDER BY accessed_at LIMIT 256").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if total <= target:
+                    break
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+        conn.execute("UPDATE meta SET value = ? WHERE name = 'total_bytes'", (total,))
+        with self._lock:
+            self._stats["expired"] += expired
+            self._stats["evictions"] += evicted
+
+    def _delete_where(self, where: str, params: tuple) -> int:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            deleted = conn.execute(f"DELETE FROM entries WHERE {where}", params).rowcount
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            conn.execute("UPDATE meta SET value = ? WHERE name = 'total_bytes'", (total,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return deleted
+
+    def delete(self, key: str) -> None:
+        self._delete_where("key = ?", (key,))
+
+    def delete_namespace(self, namespace: str) -> int:
+        return self._delete_where("namespace = ?", (namespace,))
+
+    def recent(self, namespace: str, limit: int) -> List[Tuple[str, bytes]]:
+        """Most recently used live entries of a namespace (for warm start)."""
+        rows = self._connect().execute(
+            "SELECT key, value FROM entries WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?) "
+            "ORDER BY accessed_at DESC LIMIT ?",
+            (namespace, self._clock(), limit),
+        ).fetchall()
+        return [(key, bytes(value)) for key, value in rows]
+
+    def namespaces(self) -> Dict[str, dict]:
+        rows = self._connect().execute(
+            "SELECT namespace, COUNT(*), SUM(size), MAX(accessed_at) FROM entries GROUP BY namespace"
+        ).fetchall()
+        return {ns: {"entries": n, "bytes": size or 0, "last_used": last} for ns, n, size, last in rows}
+
+    def clear(self) -> None:
+        self._delete_where("1 = 1", ())
+
+    def stats(self) -> dict:
+        conn = self._connect()
+        entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        with self._lock:
+            return {"backend": "sqlite", "path": str(self.path), "entries": entries, "bytes": total,
+                    "max_bytes": self.max_bytes, **self._stats}
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RespError(Exception):
+    """Error reply from a Redis-protocol server."""
+
+
+class RespStore:
+    """
+    Key/value store on a Redis-protocol (RESP2) server, one connection per
+    thread. Keys are prefixed with `prefix`; namespaces are key prefixes.
+    Size-based eviction is left to the server (e.g. maxmemory with
+    allkeys-lru); recent() is unsupported, so LM warm start is skipped.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, db: int = 0,
+                 prefix: str = "dspy:", timeout_s: float = 2.0) -> None:
+        self.host, self.port, self.db = host, port, db
+        self.prefix = prefix
+        self.timeout_s = timeout_s
+        self._local = threading.local()
+
+    @classmethod
+    def from_url(cls, url: str) -> "RespStore":
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        return cls(parsed.hostname or "127.0.0.1", parsed.port or 6379, db)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout_s)
+            conn = (sock, sock.makefile("rb"))
+            self._local.conn = conn
+            if self.db:
+                self._command("SELECT", str(self.db))
+        return conn
+
+    def _command(self, *args) -> Any:
+        sock, reader = self._connection()
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        try:
+            sock.sendall(b"".join(parts))
+            return self._read_reply(reader)
+        except (OSError, ConnectionError):
+            self.close()
+            raise
+
+    def _read_reply(self, reader) -> Any:
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("RESP server closed the connection")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise RespError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(body)
+            return None if count < 0 else [self._read_reply(reader) for _ in range(count)]
+        raise RespError(f"Unexpected RESP reply: {line!r}")
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._command("GET", self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl_s: Optional[float] = None, namespace: str = "") -> None:
+        if ttl_s:
+            self._command("SET", self.prefix + key, value, "PX", str(max(1, int(ttl_s * 1000))))
+        else:
+            self._command("SET", self.prefix + key, value)
+
+    def delete(self, key: str) -> None:
+        self._command("DEL", self.prefix + key)
+
+    def delete_namespace(self, namespace: str) -> int:
+        # "lm:*" also matches "lm:<fingerprint>:*"; keep only keys whose namespace is exactly this one.
+        keys = [key for key in self._command("KEYS", f"{self.prefix}{namespace}:*") or []
+                if key.decode()[len(self.prefix):].rsplit(":", 1)[0] == namespace]
+        return self._command("DEL", *keys) if keys else 0
+
+    def recent(self, namespace: str, limit: int) -> List[Tuple[str, bytes]]:
+        return []
+
+    def namespaces(self) -> Dict[str, dict]:
+        counts: Dict[str, dict] = {}
+        for key in self._command("KEYS", f"{self.prefix}*") or []:
+            namespace = key.decode()[len(self.prefix):].rsplit(":", 1)[0]
+            counts.setdefault(namespace, {"entries": 0})["entries"] += 1
+        return counts
+
+    def clear(self) -> None:
+        keys = self._command("KEYS", f"{self.prefix}*") or []
+        if keys:
+            self._command("DEL", *keys)
+
+    def stats(self) -> dict:
+        return {"backend": "resp", "url": f"redis://{self.host}:{self.port}/{self.db}",
+                "entries": self._command("DBSIZE")}
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            for part in reversed(conn):
+                try:
+                    part.close()
+                except OSError:
+                    pass
+            self._local.conn = None
+
+
+def open_store(url: str, max_bytes: int = DEFAULT_MAX_BYTES):
+    """Store for a SHARED_CACHE_URL (sqlite:///path or redis://host:port/db)."""
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///"):], max_bytes=max_bytes)
+    if url.startswith(("redis://", "resp://")):
+        return RespStore.from_url(url)
+    raise ValueError(f"Unsupported SHARED_CACHE_URL {url!r} (use sqlite:///path or redis://host:port/db)")
+
+
+# ---------------------------------------------------------------------
+# Program fingerprint
+# ---------------------------------------------------------------------
+
+def program_fingerprint(program, lm=None, adapter=None) -> str:
+    """
+    Short hash of everything that shapes a program's prompts and parsing:
+    module class and output mode, each predictor's signature instructions,
+    fields (name, description, type) and demos, the LM model id (both tiers
+    for the cascade module), the skill graph versions for the graph-trajectory
+    module and the adapter. Any change produces a new fingerprint.
+    """
+    lm = lm if lm is not None else dspy.settings.lm
+    adapter = adapter if adapter is not None else dspy.settings.adapter
+    parts: Dict[str, Any] = {
+        "format": CACHE_FORMAT_VERSION,
+        "program": f"{type(program).__module__}.{type(program).__qualname__}",
+        "output_mode": getattr(program, "OUTPUT_MODE", None),
+        "model": getattr(lm, "model", None),
+        "adapter": type(adapter).__name__ if adapter is not None else None,
+    }
+    cascade_models = getattr(program, "cascade_models", None)
+    if callable(cascade_models):
+        parts["cascade_models"] = list(cascade_models())
+    skill_graph_versions = getattr(program, "skill_graph_versions", None)
+    if callable(skill_graph_versions):
+        parts["skill_graphs"] = skill_graph_versions()
+    if isinstance(program, dspy.Module):
+        predictors = []
+        for name, predictor in program.named_predictors():
+            signature = predictor.signature
+            fields = [
+                (field_name, field.json_schema_extra.get("desc") if field.json_schema_extra else None, str(field.annotation))
+                for field_name, field in {**signature.input_fields, **signature.output_fields}.items()
+            ]
+            demos = [dict(demo) if hasattr(demo, "keys") else demo for demo in predictor.demos]
+            predictors.append({"name": name, "instructions": signature.instructions, "fields": fields, "demos": demos})
+        parts["predictors"] = predictors
+    else:
+        parts["callable"] = getattr(program, "__qualname__", repr(type(program)))
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+_fingerprint_lock = threading.Lock()
+_fingerprints: Dict[int, Tuple[Any, str]] = {}
+
+
+def cached_program_fingerprint(program) -> str:
+    """program_fingerprint() with the configured LM and adapter, memoized per program object."""
+    with _fingerprint_lock:
+        cached = _fingerprints.get(id(program))
+        if cached is not None and cached[0] is program:
+            return cached[1]
+    value = program_fingerprint(program)
+    with _fingerprint_lock:
+        if len(_fingerprints) > 256:
+            _fingerprints.clear()
+        _fingerprints[id(program)] = (program, value)
+    return value
+
+
+# ---------------------------------------------------------------------
+# IST results
+# ---------------------------------------------------------------------
+
+def _jsonable(value) -> Any:
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if isinstance(value, list):
+        return [_jsonable(v) for v in value]
+    return value
+
+
+class SharedISTCache:
+    """Exact-match IST result cache in a shared store, versioned by program fingerprint."""
+
+    def __init__(self, store, ttl_s: float = DEFAULT_IST_TTL_S) -> None:
+        self.store = store
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "hits": 0, "stores": 0, "errors": 0}
+
+    def fingerprint(self, program) -> str:
+        return cached_program_fingerprint(program)
+
+    def key(self, fingerprint: str, course_id: Optional[str], inputs: Dict[str, Any]) -> Tuple[str, str]:
+        """(namespace, key) for a request; the namespace is the program version."""
+        payload = json.dumps({k: _jsonable(v) for k, v in inputs.items()}, sort_keys=True, default=str)
+        digest = hashlib.sha256(f"{course_id or ''}\0{payload}".encode("utf-8")).hexdigest()
+        namespace = f"ist:{fingerprint}"
+        return namespace, f"{namespace}:{digest}"
+
+    def lookup(self, program, course_id: Optional[str], inputs: Dict[str, Any]) -> Optional[dict]:
+        _, key = self.key(self.fingerprint(program), course_id, inputs)
+        with self._lock:
+            self._stats["lookups"] += 1
+        try:
+            raw = self.store.get(key)
+        except Exception as e:
+            self._error("lookup", e)
+            return None
+        if raw is None:
+            return None
+        with self._lock:
+            self._stats["hits"] += 1
+        return json.loads(raw)
+
+    def store_result(self, program, course_id: Optional[str], inputs: Dict[str, Any], result: dict) -> None:
+        namespace, key = self.key(self.fingerprint(program), course_id, inputs)
+        try:
+            self.store.set(key, json.dumps(result).encode("utf-8"), ttl_s=self.ttl_s, namespace=namespace)
+        except Exception as e:
+            self._error("store", e)
+            return
+        with self._lock:
+            self._stats["stores"] += 1
+
+    def _error(self, action: str, error: Exception) -> None:
+        with self._lock:
+            self._stats["errors"] += 1
+        print(f"[CACHE] ⚠️ Shared IST cache {action} failed: {type(error).__name__}: {error}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else 0.0
+        return stats
+
+
+# ---------------------------------------------------------------------
+# DSPy LM calls
+# ---------------------------------------------------------------------
+
+class LMCacheTier:
+    """
+    Stand-in for DSPy's diskcache layer (`dspy.cache.disk_cache`): the same
+    get/set/delete/contains interface, backed by the shared store under
+    `namespace`. Store errors are treated as misses.
+    """
+
+    def __init__(self, store, namespace: str = LM_NAMESPACE, ttl_s: float = DEFAULT_LM_TTL_S) -> None:
+        self.store = store
+        self.namespace = namespace
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "errors": 0, "warmed": 0}
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def get(self, key: str, default=None):
+        try:
+            raw = self.store.get(self._key(key))
+        except Exception:
+            raw = None
+            with self._lock:
+                self._stats["errors"] += 1
+        with self._lock:
+            self._stats["hits" if raw is not None else "misses"] += 1
+        return pickle.loads(raw) if raw is not None else default
+
+    def set(self, key: str, value) -> bool:
+        try:
+            self.store.set(self._key(key), pickle.dumps(value), ttl_s=self.ttl_s, namespace=self.namespace)
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+            return False
+        with self._lock:
+            self._stats["stores"] += 1
+        return True
+
+    def __setitem__(self, key: str, value) -> None:
+        self.set(key, value)
+
+    def __contains__(self, key: str) -> bool:
+        try:
+            return self.store.get(self._key(key)) is not None
+        except Exception:
+            return False
+
+    def delete(self, key: str) -> None:
+        try:
+            self.store.delete(self._key(key))
+        except Exception:
+            pass
+
+    def warm(self, cache, limit: int) -> int:
+        """Copy the `limit` most recently used entries into `cache`'s in-memory layer."""
+        if limit <= 0 or not getattr(cache, "enable_memory_cache", False):
+            return 0
+        prefix = f"{self.namespace}:"
+        loaded = 0
+        for key, raw in self.store.recent(self.namespace, limit):
+            try:
+                value = pickle.loads(raw)
+            except Exception:
+                continue
+            with cache._lock:
+                cache.memory_cache[key[len(prefix):]] = value
+            loaded += 1
+        with self._lock:
+            self._stats["warmed"] += loaded
+        return loaded
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats, namespace=self.namespace)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+def install_lm_cache_tier(tier: LMCacheTier, cache=None, warm_entries: int = 0) -> int:
+    """Use `tier` as DSPy's on-disk LM cache layer; returns the number of warmed entries."""
+    cache = cache if cache is not None else dspy.cache
+    cache.disk_cache = tier
+    cache.enable_disk_cache = True
+    return tier.warm(cache, warm_entries)
+
+
+class LMCallCache:
+    """
+    DSPy's LM-call cache, configured and versioned by the service.
+
+    install() rebuilds dspy.cache with an in-memory LRU of `memory_entries`,
+    plugs `tier` in as its on-disk layer under the namespace
+    "lm:<fingerprint>" and warms it. A deploy with the same programs, model
+    and adapter reuses the previous entries; any change starts a new
+    namespace, and the old ones stay until purge().
+    """
+
+    def __init__(self, tier: LMCacheTier, memory_entries: int = DEFAULT_LM_MEMORY_ENTRIES,
+                 warm_entries: int = 1000, owns_store: bool = False) -> None:
+        self.tier = tier
+        self.memory_entries = memory_entries
+        self.warm_entries = warm_entries
+        self.fingerprint: Optional[str] = None
+        self._owns_store = owns_store
+        self._lock = threading.Lock()
+        self._stats = {"warmed": 0, "purged_namespaces": 0, "purged_entries": 0}
+
+    @classmethod
+    def from_env(cls, shared: Optional["SharedCache"] = None) -> Optional["LMCallCache"]:
+        """The shared store's LM tier when there is one, else a SQLite cache in IST_LM_CACHE_DIR, else None."""
+        memory_entries = int(os.getenv("IST_LM_CACHE_MEMORY_ENTRIES", str(DEFAULT_LM_MEMORY_ENTRIES)))
+        warm_entries = int(os.getenv("SHARED_CACHE_WARM_ENTRIES", "1000"))
+        if shared is not None and shared.lm is not None:
+            return cls(shared.lm, memory_entries, warm_entries)
+        directory = os.getenv("IST_LM_CACHE_DIR", "").strip()
+        if not directory:
+            return None
+        store = SQLiteStore(Path(directory) / "lm_calls.db",
+                            max_bytes=int(os.getenv("IST_LM_CACHE_MAX_BYTES", str(DEFAULT_MAX_BYTES))))
+        tier = LMCacheTier(store, ttl_s=float(os.getenv("IST_LM_CACHE_TTL_S", str(DEFAULT_LM_TTL_S))))
+        return cls(tier, memory_entries, warm_entries, owns_store=True)
+
+    @property
+    def namespace(self) -> str:
+        return self.tier.namespace
+
+    def install(self, fingerprint: str, cache=None) -> int:
+        """Version the tier by `fingerprint` and make it DSPy's LM cache; returns entries warmed."""
+        self.fingerprint = fingerprint
+        self.tier.namespace = f"{LM_NAMESPACE}:{fingerprint}"
+        if cache is None:
+            dspy.configure_cache(enable_disk_cache=False, enable_memory_cache=True,
+                                 memory_max_entries=self.memory_entries)
+            cache = dspy.cache
+        warmed = install_lm_cache_tier(self.tier, cache=cache, warm_entries=self.warm_entries)
+        with self._lock:
+            self._stats["warmed"] += warmed
+        return warmed
+
+    def namespaces(self) -> Dict[str, dict]:
+        """LM-call namespaces in the store ("lm" holds entries from before versioning)."""
+        return {
+            namespace: dict(info, current=namespace == self.namespace)
+            for namespace, info in self.tier.store.namespaces().items()
+            if namespace == LM_NAMESPACE or namespace.startswith(f"{LM_NAMESPACE}:")
+        }
+
+    def purge(self, older_than_s: Optional[float] = None) -> Dict[str, int]:
+        """
+        Delete every LM-call namespace but the current one; with older_than_s,
+        only those last used longer ago than that (stores that do not track
+        use, i.e. Redis, keep theirs). Returns entries deleted per namespace.
+        """
+        now = time.time()
+        deleted: Dict[str, int] = {}
+        for namespace, info in self.namespaces().items():
+            if info["current"]:
+                continue
+            if older_than_s is not None and (info.get("last_used") is None or now - info["last_used"] < older_than_s):
+                continue
+            deleted[namespace] = self.tier.store.delete_namespace(namespace)
+        with self._lock:
+            self._stats["purged_namespaces"] += len(deleted)
+            self._stats["purged_entries"] += sum(deleted.values())
+        print(f"[CACHE] Purged {sum(deleted.values())} LM-call entries from {len(deleted)} old namespace(s)")
+        return deleted
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(fingerprint=self.fingerprint, memory_entries=self.memory_entries, tier=self.tier.stats())
+        if self._owns_store:
+            try:
+                stats["store"] = self.tier.store.stats()
+            except Exception as e:
+                stats["store"] = {"error": f"{type(e).__name__}: {e}"}
+        return stats
+
+    def close(self) -> None:
+        if self._owns_store:
+            self.tier.store.close()
+
+
+# ---------------------------------------------------------------------
+# Wiring
+# ---------------------------------------------------------------------
+
+class SharedCache:
+    """The configured store plus its IST result cache and (optional) LM tier, installed through LMCallCache."""
+
+    def __init__(self, store, ist_ttl_s: float = DEFAULT_IST_TTL_S, lm_tier: Optional[LMCacheTier] = None) -> None:
+        self.store = store
+        self.ist = SharedISTCache(store, ttl_s=ist_ttl_s)
+        self.lm = lm_tier
+
+    @classmethod
+    def from_env(cls) -> Optional["SharedCache"]:
+        url = os.getenv("SHARED_CACHE_URL", "").strip()
+        if not url:
+            return None
+        store = open_store(url, max_bytes=int(os.getenv("SHARED_CACHE_MAX_BYTES", str(DEFAULT_MAX_BYTES))))
+        lm_tier = None
+        if os.getenv("SHARED_CACHE_LM", "1").strip().lower() not in ("0", "false", "no"):
+            lm_tier = LMCacheTier(store, ttl_s=float(os.getenv("SHARED_CACHE_LM_TTL_S", str(DEFAULT_LM_TTL_S))))
+        return cls(store, ist_ttl_s=float(os.getenv("SHARED_CACHE_IST_TTL_S", str(DEFAULT_IST_TTL_S))), lm_tier=lm_tier)
+
+    def stats(self) -> dict:
+        try:
+            store = self.store.stats()
+        except Exception as e:
+            store = {"error": f"{type(e).__name__}: {e}"}
+        return {"store": store, "ist": self.ist.stats(), "lm": self.lm.stats() if self.lm is not None else None}
+
+    def close(self) -> None:
+        self.store.close()
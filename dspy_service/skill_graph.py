@@ -0,0 +1,343 @@
+"""
+Per-course prerequisite skill graphs for deterministic IST trajectories.
+
+With trajectory_source=graph the LM only writes the intent and the skills;
+the 4-5 step trajectory is computed here from the course's prerequisite DAG,
+the identified skills and the skills the student has already mastered. That
+removes the longest part of the generated output and gives every student
+with the same gaps the same steps.
+
+Graph files live at <graph_dir>/<course_id>.json:
+
+    {
+      "skills": [
+        {"name": "Functions", "step": "Write and call functions with parameters"},
+        {"name": "Call stack", "requires": ["Functions"]},
+        {"name": "Recursion", "requires": ["Functions", "Call stack"],
+         "aliases": ["recursive functions"], "step": "Trace a recursive factorial by hand"}
+      ]
+    }
+
+`requires` lists direct prerequisites (skills must be declared, in any order);
+`step` is the trajectory text for the skill (default "Study <name>"). All
+files are loaded at startup; topological order and the transitive closure
+(ancestor and descendant bitsets) are precomputed, so a trajectory is a few
+set operations and a bounded walk over the graph.
+
+Environment variables (read by dspy_flows.initialize_ist_extractor):
+  - IST_SKILL_GRAPH_DIR: directory of per-course graph files (graph trajectories are off when unset)
+  - IST_TRAJECTORY_SOURCE: "llm" (default) or "graph" for requests that do not choose
+
+Check graph files and preview a trajectory from the command line:
+    python skill_graph.py check ./skill_graphs
+    python skill_graph.py plan ./skill_graphs cs101 "Recursion,Linked lists" --mastered "Functions"
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from latency_stats import summarize_latencies
+
+TRAJECTORY_MIN_STEPS = 4  # the "4-5 actionable learning steps" of the IST signatures
+TRAJECTORY_MAX_STEPS = 5
+
+_KEY_RE = re.compile(r"[a-z0-9+#]+")
+
+
+def skill_key(name: str) -> str:
+    """Case- and punctuation-insensitive key used to match skill names."""
+    return " ".join(_KEY_RE.findall(str(name).lower()))
+
+
+class SkillGraph:
+    """
+    One course's prerequisite DAG with precomputed topological order and
+    transitive closure. Raises ValueError for unknown prerequisites,
+    duplicate names or cycles.
+    """
+
+    def __init__(self, skills: List[dict], course_id: str = "") -> None:
+        self.course_id = course_id
+        declared = []
+        for entry in skills:
+            if isinstance(entry, str):
+                entry = {"name": entry}
+            name = str(entry.get("name") or "").strip()
+            if not name:
+                raise ValueError(f"skill without a name: {entry!r}")
+            declared.append((name, entry))
+
+        index_of: Dict[str, int] = {}
+        for i, (name, _) in enumerate(declared):
+            if skill_key(name) in index_of:
+                raise ValueError(f"duplicate skill {name!r}")
+            index_of[skill_key(name)] = i
+
+        parents: List[List[int]] = []
+        for name, entry in declared:
+            ids = []
+            for required in entry.get("requires") or []:
+                parent = index_of.get(skill_key(required))
+                if parent is None:
+                    raise ValueError(f"skill {name!r} requires unknown skill {required!r}")
+                ids.append(parent)
+            parents.append(ids)
+
+        # Kahn's algorithm; ties keep file order so the output is stable.
+        children: List[List[int]] = [[] for _ in declared]
+        indegree = [len(ids) for ids in parents]
+        for child, ids in enumerate(parents):
+            for parent in ids:
+                children[parent].append(child)
+        ready = deque(i for i, degree in enumerate(indegree) if degree == 0)
+        order = []
+        while ready:
+            node = ready.popleft()
+            order.append(node)
+            for child in children[node]:
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    ready.append(child)
+        if len(order) != len(declared):
+            cyclic = sorted(declared[i][0] for i, degree in enumerate(indegree) if degree > 0)
+            raise ValueError(f"prerequisite cycle among {', '.join(cyclic)}")
+
+        # Renumber nodes in topological order so bit i sorts before bit j when i < j.
+        position = {node: rank for rank, node in enumerate(order)}
+        self.names = [declared[node][0] for node in order]
+        self.steps = [str(declared[node][1].get("step") or f"Study {declared[node][0]}") for node in order]
+        self.parents = [[position[p] for p in parents[node]] for node in order]
+        self.ancestors = [0] * len(order)
+        for node in range(len(order)):
+            for parent in self.parents[node]:
+                self.ancestors[node] |= self.ancestors[parent] | (1 << parent)
+        self.descendants = [0] * len(order)
+        for node in reversed(range(len(order))):
+            for parent in self.parents[node]:
+                self.descendants[parent] |= self.descendants[node] | (1 << node)
+
+        self._keys: Dict[str, int] = {}
+        for rank, node in enumerate(order):
+            for alias in [declared[node][0], *(declared[node][1].get("aliases") or [])]:
+                self._keys.setdefault(skill_key(alias), rank)
+        # Longest keys first, so "binary search trees" wins over "trees" in containment matches.
+        self._keys_by_length = sorted(self._keys.items(), key=lambda item: -len(item[0]))
+        self.version = hashlib.sha256(
+            json.dumps([self.names, self.steps, self.parents, sorted(self._keys.items())]).encode("utf-8")
+        ).hexdigest()[:12]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def match(self, skill: str) -> Optional[int]:
+        """
+        Graph node for a free-text skill: exact name/alias, else whole-word
+        containment either way. Single words only match exactly, so "Hash
+        functions" does not land on "Functions".
+        """
+        key = skill_key(skill)
+        if not key:
+            return None
+        if key in self._keys:
+            return self._keys[key]
+        padded = f" {key} "
+        multiword = " " in key
+        for candidate, node in self._keys_by_length:
+            if (" " in candidate and f" {candidate} " in padded) or (multiword and padded in f" {candidate} "):
+                return node
+        return None
+
+    def _mask(self, skills: Iterable[str]) -> int:
+        mask = 0
+        for skill in skills or []:
+            node = self.match(skill)
+            if node is not None:
+                mask |= 1 << node
+        return mask
+
+    def plan(self, skills: Iterable[str], mastered: Iterable[str] = (),
+             max_steps: int = TRAJECTORY_MAX_STEPS, min_steps: int = TRAJECTORY_MIN_STEPS) -> List[int]:
+        """
+        Nodes of the trajectory, in topological order: the identified skills
+        and their unmastered prerequisites (mastering a skill implies its
+        prerequisites), nearest to the identified skills first when there are
+        more than `max_steps`. Short plans are topped up with the unmastered
+        skills that build directly on the identified ones. Empty when no
+        skill matches the graph.
+        """
+        targets = self._mask(skills)
+        if not targets:
+            return []
+        mastered_mask = 0
+        for node in _bits(self._mask(mastered)):
+            mastered_mask |= self.ancestors[node] | (1 << node)
+
+        needed = targets
+        for node in _bits(targets):
+            needed |= self.ancestors[node]
+        needed &= ~mastered_mask
+
+        chosen = list(_bits(needed))
+        if len(chosen) > max_steps:
+            # Breadth-first from the targets over prerequisite edges: closest gaps first.
+            distance = {node: 0 for node in _bits(targets)}
+            queue = deque(distance)
+            while queue:
+                node = queue.popleft()
+                for parent in self.parents[node]:
+                    if parent not in distance:
+                        distance[parent] = distance[node] + 1
+                        queue.append(parent)
+            chosen = sorted(sorted(chosen, key=lambda node: (distance.get(node, 0), -node))[:max_steps])
+        elif len(chosen) < min_steps:
+            follow_ons = 0
+            for node in _bits(targets):
+                follow_ons |= self.descendants[node]
+            follow_ons &= ~(mastered_mask | needed)
+            # In prerequisite order, each one only once its direct prerequisites are covered.
+            covered = mastered_mask | needed
+            for node in _bits(follow_ons):
+                if len(chosen) >= min_steps:
+                    break
+                if all((covered >> parent) & 1 for parent in self.parents[node]):
+                    chosen.append(node)
+                    covered |= 1 << node
+            chosen.sort()
+        return chosen
+
+    def trajectory(self, skills: Iterable[str], mastered: Iterable[str] = (),
+                   max_steps: int = TRAJECTORY_MAX_STEPS, min_steps: int = TRAJECTORY_MIN_STEPS) -> List[str]:
+        """Step texts for plan(); empty when no skill matches the graph."""
+        return [self.steps[node] for node in self.plan(skills, mastered, max_steps, min_steps)]
+
+    def skill_names(self) -> List[str]:
+        return list(self.names)
+
+    @classmethod
+    def load(cls, path: str | os.PathLike, course_id: Optional[str] = None) -> "SkillGraph":
+        path = Path(path)
+        with open(path, "r", encoding="utf-8") as handle:
+            data = json.load(handle)
+        skills = data.get("skills") if isinstance(data, dict) else data
+        if not isinstance(skills, list):
+            raise ValueError(f"{path}: expected a 'skills' list")
+        return cls(skills, course_id=course_id or path.stem)
+
+
+def _bits(mask: int):
+    """Set bit positions of `mask`, ascending."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class SkillGraphRegistry:
+    """
+    All course graphs under `graph_dir`, loaded once at startup. Files that
+    fail to load are reported and skipped so one bad graph does not take the
+    service down. Also counts graph trajectories, misses (no identified
+    skill in the graph) and trajectory compute time; served under
+    "skill_graph" in /api/metrics.
+    """
+
+    def __init__(self, graph_dir: str | os.PathLike, window: int = 1000) -> None:
+        self.graph_dir = Path(graph_dir)
+        self._lock = threading.Lock()
+        self._graphs: Dict[str, SkillGraph] = {}
+        self._errors: Dict[str, str] = {}
+        self._compute_us: deque = deque(maxlen=window)
+        self._stats = {"trajectories": 0, "misses": 0}
+        self.load_all()
+
+    @classmethod
+    def from_env(cls) -> Optional["SkillGraphRegistry"]:
+        graph_dir = os.getenv("IST_SKILL_GRAPH_DIR", "").strip()
+        if not graph_dir:
+            return None
+        return cls(graph_dir)
+
+    def load_all(self) -> None:
+        graphs, errors = {}, {}
+        for path in sorted(self.graph_dir.glob("*.json")):
+            try:
+                graphs[path.stem] = SkillGraph.load(path)
+            except (OSError, ValueError) as e:
+                errors[path.stem] = f"{type(e).__name__}: {e}"
+                print(f"[IST] ⚠️ Skipping skill graph {path}: {type(e).__name__}: {e}")
+        with self._lock:
+            self._graphs, self._errors = graphs, errors
+
+    def get(self, course_id: Optional[str]) -> Optional[SkillGraph]:
+        if not course_id:
+            return None
+        return self._graphs.get(re.sub(r"[^A-Za-z0-9_.-]", "_", course_id))
+
+    def versions(self) -> Dict[str, str]:
+        """course_id -> graph content hash, for the shared cache's program fingerprint."""
+        return {course_id: graph.version for course_id, graph in sorted(self._graphs.items())}
+
+    def trajectory(self, course_id: Optional[str], skills: List[str], mastered: Iterable[str] = ()) -> List[str]:
+        """The course graph's trajectory for `skills` ([] when there is no graph or no match)."""
+        graph = self.get(course_id)
+        if graph is None:
+            return []
+        started = time.perf_counter()
+        steps = graph.trajectory(skills, mastered)
+        elapsed_us = (time.perf_counter() - started) * 1e6
+        with self._lock:
+            self._stats["trajectories" if steps else "misses"] += 1
+            self._compute_us.append(elapsed_us)
+        return steps
+
+    def stats(self) -> dict:
+        with self._lock:
+            compute_us = list(self._compute_us)
+            stats = dict(self._stats)
+            courses = {course_id: len(graph) for course_id, graph in sorted(self._graphs.items())}
+            errors = dict(self._errors)
+        return {**stats, "courses": courses, "load_errors": errors, "compute_us": summarize_latencies(compute_us)}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check per-course skill graphs and preview trajectories.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    check = sub.add_parser("check", help="Load every graph file and report sizes or errors")
+    check.add_argument("graph_dir")
+    plan = sub.add_parser("plan", help="Print the graph trajectory for a list of skills")
+    plan.add_argument("graph_dir")
+    plan.add_argument("course_id")
+    plan.add_argument("skills", help="Comma-separated identified skills")
+    plan.add_argument("--mastered", default="", help="Comma-separated skills the student has mastered")
+    args = parser.parse_args(argv)
+
+    registry = SkillGraphRegistry(args.graph_dir)
+    if args.command == "check":
+        stats = registry.stats()
+        print(json.dumps({"courses": stats["courses"], "load_errors": stats["load_errors"],
+                          "versions": registry.versions()}, indent=2))
+        return 1 if stats["load_errors"] else 0
+
+    graph = registry.get(args.course_id)
+    if graph is None:
+        print(f"No skill graph for course {args.course_id!r} in {args.graph_dir}", file=sys.stderr)
+        return 1
+    split = lambda text: [part.strip() for part in text.split(",") if part.strip()]  # noqa: E731
+    for node in graph.plan(split(args.skills), split(args.mastered)):
+        print(f"- {graph.names[node]}: {graph.steps[node]}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
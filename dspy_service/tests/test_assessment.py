@@ -0,0 +1,177 @@
+"""
+Tests for batched personalized assessments (assessment.py and
+/api/assessment/batch): student summaries from IST events, the cached course
+digest, resumable runs and the progress report.
+"""
+
+import contextlib
+import io
+import time
+
+import pytest
+
+import app as app_module
+from assessment import (
+    AssessmentProgram,
+    AssessmentRunConflict,
+    AssessmentRunner,
+    AssessmentStore,
+    StudentActivity,
+    collect_activity,
+)
+from event_sink import EventSink, make_event
+from lm_accounting import AccountingLM, LMAccountant, TokenBudgetExceeded, get_accountant
+
+CONTENT = "Week 4: recursion. A recursive function calls itself on smaller inputs until it reaches a base case."
+
+
+def _event(intent, skills, trajectory=(), ts=None):
+    event = {"intent": intent, "skills": list(skills), "trajectory": list(trajectory)}
+    if ts is not None:
+        event["ts"] = ts
+    return event
+
+
+def _batch(run_id="run-1", students=("u1", "u2", "u3"), **overrides):
+    batch = {
+        "run_id": run_id,
+        "course_id": "cs101",
+        "course_content": CONTENT,
+        "learning_objectives": "Write recursive functions with correct base cases.",
+        "students": [{"user_id": user_id, "ist_events": [_event(f"{user_id} asks about recursion", ["Recursion"])]}
+                     for user_id in students],
+    }
+    batch.update(overrides)
+    return batch
+
+
+class FakeProgram(AssessmentProgram):
+    def __init__(self, fail_once=()):
+        super().__init__()
+        self.digests = 0
+        self.assessed = []
+        self.fail_once = set(fail_once)
+
+    def course_digest(self, course_content, learning_objectives):
+        self.digests += 1
+        return "Objective 1: recursion, base cases."
+
+    def forward(self, course_digest, learning_objectives, student_activity):
+        user = student_activity.split(" asks")[0].rsplit("- ", 1)[-1]
+        self.assessed.append(user)
+        if user in self.fail_once:
+            self.fail_once.discard(user)
+            raise RuntimeError("LM down")
+        return {"assessment": f"{user} understands recursion.", "suggested_areas_for_improvement": "Base cases."}
+
+
+@pytest.fixture
+def runner(tmp_path):
+    made = []
+
+    def make(program=None, **kwargs):
+        made.append(AssessmentRunner(AssessmentStore(tmp_path / "assessments.db"), rpm=0,
+                                     program=program or FakeProgram(), **kwargs))
+        return made[-1]
+
+    yield make
+    for instance in made:
+        instance.close()
+
+
+@pytest.mark.unit
+class TestStudentActivity:
+    def test_summary_from_events(self):
+        activity = StudentActivity()
+        for i in range(8):
+            skills = ["Recursion", "Base cases"] if i % 2 else ["Loops"]
+            activity.add(_event(f"Question {i}", skills, ["Trace factorial", "Write a base case"], ts=1_760_000_000 + i * 86_400))
+        summary = activity.summary(learning_path="Weeks 1-4")
+        assert summary.startswith("Learning path: Weeks 1-4\n8 tutoring questions between 2025-10-09 and 2025-10-16.")
+        assert "Most frequent skills: Loops (4), Recursion (4), Base cases (4)" in summary
+        assert "Question 2" not in summary and "Question 7" in summary
+        assert summary.endswith("Open learning steps: Trace factorial; Write a base case")
+        assert StudentActivity().summary() == "No tutoring questions recorded in this period."
+
+    def test_collects_from_the_event_sink_in_one_pass(self, tmp_path):
+        sink = EventSink(tmp_path / "events")
+        for user_id, course_id in (("u1", "cs101"), ("u2", "cs101"), ("u1", "cs999"), ("u3", "cs101")):
+            sink.record(make_event({"intent": "q", "skills": ["Recursion"]}, utterance="q", course_id=course_id,
+                                   user_id=user_id))
+        sink.close()
+        students = [{"user_id": "u1"}, {"user_id": "u2", "ist_events": [_event("inline", ["Loops"])] * 2}]
+        activity = collect_activity(students, "cs101", tmp_path / "events")
+        assert (activity["u1"].events, activity["u2"].events) == (1, 2)
+        assert "u3" not in activity
+
+
+@pytest.mark.unit
+class TestRunner:
+    def test_digest_is_computed_once_and_reused_across_runs(self, runner):
+        program = FakeProgram()
+        r = runner(program)
+        report = r.run(_batch())
+        assert (report["status"], report["done"], report["remaining"]) == ("done", 3, 0)
+        assert report["digest_cached"]
+        r.run(_batch(run_id="run-2", students=("u4",)))
+        assert program.digests == 1
+        assert r.stats()["digest_hits"] == 1
+        results = r.report("run-1", include_results=True)["results"]
+        assert [row["assessment"] for row in results] == [f"u{i} understands recursion." for i in (1, 2, 3)]
+
+    def test_resume_retries_only_failed_students(self, runner):
+        program = FakeProgram(fail_once={"u2"})
+        r = runner(program)
+        report = r.run(_batch())
+        assert (report["status"], report["done"], report["failed"]) == ("done_with_errors", 2, 1)
+        report = r.run(_batch())
+        assert (report["status"], report["done"], report["failed"]) == ("done", 3, 0)
+        assert sorted(program.assessed) == ["u1", "u2", "u2", "u3"]
+
+    def test_run_id_of_a_different_batch_is_rejected(self, runner):
+        r = runner()
+        r.run(_batch())
+        with pytest.raises(AssessmentRunConflict):
+            r.run(_batch(students=("u1",)))
+
+    def test_token_budget_failures_are_recorded(self, runner, monkeypatch):
+        def over_budget(course_id, user_id):
+            raise TokenBudgetExceeded(f"user:{user_id}", 100, 100, 60)
+
+        r = runner()
+        monkeypatch.setattr(get_accountant(), "check_budget", over_budget)
+        report = r.run(_batch(students=("u1",)))
+        assert report["failed"] == 1
+        assert r.report("run-1", include_results=True)["results"][0]["error"].startswith("TokenBudgetExceeded")
+
+
+@pytest.mark.integration
+class TestAssessmentBatch:
+    def test_one_digest_call_plus_one_call_per_student(self, lm_server, runner):
+        lm = AccountingLM("openai/local-ist", api_base=lm_server.base_url, api_key="local", cache=False,
+                          accountant=LMAccountant())
+        r = runner(AssessmentProgram(), workers=3, lm=lm)
+        with contextlib.redirect_stdout(io.StringIO()):
+            report = r.run(_batch())
+        rows = r.report("run-1", include_results=True)["results"]
+        assert report["status"] == "done"
+        assert all(row["assessment"] and row["lm_calls"] == 1 for row in rows)
+
+    def test_endpoint_runs_in_the_background(self, client, runner, monkeypatch):
+        monkeypatch.setattr(app_module, "assessment_runner", runner())
+        response = client.post("/api/assessment/batch", json=_batch())
+        assert response.status_code == 202
+        assert response.json()["run_id"] == "run-1"
+        deadline = time.monotonic() + 5
+        while (report := client.get("/api/assessment/batch/run-1").json())["status"] == "running":
+            assert time.monotonic() < deadline
+            time.sleep(0.02)
+        assert (report["status"], report["done"], report["total"]) == ("done", 3, 3)
+        results = client.get("/api/assessment/batch/run-1", params={"results": True}).json()["results"]
+        assert results[0]["suggested_areas_for_improvement"] == "Base cases."
+        assert client.post("/api/assessment/batch", json=_batch(students=("u9",))).status_code == 409
+        assert client.get("/api/assessment/batch/nope").status_code == 404
+
+    def test_disabled_without_a_database(self, client, monkeypatch):
+        monkeypatch.setattr(app_module, "assessment_runner", None)
+        assert client.post("/api/assessment/batch", json=_batch()).status_code == 404
@@ -0,0 +1,222 @@
+"""
+Tests for the offline IST backfill (backfill.py): streaming sources,
+resumable checkpointing, the rate limit and the worker pools.
+"""
+
+import io
+import json
+import time
+
+import pytest
+
+import backfill
+from backfill import Checkpoint, RateLimiter, iter_items, iter_source, main, run_backfill
+from event_sink import EventSink, compact, make_event
+
+
+def _events(count, start=0):
+    return [
+        {
+            "id": str(i), "createdAt": "2025-01-01T00:00:00Z", "userId": f"u{i % 3}", "courseId": "cs101",
+            "utterance": f"question {i}", "courseContext": "Course: cs101",
+            "intent": "old intent", "skills": ["Old"], "trajectory": ["Old step"],
+        }
+        for i in range(start, start + count)
+    ]
+
+
+def _write_array(path, events):
+    path.write_text(json.dumps(events, indent=2), encoding="utf-8")
+    return path
+
+
+def _fake_extract(item):
+    if "boom" in item["utterance"]:
+        raise RuntimeError("extraction failed")
+    return {"intent": f"new {item['utterance']}", "skills": ["A", "B"], "trajectory": ["1"],
+            "fallback": False, "lm_calls": 1, "latency_ms": 1.0}
+
+
+def _run(sources, output, **kwargs):
+    kwargs.setdefault("extract", _fake_extract)
+    return run_backfill([str(s) for s in sources], output, progress_stream=io.StringIO(),
+                        progress_interval_s=0, **kwargs)
+
+
+def _records(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+@pytest.mark.unit
+class TestSources:
+    def test_json_array_is_streamed_across_chunks(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(backfill, "CHUNK_SIZE", 64)
+        path = _write_array(tmp_path / "events.json", _events(50))
+        utterances = [event["utterance"] for event in iter_source(path)]
+        assert utterances == [f"question {i}" for i in range(50)]
+
+    def test_wrapped_array_and_jsonl(self, tmp_path):
+        wrapped = tmp_path / "export.json"
+        wrapped.write_text(json.dumps({"data": {"istEvents": _events(3)}}), encoding="utf-8")
+        jsonl = tmp_path / "events.jsonl"
+        jsonl.write_text("\n".join(json.dumps(e) for e in _events(3)) + '\n{"utter', encoding="utf-8")
+        assert len(list(iter_source(wrapped))) == 3
+        assert len(list(iter_source(jsonl))) == 3
+
+    def test_event_sink_directory(self, tmp_path):
+        sink = EventSink(tmp_path / "segments", start=False)
+        sink.record(make_event({"intent": "i", "skills": [], "trajectory": []}, utterance="q",
+                               course_id="cs102", user_id="u1"))
+        sink.close()
+        (index, item), = iter_items([tmp_path / "segments"])
+        assert (index, item["course_id"], item["user_id"]) == (0, "cs102", "u1")
+
+    def test_items_are_normalized_and_indexed_across_sources(self, tmp_path):
+        first = _write_array(tmp_path / "a.json", _events(2) + [{"id": "x", "utterance": ""}])
+        second = _write_array(tmp_path / "b.json", _events(1, start=10))
+        items = list(iter_items([first, second]))
+        assert [index for index, _ in items] == [0, 1, 2, 3]
+        assert items[2][1] is None
+        assert items[3][1]["id"] == "10"
+        assert items[0][1]["previous"] == {"intent": "old intent", "skills": ["Old"], "trajectory": ["Old step"]}
+        assert items[0][1]["course_context"] == "Course: cs101"
+
+
+@pytest.mark.unit
+class TestRateLimiter:
+    def test_acquire_waits_for_tokens_and_debit_borrows(self):
+        now = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        limiter = RateLimiter(60, burst=1, clock=lambda: now[0], sleep=sleep)
+        limiter.acquire()
+        limiter.acquire()
+        assert sum(sleeps) == pytest.approx(1.0)
+        limiter.debit(2)
+        limiter.acquire()
+        assert sum(sleeps) == pytest.approx(4.0)
+
+    def test_zero_rate_is_unlimited(self):
+        limiter = RateLimiter(0, sleep=lambda s: pytest.fail("should not sleep"))
+        for _ in range(100):
+            limiter.acquire()
+
+
+@pytest.mark.unit
+class TestBackfill:
+    def test_results_are_written_with_previous_values(self, tmp_path):
+        source = _write_array(tmp_path / "events.json", _events(10))
+        summary = _run([source], tmp_path / "out.jsonl", workers=3)
+        records = _records(tmp_path / "out.jsonl")
+        assert summary["submitted"] == summary["written"] == 10
+        assert sorted(r["index"] for r in records) == list(range(10))
+        first = next(r for r in records if r["index"] == 0)
+        assert first["intent"] == "new question 0"
+        assert first["previous"]["intent"] == "old intent"
+        assert (first["course_id"], first["user_id"]) == ("cs101", "u0")
+        assert json.loads((tmp_path / "out.jsonl.checkpoint.json").read_text())["watermark"] == 10
+
+    def test_interrupted_run_resumes_where_it_stopped(self, tmp_path):
+        source = _write_array(tmp_path / "events.json", _events(20))
+        output = tmp_path / "out.jsonl"
+        _run([source], output, limit=8)
+        with open(output, "a", encoding="utf-8") as handle:
+            handle.write('{"index": 8, "intent": "half')  # killed mid-write
+        seen = []
+
+        def extract(item):
+            seen.append(item["index"])
+            return _fake_extract(item)
+
+        summary = _run([source], output, extract=extract)
+        assert sorted(seen) == list(range(8, 20))
+        assert summary["skipped_done"] == 8
+        assert sorted(r["index"] for r in _records(output)) == list(range(20))
+
+    def test_resume_without_checkpoint_file_uses_output(self, tmp_path):
+        source = _write_array(tmp_path / "events.json", _events(6))
+        output = tmp_path / "out.jsonl"
+        _run([source], output, limit=4)
+        (tmp_path / "out.jsonl.checkpoint.json").unlink()
+        assert _run([source], output)["submitted"] == 2
+
+    def test_errors_are_recorded_and_retried_on_resume(self, tmp_path):
+        events = _events(4)
+        events[2]["utterance"] = "boom"
+        source = _write_array(tmp_path / "events.json", events)
+        output = tmp_path / "out.jsonl"
+        first = _run([source], output)
+        assert first["errors"] == 1
+        assert any("error" in r for r in _records(output))
+        retried = _run([source], output, extract=lambda item: _fake_extract(dict(item, utterance="ok")))
+        assert (retried["submitted"], retried["errors"], retried["watermark"]) == (1, 0, 4)
+
+    def test_event_sink_resume_survives_compaction(self, tmp_path):
+        segments = tmp_path / "segments"
+        now = time.time()
+        sink = EventSink(segments, start=False)
+        for batch, age in ((0, 3600), (1, 0)):
+            for i in range(3):
+                event = make_event({"intent": "i"}, utterance=f"question {batch}-{i}", course_id="cs101")
+                event["ts"] = now - age
+                sink.record(event)
+        sink.close()
+        output = tmp_path / "out.jsonl"
+        seen = []
+
+        def extract(item):
+            seen.append(item["utterance"])
+            return _fake_extract(item)
+
+        _run([segments], output, extract=extract, limit=4)
+        assert compact(segments, retention_s=60, now=now)["expired"] == 3
+        live = EventSink(segments, start=False)
+        live.record(make_event({"intent": "i"}, utterance="question 2-0", course_id="cs101"))
+        live.flush()  # still .active: not read until sealed
+        _run([segments], output, extract=extract)
+        assert sorted(seen) == ["question 0-0", "question 0-1", "question 0-2",
+                                "question 1-0", "question 1-1", "question 1-2"]
+        live.close()
+        _run([segments], output, extract=extract)
+        assert seen.count("question 2-0") == 1
+        assert len(seen) == len(set(seen)) == 7
+
+    def test_other_sources_need_restart(self, tmp_path):
+        source = _write_array(tmp_path / "a.json", _events(2))
+        other = _write_array(tmp_path / "b.json", _events(2))
+        output = tmp_path / "out.jsonl"
+        _run([source], output)
+        with pytest.raises(SystemExit):
+            Checkpoint.load(output, [str(other)])
+        assert _run([other], output, restart=True)["submitted"] == 2
+        assert len(_records(output)) == 2
+
+    def test_progress_reports_throughput_and_eta(self, tmp_path):
+        source = _write_array(tmp_path / "events.json", _events(5))
+        stream = io.StringIO()
+        run_backfill([str(source)], tmp_path / "out.jsonl", extract=_fake_extract,
+                     progress_stream=stream, progress_interval_s=0)
+        lines = [line for line in stream.getvalue().splitlines() if "ev/s" in line]
+        assert lines[-1].startswith("[BACKFILL] 5/5 (100.0%)")
+        assert "ETA" in lines[-1]
+
+    def test_process_pool(self, tmp_path):
+        source = _write_array(tmp_path / "events.json", _events(6))
+        summary = _run([source], tmp_path / "out.jsonl", executor="process", workers=2)
+        assert summary["written"] == 6
+
+
+@pytest.mark.integration
+def test_cli_uses_service_program(tmp_path, capsys):
+    source = _write_array(tmp_path / "events.json", _events(3))
+    output = tmp_path / "out.jsonl"
+    assert main([str(source), "--output", str(output), "--workers", "2", "--progress-interval", "0"]) == 0
+    summary = json.loads(capsys.readouterr().out)
+    assert summary["written"] == 3
+    record = _records(output)[0]
+    assert record["skills"] == ["Skill A", "Skill B"]
+    assert record["fallback"] is False
@@ -0,0 +1,155 @@
+"""
+Tests for the cheap-model-first cascade (dspy_flows.CascadeISTModule):
+acceptance checks, escalation on parse failure or low confidence, stats and
+pipeline routing.
+"""
+
+import dspy
+import pytest
+
+import dspy_flows
+from dspy_flows import (
+    CascadeISTModule,
+    CascadeStats,
+    IntentSkillTrajectoryModule,
+    cascade_rejections,
+    get_ist_program,
+    intent_category,
+)
+from lm_accounting import AccountingLM, LMAccountant, count_lm_calls
+
+GOOD = {
+    "intent": "Student wants to understand how recursion works.",
+    "skills": ["Recursion", "Base cases", "Call stack", "Recurrence relations"],
+    "trajectory": ["Trace factorial", "Write a base case", "Draw the call stack", "Solve two exercises"],
+}
+
+
+@pytest.mark.unit
+class TestAcceptance:
+    def test_intent_category(self):
+        assert intent_category("Student wants to understand recursion.") == "conceptual_question"
+        assert intent_category("Fix an off-by-one error") == "debugging"
+        assert intent_category("Student asks about merge sort.") is None
+        module = IntentSkillTrajectoryModule()
+        assert module._validate_intent("Student asks about merge sort.", "") == "conceptual_question"
+        assert module._validate_intent("", "") == "unknown"
+
+    def test_good_answer_is_accepted(self):
+        assert cascade_rejections(GOOD, 0.9, 0.7) == []
+
+    def test_rejection_reasons(self):
+        bad = {"intent": "Merge sort.", "skills": ["Sorting"], "trajectory": GOOD["trajectory"] * 2}
+        assert cascade_rejections(bad, 0.5, 0.7) == ["skill_count", "step_count", "intent_category", "low_confidence"]
+        assert cascade_rejections(GOOD, None, 0.0) == ["low_confidence"]
+
+    def test_stats_blend_paths(self):
+        stats = CascadeStats()
+        stats.record([], latency_ms=10, lm_calls=1, cost=0.001)
+        stats.record([], latency_ms=20, lm_calls=1, cost=0.001)
+        stats.record(["low_confidence"], latency_ms=100, lm_calls=2, cost=0.01, escalation_fallback=True)
+        snapshot = stats.stats()
+        assert (snapshot["requests"], snapshot["escalations"], snapshot["escalation_rate"]) == (3, 1, 0.3333)
+        assert snapshot["reasons"] == {"low_confidence": 1}
+        assert snapshot["escalation_fallbacks"] == 1
+        assert snapshot["blended"]["mean_cost_usd"] == 0.004
+        assert snapshot["blended"]["latency_ms"]["max"] == 100
+        assert snapshot["cheap"]["lm_calls"] == 2
+
+    def test_lm_call_counter_sums_tokens_and_cost(self):
+        accountant = LMAccountant()
+        with count_lm_calls() as counter:
+            accountant.record_call("m", {"prompt_tokens": 100, "completion_tokens": 20}, cost=0.5)
+            accountant.record_call("m", {"prompt_tokens": 50, "completion_tokens": 10}, cost=0.25)
+        assert (counter.calls, counter.prompt_tokens, counter.completion_tokens, counter.cost) == (2, 150, 30, 0.75)
+
+
+@pytest.mark.unit
+class TestRouting:
+    def test_get_ist_program_routes_cascade(self, monkeypatch):
+        monkeypatch.setattr(dspy_flows, "cascade_extractor", None)
+        program = get_ist_program("cs101", "cascade")
+        assert isinstance(program, CascadeISTModule)
+        assert get_ist_program("cs101", "cascade") is program
+
+    def test_tier_models_from_env(self, monkeypatch):
+        monkeypatch.setenv("IST_CASCADE_STRONG_MODEL", "openai/gpt-4.1")
+        monkeypatch.delenv("IST_CASCADE_CHEAP_MODEL", raising=False)
+        with dspy.context(lm=dspy.LM("openai/gpt-4o-mini", api_key="x")):
+            cheap, strong = dspy_flows._cascade_lms()
+            assert (cheap.model, strong.model) == ("openai/gpt-4o-mini", "openai/gpt-4.1")
+            monkeypatch.delenv("IST_CASCADE_STRONG_MODEL")
+            assert dspy_flows._cascade_lms()[1].model == "openai/gpt-4o"
+
+    def test_fingerprint_covers_tier_models(self):
+        from shared_cache import program_fingerprint
+
+        lm = dspy.LM("openai/gpt-4o-mini", api_key="x")
+        first = program_fingerprint(CascadeISTModule(lm, lm.copy(model="openai/gpt-4o")), lm=lm)
+        second = program_fingerprint(CascadeISTModule(lm, lm.copy(model="openai/gpt-4.1")), lm=lm)
+        assert first != second
+
+
+@pytest.fixture(scope="module")
+def servers(serve_local_lm):
+    return serve_local_lm(seed=3), serve_local_lm(seed=4)
+
+
+@pytest.mark.integration
+class TestCascade:
+    @pytest.fixture(autouse=True)
+    def fresh_stats(self, monkeypatch):
+        stats = CascadeStats()
+        monkeypatch.setattr(dspy_flows, "cascade_stats", stats)
+        return stats
+
+    def _lm(self, server, base_url=None):
+        accountant = LMAccountant(prompt_cost_per_1k=1.0)
+        return AccountingLM("openai/local-ist", api_base=base_url or server.base_url, api_key="local",
+                            cache=False, num_retries=0, accountant=accountant)
+
+    def _calls(self, lm):
+        return lm.accountant.stats()["calls"]
+
+    def test_confident_cheap_answer_is_not_escalated(self, servers, fresh_stats, quiet):
+        cheap, strong = self._lm(servers[0]), self._lm(servers[1])
+        result = quiet(CascadeISTModule(cheap, strong, min_confidence=0.0), utterance="How does merge sort work?")
+        assert 4 <= len(result["skills"]) <= 7
+        assert (self._calls(cheap), self._calls(strong)) == (1, 0)
+        assert fresh_stats.stats()["escalation_rate"] == 0.0
+
+    def test_low_confidence_escalates(self, servers, fresh_stats, quiet):
+        cheap, strong = self._lm(servers[0]), self._lm(servers[1])
+        quiet(CascadeISTModule(cheap, strong, min_confidence=1.0), utterance="How does merge sort work?")
+        assert (self._calls(cheap), self._calls(strong)) == (1, 1)
+        snapshot = fresh_stats.stats()
+        assert snapshot["reasons"] == {"low_confidence": 1}
+        assert snapshot["escalated"]["mean_cost_usd"] > 0
+
+    def test_parse_failure_escalates(self, servers, fresh_stats, quiet):
+        servers[0].configure(malformed_rate=1.0, malformed_kinds=("truncated",))
+        try:
+            cheap, strong = self._lm(servers[0]), self._lm(servers[1])
+            result = quiet(CascadeISTModule(cheap, strong, min_confidence=0.0), utterance="Why is my loop infinite?")
+        finally:
+            servers[0].configure(malformed_rate=0.0)
+        assert not dspy_flows.is_fallback_result(result)
+        assert self._calls(strong) == 1
+        assert fresh_stats.stats()["reasons"] == {"parse_failure": 1}
+
+    def test_failed_escalation_keeps_the_cheap_answer(self, servers, fresh_stats, quiet):
+        cheap = self._lm(servers[0])
+        unreachable = self._lm(servers[1], base_url="http://127.0.0.1:9/v1")
+        result = quiet(CascadeISTModule(cheap, unreachable, min_confidence=1.0), utterance="How does merge sort work?")
+        assert not dspy_flows.is_fallback_result(result)
+        assert fresh_stats.stats()["escalation_fallbacks"] == 1
+
+    def test_metrics_and_request_pipeline(self, client, monkeypatch):
+        class Fake:
+            def __call__(self, **kwargs):
+                return GOOD
+
+        monkeypatch.setattr(dspy_flows, "cascade_extractor", Fake())
+        response = client.post("/api/intent-skill-trajectory", json={"utterance": "q", "pipeline": "cascade"})
+        assert response.json()["intent"] == GOOD["intent"]
+        assert "escalation_rate" in client.get("/api/metrics").json()["cascade"]
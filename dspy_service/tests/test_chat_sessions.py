@@ -0,0 +1,233 @@
+"""
+Tests for WebSocket chat sessions (chat_sessions.py and /ws/chat/{thread_id}):
+warm per-thread context and formatted sections, the connection cap, idle
+eviction, takeover of a connected thread and backpressure on slow readers.
+"""
+
+import asyncio
+import threading
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+import app as app_module
+import dspy_flows
+from chat_sessions import (
+    CLOSE_SUPERSEDED,
+    CLOSE_TRY_AGAIN_LATER,
+    ChatSession,
+    ChatSessionManager,
+    SessionChannel,
+    SessionInit,
+    SlowConsumer,
+)
+from dspy_flows import CHAT_HISTORY_PROMPT_LIMIT, IntentSkillTrajectoryModule
+
+
+def _init(**overrides):
+    message = {
+        "type": "init",
+        "course_id": "cs101",
+        "user_id": "u1",
+        "course_context": "Course: cs101",
+        "chat_history": [{"role": "student", "content": "What is recursion?"},
+                         {"role": "tutor", "content": "A function calling itself."}],
+        "ist_history": [{"intent": "Understand recursion", "skills": ["Recursion"], "trajectory": ["Trace factorial"]}],
+        "student_profile": {"strong_skills": ["Loops"], "weak_skills": ["Recursion"]},
+    }
+    message.update(overrides)
+    return message
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.unit
+class TestChatSession:
+    def test_init_is_cut_to_the_prompt_limits_and_keeps_totals(self):
+        history = [{"role": "student", "content": f"m{i}"} for i in range(25)]
+        init, chat_total, ist_total = SessionInit.from_message(_init(chat_history=history))
+        assert (len(init.chat_history), chat_total, ist_total) == (CHAT_HISTORY_PROMPT_LIMIT, 25, 1)
+        assert init.chat_history[-1].content == "m24"
+
+    def test_sections_match_the_module_and_are_rebuilt_only_on_change(self):
+        session = ChatSession("t1")
+        session.seed(*SessionInit.from_message(_init()))
+        sections = session.sections()
+        module = IntentSkillTrajectoryModule()
+        assert sections["chat_history"] == module._build_chat_history_section(list(session.chat_history), 2)
+        assert sections["student_profile"] == module._build_profile_section(session.student_profile)
+        assert session.sections() is sections
+
+        session.add_message("student", "And merge sort?")
+        session.add_ist({"intent": "Merge sort", "skills": ["Merge sort"], "trajectory": ["Split the array"]})
+        rebuilt = session.sections()
+        assert rebuilt is not sections and "And merge sort?" in rebuilt["chat_history"]
+        assert rebuilt["ist_history"].index("Merge sort") < rebuilt["ist_history"].index("Understand recursion")
+        assert (session.chat_total, session.ist_total) == (3, 2)
+
+
+@pytest.mark.unit
+class TestChatSessionManager:
+    def test_connection_cap_and_takeover(self):
+        manager = ChatSessionManager(max_sessions=1)
+        first, second = object(), object()
+        session = manager.connect("t1", first)
+        assert manager.connect("t2", second) is None
+        assert manager.connect("t1", second) is session  # takeover does not count against the cap
+        assert not manager.owns(session, first)
+        manager.release(session, first)  # the superseded connection's release is a no-op
+        assert manager.owns(session, second)
+        stats = manager.stats()
+        assert (stats["connected"], stats["rejected"], stats["superseded"]) == (1, 1, 1)
+
+    def test_idle_and_overflow_eviction_of_disconnected_threads(self):
+        clock = FakeClock()
+        manager = ChatSessionManager(idle_ttl_s=60, max_retained=2, clock=clock)
+        owners = {}
+        for thread_id in ("a", "b", "c", "live"):
+            owners[thread_id] = object()
+            manager.connect(thread_id, owners[thread_id])
+        for thread_id in ("a", "b", "c"):
+            manager.release(manager._sessions[thread_id], owners[thread_id])
+        assert manager.evict_idle() == 1  # over max_retained: least recently used first
+        assert sorted(manager._sessions) == ["b", "c", "live"]
+        clock.now += 61
+        assert manager.evict_idle() == 2
+        assert list(manager._sessions) == ["live"]  # connected threads are never evicted
+
+
+@pytest.mark.unit
+class TestSessionChannel:
+    def test_partials_are_dropped_and_results_time_out_for_slow_readers(self):
+        async def scenario():
+            blocked = asyncio.Event()
+
+            async def send(message):
+                await blocked.wait()
+
+            channel = SessionChannel(send, max_queue=2, send_timeout_s=0.05)
+            channel.start()
+            channel.offer({"type": "field", "n": 0})
+            await asyncio.sleep(0.01)  # the sender takes it and blocks on the slow client
+            offered = [channel.offer({"type": "field", "n": i}) for i in range(1, 4)]
+            with pytest.raises(SlowConsumer):
+                await channel.send({"type": "result"})
+            await channel.close(timeout_s=0.01)
+            return offered, channel.dropped
+
+        offered, dropped = asyncio.run(scenario())
+        assert offered == [True, True, False] and dropped == 1
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    manager = ChatSessionManager(max_sessions=2)
+    monkeypatch.setattr(app_module, "chat_sessions", manager)
+    return manager
+
+
+@pytest.mark.integration
+class TestChatSocket:
+    def test_utterances_reuse_the_warm_context(self, client, sessions, monkeypatch):
+        seen = []
+
+        def extractor(utterance, **kwargs):
+            seen.append((kwargs["chat_history_total"], dspy_flows._prebuilt_section("chat_history")))
+            return {"intent": f"About {utterance}", "skills": ["Recursion"], "trajectory": ["Trace it"]}
+
+        monkeypatch.setattr(dspy_flows, "ist_extractor", extractor)
+        with client.websocket_connect("/ws/chat/t1") as ws:
+            assert ws.receive_json()["warm"] is False
+            ws.send_json(_init())
+            ready = ws.receive_json()
+            assert (ready["warm"], ready["chat_history_total"]) == (True, 2)
+            ws.send_json({"type": "utterance", "id": 1, "utterance": "Why does it never stop?"})
+            result = ws.receive_json()
+            assert (result["type"], result["id"]) == ("result", 1)
+            assert result["result"]["intent"] == "About Why does it never stop?"
+            ws.send_json({"type": "message", "role": "tutor", "content": "What is your base case?"})
+
+        with client.websocket_connect("/ws/chat/t1") as ws:
+            ready = ws.receive_json()
+            assert (ready["warm"], ready["chat_history_total"], ready["ist_history_total"]) == (True, 4, 2)
+            ws.send_json({"type": "utterance", "id": 2, "utterance": "n == 0?"})
+            assert ws.receive_json()["type"] == "result"
+
+        assert seen[0][0] == 2 and "A function calling itself." in seen[0][1]
+        assert seen[1][0] == 4 and "What is your base case?" in seen[1][1]
+        assert sessions.stats()["utterances"] == 2
+
+    def test_decomposed_partials_then_result(self, client, sessions, monkeypatch):
+        def decomposed(utterance, on_field=None, **kwargs):
+            result = {"intent": "Understand recursion", "skills": ["Recursion"], "trajectory": ["Trace it"]}
+            for name, value in result.items():
+                on_field(name, value)
+            return result
+
+        monkeypatch.setattr(dspy_flows, "get_decomposed_extractor", lambda: decomposed)
+        with client.websocket_connect("/ws/chat/t2") as ws:
+            ws.receive_json()
+            ws.send_json(_init(pipeline="decomposed"))
+            ws.receive_json()
+            ws.send_json({"type": "utterance", "id": "a", "utterance": "What is recursion?"})
+            messages = [ws.receive_json() for _ in range(4)]
+        assert [(m["type"], m.get("name")) for m in messages] == [
+            ("field", "intent"), ("field", "skills"), ("field", "trajectory"), ("result", None)]
+
+    def test_errors_keep_the_connection_open(self, client, sessions):
+        with client.websocket_connect("/ws/chat/t3") as ws:
+            ws.receive_json()
+            ws.send_json({"type": "utterance", "id": 1, "utterance": "trigger an error"})
+            error = ws.receive_json()
+            assert (error["type"], error["id"]) == ("error", 1)
+            assert "Simulated error" in error["detail"]
+            ws.send_text("not json")
+            assert ws.receive_json()["type"] == "error"
+            ws.send_json({"type": "message", "role": "teacher", "content": "Hi"})
+            assert ws.receive_json()["type"] == "error"
+            ws.send_json({"type": "ping"})
+            assert ws.receive_json() == {"type": "pong"}
+
+    def test_takeover_closes_the_old_connection_after_its_utterance(self, client, sessions, monkeypatch):
+        started, release = threading.Event(), threading.Event()
+
+        def extractor(utterance, **kwargs):
+            started.set()
+            assert release.wait(5)
+            return {"intent": f"About {utterance}", "skills": ["Recursion"], "trajectory": ["Trace it"]}
+
+        monkeypatch.setattr(dspy_flows, "ist_extractor", extractor)
+        with client.websocket_connect("/ws/chat/t4") as old:
+            old.receive_json()
+            old.send_json(_init())
+            old.receive_json()
+            old.send_json({"type": "utterance", "id": 1, "utterance": "Why does it never stop?"})
+            assert started.wait(5)
+            with client.websocket_connect("/ws/chat/t4") as new:
+                release.set()
+                # The takeover waited for the old connection's utterance.
+                ready = new.receive_json()
+                assert (ready["type"], ready["chat_history_total"], ready["ist_history_total"]) == ("ready", 3, 2)
+                assert old.receive_json()["type"] == "result"
+                with pytest.raises(WebSocketDisconnect) as exc:
+                    old.receive_json()
+                assert exc.value.code == CLOSE_SUPERSEDED
+                new.send_json({"type": "ping"})
+                assert new.receive_json() == {"type": "pong"}
+        assert sessions.stats()["superseded"] == 1
+
+    def test_connections_over_the_cap_are_closed(self, client, sessions):
+        with client.websocket_connect("/ws/chat/a") as a, client.websocket_connect("/ws/chat/b") as b:
+            assert a.receive_json()["type"] == b.receive_json()["type"] == "ready"
+            with client.websocket_connect("/ws/chat/c") as ws:
+                assert ws.receive_json()["type"] == "error"
+                with pytest.raises(WebSocketDisconnect) as exc:
+                    ws.receive_json()
+                assert exc.value.code == CLOSE_TRY_AGAIN_LATER
+        assert client.get("/api/metrics").json()["chat_sessions"]["rejected"] == 1
@@ -0,0 +1,198 @@
+"""
+Tests for rolling per-thread conversation summaries (conversation_summary.py):
+the versioned store, fold scheduling off the request path, load shedding and
+the summary in the IST chat-history prompt section.
+"""
+
+import asyncio
+import contextlib
+import io
+import threading
+import time
+
+import httpx
+import pytest
+
+import app as app_module
+import dspy_flows
+from conversation_summary import ConversationSummarizer, SummaryStore, ThreadSummary, use_summary
+from dspy_flows import ChatMessage, IntentSkillTrajectoryModule
+from lm_accounting import AccountingLM, LMAccountant
+
+
+def _thread(n):
+    roles = ("student", "tutor")
+    return [ChatMessage(role=roles[i % 2], content=f"message {i}") for i in range(n)]
+
+
+class FakeSummarize:
+    def __init__(self, gate=None):
+        self.calls = []
+        self.gate = gate
+
+    def __call__(self, previous, new_messages):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.calls.append((previous, new_messages))
+        return f"{previous} | {new_messages.count(chr(10)) + 1} folded".strip(" |")
+
+
+@pytest.fixture
+def summarizer(tmp_path):
+    made = []
+
+    def make(**kwargs):
+        kwargs.setdefault("summarize", FakeSummarize())
+        made.append(ConversationSummarizer(SummaryStore(tmp_path / "summaries.db"), every=4, recent=6, **kwargs))
+        return made[-1]
+
+    yield make
+    for instance in made:
+        instance.close()
+
+
+@pytest.mark.unit
+class TestSummaryStore:
+    def test_versions_and_conflicts(self, tmp_path):
+        store = SummaryStore(tmp_path / "s.db", keep_versions=2)
+        assert store.save("t1", 0, "first", 4).version == 1
+        assert store.save("t1", 0, "stale fold", 6) is None
+        store.save("t1", 1, "second", 8)
+        store.save("t1", 2, "third", 12)
+        assert [v.version for v in store.versions("t1")] == [2, 3]
+        latest = store.latest("t1")
+        assert (latest.summary, latest.summarized_through) == ("third", 12)
+        assert store.latest("t2") is None
+        assert store.stats() == {"threads": 1, "stored_versions": 2}
+
+
+@pytest.mark.unit
+class TestFolding:
+    def test_folds_once_enough_messages_leave_the_recent_window(self, summarizer):
+        s = summarizer()
+        assert not s.maybe_fold("t1", _thread(9), 9)  # only 3 outside the recent 6
+        assert s.maybe_fold("t1", _thread(10), 10)
+        assert s.drain()
+        summary = s.summary_for("t1", 10)
+        assert (summary.version, summary.summarized_through) == (1, 4)
+        assert "[student]: message 0" in s._summarize.calls[0][1]
+        assert "message 4" not in s._summarize.calls[0][1]
+
+        assert not s.maybe_fold("t1", _thread(10)[-10:], 12)
+        assert s.maybe_fold("t1", _thread(14)[-10:], 14)
+        assert s.drain()
+        previous, new_messages = s._summarize.calls[1]
+        assert previous == "4 folded"
+        assert new_messages.splitlines()[0] == "[student]: message 4"
+        assert s.summary_for("t1", 14).summarized_through == 8
+        assert s.stats()["messages_folded"] == 8
+
+    def test_records_messages_that_scrolled_out_unsummarized(self, summarizer):
+        s = summarizer()
+        assert s.maybe_fold("t1", _thread(30)[-10:], 30)
+        assert s.drain()
+        assert s._summarize.calls[0][1].startswith("(20 earlier messages were not summarized)")
+        assert s.summary_for("t1", 30).summarized_through == 24
+        assert s.stats()["gap_messages"] == 20
+
+    def test_skipped_under_load_and_while_a_fold_is_pending(self, summarizer):
+        gate = threading.Event()
+        s = summarizer(max_primary_inflight=1, summarize=FakeSummarize(gate))
+        with s.primary():
+            assert not s.maybe_fold("t1", _thread(10), 10)
+        assert s.maybe_fold("t1", _thread(10), 10)
+        assert not s.maybe_fold("t1", _thread(10), 10)
+        gate.set()
+        assert s.drain()
+        stats = s.stats()
+        assert (stats["dropped_load"], stats["skipped_pending"], stats["folds"]) == (1, 1, 1)
+
+    def test_env_configuration(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("IST_THREAD_SUMMARY_DB", raising=False)
+        assert ConversationSummarizer.from_env() is None
+        monkeypatch.setenv("IST_THREAD_SUMMARY_DB", str(tmp_path / "summaries.db"))
+        monkeypatch.setenv("IST_THREAD_SUMMARY_WORKERS", "3")
+        with contextlib.redirect_stdout(io.StringIO()):
+            s = ConversationSummarizer.from_env()
+        assert s.stats()["workers"] == 3
+        s.close()
+
+    def test_summary_ignored_when_the_thread_shrank(self, summarizer):
+        s = summarizer()
+        s.store.save("t1", 0, "old thread", 20)
+        assert s.summary_for("t1", 8) is None
+        assert s.summary_for("t1", 24).summary == "old thread"
+
+
+@pytest.mark.unit
+class TestPromptSection:
+    def test_summary_replaces_covered_messages(self):
+        module = IntentSkillTrajectoryModule()
+        history = _thread(40)[-10:]
+        with use_summary(ThreadSummary("t1", 3, "Student struggled with base cases.", 36, 0.0)):
+            section = module._build_chat_history_section(history, 40)
+        assert section.startswith("Conversation summary (messages 1-36 of 40): Student struggled with base cases.")
+        assert "message 35" not in section
+        assert "message 36" in section and "message 39" in section
+        assert module._build_chat_history_section(history, 40).count("message ") == 10
+
+
+@pytest.mark.integration
+class TestThreadSummaries:
+    def test_fold_with_the_lm(self, lm_server, tmp_path):
+        lm = AccountingLM("openai/local-ist", api_base=lm_server.base_url, api_key="local", cache=False,
+                          accountant=LMAccountant())
+        s = ConversationSummarizer(SummaryStore(tmp_path / "s.db"), every=4, recent=6, lm=lm)
+        history = [ChatMessage(role="student", content="Why does my recursive factorial never stop?")] * 10
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert s.maybe_fold("t1", history, 10)
+            assert s.drain()
+        summary = s.summary_for("t1", 10)
+        s.close()
+        assert summary.summary.startswith("The discussion so far has focused on")
+        assert s.stats()["completion_tokens"] > 0
+
+    def test_endpoint_uses_and_maintains_the_summary(self, client, summarizer, monkeypatch):
+        seen = []
+
+        def extractor(**kwargs):
+            seen.append(dspy_flows.current_summary())
+            return {"intent": "Student wants to understand recursion.", "skills": ["Recursion"], "trajectory": []}
+
+        s = summarizer()
+        monkeypatch.setattr(app_module, "thread_summarizer", s)
+        monkeypatch.setattr(dspy_flows, "ist_extractor", extractor)
+        body = {"utterance": "q", "thread_id": "t1",
+                "chat_history": [{"role": "student", "content": f"m{i}"} for i in range(12)]}
+        assert client.post("/api/intent-skill-trajectory", json=body).status_code == 200
+        assert s.drain()
+        assert seen == [None]  # the first request ran before any fold
+
+        assert client.post("/api/intent-skill-trajectory", json=body).status_code == 200
+        assert seen[1].summarized_through == 6
+        assert client.get("/api/metrics").json()["thread_summaries"]["folds"] == 1
+
+    def test_slow_summary_read_does_not_block_other_requests(self, summarizer, monkeypatch):
+        s = summarizer()
+        summary_for = s.summary_for
+
+        def slow_summary_for(thread_id, chat_total):
+            if thread_id == "slow":
+                time.sleep(0.3)  # a held SQLite write lock
+            return summary_for(thread_id, chat_total)
+
+        monkeypatch.setattr(s, "summary_for", slow_summary_for)
+        monkeypatch.setattr(app_module, "thread_summarizer", s)
+
+        async def scenario():
+            finished = []
+            transport = httpx.ASGITransport(app=app_module.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                async def post(thread_id):
+                    await client.post("/api/intent-skill-trajectory", json={"utterance": "q", "thread_id": thread_id})
+                    finished.append(thread_id)
+
+                await asyncio.gather(post("slow"), post("fast"))
+            return finished
+
+        assert asyncio.run(scenario()) == ["fast", "slow"]
@@ -0,0 +1,211 @@
+"""
+Tests for local BM25 course-material retrieval (course_retrieval.py):
+passage splitting, the mmap'd segment format, incremental index updates and
+compaction, the retriever and its use in the IST prompt.
+"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import dspy_flows
+from course_retrieval import (
+    CourseIndex,
+    CourseRetriever,
+    Segment,
+    main,
+    split_passages,
+    tokenize,
+    update_course_index,
+    write_segment,
+)
+
+SYLLABUS = """# Week 1: Recursion
+
+Base cases and recursive calls. Tracing factorial and fibonacci on the call stack.
+
+# Week 2: Sorting
+
+Merge sort splits the array into halves and merges the sorted halves in O(n log n).
+Quick sort partitions around a pivot.
+"""
+
+NOTES = """Linked lists store nodes with next pointers. Inserting in the middle means
+updating the previous node's pointer first.
+
+Hash tables resolve collisions with chaining or open addressing.
+"""
+
+
+@pytest.fixture
+def materials(tmp_path):
+    course = tmp_path / "materials" / "cs101"
+    course.mkdir(parents=True)
+    (course / "syllabus.md").write_text(SYLLABUS)
+    (course / "notes.txt").write_text(NOTES)
+    return tmp_path / "materials"
+
+
+@pytest.mark.unit
+class TestPassages:
+    def test_tokenize_drops_stopwords_and_stems(self):
+        assert tokenize("How does the Merge Sorting work?") == ["merge", "sort"]
+
+    def test_passages_keep_their_heading(self):
+        passages = split_passages(SYLLABUS)
+        assert passages[0].startswith("Week 1: Recursion: Base cases")
+        assert passages[1].startswith("Week 2: Sorting: Merge sort")
+
+    def test_long_paragraphs_are_split(self):
+        passages = split_passages(" ".join(f"w{i}" for i in range(250)), max_words=100)
+        assert [len(p.split()) for p in passages] == [100, 100, 50]
+
+
+@pytest.mark.unit
+class TestSegment:
+    def test_round_trip(self, tmp_path):
+        path = tmp_path / "seg.bin"
+        write_segment(path, [("a.md", "merge sort halves"), ("b.md", "linked list pointers merge")])
+        segment = Segment(path)
+        try:
+            assert segment.doc_count == 2
+            assert segment.term_id("zebra") == -1
+            assert list(segment.postings(segment.term_id("merge"))) == [(0, 1), (1, 1)]
+            assert segment.text(1) == "linked list pointers merge"
+            assert segment.source(1) == "b.md"
+        finally:
+            segment.close()
+
+    def test_rejects_other_files(self, tmp_path):
+        path = tmp_path / "seg.bin"
+        path.write_bytes(b"not a segment" * 10)
+        with pytest.raises(ValueError):
+            Segment(path)
+
+
+@pytest.mark.unit
+class TestIndexUpdates:
+    def test_bm25_ranks_matching_passage_first(self, materials, tmp_path):
+        update_course_index(materials / "cs101", tmp_path / "index")
+        index = CourseIndex(tmp_path / "index")
+        assert index.refresh()
+        top = index.search("how does merge sort work?", k=2)
+        assert top[0].source == "syllabus.md"
+        assert "Merge sort" in top[0].text
+        assert index.search("photosynthesis") == []
+
+    def test_unchanged_files_are_not_reindexed(self, materials, tmp_path):
+        first = update_course_index(materials / "cs101", tmp_path / "index")
+        second = update_course_index(materials / "cs101", tmp_path / "index")
+        assert sorted(first["added"]) == ["notes.txt", "syllabus.md"]
+        assert second["passages_indexed"] == 0 and second["segments"] == 1
+
+    def test_changed_and_removed_files(self, materials, tmp_path):
+        index_dir = tmp_path / "index"
+        update_course_index(materials / "cs101", index_dir)
+        index = CourseIndex(index_dir)
+        index.refresh()
+        assert index.search("linked list")
+
+        (materials / "cs101" / "notes.txt").write_text("Graphs: BFS explores level by level with a queue.")
+        (materials / "cs101" / "syllabus.md").unlink()
+        summary = update_course_index(materials / "cs101", index_dir)
+
+        assert summary["changed"] == ["notes.txt"] and summary["removed"] == ["syllabus.md"]
+        assert index.refresh()
+        assert index.search("linked list") == []
+        assert index.search("merge sort") == []
+        assert index.search("bfs queue")[0].source == "notes.txt"
+        assert index.doc_count == 1
+
+    def test_segments_are_compacted(self, materials, tmp_path):
+        index_dir = tmp_path / "index"
+        for i in range(4):
+            (materials / "cs101" / f"week{i}.md").write_text(f"Week {i} covers heaps number{i}.")
+            update_course_index(materials / "cs101", index_dir, max_segments=3)
+
+        manifest = json.loads((index_dir / "manifest.json").read_text())
+        assert len(manifest["segments"]) <= 3
+        assert sorted(p.name for p in index_dir.glob("seg-*.bin")) == sorted(s["name"] for s in manifest["segments"])
+        index = CourseIndex(index_dir)
+        index.refresh()
+        assert index.search("number0")[0].source == "week0.md"
+        assert index.search("merge sort")[0].source == "syllabus.md"
+
+
+@pytest.mark.unit
+class TestRetriever:
+    def test_builds_on_first_use(self, materials, tmp_path, quiet):
+        retriever = CourseRetriever(materials, index_dir=tmp_path / "index")
+        section = quiet(retriever.context_for, "cs101", "my linked list loses nodes when I insert")
+        assert section.startswith("[1] (notes.txt) Linked lists")
+        assert (tmp_path / "index" / "cs101" / "manifest.json").exists()
+        stats = retriever.stats()
+        assert stats["builds"] == 1 and stats["retrievals"] == 1
+        assert stats["mean_prompt_tokens_added"] > 0
+        assert stats["latency_ms"]["count"] == 1
+
+    def test_unknown_course_or_no_course(self, materials, quiet):
+        retriever = CourseRetriever(materials)
+        assert quiet(retriever.context_for, "cs999", "merge sort") == ""
+        assert quiet(retriever.context_for, None, "merge sort") == ""
+        assert retriever.stats()["empty"] == 2
+
+    def test_snippets_are_truncated(self, materials, quiet):
+        retriever = CourseRetriever(materials, snippet_chars=40)
+        section = quiet(retriever.context_for, "cs101", "merge sort")
+        first = section.splitlines()[0]
+        assert first.endswith("...")
+        assert len(first) < 40 + len("[1] (syllabus.md) ...") + 1
+
+    def test_from_env(self, monkeypatch, materials):
+        monkeypatch.delenv("COURSE_MATERIALS_DIR", raising=False)
+        assert CourseRetriever.from_env() is None
+        monkeypatch.setenv("COURSE_MATERIALS_DIR", str(materials))
+        monkeypatch.setenv("COURSE_RETRIEVAL_TOP_K", "5")
+        retriever = CourseRetriever.from_env()
+        assert retriever.top_k == 5
+        assert retriever.index_dir == materials / ".index"
+
+    def test_cli_build_and_search(self, materials, capsys):
+        assert main(["build", str(materials)]) == 0
+        assert "cs101" in capsys.readouterr().out
+        assert main(["search", str(materials), "cs101", "hash table collisions"]) == 0
+        assert "notes.txt" in capsys.readouterr().out
+
+
+@pytest.mark.unit
+class TestPromptIntegration:
+    def test_materials_reach_the_signature(self, materials, monkeypatch, quiet):
+        monkeypatch.setattr(dspy_flows, "course_retriever", CourseRetriever(materials))
+        seen = {}
+
+        def predict(**kwargs):
+            seen.update(kwargs)
+            return SimpleNamespace(structured_analysis='{"intent": "i", "skills": ["s"], "trajectory": ["t"]}')
+
+        module = dspy_flows.IntentSkillTrajectoryModule()
+        module.predict = predict
+        quiet(module, utterance="how does merge sort work?", course_context="Course: cs101")
+        assert seen["course_materials"].startswith("Course materials:\n[1] (syllabus.md)")
+
+    def test_without_retriever(self, monkeypatch):
+        monkeypatch.setattr(dspy_flows, "course_retriever", None)
+        module = dspy_flows.IntentSkillTrajectoryModule()
+        assert module._build_materials_section("q", "Course: cs101") == "Course materials: (none indexed)"
+
+    def test_retrieval_errors_do_not_fail_the_request(self, monkeypatch, quiet):
+        broken = SimpleNamespace(context_for=lambda *a: (_ for _ in ()).throw(OSError("disk")))
+        monkeypatch.setattr(dspy_flows, "course_retriever", broken)
+        section = quiet(dspy_flows.IntentSkillTrajectoryModule()._build_materials_section, "q", "Course: cs101")
+        assert section == "Course materials: (no matching passages)"
+
+
+@pytest.mark.integration
+def test_metrics_include_retrieval(client, materials, monkeypatch, quiet):
+    assert client.get("/api/metrics").json()["retrieval"] is None
+    retriever = CourseRetriever(materials)
+    quiet(retriever.context_for, "cs101", "merge sort")
+    monkeypatch.setattr(dspy_flows, "course_retriever", retriever)
+    assert client.get("/api/metrics").json()["retrieval"]["retrievals"] == 1
@@ -0,0 +1,167 @@
+"""
+Tests for the decomposed IST pipeline (dspy_flows.DecomposedISTModule),
+per-request pipeline selection and the SSE streaming endpoint.
+"""
+
+import json
+import time
+from types import SimpleNamespace
+
+import dspy
+import pytest
+
+import dspy_flows
+from dspy_flows import (
+    FALLBACK_RESULT,
+    DecomposedISTModule,
+    get_ist_program,
+    resolve_pipeline,
+)
+from lm_accounting import AccountingLM, LMAccountant
+
+
+def _fake_predictor(field, value, delay=0.0, error=None):
+    def predict(**kwargs):
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return SimpleNamespace(**{field: value})
+    return predict
+
+
+def _module(intent_delay=0.0, skills_delay=0.0, trajectory_delay=0.0):
+    module = DecomposedISTModule()
+    module.intent_predict = _fake_predictor("intent", "Understand recursion.", intent_delay)
+    module.skills_predict = _fake_predictor("skills", '["Recursion", "Base cases"]', skills_delay)
+    module.trajectory_predict = _fake_predictor("trajectory", "- Trace factorial\n- Write a base case", trajectory_delay)
+    return module
+
+
+def _sse_events(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@pytest.mark.unit
+class TestPipelineSelection:
+    def test_explicit_choice_wins(self, monkeypatch):
+        monkeypatch.setenv("IST_PIPELINE", "decomposed")
+        assert resolve_pipeline("monolithic") == "monolithic"
+        assert resolve_pipeline(None) == "decomposed"
+
+    def test_default_and_unknown(self, monkeypatch):
+        monkeypatch.delenv("IST_PIPELINE", raising=False)
+        assert resolve_pipeline(None) == "monolithic"
+        monkeypatch.setenv("IST_PIPELINE", "bogus")
+        assert resolve_pipeline(None) == "monolithic"
+
+    def test_get_ist_program_routes_decomposed(self, monkeypatch):
+        monkeypatch.setattr(dspy_flows, "decomposed_extractor", None)
+        program = get_ist_program("cs101", "decomposed")
+        assert isinstance(program, DecomposedISTModule)
+        assert get_ist_program("cs101", "decomposed") is program
+        assert get_ist_program("cs101", "monolithic") is dspy_flows.ist_extractor
+
+
+@pytest.mark.unit
+class TestDecomposedModule:
+    def test_merges_and_normalizes_fields(self, quiet):
+        result = quiet(_module(), utterance="How does recursion work?")
+        assert result == {
+            "intent": "Understand recursion.",
+            "skills": ["Recursion", "Base cases"],
+            "trajectory": ["Trace factorial", "Write a base case"],
+        }
+
+    def test_sub_predictors_run_concurrently(self, quiet):
+        started = time.perf_counter()
+        quiet(_module(0.2, 0.2, 0.2), utterance="q")
+        assert time.perf_counter() - started < 0.5
+
+    def test_fields_emitted_as_they_finish(self, quiet):
+        emitted = []
+        started = time.perf_counter()
+        quiet(_module(0.0, 0.05, 0.3), utterance="q",
+               on_field=lambda name, value: emitted.append((name, time.perf_counter() - started)))
+        assert [name for name, _ in emitted] == ["intent", "skills", "trajectory"]
+        assert emitted[1][1] < 0.25
+
+    def test_failed_sub_predictor_falls_back_for_its_field_only(self, quiet):
+        module = _module()
+        module.skills_predict = _fake_predictor("skills", None, error=RuntimeError("boom"))
+        result = quiet(module, utterance="q")
+        assert result["skills"] == FALLBACK_RESULT["skills"]
+        assert result["intent"] == "Understand recursion."
+        assert not dspy_flows.is_fallback_result(result)
+
+    def test_has_only_the_three_sub_predictors(self):
+        names = [name for name, _ in DecomposedISTModule().named_predictors()]
+        assert names == ["intent_predict", "skills_predict", "trajectory_predict"]
+
+
+@pytest.mark.integration
+def test_decomposed_against_stand_in_is_accounted(lm_server, monkeypatch, quiet):
+    """dspy.context and the accounting scope reach the worker threads."""
+    accountant = LMAccountant()
+    stats = dspy_flows.OutputModeStats()
+    monkeypatch.setattr(dspy_flows, "output_mode_stats", stats)
+    lm = AccountingLM("openai/local-ist", api_base=lm_server.base_url, api_key="local", cache=False, accountant=accountant)
+    with dspy.context(lm=lm), accountant.request_scope("cs101") as usage:
+        result = quiet(DecomposedISTModule(), utterance="Why does my linked list lose nodes?", course_context="Course: cs101")
+
+    assert "Linked lists" in result["skills"]
+    assert len(result["trajectory"]) >= 3
+    assert usage.calls == 3
+    # Recorded like the other output modes; the three calls are not format retries.
+    decomposed = stats.stats()["decomposed"]
+    assert (decomposed["requests"], decomposed["lm_calls"], decomposed["format_retries"]) == (1, 3, 0)
+
+
+@pytest.mark.integration
+class TestEndpoints:
+    @pytest.fixture
+    def decomposed(self, monkeypatch):
+        calls = []
+
+        def fake(on_field=None, **kwargs):
+            calls.append(kwargs["utterance"])
+            result = {"intent": "decomposed intent", "skills": ["A", "B"], "trajectory": ["1", "2"]}
+            for name in ("intent", "skills", "trajectory"):
+                if on_field is not None:
+                    on_field(name, result[name])
+            return result
+
+        monkeypatch.setattr(dspy_flows, "decomposed_extractor", fake)
+        return calls
+
+    def test_pipeline_selectable_per_request(self, client, decomposed):
+        chosen = client.post("/api/intent-skill-trajectory", json={"utterance": "q", "pipeline": "decomposed"})
+        default = client.post("/api/intent-skill-trajectory", json={"utterance": "q"})
+        assert chosen.json()["intent"] == "decomposed intent"
+        assert default.json()["intent"] != "decomposed intent"
+        assert decomposed == ["q"]
+
+    def test_unknown_pipeline_rejected(self, client):
+        response = client.post("/api/intent-skill-trajectory", json={"utterance": "q", "pipeline": "fastest"})
+        assert response.status_code == 422
+
+    def test_stream_decomposed_fields_then_done(self, client, decomposed):
+        response = client.post("/api/intent-skill-trajectory/stream", json={"utterance": "q", "pipeline": "decomposed"})
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = _sse_events(response.text)
+        assert [name for name, _ in events] == ["intent", "skills", "trajectory", "done"]
+        assert events[0][1] == "decomposed intent"
+        assert events[-1][1]["result"]["skills"] == ["A", "B"]
+        assert events[-1][1]["lm_usage"]["calls"] == 0
+
+    def test_stream_monolithic_sends_all_fields_at_end(self, client):
+        events = _sse_events(client.post("/api/intent-skill-trajectory/stream", json={"utterance": "q"}).text)
+        assert [name for name, _ in events] == ["intent", "skills", "trajectory", "done"]
+        assert events[1][1] == ["Skill A", "Skill B"]
+
+    def test_stream_reports_errors_as_event(self, client):
+        events = _sse_events(client.post("/api/intent-skill-trajectory/stream", json={"utterance": "trigger error"}).text)
+        assert events == [("error", {"detail": "ValueError: Simulated error in IST extraction"})]
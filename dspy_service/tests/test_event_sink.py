@@ -0,0 +1,220 @@
+"""
+Tests for the write-behind IST event sink (event_sink.py): batching, segment
+rotation, fsync policies, the iterator API, compaction and app integration.
+"""
+
+import contextlib
+import io
+import json
+import time
+from pathlib import Path
+
+import pytest
+
+import app as app_module
+import event_sink
+from event_sink import EventSink, compact, iter_events, list_segments, main, make_event
+
+
+def _event(i, course="cs101", ts=None, **extra):
+    event = make_event({"intent": f"intent {i}", "skills": ["A"], "trajectory": ["1"]},
+                       utterance=f"question {i}", course_id=course, user_id=f"u{i % 3}", **extra)
+    if ts is not None:
+        event["ts"] = ts
+    return event
+
+
+def _fill(directory, count, segment_bytes=64 * 1024 * 1024, **kwargs):
+    sink = EventSink(directory, segment_bytes=segment_bytes, start=False, **kwargs)
+    for i in range(count):
+        sink.record(_event(i, course="cs101" if i % 2 == 0 else "cs102"))
+    sink.close()
+    return sink
+
+
+@pytest.mark.unit
+class TestSink:
+    def test_events_are_buffered_until_flushed(self, tmp_path):
+        sink = EventSink(tmp_path, start=False)
+        sink.record(_event(1))
+        assert list(iter_events(tmp_path)) == []
+        assert sink.flush() == 1
+        assert [e["utterance"] for e in iter_events(tmp_path)] == ["question 1"]
+        sink.close()
+
+    def test_background_writer_flushes_by_batch_and_interval(self, tmp_path):
+        sink = EventSink(tmp_path, batch_size=10, flush_interval_s=0.05)
+        for i in range(25):
+            sink.record(_event(i))
+        deadline = time.time() + 5
+        while sink.stats()["written"] < 25 and time.time() < deadline:
+            time.sleep(0.01)
+        stats = sink.stats()
+        assert stats["written"] == 25
+        assert stats["batches"] >= 3
+        sink.close()
+
+    def test_rotation_seals_segments(self, tmp_path):
+        _fill(tmp_path, 200, segment_bytes=4096, batch_size=10)
+        segments = list_segments(tmp_path)
+        assert len(segments) > 3
+        assert not any(path.name.endswith(".active") for path in segments)
+        assert sum(1 for _ in iter_events(tmp_path)) == 200
+
+    def test_active_segment_is_readable_and_sealed_on_close(self, tmp_path):
+        sink = EventSink(tmp_path, start=False)
+        sink.record(_event(1))
+        sink.flush()
+        assert list_segments(tmp_path)[0].name.endswith(".jsonl.active")
+        assert list(iter_events(tmp_path, include_active=False)) == []
+        sink.close()
+        assert list_segments(tmp_path)[0].suffix == ".jsonl"
+
+    def test_full_buffer_drops_instead_of_blocking(self, tmp_path):
+        sink = EventSink(tmp_path, max_buffer=3, start=False)
+        accepted = [sink.record(_event(i)) for i in range(5)]
+        assert accepted == [True, True, True, False, False]
+        assert sink.stats()["dropped"] == 2
+        sink.close()
+        assert sink.record(_event(9)) is False
+
+    @pytest.mark.parametrize("policy,expected", [("batch", 3), ("off", 0)])
+    def test_fsync_policies(self, tmp_path, policy, expected):
+        sink = EventSink(tmp_path, batch_size=2, fsync=policy, start=False)
+        for i in range(6):
+            sink.record(_event(i))
+        sink.flush()
+        assert sink.stats()["fsyncs"] == expected
+        sink.close()
+
+    def test_unknown_fsync_policy_rejected(self, tmp_path):
+        with pytest.raises(ValueError):
+            EventSink(tmp_path, fsync="sometimes", start=False)
+
+
+@pytest.mark.unit
+class TestIterator:
+    def test_filters(self, tmp_path):
+        sink = EventSink(tmp_path, start=False)
+        for i, ts in enumerate([100.0, 200.0, 300.0]):
+            sink.record(_event(i, ts=ts))
+        sink.record(_event(3, course="cs102", ts=400.0))
+        sink.close()
+        assert len(list(iter_events(tmp_path, course_id="cs101"))) == 3
+        assert [e["ts"] for e in iter_events(tmp_path, since=150, until=350)] == [200.0, 300.0]
+        assert [e["user_id"] for e in iter_events(tmp_path, user_id="u1")] == ["u1"]
+
+    def test_truncated_tail_is_skipped(self, tmp_path):
+        _fill(tmp_path, 3)
+        with open(list_segments(tmp_path)[0], "a", encoding="utf-8") as handle:
+            handle.write('{"id": "partial", "utter')
+        assert sum(1 for _ in iter_events(tmp_path)) == 3
+
+
+@pytest.mark.unit
+class TestCompaction:
+    def test_merges_small_segments_and_dedupes(self, tmp_path):
+        _fill(tmp_path, 300, segment_bytes=4096, batch_size=10)
+        before = len(list_segments(tmp_path))
+        duplicate = next(iter_events(tmp_path))
+        with open(tmp_path / "events-20200101T000000-1-0001.jsonl", "w", encoding="utf-8") as handle:
+            handle.write(json.dumps(duplicate) + "\n")
+
+        summary = compact(tmp_path)
+        assert summary["segments_in"] == before + 1
+        assert summary["segments_out"] == 1
+        assert summary["duplicates"] == 1
+        assert len(list_segments(tmp_path)) == 1
+        events = list(iter_events(tmp_path))
+        assert len(events) == 300
+        assert len({e["id"] for e in events}) == 300
+
+    def test_dedupe_memory_is_bounded_by_window(self, tmp_path):
+        _fill(tmp_path, 50, segment_bytes=2048, batch_size=5)
+        first = next(iter_events(tmp_path))
+        with open(tmp_path / "events-29990101T000000-1-0001.jsonl", "w", encoding="utf-8") as handle:
+            handle.write(json.dumps(first) + "\n")  # sorts last, 50 events after the original
+        assert compact(tmp_path, dedupe_window=10)["duplicates"] == 0
+        assert compact(tmp_path, retention_s=10 * 365 * 86_400, dedupe_window=100)["duplicates"] == 1
+
+    @pytest.mark.parametrize("crash_at, outcome", [("publish", "rolled_back"), ("cleanup", "finished")])
+    def test_interrupted_compaction_never_exposes_duplicates(self, tmp_path, monkeypatch, crash_at, outcome):
+        _fill(tmp_path, 300, segment_bytes=4096, batch_size=10)
+        real_replace, real_unlink = event_sink.os.replace, Path.unlink
+
+        def replace(src, dst):
+            if crash_at == "publish" and Path(dst).name.startswith("events-"):
+                raise KeyboardInterrupt("killed while publishing")
+            return real_replace(src, dst)
+
+        def unlink(path, missing_ok=False):
+            if crash_at == "cleanup" and path.name.startswith("events-"):
+                raise KeyboardInterrupt("killed while removing inputs")
+            return real_unlink(path, missing_ok=missing_ok)
+
+        with monkeypatch.context() as patch:
+            patch.setattr(event_sink.os, "replace", replace)
+            patch.setattr(Path, "unlink", unlink)
+            with pytest.raises(KeyboardInterrupt):
+                compact(tmp_path)
+
+        # Readers see every event exactly once while the swap is half done...
+        assert len([e["id"] for e in iter_events(tmp_path)]) == 300
+        # ...and the next compaction completes or undoes it.
+        assert compact(tmp_path)["interrupted"] == outcome
+        assert not (tmp_path / event_sink.PENDING_MANIFEST).exists()
+        assert not list(tmp_path.glob(".events-*.tmp"))
+        events = list(iter_events(tmp_path))
+        assert len(events) == 300 and len({e["id"] for e in events}) == 300
+
+    def test_retention_drops_old_events(self, tmp_path):
+        sink = EventSink(tmp_path, start=False)
+        now = time.time()
+        sink.record(_event(0, ts=now - 10 * 86_400))
+        sink.record(_event(1, ts=now - 60))
+        sink.close()
+        summary = compact(tmp_path, retention_s=7 * 86_400, now=now)
+        assert summary["expired"] == 1
+        assert [e["utterance"] for e in iter_events(tmp_path)] == ["question 1"]
+
+    def test_live_active_segments_are_left_alone_and_dead_ones_sealed(self, tmp_path):
+        live = EventSink(tmp_path, start=False)
+        live.record(_event(1))
+        live.flush()
+        orphan = tmp_path / "events-20200101T000000-999999-0001.jsonl.active"
+        orphan.write_text(json.dumps(_event(2)) + "\n", encoding="utf-8")
+
+        summary = compact(tmp_path, retention_s=365 * 86_400)
+        assert summary["orphans_sealed"] == 1
+        assert any(path.name.endswith(".active") for path in list_segments(tmp_path))
+        live.close()
+        assert sum(1 for _ in iter_events(tmp_path)) == 2
+
+    def test_cli(self, tmp_path):
+        _fill(tmp_path, 10, segment_bytes=512, batch_size=2)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            main(["scan", str(tmp_path), "--course", "cs102"])
+        assert json.loads(out.getvalue())["events"] == 5
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert main(["compact", str(tmp_path)]) == 0
+        assert len(list_segments(tmp_path)) == 1
+
+
+@pytest.mark.integration
+class TestEndpoint:
+    def test_results_are_recorded(self, client, tmp_path, monkeypatch):
+        sink = EventSink(tmp_path, start=False)
+        monkeypatch.setattr(app_module, "event_sink", sink)
+        client.post("/api/intent-skill-trajectory",
+                    json={"utterance": "How does recursion work?", "course_id": "cs101", "user_id": "u7"})
+        sink.flush()
+        (event,) = list(iter_events(tmp_path))
+        assert (event["course_id"], event["user_id"], event["source"]) == ("cs101", "u7", "lm")
+        assert event["skills"]
+        assert client.get("/api/metrics").json()["events"]["written"] == 1
+        sink.close()
+
+    def test_disabled_without_directory(self, monkeypatch):
+        monkeypatch.delenv("IST_EVENT_DIR", raising=False)
+        assert EventSink.from_env() is None
@@ -0,0 +1,209 @@
+"""
+Tests for idempotent IST processing (idempotency.py) and the keyed endpoint path.
+"""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+
+import httpx
+import pytest
+
+import app as app_module
+from idempotency import IdempotencyKeyReused, IdempotencyStore, request_hash
+from lm_accounting import get_accountant
+
+
+class FakeClock:
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+RESULT = {"intent": "Understand recursion.", "skills": ["Recursion"], "trajectory": ["Trace it"]}
+
+
+@pytest.mark.unit
+class TestStore:
+    def test_claim_complete_replay(self, tmp_path):
+        store = IdempotencyStore(tmp_path / "idem.db")
+        first = store.claim("u1:m1", "h")
+        assert first.state == "owner"
+        assert store.claim("u1:m1", "h").state == "pending"
+        assert store.complete(first, RESULT, lm_calls=2)
+        replay = store.claim("u1:m1", "h")
+        assert (replay.state, replay.result) == ("done", RESULT)
+        totals = store.stats()["totals"]
+        assert (totals["requests"], totals["replays"], totals["waits"], totals["lm_calls_avoided"]) == (1, 1, 1, 2)
+
+    def test_key_reused_for_other_request_is_rejected(self, tmp_path):
+        store = IdempotencyStore(tmp_path / "idem.db")
+        store.complete(store.claim("k", request_hash({"utterance": "a"})), RESULT)
+        with pytest.raises(IdempotencyKeyReused):
+            store.claim("k", request_hash({"utterance": "b"}))
+
+    def test_stale_pending_is_taken_over(self, tmp_path):
+        clock = FakeClock()
+        store = IdempotencyStore(tmp_path / "idem.db", pending_ttl_s=30, clock=clock)
+        crashed = store.claim("k", "h")
+        clock.now += 31
+        retry = store.claim("k", "h")
+        assert (retry.state, retry.took_over) == ("owner", True)
+        assert not store.complete(crashed, RESULT)  # the stale owner can no longer write
+        assert store.complete(retry, RESULT)
+        assert store.stats()["totals"]["stale_takeovers"] == 1
+
+    def test_release_and_result_expiry(self, tmp_path):
+        clock = FakeClock()
+        store = IdempotencyStore(tmp_path / "idem.db", result_ttl_s=60, clock=clock)
+        store.release(store.claim("k", "h"))
+        claim = store.claim("k", "h")
+        assert claim.state == "owner"
+        store.complete(claim, RESULT)
+        clock.now += 61
+        assert store.claim("k", "h").state == "owner"
+        assert store.purge_expired() == 0  # the expired row was replaced by the new claim
+
+    def test_durable_across_instances(self, tmp_path):
+        store = IdempotencyStore(tmp_path / "idem.db")
+        store.complete(store.claim("k", "h"), RESULT, lm_calls=1)
+        store.close()
+        assert IdempotencyStore(tmp_path / "idem.db").claim("k", "h").result == RESULT
+
+
+@pytest.mark.integration
+class TestEndpoint:
+    @pytest.fixture
+    def store(self, tmp_path, monkeypatch):
+        store = IdempotencyStore(tmp_path / "idem.db")
+        monkeypatch.setattr(app_module, "idempotency_store", store)
+        monkeypatch.setattr(app_module, "IDEMPOTENCY_WAIT_S", 5.0)
+        return store
+
+    @pytest.fixture
+    def calls(self, monkeypatch):
+        calls = []
+
+        def extractor(**kwargs):
+            calls.append(kwargs["utterance"])
+            if "error" in kwargs["utterance"] and len(calls) == 1:
+                raise ValueError("first attempt fails")
+            get_accountant().record_call("openai/test", {"prompt_tokens": 10, "completion_tokens": 5})
+            return RESULT
+
+        monkeypatch.setattr("dspy_flows.ist_extractor", extractor)
+        return calls
+
+    def _post(self, client, utterance="Why does my recursion never stop?", key="msg-1", **extra):
+        return client.post("/api/intent-skill-trajectory",
+                           json={"utterance": utterance, "user_id": "u1", "idempotency_key": key, **extra})
+
+    def test_repeat_is_replayed_without_lm_calls(self, client, store, calls):
+        first = self._post(client)
+        second = self._post(client, chat_history=[{"role": "student", "content": "new message"}])
+        assert first.headers["X-IST-Idempotency"] == "new"
+        assert second.headers["X-IST-Idempotency"] == "replay"
+        assert second.json() == first.json()
+        assert len(calls) == 1
+        totals = client.get("/api/metrics").json()["idempotency"]["totals"]
+        assert (totals["replays"], totals["lm_calls_avoided"]) == (1, 1)
+
+    def test_keys_are_scoped_per_user_and_unkeyed_requests_bypass(self, client, store, calls):
+        self._post(client)
+        other_user = client.post("/api/intent-skill-trajectory",
+                                 json={"utterance": "Why does my recursion never stop?", "user_id": "u2", "idempotency_key": "msg-1"})
+        unkeyed = client.post("/api/intent-skill-trajectory", json={"utterance": "q"})
+        assert other_user.headers["X-IST-Idempotency"] == "new"
+        assert "X-IST-Idempotency" not in unkeyed.headers
+        assert len(calls) == 3
+
+    def test_concurrent_duplicate_waits_for_first(self, client, store, calls):
+        body_hash = request_hash({"utterance": "Why does my recursion never stop?", "course_id": None, "course_context": None})
+        running = store.claim("u1:msg-1", body_hash)
+
+        def finish():
+            time.sleep(0.2)
+            store.complete(running, RESULT, lm_calls=1)
+
+        threading.Thread(target=finish).start()
+        response = self._post(client)
+        assert response.headers["X-IST-Idempotency"] == "waited"
+        assert response.json()["intent"] == RESULT["intent"]
+        assert calls == []
+
+    def test_wait_timeout_is_409(self, client, store, calls, monkeypatch):
+        monkeypatch.setattr(app_module, "IDEMPOTENCY_WAIT_S", 0.1)
+        body_hash = request_hash({"utterance": "Why does my recursion never stop?", "course_id": None, "course_context": None})
+        store.claim("u1:msg-1", body_hash)
+        response = self._post(client)
+        assert response.status_code == 409
+        assert response.headers["Retry-After"] == "5"
+
+    def test_failure_releases_key_for_retry(self, client, store, calls):
+        assert self._post(client, utterance="this will error once").status_code == 400
+        retry = self._post(client, utterance="this will error once")
+        assert retry.status_code == 200
+        assert retry.headers["X-IST-Idempotency"] == "new"
+
+    def test_reused_key_with_other_utterance_is_422(self, client, store, calls):
+        self._post(client)
+        assert self._post(client, utterance="A different question").status_code == 422
+
+    def test_stream_claims_and_replays_the_key(self, client, store, calls):
+        def stream(utterance="Why does my recursion never stop?"):
+            return client.post("/api/intent-skill-trajectory/stream",
+                               json={"utterance": utterance, "user_id": "u1", "idempotency_key": "msg-1"})
+
+        first, second = stream(), stream()
+        assert (first.headers["X-IST-Idempotency"], second.headers["X-IST-Idempotency"]) == ("new", "replay")
+        done = json.loads(second.text.strip().split("\n\n")[-1].split("data: ", 1)[1])
+        assert done == {"result": RESULT, "idempotency": "replay"}
+        assert self._post(client).headers["X-IST-Idempotency"] == "replay"
+        assert len(calls) == 1
+        assert stream("A different question").status_code == 422
+
+    def test_stream_failure_releases_key_for_retry(self, client, store, calls):
+        def stream():
+            return client.post("/api/intent-skill-trajectory/stream",
+                               json={"utterance": "this will error once", "user_id": "u1", "idempotency_key": "msg-1"})
+
+        assert "event: error" in stream().text
+        retry = stream()
+        assert retry.headers["X-IST-Idempotency"] == "new"
+        assert "event: done" in retry.text and len(calls) == 2
+
+    def test_locked_store_does_not_block_other_requests(self, store, calls):
+        locked = threading.Event()
+
+        def hold_write_lock():
+            conn = sqlite3.connect(store.path, isolation_level=None)
+            conn.execute("BEGIN IMMEDIATE")
+            locked.set()
+            time.sleep(0.5)
+            conn.execute("COMMIT")
+            conn.close()
+
+        async def scenario():
+            finished = []
+            transport = httpx.ASGITransport(app=app_module.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                async def post(name, body):
+                    response = await client.post("/api/intent-skill-trajectory", json=body)
+                    finished.append((name, response.status_code))
+
+                await asyncio.gather(
+                    post("keyed", {"utterance": "q", "user_id": "u1", "idempotency_key": "msg-1"}),
+                    post("unkeyed", {"utterance": "other question"}),
+                )
+            return finished
+
+        holder = threading.Thread(target=hold_write_lock)
+        holder.start()
+        locked.wait(5)
+        finished = asyncio.run(scenario())
+        holder.join()
+        assert finished == [("unkeyed", 200), ("keyed", 200)]
@@ -0,0 +1,155 @@
+"""
+Tests for bounded request ingestion: streaming body-size limits (ingestion_limits.py)
+and pre-validation history truncation on IntentSkillRequest.
+"""
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import IntentSkillRequest, app
+from dspy_flows import (
+    CHAT_HISTORY_PROMPT_LIMIT,
+    IST_HISTORY_PROMPT_LIMIT,
+    IntentSkillTrajectoryModule,
+)
+from ingestion_limits import BodySizeLimitMiddleware
+
+
+def _history_request(n: int) -> dict:
+    return {
+        "utterance": "Can you explain recursion?",
+        "course_context": "Course: cs101",
+        "chat_history": [
+            {"role": "student" if i % 2 else "tutor", "content": f"message {i}"} for i in range(n)
+        ],
+        "ist_history": [
+            {"intent": f"intent {i}", "skills": ["Recursion"], "trajectory": ["Practice"]} for i in range(n)
+        ],
+    }
+
+
+@pytest.mark.integration
+class TestBodySizeLimit:
+    """Oversized bodies are rejected with a structured 413 before parsing."""
+
+    def test_declared_content_length_over_limit(self):
+        client = TestClient(BodySizeLimitMiddleware(app, max_bytes=200))
+        response = client.post("/api/intent-skill-trajectory", json=_history_request(20))
+
+        assert response.status_code == 413
+        detail = response.json()["detail"]
+        assert detail["error"] == "payload_too_large"
+        assert detail["max_bytes"] == 200
+        assert detail["received_bytes"] > 200
+
+    def test_chunked_body_over_limit_is_cut_off(self):
+        client = TestClient(BodySizeLimitMiddleware(app, max_bytes=200))
+        chunks = iter([b'{"utterance": "' + b"x" * 150, b"y" * 150, b'"}'])
+        response = client.post(
+            "/api/intent-skill-trajectory",
+            content=chunks,
+            headers={"Content-Type": "application/json"},
+        )
+        assert response.status_code == 413
+        assert response.json()["detail"]["error"] == "payload_too_large"
+
+    def test_body_under_limit_passes(self):
+        client = TestClient(BodySizeLimitMiddleware(app, max_bytes=10_000))
+        response = client.post("/api/intent-skill-trajectory", json={"utterance": "What is recursion?"})
+        assert response.status_code == 200
+
+    def test_zero_disables_limit(self):
+        client = TestClient(BodySizeLimitMiddleware(app, max_bytes=0))
+        response = client.post("/api/intent-skill-trajectory", json=_history_request(50))
+        assert response.status_code == 200
+
+    def test_service_default_limit_rejects_semester_of_history(self, client):
+        response = client.post("/api/intent-skill-trajectory", json=_history_request(10_000))
+        assert response.status_code == 413
+
+    def test_route_limits_override_the_default(self):
+        client = TestClient(BodySizeLimitMiddleware(app, max_bytes=200, route_limits={"/api/assessment/": 5000}))
+        batch = {"course_id": "cs101", "course_content": "x" * 1000, "students": []}
+        assert client.post("/api/assessment/batch", json=batch).status_code == 422  # validated, not cut off
+        too_big = client.post("/api/assessment/batch", json={**batch, "course_content": "x" * 6000})
+        assert (too_big.status_code, too_big.json()["detail"]["max_bytes"]) == (413, 5000)
+        assert client.post("/api/intent-skill-trajectory", json={"utterance": "x" * 1000}).status_code == 413
+
+    def test_service_accepts_assessment_batch_over_one_mib(self, client):
+        event = {"intent": "Understand how recursion ends", "skills": ["Recursion"], "trajectory": ["Trace it"]}
+        students = [{"user_id": f"u{i}", "ist_events": [event] * 20} for i in range(30)]
+        batch = {"course_id": "cs101", "course_content": "Week 1: recursion. " * 60_000, "students": students}
+        assert len(json.dumps(batch)) > 1024 * 1024
+        response = client.post("/api/assessment/batch", json=batch)
+        # Parsed and validated: the test service has no IST_ASSESSMENT_DB, so the batch endpoint is off.
+        assert response.status_code == 404
+        assert "IST_ASSESSMENT_DB" in response.json()["detail"]
+
+
+@pytest.mark.unit
+class TestHistoryTruncation:
+    """History lists are cut to the prompt limits before item validation."""
+
+    def test_lists_truncated_to_prompt_limits(self):
+        request = IntentSkillRequest.model_validate(_history_request(1000))
+
+        assert len(request.chat_history) == CHAT_HISTORY_PROMPT_LIMIT
+        assert len(request.ist_history) == IST_HISTORY_PROMPT_LIMIT
+        assert request.chat_history_total == 1000
+        assert request.ist_history_total == 1000
+        # Most recent chat messages, first IST events - exactly what the prompt builders use.
+        assert request.chat_history[-1].content == "message 999"
+        assert request.ist_history[0].intent == "intent 0"
+
+    def test_items_beyond_limit_are_never_validated(self):
+        data = _history_request(CHAT_HISTORY_PROMPT_LIMIT)
+        data["chat_history"] = [{"role": "not-a-role"}] * 50 + data["chat_history"]
+        request = IntentSkillRequest.model_validate(data)
+        assert request.chat_history_total == 50 + CHAT_HISTORY_PROMPT_LIMIT
+        assert len(request.chat_history) == CHAT_HISTORY_PROMPT_LIMIT
+
+    def test_items_within_limit_still_validated(self):
+        data = _history_request(2)
+        data["chat_history"][-1] = {"role": "not-a-role", "content": "x"}
+        with pytest.raises(ValueError):
+            IntentSkillRequest.model_validate(data)
+
+    def test_json_body_is_truncated_too(self):
+        request = IntentSkillRequest.model_validate_json(json.dumps(_history_request(100)))
+        assert len(request.chat_history) == CHAT_HISTORY_PROMPT_LIMIT
+        assert request.ist_history_total == 100
+
+    def test_short_histories_untouched(self):
+        request = IntentSkillRequest.model_validate(_history_request(2))
+        assert len(request.chat_history) == 2
+        assert request.chat_history_total == 2
+
+    def test_profile_skills_truncated(self):
+        data = {"utterance": "q", "student_profile": {"strong_skills": [f"s{i}" for i in range(100)]}}
+        request = IntentSkillRequest.model_validate(data)
+        assert len(request.student_profile.strong_skills) == 10
+
+    def test_endpoint_forwards_original_totals(self, client, monkeypatch):
+        seen = {}
+
+        def recording_extractor(**kwargs):
+            seen.update(kwargs)
+            return {"intent": "i", "skills": ["s"], "trajectory": ["t"]}
+
+        monkeypatch.setattr("dspy_flows.ist_extractor", recording_extractor)
+        response = client.post("/api/intent-skill-trajectory", json=_history_request(300))
+
+        assert response.status_code == 200
+        assert len(seen["chat_history"]) == CHAT_HISTORY_PROMPT_LIMIT
+        assert seen["chat_history_total"] == 300
+        assert seen["ist_history_total"] == 300
+
+    def test_prompt_sections_report_original_totals(self):
+        request = IntentSkillRequest.model_validate(_history_request(40))
+        module = IntentSkillTrajectoryModule()
+        chat = module._build_chat_history_section(request.chat_history, request.chat_history_total)
+        ist = module._build_ist_history_section(request.ist_history, request.ist_history_total)
+        assert chat.startswith("Recent chat history (40 messages)")
+        assert ist.startswith("Recent IST events (40 total)")
@@ -0,0 +1,194 @@
+"""
+Tests for the Python client (ist_client.py) and the batch endpoint it uses:
+micro-batching, per-item errors, retries with Retry-After and the fallback
+to single requests.
+"""
+
+import asyncio
+import email.utils
+import json
+import threading
+import time
+
+import httpx
+import pytest
+
+import app as app_module
+import ist_client
+from ist_client import AsyncISTClient, ISTClient, ISTServiceError, RetryPolicy
+
+NO_WAIT = RetryPolicy(base_delay_s=0.0, max_delay_s=0.0)
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """ASGI transport to the app that records the paths it was asked for."""
+
+    def __init__(self):
+        self.inner = httpx.ASGITransport(app=app_module.app)
+        self.paths = []
+
+    async def handle_async_request(self, request):
+        self.paths.append(request.url.path)
+        return await self.inner.handle_async_request(request)
+
+
+def _run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.mark.unit
+class TestModelsAndRetry:
+    @pytest.mark.parametrize("name", ["ChatMessage", "IstHistoryItem", "StudentProfile", "IntentSkillRequest",
+                                      "IntentSkillResponse"])
+    def test_models_mirror_the_service(self, name):
+        assert set(getattr(ist_client, name).model_fields) == set(getattr(app_module, name).model_fields)
+
+    def test_backoff_respects_retry_after(self):
+        policy = RetryPolicy(base_delay_s=0.1, max_delay_s=1.0, max_retry_after_s=30)
+        assert all(0 <= policy.delay(attempt) <= 1.0 for attempt in range(10))
+        assert policy.delay(0, retry_after=2.5) >= 2.5
+        assert policy.delay(0, retry_after=3600) == 30
+        assert ist_client._retry_after("7") == 7
+        http_date = email.utils.formatdate(time.time() + 20, usegmt=True)
+        assert 15 < ist_client._retry_after(http_date) <= 20
+        assert ist_client._retry_after("soon") is None
+
+    def test_transient_errors_are_retried(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            if len(calls) == 1:
+                raise httpx.ConnectError("refused")
+            if len(calls) == 2:
+                return httpx.Response(429, headers={"Retry-After": "0"}, json={"detail": "budget"})
+            return httpx.Response(200, json={"intent": "i", "skills": ["s"], "trajectory": ["t"]})
+
+        async def scenario():
+            async with AsyncISTClient(retry=NO_WAIT, transport=httpx.MockTransport(handler)) as client:
+                return await client.extract(utterance="q"), client.stats()
+
+        result, stats = _run(scenario())
+        assert result.intent == "i" and stats["retries"] == 2
+        keys = {json.loads(request.content)["idempotency_key"] for request in calls}
+        assert len(keys) == 1  # the retries reuse the call's idempotency key
+
+    def test_client_errors_are_not_retried(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(400, json={"detail": "Validation error"})
+
+        async def scenario():
+            async with AsyncISTClient(retry=NO_WAIT, transport=httpx.MockTransport(handler)) as client:
+                await client.extract(utterance="q")
+
+        with pytest.raises(ISTServiceError) as exc:
+            _run(scenario())
+        assert (exc.value.status_code, exc.value.transient, len(calls)) == (400, False, 1)
+
+
+@pytest.mark.integration
+class TestBatching:
+    def test_concurrent_calls_share_one_batch_request(self):
+        transport = RecordingTransport()
+
+        async def scenario():
+            async with AsyncISTClient(transport=transport, max_batch=16, batch_window_ms=20) as client:
+                results = await client.extract_many([{"utterance": f"Question {i}"} for i in range(10)])
+                single = await client.extract(utterance="Alone")
+                return results, single, client.stats()
+
+        results, single, stats = _run(scenario())
+        assert [r.intent for r in results] == [f"Student is asking about: Question {i}..." for i in range(10)]
+        assert single.intent.startswith("Student is asking about: Alone")
+        assert transport.paths == ["/api/intent-skill-trajectory/batch", "/api/intent-skill-trajectory"]
+        assert (stats["batches"], stats["batched_calls"]) == (1, 10)
+
+    def test_batches_are_split_at_max_batch(self):
+        transport = RecordingTransport()
+
+        async def scenario():
+            async with AsyncISTClient(transport=transport, max_batch=4, batch_window_ms=20) as client:
+                return await client.extract_many([{"utterance": f"Question {i}"} for i in range(10)])
+
+        assert len(_run(scenario())) == 10
+        assert transport.paths == ["/api/intent-skill-trajectory/batch"] * 3  # 4 + 4 + 2
+
+    def test_failed_items_fail_alone(self):
+        async def scenario():
+            async with AsyncISTClient(transport=RecordingTransport(), retry=NO_WAIT) as client:
+                return await client.extract_many([{"utterance": "fine"}, {"utterance": "trigger an error"}],
+                                                 return_exceptions=True)
+
+        ok, failed = _run(scenario())
+        assert ok.skills == ["Skill A", "Skill B"]
+        assert isinstance(failed, ISTServiceError) and failed.status_code == 400
+
+    def test_falls_back_to_single_requests_without_the_batch_endpoint(self):
+        def handler(request):
+            if request.url.path.endswith("/batch"):
+                return httpx.Response(404, json={"detail": "Not Found"})
+            body = json.loads(request.content)
+            return httpx.Response(200, json={"intent": body["utterance"], "skills": [], "trajectory": []})
+
+        async def scenario():
+            async with AsyncISTClient(transport=httpx.MockTransport(handler)) as client:
+                first = await client.extract_many([{"utterance": "a"}, {"utterance": "b"}])
+                second = await client.extract_many([{"utterance": "c"}, {"utterance": "d"}])
+                return first + second, client.stats()
+
+        results, stats = _run(scenario())
+        assert [r.intent for r in results] == ["a", "b", "c", "d"]
+        assert (stats["batch_endpoint"], stats["requests"]) == (False, 5)
+
+    def test_sync_client_batches_calls_from_several_threads(self):
+        transport = RecordingTransport()
+        results = {}
+        with ISTClient(transport=transport, batch_window_ms=50) as client:
+            threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, client.extract(utterance=f"Q{i}")))
+                       for i in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert client.stats()["batched_calls"] >= 2
+        assert sorted(results) == list(range(6))
+        assert results[3].intent.startswith("Student is asking about: Q3")
+
+
+@pytest.mark.integration
+def test_batch_endpoint_limits_and_order(client):
+    response = client.post("/api/intent-skill-trajectory/batch",
+                           json={"requests": [{"utterance": "one"}, {"utterance": "trigger an error"}, {"utterance": "three"}]})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert results[0]["result"]["intent"].startswith("Student is asking about: one")
+    assert results[1]["error"]["status_code"] == 400
+    assert results[2]["result"]["intent"].startswith("Student is asking about: three")
+    too_many = [{"utterance": "q"}] * (app_module.BATCH_MAX_ITEMS + 1)
+    assert client.post("/api/intent-skill-trajectory/batch", json={"requests": too_many}).status_code == 422
+
+
+@pytest.mark.integration
+def test_batch_items_overlap_up_to_the_concurrency_limit(client, monkeypatch):
+    import dspy_flows
+
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def extractor(utterance, **kwargs):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)  # a blocking LM call
+        with lock:
+            running[0] -= 1
+        return {"intent": f"i {utterance}", "skills": [], "trajectory": []}
+
+    monkeypatch.setattr(dspy_flows, "ist_extractor", extractor)
+    monkeypatch.setattr(app_module, "BATCH_CONCURRENCY", 3)
+    response = client.post("/api/intent-skill-trajectory/batch",
+                           json={"requests": [{"utterance": f"q{i}"} for i in range(6)]})
+    assert [r["result"]["intent"] for r in response.json()["results"]] == [f"i q{i}" for i in range(6)]
+    assert peak[0] == 3
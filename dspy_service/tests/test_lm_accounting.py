@@ -0,0 +1,253 @@
+"""
+Tests for LM token/cost accounting (lm_accounting.py): the bounded call journal,
+per-request headers, per-course/per-user totals, token budgets and a 100k-call
+RSS soak test.
+"""
+
+import contextvars
+import gc
+import json
+import os
+import sys
+import threading
+
+import dspy
+import pytest
+
+import app as app_module
+from lm_accounting import (
+    AccountingLM,
+    BudgetConfig,
+    LMAccountant,
+    TokenBudgetExceeded,
+    count_lm_calls,
+)
+from traffic_capture import CaptureWriter
+
+MOCK_COMPLETION = "[[ ## answer ## ]]\nok\n\n[[ ## completed ## ]]"
+
+
+def _mock_lm(accountant, cache=False):
+    # litellm's mock_response returns a completion (with usage) without any network I/O.
+    return AccountingLM("openai/mock", api_key="test", cache=cache, mock_response=MOCK_COMPLETION, accountant=accountant)
+
+
+class _Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.unit
+class TestAccountant:
+    def test_journal_is_a_ring_buffer(self):
+        accountant = LMAccountant(journal_size=3)
+        for i in range(10):
+            accountant.record_call("m", {"prompt_tokens": i, "completion_tokens": 1})
+        recent = accountant.recent()
+        assert [r["prompt_tokens"] for r in recent] == [7, 8, 9]
+        assert accountant.stats()["calls"] == 10
+        assert accountant.stats()["prompt_tokens"] == sum(range(10))
+
+    def test_request_scope_attributes_course_and_user(self):
+        accountant = LMAccountant()
+        with accountant.request_scope("cs101", "u1") as usage:
+            accountant.record_call("m", {"prompt_tokens": 100, "completion_tokens": 20})
+            accountant.record_call("m", {}, cache_hit=True)
+        accountant.record_call("m", {"prompt_tokens": 5, "completion_tokens": 5})  # outside any request
+
+        assert (usage.calls, usage.cache_hits, usage.total_tokens) == (2, 1, 120)
+        assert usage.headers()["X-LM-Prompt-Tokens"] == "100"
+        assert accountant.course_totals("cs101")["total_tokens"] == 120
+        assert accountant.user_totals("u1")["calls"] == 2
+        assert accountant.stats()["total_tokens"] == 130
+
+    def test_configured_prices_used_when_provider_reports_no_cost(self):
+        accountant = LMAccountant(prompt_cost_per_1k=1.0, completion_cost_per_1k=2.0)
+        record = accountant.record_call("m", {"prompt_tokens": 1000, "completion_tokens": 500})
+        assert record["cost"] == pytest.approx(2.0)
+        assert accountant.record_call("m", {"prompt_tokens": 1000}, cost=0.25)["cost"] == 0.25
+
+    def test_tenant_tables_are_bounded(self):
+        accountant = LMAccountant(max_tenants=5)
+        for i in range(50):
+            with accountant.request_scope(f"course-{i}", f"user-{i}"):
+                accountant.record_call("m", {"prompt_tokens": 1})
+        stats = accountant.stats()
+        assert sorted(stats["courses"]) == [f"course-{i}" for i in range(45, 50)]
+        assert stats["users_tracked"] == 5
+
+    def test_concurrent_calls_in_one_request_are_all_counted(self):
+        accountant = LMAccountant()
+
+        def calls():
+            for _ in range(2000):
+                accountant.record_call("m", {"prompt_tokens": 1, "completion_tokens": 1})
+
+        with accountant.request_scope("cs101", "u1") as usage, count_lm_calls() as counter:
+            # Threads started inside the scope see its usage and counter, like the decomposed pipeline's.
+            threads = [threading.Thread(target=contextvars.copy_context().run, args=(calls,)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert (usage.calls, usage.total_tokens) == (16000, 32000)
+        assert (counter.calls, counter.prompt_tokens) == (16000, 16000)
+
+    def test_spill_to_rotating_jsonl(self, tmp_path):
+        writer = CaptureWriter(tmp_path, max_bytes=500, max_files=3, prefix="lm-journal")
+        accountant = LMAccountant(journal_size=2, spill=writer)
+        for i in range(40):
+            accountant.record_call("m", {"prompt_tokens": i})
+        accountant.close()
+
+        files = sorted(tmp_path.glob("lm-journal-*.jsonl"))
+        assert len(files) == 3
+        last = [json.loads(line) for line in files[-1].read_text().splitlines()]
+        assert last[-1]["prompt_tokens"] == 39
+
+
+@pytest.mark.unit
+class TestBudgets:
+    def test_course_budget_blocks_until_window_rolls(self):
+        clock = _Clock()
+        accountant = LMAccountant(budgets=BudgetConfig(per_course=100, window_s=3600), clock=clock)
+        accountant.check_budget("cs101", None)  # unseen tenants are always allowed
+        with accountant.request_scope("cs101"):
+            accountant.record_call("m", {"prompt_tokens": 80, "completion_tokens": 30})
+
+        with pytest.raises(TokenBudgetExceeded) as exc_info:
+            accountant.check_budget("cs101", "someone")
+        assert exc_info.value.tenant == "course:cs101"
+        assert 1 <= exc_info.value.retry_after_s <= 3600
+        accountant.check_budget("cs202", None)
+
+        clock.now += 3600
+        accountant.check_budget("cs101", None)
+
+    def test_user_budget(self):
+        accountant = LMAccountant(budgets=BudgetConfig(per_user=10))
+        with accountant.request_scope("cs101", "u1"):
+            accountant.record_call("m", {"prompt_tokens": 10})
+        with pytest.raises(TokenBudgetExceeded):
+            accountant.check_budget("cs101", "u1")
+        accountant.check_budget("cs101", "u2")
+
+
+@pytest.mark.integration
+class TestAccountingLM:
+    def test_calls_recorded_instead_of_history(self):
+        accountant = LMAccountant()
+        lm = _mock_lm(accountant)
+        global_before = len(dspy.clients.base_lm.GLOBAL_HISTORY)
+
+        with accountant.request_scope("cs101", "u1") as usage:
+            lm("What is recursion?")
+
+        record = accountant.recent()[-1]
+        assert record["prompt_tokens"] > 0 and record["completion_tokens"] > 0
+        assert record["latency_ms"] is not None
+        assert record["cache_hit"] is False
+        assert usage.calls == 1
+        assert lm.history == []
+        assert len(dspy.clients.base_lm.GLOBAL_HISTORY) == global_before
+
+    def test_cache_hits_are_flagged(self):
+        accountant = LMAccountant()
+        lm = _mock_lm(accountant, cache=True)
+        lm("cache me please")
+        lm("cache me please")
+        first, second = accountant.recent()[-2:]
+        assert second["cache_hit"] is True
+        assert second["prompt_tokens"] == 0
+
+    def test_response_without_usage_is_not_a_cache_hit(self):
+        accountant = LMAccountant()
+        lm = _mock_lm(accountant)
+        lm.update_history({"model": "openai/mock", "usage": {}, "response": object()})
+        assert accountant.recent()[-1]["cache_hit"] is False
+
+
+@pytest.mark.integration
+class TestEndpointAccounting:
+    @pytest.fixture
+    def accountant(self, monkeypatch):
+        accountant = LMAccountant(budgets=BudgetConfig(per_user=50))
+        monkeypatch.setattr(app_module, "get_accountant", lambda: accountant)
+        return accountant
+
+    def test_usage_headers_and_totals(self, client, accountant, monkeypatch):
+        def extractor(**kwargs):
+            accountant.record_call("m", {"prompt_tokens": 30, "completion_tokens": 12})
+            return {"intent": "i", "skills": ["s"], "trajectory": ["t"]}
+
+        monkeypatch.setattr("dspy_flows.ist_extractor", extractor)
+        response = client.post("/api/intent-skill-trajectory",
+                               json={"utterance": "q", "course_id": "cs101", "user_id": "u1"})
+
+        assert response.status_code == 200
+        assert response.headers["X-LM-Calls"] == "1"
+        assert response.headers["X-LM-Total-Tokens"] == "42"
+        assert accountant.course_totals("cs101")["prompt_tokens"] == 30
+
+        metrics = client.get("/api/metrics").json()
+        assert metrics["lm"]["courses"]["cs101"]["total_tokens"] == 42
+
+    def test_budget_exhausted_returns_429(self, client, accountant, monkeypatch):
+        def extractor(**kwargs):
+            accountant.record_call("m", {"prompt_tokens": 60})
+            return {"intent": "i", "skills": ["s"], "trajectory": ["t"]}
+
+        monkeypatch.setattr("dspy_flows.ist_extractor", extractor)
+        body = {"utterance": "q", "user_id": "u1"}
+        assert client.post("/api/intent-skill-trajectory", json=body).status_code == 200
+
+        response = client.post("/api/intent-skill-trajectory", json=body)
+        assert response.status_code == 429
+        assert response.json()["detail"]["error"] == "token_budget_exceeded"
+        assert int(response.headers["Retry-After"]) >= 1
+
+
+def _rss_bytes() -> int:
+    with open("/proc/self/statm") as handle:
+        return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+@pytest.mark.slow
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads RSS from /proc")
+def test_rss_flat_over_100k_calls():
+    """
+    100k real LM.__call__ invocations (1% fresh completions, the rest served
+    from DSPy's memory cache) across 20 courses and 1,000 users must not grow
+    RSS: the journal, tenant tables and DSPy history all stay bounded.
+    """
+    dspy.configure_cache(enable_disk_cache=False, enable_memory_cache=True)
+    accountant = LMAccountant(journal_size=1000)
+    cached_lm = _mock_lm(accountant, cache=True)
+    fresh_lm = _mock_lm(accountant, cache=False)
+    prompts = [f"soak prompt {i}" for i in range(200)]
+
+    def run(start, count):
+        for i in range(start, start + count):
+            with accountant.request_scope(f"course-{i % 20}", f"user-{i % 1000}"):
+                if i % 100 == 0:
+                    fresh_lm(f"fresh prompt {i}")
+                else:
+                    cached_lm(prompts[i % len(prompts)])
+
+    run(0, 5_000)  # warm-up: fill the journal, cache and tenant tables
+    gc.collect()
+    baseline = _rss_bytes()
+
+    run(5_000, 100_000)
+    gc.collect()
+    growth = _rss_bytes() - baseline
+
+    stats = accountant.stats()
+    assert stats["calls"] == 105_000
+    assert stats["journal_size"] == 1000
+    assert cached_lm.history == [] and fresh_lm.history == []
+    assert growth < 8 * 1024 * 1024, f"RSS grew by {growth / 1024 / 1024:.1f} MiB"
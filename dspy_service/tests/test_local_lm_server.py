@@ -0,0 +1,184 @@
+"""
+Tests for the local OpenAI-compatible LM stand-in (local_lm_server.py)
+and the LLM_PROVIDER=local configuration path.
+"""
+
+import contextlib
+import io
+import json
+
+import dspy
+import pytest
+from fastapi.testclient import TestClient
+
+import dspy_flows
+from local_lm_server import (
+    LocalLMConfig,
+    build_completion_text,
+    create_app,
+    requested_output_fields,
+)
+
+
+CHAT_BODY = {
+    "model": "local-ist",
+    "messages": [
+        {"role": "system", "content": "Your input fields are: ..."},
+        {
+            "role": "user",
+            "content": (
+                "[[ ## utterance ## ]]\nHow does recursion work?\n\n"
+                "[[ ## course_context ## ]]\nCourse: cs101\n\n"
+                "Respond with the corresponding output fields, starting with the field `[[ ## reasoning ## ]]`, "
+                "then `[[ ## structured_analysis ## ]]`, and then ending with the marker for `[[ ## completed ## ]]`."
+            ),
+        },
+    ],
+}
+
+
+def _structured_analysis(text: str) -> str:
+    return text.split("[[ ## structured_analysis ## ]]\n", 1)[1].split("\n\n[[ ## completed ## ]]", 1)[0]
+
+
+@pytest.mark.unit
+class TestContentGeneration:
+    """Prompt parsing and IST-shaped output."""
+
+    def test_chat_adapter_fields_detected(self):
+        fields, fmt = requested_output_fields(CHAT_BODY)
+        assert fmt == "chat"
+        assert fields == [("reasoning", False), ("structured_analysis", False)]
+
+    def test_json_adapter_fields_detected(self):
+        body = {"messages": [{"role": "user", "content": (
+            "[[ ## utterance ## ]]\nsorting\n\nRespond with a JSON object in the following order of fields: "
+            "`intent`, then `skills` (must be formatted as a valid Python list[str])."
+        )}]}
+        fields, fmt = requested_output_fields(body)
+        assert fmt == "json"
+        assert fields == [("intent", False), ("skills", True)]
+
+    def test_response_format_schema_wins(self):
+        body = dict(CHAT_BODY, response_format={"type": "json_schema", "json_schema": {"schema": {
+            "properties": {"intent": {"type": "string"}, "trajectory": {"type": "array"}},
+        }}})
+        payload = json.loads(build_completion_text(body))
+        assert set(payload) == {"intent", "trajectory"}
+        assert 4 <= len(payload["trajectory"]) <= 5
+
+    def test_structured_analysis_is_ist_json(self):
+        analysis = json.loads(_structured_analysis(build_completion_text(CHAT_BODY)))
+        assert "recursion" in analysis["intent"].lower()
+        assert 4 <= len(analysis["skills"]) <= 7
+        assert 4 <= len(analysis["trajectory"]) <= 5
+
+    def test_output_is_deterministic_per_utterance(self):
+        assert build_completion_text(CHAT_BODY) == build_completion_text(CHAT_BODY)
+
+    @pytest.mark.parametrize("kind", ["fenced", "truncated", "prose"])
+    def test_malformed_variants_break_json(self, kind):
+        analysis = _structured_analysis(build_completion_text(CHAT_BODY, malformed_kind=kind))
+        with pytest.raises(json.JSONDecodeError):
+            json.loads(analysis)
+
+    def test_config_validation(self):
+        config = LocalLMConfig().updated({"error_rate": "0.5", "malformed_kinds": "fenced,prose"})
+        assert config.error_rate == 0.5
+        assert config.malformed_kinds == ["fenced", "prose"]
+        with pytest.raises(ValueError):
+            LocalLMConfig().updated({"malformed_kinds": "garbled"})
+        with pytest.raises(ValueError):
+            LocalLMConfig().updated({"nonsense": 1})
+
+    def test_latency_distributions(self):
+        import random
+        rng = random.Random(0)
+        assert LocalLMConfig(latency_ms=100).sample_latency_s(rng) == 0.1
+        uniform = LocalLMConfig(latency_ms=100, latency_distribution="uniform", latency_spread=0.5)
+        assert all(0.05 <= uniform.sample_latency_s(rng) <= 0.15 for _ in range(100))
+        lognormal = LocalLMConfig(latency_ms=100, latency_distribution="lognormal", latency_spread=0.3)
+        assert all(lognormal.sample_latency_s(rng) > 0 for _ in range(100))
+
+
+@pytest.mark.integration
+class TestStandInApi:
+    """HTTP behaviour of the stand-in."""
+
+    def test_completion_shape_and_usage(self):
+        client = TestClient(create_app(LocalLMConfig()))
+        data = client.post("/v1/chat/completions", json=CHAT_BODY).json()
+        assert data["object"] == "chat.completion"
+        assert data["choices"][0]["message"]["role"] == "assistant"
+        assert data["usage"]["completion_tokens"] > 0
+        assert data["usage"]["total_tokens"] == data["usage"]["prompt_tokens"] + data["usage"]["completion_tokens"]
+
+    def test_error_injection(self):
+        client = TestClient(create_app(LocalLMConfig(error_rate=1.0)))
+        response = client.post("/v1/chat/completions", json=CHAT_BODY)
+        assert response.status_code == 500
+        assert client.get("/admin/stats").json()["errors"] == 1
+
+    def test_rate_limit_injection(self):
+        client = TestClient(create_app(LocalLMConfig(rate_limit_rate=1.0, retry_after_s=2)))
+        response = client.post("/v1/chat/completions", json=CHAT_BODY)
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "2"
+
+    def test_streaming_reassembles_to_full_text(self):
+        client = TestClient(create_app(LocalLMConfig()))
+        body = dict(CHAT_BODY, stream=True, stream_options={"include_usage": True})
+        with client.stream("POST", "/v1/chat/completions", json=body) as response:
+            events = [line[len("data: "):] for line in response.iter_lines() if line.startswith("data: ")]
+        assert events[-1] == "[DONE]"
+        chunks = [json.loads(e) for e in events[:-1]]
+        text = "".join(c["choices"][0]["delta"].get("content", "") for c in chunks if c["choices"])
+        assert text == build_completion_text(CHAT_BODY)
+        assert chunks[-1]["usage"]["completion_tokens"] > 0
+
+    def test_admin_config_round_trip(self):
+        client = TestClient(create_app(LocalLMConfig()))
+        assert client.post("/admin/config", json={"malformed_rate": 1, "malformed_kinds": "prose"}).status_code == 200
+        data = client.post("/v1/chat/completions", json=CHAT_BODY).json()
+        assert "Sure! Here is the analysis" in data["choices"][0]["message"]["content"]
+        assert client.post("/admin/config", json={"latency_distribution": "bogus"}).status_code == 400
+
+
+@pytest.mark.integration
+class TestDspyAgainstStandIn:
+    """The real IST module runs end to end against the stand-in over HTTP."""
+
+    def _run(self, lm, **kwargs):
+        module = dspy_flows.IntentSkillTrajectoryModule()
+        with dspy.context(lm=lm), contextlib.redirect_stdout(io.StringIO()):
+            return module(**kwargs)
+
+    def test_ist_module_parses_stand_in_output(self, lm_server):
+        lm = dspy.LM("openai/local-ist", api_base=lm_server.base_url, api_key="local", cache=False)
+        result = self._run(lm, utterance="Why does my linked list lose nodes?", course_context="Course: cs101")
+        assert not dspy_flows.is_fallback_result(result)
+        assert "Linked lists" in result["skills"]
+
+    def test_fenced_output_is_repaired(self, lm_server):
+        lm_server.configure(malformed_rate=1.0, malformed_kinds="fenced")
+        try:
+            lm = dspy.LM("openai/local-ist", api_base=lm_server.base_url, api_key="local", cache=False)
+            result = self._run(lm, utterance="Explain merge sort", course_context="Course: cs101")
+        finally:
+            lm_server.configure(malformed_rate=0.0)
+        assert not dspy_flows.is_fallback_result(result)
+        assert "Sorting algorithms" in result["skills"]
+
+    def test_local_provider_configuration(self, lm_server, monkeypatch):
+        configured = {}
+        monkeypatch.setenv("LLM_PROVIDER", "local")
+        monkeypatch.setenv("LOCAL_LM_BASE_URL", lm_server.base_url)
+        monkeypatch.delenv("LLM_MODEL", raising=False)
+        monkeypatch.setattr(dspy_flows, "_LM_CONFIGURED", False)
+        monkeypatch.setattr(dspy_flows.dspy, "configure", lambda **kwargs: configured.update(kwargs))
+
+        dspy_flows._configure_lm_once()
+
+        lm = configured["lm"]
+        assert lm.model == "openai/local-ist"
+        assert lm.kwargs["api_base"] == lm_server.base_url
@@ -0,0 +1,170 @@
+"""
+Tests for the typed structured-output mode (dspy_flows.TypedISTModule),
+per-mode retry/fallback statistics and LM call counting.
+"""
+
+from types import SimpleNamespace
+from typing import List
+
+import dspy
+import pytest
+from dspy.utils.exceptions import AdapterParseError
+
+import dspy_flows
+from dspy_flows import (
+    FALLBACK_RESULT,
+    IntentSkillTrajectoryModule,
+    OutputModeStats,
+    TypedISTModule,
+    TypedISTSignature,
+    get_ist_program,
+    resolve_output_mode,
+)
+from lm_accounting import AccountingLM, LMAccountant, count_lm_calls
+
+GOOD = SimpleNamespace(intent="Understand merge sort.", skills=["Merge sort", "Recursion"], trajectory=["Trace it", "Code it"])
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    stats = OutputModeStats()
+    monkeypatch.setattr(dspy_flows, "output_mode_stats", stats)
+    return stats
+
+
+@pytest.mark.unit
+class TestModeSelection:
+    def test_default_explicit_and_unknown(self, monkeypatch):
+        monkeypatch.delenv("IST_OUTPUT_MODE", raising=False)
+        assert resolve_output_mode(None) == "json_string"
+        monkeypatch.setenv("IST_OUTPUT_MODE", "typed")
+        assert resolve_output_mode(None) == "typed"
+        assert resolve_output_mode("json_string") == "json_string"
+        assert resolve_output_mode("xml") == "json_string"
+
+    def test_get_ist_program_routes_typed(self, monkeypatch):
+        monkeypatch.delenv("IST_OUTPUT_MODE", raising=False)
+        monkeypatch.setattr(dspy_flows, "typed_extractor", None)
+        program = get_ist_program("cs101", output_mode="typed")
+        assert isinstance(program, TypedISTModule)
+        assert get_ist_program("cs101", output_mode="typed") is program
+        assert get_ist_program("cs101") is dspy_flows.ist_extractor
+
+    def test_typed_signature_fields(self):
+        fields = TypedISTSignature.output_fields
+        assert list(fields) == ["intent", "skills", "trajectory"]
+        assert fields["skills"].annotation == List[str]
+
+
+@pytest.mark.unit
+class TestTypedModule:
+    def test_decoded_fields_are_returned_as_is(self, fresh_stats, quiet):
+        module = TypedISTModule()
+        module.predict = lambda **kwargs: GOOD
+        result = quiet(module, utterance="How does merge sort work?")
+        assert result == {"intent": GOOD.intent, "skills": GOOD.skills, "trajectory": GOOD.trajectory}
+        assert fresh_stats.stats()["typed"]["requests"] == 1
+
+    def test_decode_error_is_retried_with_new_rollout(self, quiet):
+        calls = []
+
+        def predict(config=None, **kwargs):
+            calls.append(config)
+            if len(calls) == 1:
+                raise AdapterParseError(adapter_name="JSONAdapter", signature=TypedISTSignature, lm_response="{")
+            return GOOD
+
+        module = TypedISTModule(format_retries=1)
+        module.predict = predict
+        assert quiet(module, utterance="q")["intent"] == GOOD.intent
+        assert calls == [{}, {"rollout_id": 1}]
+
+    def test_exhausted_retries_and_empty_fields_fall_back(self, fresh_stats, quiet):
+        def never_decodes(**kwargs):
+            raise AdapterParseError(adapter_name="JSONAdapter", signature=TypedISTSignature, lm_response="{")
+
+        module = TypedISTModule(format_retries=2)
+        module.predict = never_decodes
+        assert quiet(module, utterance="q") == FALLBACK_RESULT
+
+        module.predict = lambda **kwargs: SimpleNamespace(intent="x", skills=[], trajectory=["a"])
+        assert quiet(module, utterance="q") == FALLBACK_RESULT
+        assert fresh_stats.stats()["typed"]["fallbacks"] == 2
+
+
+@pytest.mark.unit
+class TestStats:
+    def test_rates_per_mode(self):
+        stats = OutputModeStats()
+        stats.record("typed", latency_ms=10, lm_calls=1, fallback=False)
+        stats.record("typed", latency_ms=30, lm_calls=2, fallback=True)
+        stats.record_repair("json_string")
+        typed = stats.stats()["typed"]
+        assert typed["format_retries"] == 1
+        assert typed["format_retry_rate"] == 0.5
+        assert typed["fallback_rate"] == 0.5
+        assert typed["latency_ms"]["count"] == 2
+        assert stats.stats()["json_string"]["repairs"] == 1
+
+    def test_count_lm_calls_nests(self):
+        accountant = LMAccountant()
+        with count_lm_calls() as outer:
+            accountant.record_call("m", {"prompt_tokens": 1})
+            with count_lm_calls() as inner:
+                accountant.record_call("m", {"prompt_tokens": 1})
+        accountant.record_call("m", {"prompt_tokens": 1})
+        assert (outer.calls, inner.calls) == (2, 1)
+
+
+@pytest.fixture(scope="module")
+def malformed_lm(serve_local_lm):
+    return serve_local_lm(seed=5, malformed_rate=1.0, malformed_kinds=("truncated",))
+
+
+@pytest.mark.integration
+class TestAgainstStandIn:
+    def _lm(self, server):
+        return AccountingLM("openai/local-ist", api_base=server.base_url, api_key="local", cache=False, accountant=LMAccountant())
+
+    def test_typed_mode_decodes_clean_replies(self, malformed_lm, fresh_stats, quiet):
+        malformed_lm.configure(malformed_rate=0.0)
+        try:
+            with dspy.context(lm=self._lm(malformed_lm)):
+                result = quiet(TypedISTModule(), utterance="Why does my linked list lose nodes?")
+        finally:
+            malformed_lm.configure(malformed_rate=1.0)
+        assert "Linked lists" in result["skills"]
+        assert fresh_stats.stats()["typed"]["lm_calls"] == 1
+
+    def test_typed_mode_retries_then_falls_back(self, malformed_lm, fresh_stats, quiet):
+        with dspy.context(lm=self._lm(malformed_lm)):
+            result = quiet(TypedISTModule(format_retries=1), utterance="How does merge sort work?")
+        assert result == FALLBACK_RESULT
+        typed = fresh_stats.stats()["typed"]
+        assert (typed["lm_calls"], typed["format_retries"], typed["fallbacks"]) == (2, 1, 1)
+
+    def test_json_string_mode_counts_repairs(self, malformed_lm, fresh_stats, quiet):
+        with dspy.context(lm=self._lm(malformed_lm)):
+            quiet(IntentSkillTrajectoryModule(), utterance="How does merge sort work?")
+        entry = fresh_stats.stats()["json_string"]
+        assert entry["requests"] == 1
+        assert entry["repairs"] + entry["fallbacks"] >= 1
+
+
+@pytest.mark.integration
+class TestEndpoint:
+    def test_output_mode_selectable_per_request(self, client, monkeypatch):
+        monkeypatch.setattr(dspy_flows, "typed_extractor",
+                            lambda **kwargs: {"intent": "typed intent", "skills": ["A"], "trajectory": ["1"]})
+        typed = client.post("/api/intent-skill-trajectory", json={"utterance": "q", "output_mode": "typed"})
+        default = client.post("/api/intent-skill-trajectory", json={"utterance": "q"})
+        assert typed.json()["intent"] == "typed intent"
+        assert default.json()["intent"] != "typed intent"
+
+    def test_unknown_output_mode_rejected(self, client):
+        response = client.post("/api/intent-skill-trajectory", json={"utterance": "q", "output_mode": "xml"})
+        assert response.status_code == 422
+
+    def test_metrics_include_output_modes(self, client, fresh_stats):
+        fresh_stats.record("typed", latency_ms=5, lm_calls=1, fallback=False)
+        assert client.get("/api/metrics").json()["output_modes"]["typed"]["requests"] == 1
@@ -0,0 +1,195 @@
+"""
+Tests for the lazy per-course DSPy program registry (dspy_flows.ProgramRegistry).
+"""
+
+import os
+import threading
+import time
+
+import dspy
+import pytest
+
+import dspy_flows
+from dspy_flows import (
+    IntentSkillTrajectoryModule,
+    ProgramRegistry,
+    get_ist_program,
+    program_artifact_path,
+    resolve_course_id,
+)
+
+
+def _save_artifact(directory, course_id, demo_utterance):
+    program = IntentSkillTrajectoryModule()
+    for predictor in program.predictors():
+        predictor.demos = [dspy.Example(utterance=demo_utterance, reasoning="r", structured_analysis="{}")]
+    path = program_artifact_path(str(directory), course_id)
+    program.save(path)
+    return path
+
+
+def _demo_utterance(program):
+    return program.predictors()[0].demos[0]["utterance"]
+
+
+@pytest.mark.unit
+class TestResolveCourseId:
+    def test_explicit_id_wins(self):
+        assert resolve_course_id("cs101", "Course: other") == "cs101"
+
+    def test_parsed_from_context(self):
+        assert resolve_course_id(None, "Course: algo-2026") == "algo-2026"
+        assert resolve_course_id("", "course: ds") == "ds"
+
+    def test_none_without_course(self):
+        assert resolve_course_id(None, "Intro to Algorithms") is None
+        assert resolve_course_id(None, None) is None
+
+    def test_artifact_path_is_sanitized(self, tmp_path):
+        path = program_artifact_path(str(tmp_path), "../etc/passwd")
+        assert os.path.dirname(path) == str(tmp_path)
+
+
+@pytest.mark.unit
+class TestProgramRegistry:
+    def test_loads_course_program_lazily(self, tmp_path):
+        _save_artifact(tmp_path, "cs101", "course tuned demo")
+        registry = ProgramRegistry(str(tmp_path))
+
+        assert registry.stats()["loaded"] == []
+        program = registry.get("cs101")
+        assert _demo_utterance(program) == "course tuned demo"
+        assert registry.get("cs101") is program
+        stats = registry.stats()
+        assert stats["loads"] == 1
+        assert stats["hits"] == 1
+
+    def test_unknown_course_returns_none(self, tmp_path):
+        registry = ProgramRegistry(str(tmp_path))
+        assert registry.get("nope") is None
+        assert registry.get("nope") is None
+        assert registry.get(None) is None
+        assert registry.stats()["defaults"] == 2
+
+    def test_lru_eviction(self, tmp_path):
+        for course in ("a", "b", "c"):
+            _save_artifact(tmp_path, course, course)
+        registry = ProgramRegistry(str(tmp_path), capacity=2)
+
+        registry.get("a")
+        registry.get("b")
+        registry.get("a")  # a is now most recently used
+        registry.get("c")  # evicts b
+
+        stats = registry.stats()
+        assert stats["loaded"] == ["a", "c"]
+        assert stats["evictions"] == 1
+
+    def test_concurrent_first_access_loads_once(self, tmp_path):
+        _save_artifact(tmp_path, "cs101", "demo")
+        load_count = []
+
+        class SlowModule(IntentSkillTrajectoryModule):
+            def load(self, path, **kwargs):
+                load_count.append(path)
+                time.sleep(0.05)
+                return super().load(path, **kwargs)
+
+        registry = ProgramRegistry(str(tmp_path), program_factory=SlowModule)
+        results = []
+        barrier = threading.Barrier(16)
+
+        def worker():
+            barrier.wait()
+            results.append(registry.get("cs101"))
+
+        threads = [threading.Thread(target=worker) for _ in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(load_count) == 1
+        assert len(results) == 16
+        assert all(r is results[0] for r in results)
+
+    def test_hot_swap_keeps_old_program_usable(self, tmp_path):
+        path = _save_artifact(tmp_path, "cs101", "v1")
+        registry = ProgramRegistry(str(tmp_path), check_interval_s=0)
+        in_flight = registry.get("cs101")
+
+        _save_artifact(tmp_path, "cs101", "v2")
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+
+        swapped = registry.get("cs101")
+        assert swapped is not in_flight
+        assert _demo_utterance(swapped) == "v2"
+        # The request that already held v1 still has an intact program.
+        assert _demo_utterance(in_flight) == "v1"
+        assert registry.stats()["reloads"] == 1
+
+    def test_broken_artifact_keeps_previous_version(self, tmp_path):
+        path = _save_artifact(tmp_path, "cs101", "v1")
+        registry = ProgramRegistry(str(tmp_path), check_interval_s=0)
+        good = registry.get("cs101")
+
+        with open(path, "w") as handle:
+            handle.write("{not json")
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+
+        assert registry.get("cs101") is good
+        assert registry.stats()["load_errors"] == 1
+
+    def test_failed_first_load_is_negative_cached(self, tmp_path):
+        path = program_artifact_path(str(tmp_path), "cs101")
+        with open(path, "w") as handle:
+            handle.write("{not json")
+        registry = ProgramRegistry(str(tmp_path), check_interval_s=0, failure_ttl_s=60)
+
+        assert [registry.get("cs101") for _ in range(5)] == [None] * 5
+        assert registry.stats()["load_errors"] == 1
+
+        registry.failure_ttl_s = 0  # TTL over: the next request tries the disk again
+        _save_artifact(tmp_path, "cs101", "fixed")
+        assert _demo_utterance(registry.get("cs101")) == "fixed"
+
+    def test_removed_artifact_falls_back_to_default(self, tmp_path):
+        path = _save_artifact(tmp_path, "cs101", "v1")
+        registry = ProgramRegistry(str(tmp_path), check_interval_s=0)
+        assert registry.get("cs101") is not None
+        os.remove(path)
+        assert registry.get("cs101") is None
+
+
+@pytest.mark.integration
+class TestRegistryRouting:
+    def test_get_ist_program_falls_back_to_default(self, tmp_path, monkeypatch):
+        default = object()
+        monkeypatch.setattr(dspy_flows, "ist_extractor", default)
+        monkeypatch.setattr(dspy_flows, "program_registry", ProgramRegistry(str(tmp_path)))
+        assert get_ist_program("unknown") is default
+        assert get_ist_program(None) is default
+
+    def test_endpoint_uses_course_program(self, client, tmp_path, monkeypatch):
+        calls = []
+
+        def course_program(**kwargs):
+            calls.append(kwargs["utterance"])
+            return {"intent": "course specific", "skills": ["s"], "trajectory": ["t"]}
+
+        class StubRegistry:
+            def get(self, course_id):
+                return course_program if course_id == "cs101" else None
+
+        monkeypatch.setattr(dspy_flows, "program_registry", StubRegistry())
+
+        by_id = client.post("/api/intent-skill-trajectory", json={"utterance": "q1", "course_id": "cs101"})
+        by_context = client.post("/api/intent-skill-trajectory", json={"utterance": "q2", "course_context": "Course: cs101"})
+        other = client.post("/api/intent-skill-trajectory", json={"utterance": "q3", "course_id": "cs999"})
+
+        assert by_id.json()["intent"] == "course specific"
+        assert by_context.json()["intent"] == "course specific"
+        assert other.json()["intent"] != "course specific"
+        assert calls == ["q1", "q2"]
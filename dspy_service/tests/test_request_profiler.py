@@ -0,0 +1,161 @@
+"""
+Tests for on-demand and sampled request profiling (request_profiler.py) and
+its endpoints.
+"""
+
+import contextlib
+import contextvars
+import io
+import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import app as app_module
+import request_profiler
+from request_profiler import RequestProfiler, folded_stack, to_folded, to_speedscope
+
+TOKEN = "s3cret"
+
+
+def _slow_lm_call(seconds=0.08):
+    time.sleep(seconds)
+
+
+def slow_extractor(**kwargs):
+    _slow_lm_call()
+    return {"intent": "profiled", "skills": ["A"], "trajectory": ["1"]}
+
+
+@pytest.mark.unit
+class TestFormats:
+    def test_folded_stack_is_root_to_leaf(self):
+        stack = folded_stack(__import__("sys")._getframe())
+        assert stack.split(";")[-1].startswith("test_folded_stack_is_root_to_leaf (tests/test_request_profiler.py:")
+
+    def test_speedscope_shares_frames(self):
+        samples = Counter({"main (a.py:1);work (a.py:5)": 3, "main (a.py:1)": 1})
+        doc = to_speedscope(samples, 5.0, "x")
+        assert [f["name"] for f in doc["shared"]["frames"]] == ["main", "work"]
+        assert doc["shared"]["frames"][1] == {"name": "work", "file": "a.py", "line": 5}
+        profile = doc["profiles"][0]
+        assert profile["samples"] == [[0, 1], [0]]
+        assert profile["weights"] == [15.0, 5.0]
+        assert profile["endValue"] == 20.0
+
+    def test_folded_text(self):
+        assert to_folded(Counter({"a;b": 2})) == "a;b 2\n"
+
+
+@pytest.mark.unit
+class TestProfiler:
+    def test_disabled_by_default(self, tmp_path, quiet):
+        profiler = RequestProfiler(directory=tmp_path)
+        assert not profiler.enabled
+        assert not quiet(profiler.authorized, "anything")
+        with profiler.session("r") as session:
+            assert session is None
+        with request_profiler.follow():
+            pass
+        assert list(tmp_path.iterdir()) == []
+
+    def test_explicit_session_saves_files(self, tmp_path):
+        profiler = RequestProfiler(token=TOKEN, directory=tmp_path, interval_ms=1)
+        assert profiler.authorized(TOKEN)
+        with _quiet_session(profiler, explicit=True) as session:
+            _slow_lm_call()
+        assert session.saved_as.endswith(".speedscope.json")
+        doc = json.loads((tmp_path / session.saved_as).read_text())
+        names = {frame["name"] for frame in doc["shared"]["frames"]}
+        assert "_slow_lm_call" in names
+        folded = (tmp_path / session.saved_as.replace(".speedscope.json", ".folded")).read_text()
+        assert "_slow_lm_call" in folded
+        assert profiler.stats()["explicit"] == 1
+
+    def test_one_in_n_sampling_aggregates(self, tmp_path):
+        profiler = RequestProfiler(directory=tmp_path, sample_every=2, interval_ms=1)
+        sampled = []
+        for _ in range(4):
+            with profiler.session("r") as session:
+                sampled.append(session is not None)
+                if session is not None:
+                    _slow_lm_call(0.03)
+        assert sampled == [False, True, False, True]
+        assert "_slow_lm_call" in profiler.aggregate("folded")
+        assert list(tmp_path.iterdir()) == []  # sampled requests are not saved one by one
+
+        doc = profiler.aggregate(reset=True)
+        assert doc["profiles"][0]["samples"]
+        assert profiler.aggregate("folded") == ""
+
+    def test_worker_threads_join_via_follow(self, tmp_path):
+        profiler = RequestProfiler(token=TOKEN, directory=tmp_path, interval_ms=1)
+
+        def sub_predictor():
+            with request_profiler.follow():
+                _slow_lm_call(0.06)
+
+        def unrelated():
+            _slow_lm_call(0.06)
+
+        with ThreadPoolExecutor(2) as pool, _quiet_session(profiler, explicit=True) as session:
+            other = pool.submit(unrelated)
+            pool.submit(contextvars.copy_context().run, sub_predictor).result()
+            other.result()
+        stacks = list(session.samples)
+        assert any("sub_predictor" in stack for stack in stacks)
+        assert not any("unrelated" in stack for stack in stacks)
+
+    def test_unsafe_profile_names_rejected(self, tmp_path):
+        profiler = RequestProfiler(token=TOKEN, directory=tmp_path)
+        (tmp_path / "ok.speedscope.json").write_text("{}")
+        assert profiler.profile_path("ok.speedscope.json") is not None
+        assert profiler.profile_path("../ok.speedscope.json") is None
+        assert profiler.profile_path("missing.json") is None
+
+
+@contextlib.contextmanager
+def _quiet_session(profiler, explicit):
+    with contextlib.redirect_stdout(io.StringIO()), profiler.session("test", explicit=explicit) as session:
+        yield session
+
+
+@pytest.mark.integration
+class TestEndpoints:
+    @pytest.fixture
+    def profiler(self, tmp_path, monkeypatch):
+        profiler = RequestProfiler(token=TOKEN, directory=tmp_path, sample_every=1, interval_ms=1)
+        monkeypatch.setattr(app_module, "request_profiler", profiler)
+        monkeypatch.setattr("dspy_flows.ist_extractor", slow_extractor)
+        return profiler
+
+    def test_header_profiles_one_request(self, client, profiler):
+        response = client.post("/api/intent-skill-trajectory", json={"utterance": "q"},
+                               headers={"X-IST-Profile": TOKEN})
+        name = response.headers["X-IST-Profile-File"]
+        download = client.get(f"/api/profile/{name}", headers={"X-IST-Profile": TOKEN})
+        assert download.status_code == 200
+        assert "_slow_lm_call" in {f["name"] for f in download.json()["shared"]["frames"]}
+
+    def test_query_flag_and_wrong_token(self, client, profiler):
+        ok = client.post(f"/api/intent-skill-trajectory?profile={TOKEN}", json={"utterance": "q"})
+        wrong = client.post("/api/intent-skill-trajectory?profile=guess", json={"utterance": "q"})
+        assert "X-IST-Profile-File" in ok.headers
+        assert wrong.status_code == 200
+        assert "X-IST-Profile-File" not in wrong.headers
+
+    def test_aggregate_download(self, client, profiler):
+        client.post("/api/intent-skill-trajectory", json={"utterance": "q"})
+        folded = client.get("/api/profile?format=folded", headers={"X-IST-Profile": TOKEN})
+        assert "slow_extractor" in folded.text
+        assert client.get("/api/profile").status_code == 403
+        assert client.get("/api/metrics").json()["profiler"]["sampled"] == 1
+
+    def test_downloads_disabled_without_token(self, client, monkeypatch):
+        monkeypatch.setattr(app_module, "request_profiler", RequestProfiler())
+        assert client.get("/api/profile", headers={"X-IST-Profile": "x"}).status_code == 404
+        response = client.post("/api/intent-skill-trajectory", json={"utterance": "q"}, headers={"X-IST-Profile": "x"})
+        assert response.status_code == 200
+        assert "X-IST-Profile-File" not in response.headers
@@ -0,0 +1,305 @@
+"""
+Tests for the near-duplicate IST cache (semantic_cache.py): MinHash features,
+the per-course LSH index, context compatibility, eviction, the endpoint
+integration and the capture-based evaluation tool.
+"""
+
+import json
+
+import pytest
+
+import app as app_module
+from dspy_flows import FALLBACK_RESULT
+from semantic_cache import (
+    CacheContext,
+    MinHasher,
+    SemanticISTCache,
+    chat_digest,
+    context_from_request,
+    evaluate,
+    is_follow_up,
+    main,
+    utterance_features,
+)
+
+KNAPSACK = {"intent": "Understand DP for knapsack", "skills": ["Dynamic programming", "Knapsack"],
+            "trajectory": ["Review DP", "Solve 0/1 knapsack"]}
+LINKED_LIST = {"intent": "Reverse a linked list", "skills": ["Linked lists", "Pointers"],
+               "trajectory": ["Trace pointers", "Implement reverse"]}
+THREAD_A = [{"role": "student", "content": "I'm stuck on the knapsack problem in my homework"},
+            {"role": "tutor", "content": "Which part?"},
+            {"role": "student", "content": "the dynamic programming table for knapsack"}]
+THREAD_B = [{"role": "student", "content": "we started dynamic programming this week"},
+            {"role": "tutor", "content": "Great, what's unclear?"},
+            {"role": "student", "content": "knapsack problem tables confuse me"}]
+THREAD_C = [{"role": "student", "content": "my linked list loses nodes when I insert"}]
+EMPTY = CacheContext()
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.unit
+class TestFeatures:
+    def test_paraphrase_with_abbreviation_is_identical(self):
+        a = utterance_features("how does DP work for knapsack?")
+        b = utterance_features("explain knapsack dynamic programming")
+        assert a == b
+
+    def test_minhash_estimates_jaccard(self):
+        hasher = MinHasher(num_perm=128)
+        a = utterance_features("How do I reverse a linked list?")
+        b = utterance_features("reversing a linked list in place")
+        exact = len(a & b) / len(a | b)
+        estimate = hasher.similarity(hasher.signature(a), hasher.signature(b))
+        assert abs(estimate - exact) < 0.15
+
+    def test_unrelated_utterances_are_dissimilar(self):
+        hasher = MinHasher()
+        a = hasher.signature(utterance_features("how does DP work for knapsack?"))
+        b = hasher.signature(utterance_features("what is a linked list"))
+        assert hasher.similarity(a, b) < 0.2
+
+
+@pytest.mark.unit
+class TestSemanticCache:
+    def test_hit_on_paraphrase_in_same_course(self):
+        cache = SemanticISTCache()
+        assert cache.store("cs101", "how does DP work for knapsack?", EMPTY, KNAPSACK)
+
+        hit = cache.lookup("cs101", "explain knapsack dynamic programming", EMPTY)
+        assert hit is not None
+        assert hit.result == KNAPSACK
+        assert hit.similarity == 1.0
+        assert cache.lookup("cs101", "what is a linked list", EMPTY) is None
+
+    def test_courses_are_isolated(self):
+        cache = SemanticISTCache()
+        cache.store("cs101", "how does DP work for knapsack?", EMPTY, KNAPSACK)
+        assert cache.lookup("cs202", "how does DP work for knapsack?", EMPTY) is None
+
+    def test_incompatible_context_misses(self):
+        cache = SemanticISTCache()
+        stored = CacheContext(course_context="course: cs101", recent_skills=("Recursion",))
+        cache.store("cs101", "how does DP work for knapsack?", stored, KNAPSACK)
+
+        other_topic = CacheContext(course_context="course: cs101", recent_skills=("Graphs", "BFS"))
+        other_context = CacheContext(course_context="course: cs101 week 9", recent_skills=("Recursion",))
+        assert cache.lookup("cs101", "how does DP work for knapsack?", other_topic) is None
+        assert cache.lookup("cs101", "how does DP work for knapsack?", other_context) is None
+        assert cache.lookup("cs101", "how does DP work for knapsack?", stored) is not None
+
+    def test_threshold_is_tunable(self):
+        strict, loose = SemanticISTCache(threshold=0.95), SemanticISTCache(threshold=0.3)
+        for cache in (strict, loose):
+            cache.store("cs101", "How do I reverse a linked list?", EMPTY, LINKED_LIST)
+        assert strict.lookup("cs101", "reversing a linked list in place", EMPTY) is None
+        assert loose.lookup("cs101", "reversing a linked list in place", EMPTY) is not None
+
+    def test_fallback_results_are_not_stored(self):
+        cache = SemanticISTCache()
+        assert not cache.store("cs101", "anything", EMPTY, dict(FALLBACK_RESULT))
+        assert cache.stats()["stores"] == 0
+
+    def test_per_course_capacity_evicts_oldest(self):
+        cache = SemanticISTCache(per_course_capacity=2)
+        cache.store("cs101", "how does DP work for knapsack?", EMPTY, KNAPSACK)
+        cache.store("cs101", "How do I reverse a linked list?", EMPTY, LINKED_LIST)
+        cache.store("cs101", "what is a hash table", EMPTY, KNAPSACK)
+
+        assert cache.lookup("cs101", "how does DP work for knapsack?", EMPTY) is None
+        assert cache.lookup("cs101", "How do I reverse a linked list?", EMPTY) is not None
+        stats = cache.stats()
+        assert stats["entries"] == {"cs101": 2}
+        assert stats["evictions"] == 1
+
+    def test_course_count_is_bounded(self):
+        cache = SemanticISTCache(max_courses=2)
+        for course in ("a", "b", "c"):
+            cache.store(course, "how does DP work for knapsack?", EMPTY, KNAPSACK)
+        assert set(cache.stats()["entries"]) == {"b", "c"}
+
+    def test_entries_expire(self):
+        clock = _Clock()
+        cache = SemanticISTCache(ttl_s=60, clock=clock)
+        cache.store("cs101", "how does DP work for knapsack?", EMPTY, KNAPSACK)
+        clock.now += 61
+        assert cache.lookup("cs101", "how does DP work for knapsack?", EMPTY) is None
+        assert cache.stats()["expired"] == 1
+
+    def test_hit_rate_metrics(self):
+        cache = SemanticISTCache()
+        cache.store("cs101", "how does DP work for knapsack?", EMPTY, KNAPSACK)
+        cache.lookup("cs101", "explain knapsack dynamic programming", EMPTY)
+        cache.lookup("cs101", "what is a linked list", EMPTY)
+        stats = cache.stats()
+        assert (stats["lookups"], stats["hits"], stats["misses"]) == (2, 1, 1)
+        assert stats["hit_rate"] == 0.5
+
+    def test_program_and_follow_up_chat_digest_must_match(self):
+        cache = SemanticISTCache()
+        stored = CacheContext(program="abc/monolithic", follow_up=True,
+                              chat_digest=chat_digest([{"role": "student", "content": "DP?"}]))
+        cache.store("cs101", "how does DP work for knapsack?", stored, KNAPSACK)
+        same_turns = CacheContext(program="abc/monolithic", follow_up=True,
+                                  chat_digest=chat_digest([{"role": "student", "content": " dp? "}]))
+        assert cache.lookup("cs101", "how does DP work for knapsack?", same_turns) is not None
+        assert cache.lookup("cs101", "how does DP work for knapsack?", CacheContext(program="abc/decomposed",
+                                                                                    chat_digest=stored.chat_digest)) is None
+        assert cache.lookup("cs101", "how does DP work for knapsack?", CacheContext(program="abc/monolithic")) is None
+
+    def test_similar_threads_share_entries(self):
+        cache = SemanticISTCache()
+        cache.store("cs101", "how does DP work for knapsack?", context_from_request(
+            "cs101", chat_history=THREAD_A, utterance="how does DP work for knapsack?"), KNAPSACK)
+        other_thread = context_from_request("cs101", chat_history=THREAD_B,
+                                            utterance="explain knapsack dynamic programming")
+        assert not other_thread.follow_up
+        assert cache.lookup("cs101", "explain knapsack dynamic programming", other_thread) is not None
+        unrelated = context_from_request("cs101", chat_history=THREAD_C, utterance="explain knapsack dynamic programming")
+        assert cache.lookup("cs101", "explain knapsack dynamic programming", unrelated) is None
+        no_history = context_from_request("cs101", utterance="explain knapsack dynamic programming")
+        assert cache.lookup("cs101", "explain knapsack dynamic programming", no_history) is None
+
+    @pytest.mark.parametrize("utterance, expected", [
+        ("can you give an example?", True),
+        ("why?", True),
+        ("how does this work", True),
+        ("what is recursion?", False),
+        ("explain knapsack dynamic programming", False),
+    ])
+    def test_follow_up_detection(self, utterance, expected):
+        assert is_follow_up(utterance) is expected
+
+    def test_context_from_request_dicts(self):
+        context = context_from_request(
+            "  Course:  CS101 ",
+            [{"skills": ["Recursion"]}, {"skills": ["Older"]}],
+            {"strong_skills": ["Loops"], "weak_skills": ["Pointers"]},
+        )
+        assert context == CacheContext("course: cs101", ("Loops", "Pointers"), ("Recursion",))
+
+
+@pytest.mark.integration
+class TestEndpointCache:
+    def test_second_similar_request_skips_the_module(self, client, monkeypatch):
+        calls = []
+
+        def extractor(**kwargs):
+            calls.append(kwargs["utterance"])
+            return dict(KNAPSACK)
+
+        monkeypatch.setattr("dspy_flows.ist_extractor", extractor)
+        monkeypatch.setattr(app_module, "semantic_cache", SemanticISTCache())
+
+        first = client.post("/api/intent-skill-trajectory",
+                            json={"utterance": "how does DP work for knapsack?", "course_id": "cs101"})
+        second = client.post("/api/intent-skill-trajectory",
+                             json={"utterance": "explain knapsack dynamic programming", "course_id": "cs101"})
+
+        assert first.headers["X-IST-Cache"] == "miss"
+        assert second.headers["X-IST-Cache"] == "hit"
+        assert second.json()["skills"] == KNAPSACK["skills"]
+        assert calls == ["how does DP work for knapsack?"]
+        assert client.get("/api/metrics").json()["semantic_cache"]["hits"] == 1
+
+    def test_pipelines_do_not_share_entries(self, client, monkeypatch):
+        calls = []
+
+        def monolithic(**kwargs):
+            calls.append("monolithic")
+            return dict(KNAPSACK)
+
+        def decomposed(**kwargs):
+            calls.append("decomposed")
+            return dict(KNAPSACK)
+
+        monkeypatch.setattr("dspy_flows.ist_extractor", monolithic)
+        monkeypatch.setattr("dspy_flows.get_decomposed_extractor", lambda: decomposed)
+        monkeypatch.setattr(app_module, "semantic_cache", SemanticISTCache())
+        body = {"utterance": "how does DP work for knapsack?", "course_id": "cs101"}
+
+        first = client.post("/api/intent-skill-trajectory", json=body)
+        second = client.post("/api/intent-skill-trajectory", json={**body, "pipeline": "decomposed"})
+        third = client.post("/api/intent-skill-trajectory", json={**body, "pipeline": "decomposed"})
+
+        assert [r.headers["X-IST-Cache"] for r in (first, second, third)] == ["miss", "miss", "hit"]
+        assert calls == ["monolithic", "decomposed"]
+
+    def test_follow_ups_are_keyed_on_the_conversation(self, client, monkeypatch):
+        monkeypatch.setattr("dspy_flows.ist_extractor", lambda **kwargs: dict(KNAPSACK))
+        monkeypatch.setattr(app_module, "semantic_cache", SemanticISTCache())
+
+        def ask(topic):
+            history = [{"role": "student", "content": f"Explain {topic}"}, {"role": "tutor", "content": "Sure."}]
+            return client.post("/api/intent-skill-trajectory", json={
+                "utterance": "can you give an example?", "course_id": "cs101", "chat_history": history,
+            }).headers["X-IST-Cache"]
+
+        assert [ask("knapsack"), ask("linked lists"), ask("knapsack")] == ["miss", "miss", "hit"]
+
+    def test_paraphrase_hits_across_threads(self, client, monkeypatch):
+        calls = []
+
+        def extractor(**kwargs):
+            calls.append(kwargs["utterance"])
+            return dict(KNAPSACK)
+
+        monkeypatch.setattr("dspy_flows.ist_extractor", extractor)
+        monkeypatch.setattr(app_module, "semantic_cache", SemanticISTCache())
+        first = client.post("/api/intent-skill-trajectory", json={
+            "utterance": "how does DP work for knapsack?", "course_id": "cs101", "chat_history": THREAD_A,
+            "thread_id": "thread-a"})
+        second = client.post("/api/intent-skill-trajectory", json={
+            "utterance": "explain knapsack dynamic programming", "course_id": "cs101", "chat_history": THREAD_B,
+            "thread_id": "thread-b"})
+        assert [first.headers["X-IST-Cache"], second.headers["X-IST-Cache"]] == ["miss", "hit"]
+        assert calls == ["how does DP work for knapsack?"]
+
+    def test_fallback_answers_are_not_reused(self, client, monkeypatch):
+        monkeypatch.setattr("dspy_flows.ist_extractor", lambda **kwargs: dict(FALLBACK_RESULT))
+        cache = SemanticISTCache()
+        monkeypatch.setattr(app_module, "semantic_cache", cache)
+        for _ in range(2):
+            client.post("/api/intent-skill-trajectory", json={"utterance": "how does DP work for knapsack?"})
+        assert cache.stats()["hits"] == 0
+
+
+def _capture(utterance, result, course="cs101"):
+    return {"status": 200, "request": {"utterance": utterance, "course_id": course}, "response": result}
+
+
+@pytest.mark.unit
+class TestEvaluation:
+    RECORDS = [
+        _capture("how does DP work for knapsack?", KNAPSACK),
+        _capture("explain knapsack dynamic programming", KNAPSACK),
+        _capture("How do I reverse a linked list?", LINKED_LIST),
+        _capture("reversing a linked list in place", LINKED_LIST),
+        # Lexically similar to the knapsack question but a different answer.
+        _capture("how does DP work for knapsack with repetition?", LINKED_LIST),
+        {"status": 500, "request": {"utterance": "x"}, "response": None},
+    ]
+
+    def test_precision_and_recall_per_threshold(self):
+        rows = {row["threshold"]: row for row in evaluate(self.RECORDS, [0.3, 0.99])}
+        loose, strict = rows[0.3], rows[0.99]
+
+        assert loose["requests"] == 5
+        assert loose["servable"] == 3
+        assert loose["recall"] > strict["recall"]
+        assert loose["precision"] < 1.0
+        assert strict["precision"] == 1.0
+
+    def test_cli_reads_capture_files(self, tmp_path, capsys):
+        path = tmp_path / "capture-1.jsonl"
+        path.write_text("".join(json.dumps(r) + "\n" for r in self.RECORDS))
+        assert main([str(tmp_path), "--thresholds", "0.7", "--json"]) == 0
+        rows = json.loads(capsys.readouterr().out)
+        assert rows[0]["threshold"] == 0.7
+        assert rows[0]["hits"] >= 1
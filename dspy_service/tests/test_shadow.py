@@ -0,0 +1,150 @@
+"""
+Tests for shadow traffic (shadow.py): sampling, the bounded droppable pool,
+agreement metrics and the endpoint hook.
+"""
+
+import contextlib
+import io
+import json
+import threading
+import time
+
+import dspy
+import pytest
+
+import app as app_module
+from lm_accounting import AccountingLM, LMAccountant
+from shadow import Candidate, ShadowRunner, compare
+
+PRIMARY = {
+    "intent": "Student wants to understand recursion.",
+    "skills": ["Recursion", "Base cases", "Call stack"],
+    "trajectory": ["Trace factorial", "Write a base case"],
+}
+SHADOW = {
+    "intent": "Student is trying to fix a recursion error.",
+    "skills": ["Recursion", "Base cases"],
+    "trajectory": ["Trace factorial", "Write a base case"],
+}
+INPUTS = {"utterance": "How does recursion work?", "course_context": "Course: cs101", "course_id": "cs101"}
+
+
+def _runner(candidate=lambda inputs: SHADOW, **kwargs):
+    kwargs.setdefault("rate", 1.0)
+    return ShadowRunner(candidate, label="test", **kwargs)
+
+
+@pytest.mark.unit
+class TestCompare:
+    def test_agreement_metrics(self):
+        comparison = compare(PRIMARY, SHADOW)
+        assert comparison["intent_category_agreement"] is False  # conceptual_question vs debugging
+        assert comparison["intent_exact"] is False
+        assert comparison["skills_jaccard"] == pytest.approx(2 / 3, abs=1e-4)
+        assert comparison["trajectory_jaccard"] == 1.0
+        assert compare(PRIMARY, PRIMARY)["intent_category_agreement"] is True
+
+
+@pytest.mark.unit
+class TestRunner:
+    def test_sampled_requests_are_compared(self, tmp_path):
+        runner = _runner(log_path=tmp_path / "shadow.jsonl")
+        assert runner.submit(INPUTS, PRIMARY, 120.0, {"prompt_tokens": 300, "completion_tokens": 80})
+        assert runner.drain()
+        stats = runner.stats()
+        assert (stats["sampled"], stats["completed"], stats["compared"]) == (1, 1, 1)
+        assert stats["agreement"]["intent_category"] == 0.0
+        assert stats["tokens_per_request"]["primary"] == 380
+        assert stats["latency_ms"]["primary"]["max"] == 120.0
+        runner.close()
+        record = json.loads((tmp_path / "shadow.jsonl").read_text().splitlines()[0])
+        assert record["shadow"]["result"]["intent"] == SHADOW["intent"]
+        assert record["course_id"] == "cs101"
+
+    def test_rate_zero_mirrors_nothing(self):
+        runner = _runner(rate=0.0)
+        assert not any(runner.submit(INPUTS, PRIMARY, 1.0) for _ in range(50))
+        assert runner.stats()["sampled"] == 0
+        runner.close()
+
+    def test_full_queue_drops_without_blocking(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow(inputs):
+            started.set()
+            release.wait(5)
+            return SHADOW
+
+        runner = _runner(slow, workers=1, max_queue=1)
+        runner.submit(INPUTS, PRIMARY, 1.0)
+        assert started.wait(5)
+        began = time.perf_counter()
+        accepted = [runner.submit(INPUTS, PRIMARY, 1.0) for _ in range(5)]
+        assert time.perf_counter() - began < 0.05
+        assert accepted == [True, False, False, False, False]
+        assert runner.stats()["dropped_queue_full"] == 4
+        release.set()
+        runner.close()
+        assert runner.stats()["completed"] == 2
+
+    def test_shadow_work_is_dropped_while_primary_is_busy(self):
+        runner = _runner(max_primary_inflight=1)
+        with runner.primary():
+            assert runner.submit(INPUTS, PRIMARY, 1.0) is False
+        assert runner.stats()["dropped_load"] == 1
+        assert runner.submit(INPUTS, PRIMARY, 1.0) is True
+        runner.close()
+
+    def test_candidate_errors_are_counted(self):
+        def broken(inputs):
+            raise RuntimeError("candidate down")
+
+        runner = _runner(broken)
+        with contextlib.redirect_stdout(io.StringIO()):
+            runner.submit(INPUTS, PRIMARY, 1.0)
+            runner.drain()
+        assert (runner.stats()["errors"], runner.stats()["completed"]) == (1, 0)
+        runner.close()
+
+    def test_env_configuration(self, monkeypatch):
+        monkeypatch.delenv("IST_SHADOW_RATE", raising=False)
+        assert ShadowRunner.from_env() is None
+        monkeypatch.setenv("IST_SHADOW_RATE", "0.1")
+        for name in ("IST_SHADOW_MODEL", "IST_SHADOW_PIPELINE", "IST_SHADOW_OUTPUT_MODE", "IST_SHADOW_PROGRAM"):
+            monkeypatch.delenv(name, raising=False)
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert ShadowRunner.from_env() is None  # no candidate configured
+            monkeypatch.setenv("IST_SHADOW_MODEL", "openai/gpt-4.1-nano")
+            runner = ShadowRunner.from_env()
+        assert (runner.rate, runner.label) == (0.1, "model=openai/gpt-4.1-nano")
+        runner.close()
+
+
+@pytest.mark.integration
+class TestIntegration:
+    def test_candidate_model_and_pipeline_against_stand_in(self, lm_server):
+        primary_lm = AccountingLM("openai/local-ist", api_base=lm_server.base_url, api_key="local", cache=False,
+                                  accountant=LMAccountant())
+        candidate = Candidate(model="openai/local-ist-small", pipeline="decomposed")
+        with dspy.context(lm=primary_lm):
+            candidate._resolve()  # the shadow threads see the copy made from the configured LM
+        runner = ShadowRunner(candidate, rate=1.0)
+        with contextlib.redirect_stdout(io.StringIO()):
+            runner.submit(dict(INPUTS, utterance="How does merge sort work?"), PRIMARY, 50.0)
+            assert runner.drain()
+        stats = runner.stats()
+        runner.close()
+        assert stats["completed"] == 1
+        assert stats["tokens_per_request"]["shadow"] > 0
+        assert primary_lm.accountant.recent()[-1]["model"] == "openai/local-ist-small"
+
+    def test_endpoint_mirrors_after_response(self, client, monkeypatch):
+        runner = _runner()
+        monkeypatch.setattr(app_module, "shadow_runner", runner)
+        response = client.post("/api/intent-skill-trajectory", json={"utterance": "How does recursion work?"})
+        assert response.status_code == 200
+        assert runner.drain()
+        stats = client.get("/api/metrics").json()["shadow"]
+        assert stats["completed"] == 1
+        assert stats["agreement"]["mean_skills_jaccard"] == 0.0  # mock primary skills are "Skill A"/"Skill B"
+        runner.close()
@@ -0,0 +1,373 @@
+"""
+Tests for the cross-worker shared cache (shared_cache.py), its RESP
+stand-in (local_resp_server.py) and the endpoint integration.
+"""
+
+import asyncio
+import subprocess
+import sys
+import textwrap
+import time
+from pathlib import Path
+
+import dspy
+import httpx
+import pytest
+
+import app as app_module
+import dspy_flows
+from dspy_flows import IntentSkillTrajectoryModule, TypedISTModule, service_program_fingerprint
+from local_resp_server import serve_in_thread
+from shared_cache import (
+    LMCacheTier,
+    LMCallCache,
+    RespStore,
+    SharedCache,
+    SharedISTCache,
+    SQLiteStore,
+    install_lm_cache_tier,
+    open_store,
+    program_fingerprint,
+)
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(scope="module")
+def resp_server():
+    server = serve_in_thread()
+    yield server
+    server.stop()
+
+
+@pytest.mark.unit
+class TestSQLiteStore:
+    def test_roundtrip_delete_and_namespaces(self, tmp_path):
+        store = SQLiteStore(tmp_path / "cache.db")
+        store.set("ist:a:1", b"one", namespace="ist:a")
+        store.set("ist:b:1", b"two", namespace="ist:b")
+        assert store.get("ist:a:1") == b"one"
+        assert store.get("missing") is None
+        assert store.delete_namespace("ist:a") == 1
+        assert set(store.namespaces()) == {"ist:b"}
+        assert store.stats()["bytes"] == 3
+
+    def test_ttl_expires_entries(self, tmp_path):
+        clock = FakeClock()
+        store = SQLiteStore(tmp_path / "cache.db", clock=clock)
+        store.set("k", b"v", ttl_s=10)
+        assert store.get("k") == b"v"
+        clock.now += 11
+        assert store.get("k") is None
+        assert store.stats()["expired"] == 1
+
+    def test_size_limit_evicts_least_recently_used(self, tmp_path):
+        clock = FakeClock()
+        store = SQLiteStore(tmp_path / "cache.db", max_bytes=1000, touch_interval_s=0, clock=clock)
+        for i in range(5):
+            clock.now += 1
+            store.set(f"k{i}", b"x" * 200)
+        clock.now += 1
+        store.get("k0")  # k0 is now the most recently used
+        clock.now += 1
+        store.set("k5", b"x" * 200)
+        stats = store.stats()
+        assert stats["bytes"] <= 900
+        assert stats["evictions"] == 2
+        assert store.get("k0") is not None
+        assert store.get("k1") is None and store.get("k2") is None
+
+    def test_another_process_sees_writes(self, tmp_path):
+        path = tmp_path / "cache.db"
+        store = SQLiteStore(path)
+        store.set("from-parent", b"p")
+        script = textwrap.dedent(f"""
+            import sys
+            sys.path.insert(0, {str(SERVICE_DIR)!r})
+            from shared_cache import SQLiteStore
+            store = SQLiteStore({str(path)!r})
+            assert store.get("from-parent") == b"p"
+            store.set("from-child", b"c")
+        """)
+        subprocess.run([sys.executable, "-c", script], check=True, timeout=60)
+        assert store.get("from-child") == b"c"
+
+    def test_open_store_urls(self, tmp_path, resp_server):
+        assert isinstance(open_store(f"sqlite:///{tmp_path}/c.db"), SQLiteStore)
+        assert isinstance(open_store(resp_server.url), RespStore)
+        with pytest.raises(ValueError):
+            open_store("memcached://x")
+
+
+@pytest.mark.integration
+class TestRespStore:
+    def test_roundtrip_ttl_and_namespace_delete(self, resp_server):
+        store = RespStore.from_url(resp_server.url)
+        store.clear()
+        store.set("lm:a", b"\x00binary\r\n", namespace="lm")
+        store.set("ist:x:1", b"v", ttl_s=0.05, namespace="ist:x")
+        assert store.get("lm:a") == b"\x00binary\r\n"
+        assert store.stats()["entries"] == 2
+        time.sleep(0.1)
+        assert store.get("ist:x:1") is None
+        assert store.delete_namespace("lm") == 1
+        assert store.get("lm:a") is None
+
+    def test_stand_in_lru_byte_limit(self):
+        server = serve_in_thread(max_bytes=100)
+        try:
+            store = RespStore.from_url(server.url)
+            for i in range(5):
+                store.set(f"k{i}", b"x" * 30)
+            assert store.get("k0") is None
+            assert store.get("k4") == b"x" * 30
+        finally:
+            server.stop()
+
+
+@pytest.mark.unit
+class TestFingerprint:
+    def test_prompt_changes_change_fingerprint(self):
+        base = program_fingerprint(IntentSkillTrajectoryModule())
+        assert program_fingerprint(IntentSkillTrajectoryModule()) == base
+        assert program_fingerprint(TypedISTModule()) != base
+
+        edited = IntentSkillTrajectoryModule()
+        _, predictor = edited.named_predictors()[0]
+        predictor.signature = predictor.signature.with_instructions("Be terse.")
+        assert program_fingerprint(edited) != base
+
+        with_demo = IntentSkillTrajectoryModule()
+        with_demo.named_predictors()[0][1].demos = [dspy.Example(utterance="q", ist_json="{}")]
+        assert program_fingerprint(with_demo) != base
+
+    def test_model_and_adapter_are_part_of_it(self):
+        module = IntentSkillTrajectoryModule()
+        a = program_fingerprint(module, lm=dspy.LM("openai/gpt-4o-mini"))
+        b = program_fingerprint(module, lm=dspy.LM("openai/gpt-4o"))
+        c = program_fingerprint(module, lm=dspy.LM("openai/gpt-4o"), adapter=dspy.JSONAdapter())
+        assert len({a, b, c}) == 3
+
+    def test_fingerprint_versions_ist_keys(self, tmp_path):
+        cache = SharedISTCache(SQLiteStore(tmp_path / "c.db"))
+        inputs = {"utterance": "How does merge sort work?", "course_context": ""}
+        old, new = IntentSkillTrajectoryModule(), TypedISTModule()
+        cache.store_result(old, "cs101", inputs, {"intent": "i", "skills": [], "trajectory": []})
+        assert cache.lookup(old, "cs101", inputs)["intent"] == "i"
+        assert cache.lookup(old, "cs102", inputs) is None
+        assert cache.lookup(new, "cs101", inputs) is None
+        assert cache.stats()["hit_rate"] == pytest.approx(1 / 3, abs=1e-3)
+
+
+@pytest.mark.unit
+class TestLMTier:
+    def test_dspy_cache_uses_tier_and_warm_start(self, tmp_path):
+        store = SQLiteStore(tmp_path / "c.db")
+        first = dspy.clients.cache.Cache(enable_disk_cache=False, enable_memory_cache=True,
+                                         disk_cache_dir=str(tmp_path / "unused"))
+        install_lm_cache_tier(LMCacheTier(store), cache=first)
+        request = {"model": "openai/x", "messages": [{"role": "user", "content": "hi"}]}
+        first.put(request, {"answer": 42})
+        assert len(store.recent("lm", 10)) == 1
+
+        # A "restarted worker": a fresh DSPy cache warmed from the shared store.
+        restarted = dspy.clients.cache.Cache(enable_disk_cache=False, enable_memory_cache=True,
+                                             disk_cache_dir=str(tmp_path / "unused"))
+        tier = LMCacheTier(store)
+        assert install_lm_cache_tier(tier, cache=restarted, warm_entries=10) == 1
+        assert restarted.get(request) == {"answer": 42}
+        assert tier.stats()["hits"] == 0  # served from the warmed memory layer
+
+        cold = dspy.clients.cache.Cache(enable_disk_cache=False, enable_memory_cache=True,
+                                        disk_cache_dir=str(tmp_path / "unused"))
+        cold_tier = LMCacheTier(store)
+        install_lm_cache_tier(cold_tier, cache=cold)
+        assert cold.get(request) == {"answer": 42}
+        assert cold_tier.stats()["hits"] == 1
+
+    def test_store_errors_are_misses(self):
+        class Broken:
+            def get(self, key):
+                raise ConnectionError("down")
+
+            set = get
+
+        tier = LMCacheTier(Broken())
+        assert tier.get("k") is None
+        assert tier.set("k", 1) is False
+        assert "k" not in tier
+        assert tier.stats()["errors"] == 2
+
+
+def _dspy_cache(tmp_path):
+    return dspy.clients.cache.Cache(enable_disk_cache=False, enable_memory_cache=True,
+                                    disk_cache_dir=str(tmp_path / "unused"))
+
+
+LM_REQUEST = {"model": "openai/x", "messages": [{"role": "user", "content": "hi"}]}
+
+
+@pytest.mark.unit
+class TestLMCallCache:
+    def test_entries_are_namespaced_by_fingerprint_and_old_ones_purged(self, tmp_path):
+        store = SQLiteStore(tmp_path / "c.db")
+        LMCacheTier(store).set("legacy", {"answer": 0})  # written before namespaces were versioned
+        old = LMCallCache(LMCacheTier(store))
+        cache = _dspy_cache(tmp_path)
+        old.install("aaaa", cache=cache)
+        cache.put(LM_REQUEST, {"answer": 1})
+
+        new = LMCallCache(LMCacheTier(store))
+        cache = _dspy_cache(tmp_path)
+        assert new.install("bbbb", cache=cache) == 0  # nothing to warm from another program version
+        assert cache.get(LM_REQUEST) is None
+        cache.put(LM_REQUEST, {"answer": 2})
+        assert {ns: info["current"] for ns, info in new.namespaces().items()} == {
+            "lm": False, "lm:aaaa": False, "lm:bbbb": True}
+
+        assert new.purge(older_than_s=3600) == {}  # both were used just now
+        assert new.purge() == {"lm": 1, "lm:aaaa": 1}
+        assert list(new.namespaces()) == ["lm:bbbb"]
+        assert new.stats()["purged_entries"] == 2
+
+        restarted = _dspy_cache(tmp_path)
+        assert LMCallCache(LMCacheTier(store)).install("bbbb", cache=restarted) == 1
+        assert restarted.get(LM_REQUEST) == {"answer": 2}
+
+    def test_resp_namespace_delete_is_exact(self, resp_server):
+        store = RespStore(port=resp_server.port, prefix=f"t{time.time_ns()}:")
+        store.set("lm:k1", b"1", namespace="lm")
+        store.set("lm:aaaa:k2", b"2", namespace="lm:aaaa")
+        assert store.delete_namespace("lm") == 1
+        assert store.get("lm:aaaa:k2") == b"2"
+
+    def test_from_env(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("IST_LM_CACHE_DIR", raising=False)
+        assert LMCallCache.from_env(None) is None
+        shared = SharedCache(SQLiteStore(tmp_path / "shared.db"), lm_tier=LMCacheTier(SQLiteStore(tmp_path / "shared.db")))
+        assert LMCallCache.from_env(shared).tier is shared.lm
+        monkeypatch.setenv("IST_LM_CACHE_DIR", str(tmp_path / "lm"))
+        monkeypatch.setenv("IST_LM_CACHE_MEMORY_ENTRIES", "50")
+        cache = LMCallCache.from_env(None)
+        assert cache.memory_entries == 50
+        assert cache.stats()["store"]["path"] == str(tmp_path / "lm" / "lm_calls.db")
+        cache.close()
+
+    def test_service_fingerprint_follows_signature_edits(self, monkeypatch):
+        before = service_program_fingerprint()
+        assert service_program_fingerprint() == before
+        monkeypatch.setattr(dspy_flows, "IntentSkillTrajectorySignature",
+                            dspy_flows.IntentSkillTrajectorySignature.with_instructions("Edited instructions."))
+        assert service_program_fingerprint() != before
+
+
+@pytest.mark.integration
+class TestLMCacheAdmin:
+    def test_requires_the_admin_token(self, client, monkeypatch):
+        monkeypatch.delenv("IST_ADMIN_TOKEN", raising=False)
+        assert client.get("/api/admin/lm-cache").status_code == 404
+        monkeypatch.setenv("IST_ADMIN_TOKEN", "secret")
+        assert client.post("/api/admin/lm-cache/purge", headers={"X-IST-Admin": "wrong"}).status_code == 403
+        monkeypatch.setattr(app_module, "lm_cache", None)
+        assert client.get("/api/admin/lm-cache", headers={"X-IST-Admin": "secret"}).status_code == 404
+
+    def test_lists_and_purges_namespaces(self, client, tmp_path, monkeypatch):
+        store = SQLiteStore(tmp_path / "c.db")
+        LMCacheTier(store, namespace="lm:old").set("k", 1)
+        cache = LMCallCache(LMCacheTier(store))
+        cache.install("new", cache=_dspy_cache(tmp_path))
+        cache.tier.set("k", 2)
+        monkeypatch.setattr(app_module, "lm_cache", cache)
+        monkeypatch.setenv("IST_ADMIN_TOKEN", "secret")
+        headers = {"X-IST-Admin": "secret"}
+
+        listed = client.get("/api/admin/lm-cache", headers=headers).json()
+        assert listed["stats"]["fingerprint"] == "new"
+        assert {ns: info["current"] for ns, info in listed["namespaces"].items()} == {"lm:old": False, "lm:new": True}
+        assert client.post("/api/admin/lm-cache/purge", params={"older_than_days": 1}, headers=headers).json()["deleted"] == {}
+        purged = client.post("/api/admin/lm-cache/purge", headers=headers).json()
+        assert purged == {"deleted": {"lm:old": 1}, "current": "lm:new"}
+        assert client.get("/api/metrics").json()["lm_cache"]["purged_namespaces"] == 1
+
+
+@pytest.mark.integration
+class TestEndpoint:
+    @pytest.fixture
+    def shared(self, tmp_path, monkeypatch):
+        cache = SharedCache(SQLiteStore(tmp_path / "c.db"))
+        monkeypatch.setattr(app_module, "shared_cache", cache)
+        monkeypatch.setattr(app_module, "semantic_cache", None)
+        return cache
+
+    def test_second_identical_request_is_served_from_shared_cache(self, client, shared, monkeypatch):
+        calls = []
+
+        def extractor(**kwargs):
+            calls.append(kwargs["utterance"])
+            return {"intent": "Understand recursion.", "skills": ["Recursion"], "trajectory": ["Trace it"]}
+
+        monkeypatch.setattr("dspy_flows.ist_extractor", extractor)
+        body = {"utterance": "Why does my recursion never stop?", "course_id": "cs101"}
+        first = client.post("/api/intent-skill-trajectory", json=body)
+        second = client.post("/api/intent-skill-trajectory", json=body)
+        other = client.post("/api/intent-skill-trajectory", json={**body, "course_id": "cs102"})
+        assert first.headers["X-IST-Shared-Cache"] == "miss"
+        assert second.headers["X-IST-Shared-Cache"] == "hit"
+        assert second.json() == first.json()
+        assert other.headers["X-IST-Shared-Cache"] == "miss"
+        assert len(calls) == 2
+        assert client.get("/api/metrics").json()["shared_cache"]["ist"]["hits"] == 1
+
+    def test_stream_uses_the_shared_cache(self, client, shared, monkeypatch):
+        calls = []
+
+        def extractor(**kwargs):
+            calls.append(kwargs["utterance"])
+            return {"intent": "Understand recursion.", "skills": ["Recursion"], "trajectory": ["Trace it"]}
+
+        monkeypatch.setattr("dspy_flows.ist_extractor", extractor)
+        body = {"utterance": "What is recursion?", "course_id": "cs101"}
+        first = client.post("/api/intent-skill-trajectory/stream", json=body)
+        second = client.post("/api/intent-skill-trajectory/stream", json=body)
+        assert (first.headers["X-IST-Shared-Cache"], second.headers["X-IST-Shared-Cache"]) == ("miss", "hit")
+        assert '"cache": "shared"' in second.text.strip().split("\n\n")[-1]
+        assert client.post("/api/intent-skill-trajectory", json=body).headers["X-IST-Shared-Cache"] == "hit"
+        assert len(calls) == 1
+
+    def test_slow_store_does_not_block_other_requests(self, shared, monkeypatch):
+        lookup = shared.ist.lookup
+
+        def slow_lookup(program, course_id, inputs):
+            if inputs["utterance"] == "slow":
+                time.sleep(0.3)  # a slow Redis round trip or a held SQLite write lock
+            return lookup(program, course_id, inputs)
+
+        monkeypatch.setattr(shared.ist, "lookup", slow_lookup)
+
+        async def scenario():
+            finished = []
+            transport = httpx.ASGITransport(app=app_module.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                async def post(utterance):
+                    await client.post("/api/intent-skill-trajectory", json={"utterance": utterance})
+                    finished.append(utterance)
+
+                await asyncio.gather(post("slow"), post("fast"))
+            return finished
+
+        assert asyncio.run(scenario()) == ["fast", "slow"]
+
+    def test_disabled_without_url(self, client, monkeypatch):
+        monkeypatch.delenv("SHARED_CACHE_URL", raising=False)
+        assert SharedCache.from_env() is None
+        monkeypatch.setattr(app_module, "shared_cache", None)
+        response = client.post("/api/intent-skill-trajectory", json={"utterance": "q"})
+        assert "X-IST-Shared-Cache" not in response.headers
@@ -0,0 +1,185 @@
+"""
+Tests for per-course prerequisite skill graphs (skill_graph.py) and the
+graph-trajectory IST module (dspy_flows.GraphTrajectoryISTModule).
+"""
+
+import contextlib
+import io
+import json
+
+import dspy
+import pytest
+
+import dspy_flows
+from dspy_flows import GraphTrajectoryISTModule, IntentSkillTrajectoryModule, get_ist_program
+from lm_accounting import AccountingLM, LMAccountant, count_lm_calls
+from shared_cache import program_fingerprint
+from skill_graph import SkillGraph, SkillGraphRegistry, main
+
+# Declared out of order on purpose; covers the stand-in LM's recursion skills.
+CS101 = [
+    {"name": "Recursion", "requires": ["Base cases", "Call stack"], "step": "Trace a recursive factorial by hand",
+     "aliases": ["recursive functions"]},
+    {"name": "Functions", "step": "Write and call functions with parameters"},
+    {"name": "Call stack", "requires": ["Functions"], "step": "Draw the call stack for nested calls"},
+    {"name": "Base cases", "requires": ["Functions"], "step": "Identify base cases in three examples"},
+    {"name": "Recursive decomposition", "requires": ["Recursion"], "step": "Split a problem into smaller subproblems"},
+    {"name": "Stack overflow debugging", "requires": ["Recursion", "Call stack"],
+     "step": "Debug an infinite recursion example"},
+    {"name": "Divide and conquer", "requires": ["Recursive decomposition"], "step": "Trace merge sort on 8 elements"},
+    {"name": "Binary search trees", "requires": ["Recursion"]},
+]
+
+
+def _graph():
+    return SkillGraph(CS101, course_id="cs101")
+
+
+def _names(graph, nodes):
+    return [graph.names[node] for node in nodes]
+
+
+def _write_graphs(directory, **courses):
+    directory.mkdir(exist_ok=True)
+    for course_id, skills in courses.items():
+        (directory / f"{course_id}.json").write_text(json.dumps({"skills": skills}), encoding="utf-8")
+    return directory
+
+
+@pytest.mark.unit
+class TestSkillGraph:
+    def test_topological_order_and_closure(self):
+        graph = _graph()
+        position = {name: i for i, name in enumerate(graph.names)}
+        for entry in CS101:
+            for required in entry.get("requires", []):
+                assert position[required] < position[entry["name"]]
+        recursion = graph.match("Recursion")
+        assert _names(graph, [n for n in range(len(graph)) if graph.ancestors[recursion] >> n & 1]) == \
+            ["Functions", "Call stack", "Base cases"]
+        assert graph.steps[graph.match("Binary search trees")] == "Study Binary search trees"
+
+    @pytest.mark.parametrize("skills, error", [
+        ([{"name": "A", "requires": ["B"]}, {"name": "B", "requires": ["A"]}], "cycle"),
+        ([{"name": "A", "requires": ["Missing"]}], "unknown skill"),
+        ([{"name": "A"}, {"name": "a"}], "duplicate"),
+    ])
+    def test_invalid_graphs(self, skills, error):
+        with pytest.raises(ValueError, match=error):
+            SkillGraph(skills)
+
+    def test_matching(self):
+        graph = _graph()
+        assert graph.names[graph.match("recursive functions")] == "Recursion"
+        assert graph.names[graph.match("the call-stack")] == "Call stack"
+        assert graph.names[graph.match("Balanced binary search trees")] == "Binary search trees"
+        assert graph.match("Hash tables") is None
+        assert graph.match("Hash functions") is None  # single-word names only match exactly
+
+    def test_plan_skips_mastered_skills_and_their_prerequisites(self):
+        graph = _graph()
+        assert _names(graph, graph.plan(["Recursion"])) == ["Functions", "Call stack", "Base cases", "Recursion"]
+        assert _names(graph, graph.plan(["Recursion"], mastered=["Call stack"])) == \
+            ["Base cases", "Recursion", "Recursive decomposition", "Stack overflow debugging"]
+        assert graph.trajectory(["Recursion"], mastered=["Call stack"])[0] == "Identify base cases in three examples"
+
+    def test_long_plans_keep_the_nearest_prerequisites(self):
+        plan = _names(_graph(), _graph().plan(["Divide and conquer", "Stack overflow debugging"]))
+        assert len(plan) == 5
+        assert "Functions" not in plan
+        assert plan[-2:] == ["Stack overflow debugging", "Divide and conquer"]
+
+    def test_no_match_is_empty(self):
+        assert _graph().trajectory(["Hash tables"]) == []
+
+
+@pytest.mark.unit
+class TestRegistry:
+    def test_loads_all_graphs_and_skips_bad_files(self, tmp_path):
+        directory = _write_graphs(tmp_path / "graphs", cs101=CS101, bad=[{"name": "A", "requires": ["A"]}])
+        with contextlib.redirect_stdout(io.StringIO()):
+            registry = SkillGraphRegistry(directory)
+        assert registry.get("cs101") is not None and registry.get("bad") is None
+        assert registry.trajectory("cs101", ["Recursion"])
+        assert registry.trajectory("cs101", ["Hash tables"]) == []
+        assert registry.trajectory("cs999", ["Recursion"]) == []
+        stats = registry.stats()
+        assert (stats["trajectories"], stats["misses"], stats["courses"]) == (1, 1, {"cs101": 8})
+        assert "cycle" in stats["load_errors"]["bad"]
+
+    def test_versions_follow_content(self, tmp_path):
+        directory = _write_graphs(tmp_path / "graphs", cs101=CS101)
+        before = SkillGraphRegistry(directory).versions()
+        _write_graphs(directory, cs101=CS101[:-1])
+        assert SkillGraphRegistry(directory).versions()["cs101"] != before["cs101"]
+
+    def test_cli(self, tmp_path, capsys):
+        directory = _write_graphs(tmp_path / "graphs", cs101=CS101)
+        assert main(["plan", str(directory), "cs101", "Recursion", "--mastered", "Functions"]) == 0
+        assert capsys.readouterr().out.splitlines()[0] == "- Call stack: Draw the call stack for nested calls"
+        assert main(["check", str(directory)]) == 0
+
+
+@pytest.mark.unit
+class TestRouting:
+    def test_graph_source_needs_a_course_graph(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("IST_TRAJECTORY_SOURCE", raising=False)
+        monkeypatch.setattr(dspy_flows, "skill_graphs", SkillGraphRegistry(_write_graphs(tmp_path / "g", cs101=CS101)))
+        monkeypatch.setattr(dspy_flows, "graph_trajectory_extractor", None)
+        assert isinstance(get_ist_program("cs101", trajectory_source="graph"), GraphTrajectoryISTModule)
+        assert not isinstance(get_ist_program("cs999", trajectory_source="graph"), GraphTrajectoryISTModule)
+        assert not isinstance(get_ist_program("cs101"), GraphTrajectoryISTModule)
+        monkeypatch.setenv("IST_TRAJECTORY_SOURCE", "graph")
+        assert isinstance(get_ist_program("cs101"), GraphTrajectoryISTModule)
+
+    def test_fingerprint_covers_graph_versions(self, tmp_path):
+        first = SkillGraphRegistry(_write_graphs(tmp_path / "a", cs101=CS101))
+        second = SkillGraphRegistry(_write_graphs(tmp_path / "b", cs101=CS101[:-1]))
+        lm = dspy.LM("openai/gpt-4o-mini", api_key="x")
+        assert program_fingerprint(GraphTrajectoryISTModule(first), lm=lm) != \
+            program_fingerprint(GraphTrajectoryISTModule(second), lm=lm)
+
+
+@pytest.mark.integration
+class TestGraphTrajectoryModule:
+    def _run(self, module, lm, **kwargs):
+        with dspy.context(lm=lm), count_lm_calls() as counter, contextlib.redirect_stdout(io.StringIO()):
+            result = module(course_context="Course: cs101", **kwargs)
+        return result, counter
+
+    def _lm(self, server):
+        return AccountingLM("openai/local-ist", api_base=server.base_url, api_key="local", cache=False,
+                            accountant=LMAccountant())
+
+    def test_trajectory_comes_from_the_graph(self, lm_server, tmp_path):
+        registry = SkillGraphRegistry(_write_graphs(tmp_path / "graphs", cs101=CS101))
+        lm = self._lm(lm_server)
+        result, counter = self._run(GraphTrajectoryISTModule(registry), lm, utterance="How does recursion work?",
+                                    student_profile={"strong_skills": ["Functions"]})
+        assert result["skills"][0] == "Recursion"
+        assert result["trajectory"][0] == "Draw the call stack for nested calls"
+        assert "Write and call functions with parameters" not in result["trajectory"]
+        assert counter.calls == 1
+        _, monolithic = self._run(IntentSkillTrajectoryModule(), lm, utterance="How does recursion work?")
+        assert counter.completion_tokens < monolithic.completion_tokens
+
+    def test_unmatched_skills_fall_back_to_the_lm(self, lm_server, tmp_path):
+        registry = SkillGraphRegistry(_write_graphs(tmp_path / "graphs", cs101=CS101))
+        result, counter = self._run(GraphTrajectoryISTModule(registry), self._lm(lm_server),
+                                    utterance="How do hash tables handle collisions?")
+        assert counter.calls == 2
+        assert 4 <= len(result["trajectory"]) <= 5
+        assert registry.stats()["misses"] == 1
+
+    def test_request_field_and_metrics(self, client, tmp_path, monkeypatch):
+        class Fake:
+            def __call__(self, **kwargs):
+                return {"intent": "Student wants to understand recursion.", "skills": ["Recursion"],
+                        "trajectory": ["Draw the call stack for nested calls"]}
+
+        monkeypatch.setattr(dspy_flows, "skill_graphs", SkillGraphRegistry(_write_graphs(tmp_path / "g", cs101=CS101)))
+        monkeypatch.setattr(dspy_flows, "graph_trajectory_extractor", Fake())
+        response = client.post("/api/intent-skill-trajectory",
+                               json={"utterance": "q", "course_id": "cs101", "trajectory_source": "graph"})
+        assert response.json()["trajectory"] == ["Draw the call stack for nested calls"]
+        assert client.get("/api/metrics").json()["skill_graph"]["courses"] == {"cs101": 8}
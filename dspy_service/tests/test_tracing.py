@@ -0,0 +1,205 @@
+"""
+Tests for request tracing (tracing.py): W3C propagation, sampling, span
+nesting, exporters and the instrumented IST request path.
+"""
+
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import dspy
+import pytest
+
+import tracing
+from dspy_flows import DecomposedISTModule, IntentSkillTrajectoryModule
+from lm_accounting import AccountingLM, LMAccountant
+from tracing import NOOP_SPAN, FileExporter, Tracer, parse_traceparent
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans, service_name):
+        self.spans.extend(spans)
+
+    def close(self):
+        pass
+
+    def names(self):
+        return [span.name for span in self.spans]
+
+
+@pytest.fixture
+def exporter():
+    exporter = ListExporter()
+    tracer = Tracer(exporter, start=False)
+    previous = tracing.configure(tracer)
+    yield exporter
+    tracing.configure(previous)
+
+
+def _finish(exporter):
+    tracing.get_tracer().flush()
+    return exporter
+
+
+@pytest.mark.unit
+class TestPropagation:
+    def test_parse_traceparent(self):
+        ctx = parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-01", "vendor=1")
+        assert (ctx.trace_id, ctx.span_id, ctx.sampled, ctx.tracestate) == (TRACE_ID, PARENT_ID, True, "vendor=1")
+        assert parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-00").sampled is False
+        for bad in (None, "", "garbage", f"ff-{TRACE_ID}-{PARENT_ID}-01", f"00-{'0' * 32}-{PARENT_ID}-01"):
+            assert parse_traceparent(bad) is None
+
+    def test_incoming_context_is_continued(self, exporter):
+        with tracing.request_span("POST /x", traceparent=f"00-{TRACE_ID}-{PARENT_ID}-01") as root:
+            with tracing.span("child"):
+                assert tracing.traceparent().startswith(f"00-{TRACE_ID}-")
+        root_span, = [s for s in _finish(exporter).spans if s.name == "POST /x"]
+        child, = [s for s in exporter.spans if s.name == "child"]
+        assert root_span.context.trace_id == TRACE_ID
+        assert root_span.parent_span_id == PARENT_ID
+        assert child.parent_span_id == root_span.context.span_id
+
+    def test_spans_follow_context_into_worker_threads(self, exporter):
+        def work():
+            with tracing.span("worker"):
+                pass
+
+        with tracing.request_span("root"), ThreadPoolExecutor(2) as pool:
+            pool.submit(contextvars.copy_context().run, work).result()
+        worker, = [s for s in _finish(exporter).spans if s.name == "worker"]
+        root_span, = [s for s in exporter.spans if s.name == "root"]
+        assert worker.parent_span_id == root_span.context.span_id
+
+
+@pytest.mark.unit
+class TestSampling:
+    def test_untraced_and_unsampled_work_is_noop(self, exporter):
+        with tracing.span("orphan") as span:
+            assert span is NOOP_SPAN
+        tracing.get_tracer().sample_ratio = 0.0
+        tracing.get_tracer()._threshold = 0
+        with tracing.request_span("root") as root:
+            assert root is NOOP_SPAN
+            assert tracing.current_trace_id() is not None
+            with tracing.span("child") as child:
+                assert child is NOOP_SPAN
+        assert _finish(exporter).spans == []
+
+    def test_parent_decision_wins_over_ratio(self):
+        tracer = Tracer(ListExporter(), sample_ratio=0.0, start=False)
+        span, _ = tracer.start_trace("r", parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-01"))
+        assert span is not None
+        span, _ = Tracer(ListExporter(), sample_ratio=1.0, start=False).start_trace(
+            "r", parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-00"))
+        assert span is None
+
+    def test_ratio_is_respected(self):
+        tracer = Tracer(ListExporter(), sample_ratio=0.1, start=False)
+        sampled = sum(tracer.start_trace("r")[0] is not None for _ in range(4000))
+        assert 300 < sampled < 500
+        assert tracer.stats()["traces"] == 4000
+
+
+@pytest.mark.unit
+class TestSpans:
+    def test_errors_are_recorded(self, exporter):
+        with pytest.raises(ValueError):
+            with tracing.request_span("root"), tracing.span("fails"):
+                raise ValueError("boom")
+        fails, = [s for s in _finish(exporter).spans if s.name == "fails"]
+        assert fails.status == "error"
+        assert fails.events[0][1] == "exception"
+
+    def test_file_exporter_writes_otlp_json(self, tmp_path):
+        path = tmp_path / "spans.jsonl"
+        tracer = Tracer(FileExporter(path), start=False, service_name="svc")
+        previous = tracing.configure(tracer)
+        try:
+            with tracing.request_span("root", **{"http.method": "POST"}):
+                with tracing.span("child", count=3) as span:
+                    span.add_event("ist.fallback", reason="x")
+            tracer.flush()
+        finally:
+            tracing.configure(previous)
+        payload = json.loads(path.read_text().splitlines()[0])
+        resource_spans = payload["resourceSpans"][0]
+        assert resource_spans["resource"]["attributes"][0] == {"key": "service.name", "value": {"stringValue": "svc"}}
+        spans = {s["name"]: s for s in resource_spans["scopeSpans"][0]["spans"]}
+        assert spans["child"]["parentSpanId"] == spans["root"]["spanId"]
+        assert spans["child"]["attributes"] == [{"key": "count", "value": {"intValue": "3"}}]
+        assert spans["child"]["events"][0]["name"] == "ist.fallback"
+        assert spans["root"]["kind"] == 2
+
+    def test_env_configuration(self, monkeypatch, tmp_path):
+        monkeypatch.delenv("IST_TRACE_EXPORTER", raising=False)
+        assert Tracer.from_env() is None
+        monkeypatch.setenv("IST_TRACE_EXPORTER", "file")
+        monkeypatch.setenv("IST_TRACE_FILE", str(tmp_path / "t.jsonl"))
+        monkeypatch.setenv("IST_TRACE_SAMPLE_RATIO", "0.01")
+        tracer = Tracer.from_env()
+        assert (tracer.sample_ratio, type(tracer.exporter).__name__) == (0.01, "FileExporter")
+        tracer.close()
+        monkeypatch.setenv("IST_TRACE_EXPORTER", "zipkin")
+        with pytest.raises(ValueError):
+            Tracer.from_env()
+
+
+@pytest.mark.integration
+class TestInstrumentation:
+    def _lm(self, server):
+        return AccountingLM("openai/local-ist", api_base=server.base_url, api_key="local", cache=False,
+                            accountant=LMAccountant())
+
+    def test_forward_stages_and_lm_call(self, exporter, lm_server, quiet):
+        with dspy.context(lm=self._lm(lm_server)), tracing.request_span("root"):
+            quiet(IntentSkillTrajectoryModule(), utterance="How does merge sort work?")
+        names = _finish(exporter).names()
+        for expected in ("ist.forward", "ist.build_context", "ist.predict", "ist.parse_json", "lm.call"):
+            assert expected in names
+        lm_call, = [s for s in exporter.spans if s.name == "lm.call"]
+        assert lm_call.attributes["lm.model"] == "openai/local-ist"
+        assert lm_call.attributes["lm.prompt_tokens"] > 0
+        predict, = [s for s in exporter.spans if s.name == "ist.predict"]
+        assert lm_call.parent_span_id == predict.context.span_id
+
+    def test_json_repair_span(self, exporter, lm_server, quiet):
+        lm_server.configure(malformed_rate=1.0, malformed_kinds=("truncated",))
+        try:
+            with dspy.context(lm=self._lm(lm_server)), tracing.request_span("root"):
+                quiet(IntentSkillTrajectoryModule(), utterance="Why is my loop infinite?")
+        finally:
+            lm_server.configure(malformed_rate=0.0)
+        spans = _finish(exporter).spans
+        parse, = [s for s in spans if s.name == "ist.parse_json"]
+        assert parse.status == "error"
+        assert "ist.json_repair" in exporter.names() or any(
+            name == "ist.fallback" for s in spans for _, name, _ in s.events)
+
+    def test_decomposed_fields_are_children_of_forward(self, exporter, lm_server, quiet):
+        with dspy.context(lm=self._lm(lm_server)), tracing.request_span("root"):
+            quiet(DecomposedISTModule(), utterance="What is a hash table?")
+        spans = _finish(exporter).spans
+        forward, = [s for s in spans if s.name == "ist.forward"]
+        fields = [s for s in spans if s.name.startswith("ist.field.")]
+        assert len(fields) == 3
+        assert all(s.parent_span_id == forward.context.span_id for s in fields)
+
+    def test_endpoint_continues_trace_and_returns_trace_id(self, client, exporter):
+        response = client.post("/api/intent-skill-trajectory", json={"utterance": "q", "course_id": "cs101"},
+                               headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"})
+        assert response.headers["X-Trace-Id"] == TRACE_ID
+        spans = _finish(exporter).spans
+        root_span, = [s for s in spans if s.name == "POST /api/intent-skill-trajectory"]
+        assert root_span.parent_span_id == PARENT_ID
+        assert root_span.attributes["http.status_code"] == 200
+        assert root_span.attributes["ist.course_id"] == "cs101"
+        validate, = [s for s in spans if s.name == "ist.validate_request"]
+        assert validate.parent_span_id == root_span.context.span_id
+        assert client.get("/health").headers.get("X-Trace-Id") is None
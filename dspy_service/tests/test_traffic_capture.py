@@ -0,0 +1,256 @@
+"""
+Tests for opt-in traffic capture (traffic_capture.py) and the replay tool (replay.py).
+"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import app
+from dspy_flows import FALLBACK_RESULT
+from latency_stats import summarize_latencies
+from replay import parse_speed, replay_capture
+from traffic_capture import (
+    CaptureWriter,
+    TrafficCaptureMiddleware,
+    iter_capture_records,
+    sanitize_request_body,
+)
+
+
+@pytest.mark.unit
+class TestSanitization:
+    """Redaction keeps structure but removes personal data."""
+
+    def test_redacts_emails_phones_and_keys(self):
+        body = {
+            "utterance": "Mail me at jane.doe@example.com or call +1 (555) 123-4567",
+            "course_context": "key sk-abcdefghijklmnopqrstuv",
+            "chat_history": [{"role": "student", "content": "I'm bob@uni.edu"}],
+        }
+        cleaned = sanitize_request_body(body)
+
+        assert "jane.doe@example.com" not in cleaned["utterance"]
+        assert "<email>" in cleaned["utterance"]
+        assert "<phone>" in cleaned["utterance"]
+        assert cleaned["course_context"] == "key <secret>"
+        assert cleaned["chat_history"][0]["content"] == "I'm <email>"
+        assert cleaned["chat_history"][0]["role"] == "student"
+
+    def test_timestamps_ids_and_dates_survive(self):
+        body = {
+            "utterance": "In 2024-01-15 at 10:30 I got 3628800 for factorial(10)",
+            "idempotency_key": "msg-2024-01-15-0001",
+            "chat_history": [{"role": "student", "content": "hi", "created_at": "2024-01-15T10:00:00Z"}],
+        }
+        assert sanitize_request_body(body) == body
+
+    @pytest.mark.parametrize("phone", ["+1 (555) 123-4567", "555-123-4567", "555.123.4567", "+447911123456"])
+    def test_redacts_phone_shapes(self, phone):
+        assert sanitize_request_body(f"call {phone} today") == "call <phone> today"
+
+    def test_non_string_values_preserved(self):
+        body = {"student_profile": None, "ist_history": [], "n": 3}
+        assert sanitize_request_body(body) == body
+
+
+@pytest.mark.unit
+class TestCaptureWriter:
+    """Rotation and retention of capture files."""
+
+    def test_rotates_by_size_and_keeps_max_files(self, tmp_path):
+        writer = CaptureWriter(tmp_path, max_bytes=200, max_files=3)
+        for i in range(20):
+            writer.write({"ts": float(i), "request": {"utterance": "x" * 100}})
+        writer.close()
+
+        files = sorted(tmp_path.glob("capture-*.jsonl"))
+        assert len(files) == 3
+        records = list(iter_capture_records(tmp_path))
+        assert [r["ts"] for r in records] == sorted(r["ts"] for r in records)
+        assert records[-1]["ts"] == 19.0
+
+    def test_write_only_buffers_until_flushed(self, tmp_path):
+        writer = CaptureWriter(tmp_path, flush_interval_s=60)
+        assert writer.write({"ts": 1.0})
+        assert list(iter_capture_records(tmp_path)) == []
+
+        assert writer.flush() == 1
+        assert [r["ts"] for r in iter_capture_records(tmp_path)] == [1.0]
+        writer.close()
+
+    def test_drops_when_buffer_full_and_after_close(self, tmp_path):
+        writer = CaptureWriter(tmp_path, flush_interval_s=60, max_buffer=2)
+        assert writer.write({"ts": 1.0}) and writer.write({"ts": 2.0})
+        assert not writer.write({"ts": 3.0})
+        writer.close()
+        assert not writer.write({"ts": 4.0})
+
+        assert writer.dropped == 2
+        assert [r["ts"] for r in iter_capture_records(tmp_path)] == [1.0, 2.0]
+
+    def test_iter_skips_truncated_lines(self, tmp_path):
+        path = tmp_path / "capture-x.jsonl"
+        path.write_text('{"ts": 1.0}\n{"ts": 2.0, "requ', encoding="utf-8")
+        assert [r["ts"] for r in iter_capture_records(path)] == [1.0]
+
+
+@pytest.mark.integration
+class TestCaptureMiddleware:
+    """Middleware records request, response, status and timing."""
+
+    def test_captures_ist_request_and_response(self, tmp_path):
+        writer = CaptureWriter(tmp_path)
+        client = TestClient(TrafficCaptureMiddleware(app, writer=writer))
+
+        response = client.post(
+            "/api/intent-skill-trajectory",
+            json={"utterance": "What is recursion? ping me at a@b.io", "course_context": "CS101"},
+        )
+        client.get("/health")
+        writer.close()
+
+        assert response.status_code == 200
+        records = list(iter_capture_records(tmp_path))
+        assert len(records) == 1
+        record = records[0]
+        assert record["path"] == "/api/intent-skill-trajectory"
+        assert record["status"] == 200
+        assert record["latency_ms"] >= 0
+        assert record["ts"] > 0
+        assert "a@b.io" not in record["request"]["utterance"]
+        assert record["response"] == response.json()
+
+    def test_captures_validation_errors(self, tmp_path):
+        writer = CaptureWriter(tmp_path)
+        client = TestClient(TrafficCaptureMiddleware(app, writer=writer))
+        client.post("/api/intent-skill-trajectory", json={"utterance": ""})
+        writer.close()
+
+        records = list(iter_capture_records(tmp_path))
+        assert records[0]["status"] == 422
+
+    def test_captures_msgpack_bodies(self, tmp_path):
+        msgpack = pytest.importorskip("msgpack")
+        writer = CaptureWriter(tmp_path)
+        client = TestClient(TrafficCaptureMiddleware(app, writer=writer))
+        response = client.post(
+            "/api/intent-skill-trajectory",
+            content=msgpack.packb({"utterance": "What is recursion? ping me at a@b.io"}),
+            headers={"Content-Type": "application/msgpack", "Accept": "application/msgpack"},
+        )
+        writer.close()
+
+        record = list(iter_capture_records(tmp_path))[0]
+        assert "a@b.io" not in record["request"]["utterance"]
+        assert record["response"] == msgpack.unpackb(response.content)
+
+    def test_sample_rate_zero_captures_nothing(self, tmp_path):
+        writer = CaptureWriter(tmp_path)
+        client = TestClient(TrafficCaptureMiddleware(app, writer=writer, sample_rate=0.0))
+        client.post("/api/intent-skill-trajectory", json={"utterance": "hi"})
+        writer.close()
+
+        assert list(iter_capture_records(tmp_path)) == []
+
+
+@pytest.mark.unit
+class TestReplayHelpers:
+    def test_parse_speed(self):
+        assert parse_speed("1x") == 1.0
+        assert parse_speed("10X") == 10.0
+        assert parse_speed("2.5") == 2.5
+        assert parse_speed("max") is None
+        with pytest.raises(ValueError):
+            parse_speed("0x")
+
+    def test_summarize_latencies(self):
+        summary = summarize_latencies([float(i) for i in range(1, 101)])
+        assert summary["p50"] == 50.0
+        assert summary["p99"] == 99.0
+        assert summary["max"] == 100.0
+        assert summarize_latencies([])["count"] == 0
+
+
+@pytest.mark.integration
+class TestReplay:
+    """Replay re-issues captured requests against the ASGI app in-process."""
+
+    def _records(self):
+        return [
+            {
+                "ts": 1000.0 + i * 0.01,
+                "path": "/api/intent-skill-trajectory",
+                "request": {"utterance": f"Question {i}", "course_context": "CS101"},
+                "status": 200,
+                "response": {
+                    "intent": f"Student is asking about: Question {i}...",
+                    "skills": ["Skill A", "Skill B"],
+                    "trajectory": ["Something else"],
+                },
+            }
+            for i in range(10)
+        ] + [{"ts": 1000.5, "path": "/api/intent-skill-trajectory", "request": None, "status": 422}]
+
+    def _run(self, records, speed):
+        transport = httpx.ASGITransport(app=app)
+        return asyncio.run(replay_capture(records, target="http://testserver", speed=speed, transport=transport))
+
+    def test_replay_max_speed_reports_drift(self):
+        summary = self._run(self._records(), speed=None).to_dict()
+
+        assert summary["requests"] == 10
+        assert summary["skipped"] == 1
+        assert summary["error_rate"] == 0.0
+        assert summary["fallback_rate"] == 0.0
+        assert summary["throughput_rps"] > 0
+        drift = summary["drift"]
+        assert drift["compared"] == 10
+        assert drift["intent_exact_rate"] == 1.0
+        assert drift["mean_skills_jaccard"] == 1.0
+        assert drift["mean_trajectory_jaccard"] == 0.0
+
+    def test_replay_honours_inter_arrival_timing(self):
+        report = self._run(self._records(), speed=1.0)
+        # 10 requests spread over 90 ms of recorded time.
+        assert report.wall_time_s >= 0.09
+
+    def test_replay_counts_errors_and_fallbacks(self):
+        records = [
+            {"ts": 1.0, "path": "/api/intent-skill-trajectory", "request": {"utterance": "trigger error"}},
+            {"ts": 1.0, "path": "/api/intent-skill-trajectory", "request": {"utterance": "fine"}},
+        ]
+        summary = self._run(records, speed=None).to_dict()
+        assert summary["error_rate"] == 0.5
+        assert summary["drift"]["compared"] == 0
+
+    def test_idempotency_keys_are_scoped_to_the_run(self):
+        sent = []
+
+        def handler(request):
+            sent.append(json.loads(request.content).get("idempotency_key"))
+            return httpx.Response(200, json={"intent": "", "skills": [], "trajectory": []})
+
+        records = [
+            {"ts": 1.0, "request": {"utterance": "q", "idempotency_key": "msg-1"}},
+            {"ts": 1.0, "request": {"utterance": "q", "idempotency_key": "msg-1"}},
+            {"ts": 1.0, "request": {"utterance": "q"}},
+        ]
+        for run_id in ("run-a", "run-b"):
+            asyncio.run(replay_capture(records, target="http://testserver", speed=None,
+                                       transport=httpx.MockTransport(handler), run_id=run_id))
+
+        assert sorted(sent, key=str) == sorted(["run-a:msg-1"] * 2 + ["run-b:msg-1"] * 2 + [None] * 2, key=str)
+        assert records[0]["request"]["idempotency_key"] == "msg-1"
+
+    def test_fallback_detection(self, monkeypatch):
+        def fallback_extractor(**kwargs):
+            return dict(FALLBACK_RESULT)
+
+        monkeypatch.setattr("dspy_flows.ist_extractor", fallback_extractor)
+        records = [{"ts": 1.0, "path": "/api/intent-skill-trajectory", "request": {"utterance": "q"}}]
+        summary = self._run(records, speed=None).to_dict()
+        assert summary["fallback_rate"] == 1.0
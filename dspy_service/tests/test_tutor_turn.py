@@ -0,0 +1,102 @@
+"""
+Tests for the fused tutor turn (dspy_flows.TutorTurnModule and
+POST /api/tutor-turn): one LM call, reply streamed first, IST fields in the
+trailing event.
+"""
+
+import contextlib
+import io
+import json
+
+import dspy
+import pytest
+
+import dspy_flows
+from dspy_flows import FALLBACK_RESULT, TUTOR_FALLBACK_REPLY, TutorTurnModule
+from lm_accounting import AccountingLM, LMAccountant, count_lm_calls
+
+
+def _sse(text):
+    """[(event, data), ...] from a Server-Sent Events body."""
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@pytest.fixture(scope="module")
+def lm_server(serve_local_lm):
+    return serve_local_lm(latency_ms=20, tokens_per_second=2000, seed=7)  # slow enough to see the reply stream
+
+
+def _lm(server, base_url=None, cache=False):
+    return AccountingLM("openai/local-ist", api_base=base_url or server.base_url, api_key="local", cache=cache,
+                        num_retries=0, accountant=LMAccountant())
+
+
+def _turn(lm, **kwargs):
+    with dspy.context(lm=lm), count_lm_calls() as counter, contextlib.redirect_stdout(io.StringIO()):
+        result = TutorTurnModule()(utterance="How does recursion work?", course_context="Course: cs101", **kwargs)
+    return result, counter
+
+
+@pytest.mark.integration
+class TestTutorTurnModule:
+    def test_reply_and_ist_from_one_call(self, lm_server):
+        result, counter = _turn(_lm(lm_server), course_material="Recursion: a function that calls itself.")
+        assert counter.calls == 1
+        assert "recursion" in result["reply"].lower()
+        assert result["intent"].startswith("Student wants to understand")
+        assert result["skills"][0] == "Recursion"
+        assert 4 <= len(result["trajectory"]) <= 5
+
+    def test_reply_streams_before_the_call_completes(self, lm_server):
+        chunks = []
+        result, _ = _turn(_lm(lm_server), on_reply_chunk=chunks.append)
+        assert len(chunks) > 1
+        assert "".join(chunks).strip() == result["reply"]
+
+    def test_cached_reply_is_sent_in_one_chunk(self, lm_server):
+        lm = _lm(lm_server, cache=True)
+        _turn(lm, course_material="cache me")
+        chunks = []
+        result, _ = _turn(lm, course_material="cache me", on_reply_chunk=chunks.append)
+        assert chunks == [result["reply"]]
+
+    def test_failed_call_falls_back(self, lm_server):
+        chunks = []
+        result, _ = _turn(_lm(lm_server, base_url="http://127.0.0.1:9/v1"), on_reply_chunk=chunks.append)
+        assert chunks == [TUTOR_FALLBACK_REPLY]
+        assert result["skills"] == FALLBACK_RESULT["skills"]
+
+
+class FakeTurn:
+    def __call__(self, utterance, on_reply_chunk=None, **kwargs):
+        if "error" in utterance:
+            raise RuntimeError("LM down")
+        for chunk in ("What do ", "you think?"):
+            on_reply_chunk(chunk)
+        return {"reply": "What do you think?", "intent": "Student wants to understand recursion.",
+                "skills": ["Recursion"], "trajectory": ["Trace factorial"]}
+
+
+@pytest.mark.integration
+class TestTutorTurnEndpoint:
+    def test_reply_events_then_ist(self, client, monkeypatch):
+        monkeypatch.setattr(dspy_flows, "tutor_turn_module", FakeTurn())
+        response = client.post("/api/tutor-turn", json={"utterance": "How does recursion work?",
+                                                        "course_material": "Recursion notes"})
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = _sse(response.text)
+        assert events[:2] == [("reply", "What do "), ("reply", "you think?")]
+        name, data = events[-1]
+        assert name == "done"
+        assert data["reply"] == "What do you think?"
+        assert data["result"]["skills"] == ["Recursion"]
+        assert "total_tokens" in data["lm_usage"]
+
+    def test_error_event(self, client, monkeypatch):
+        monkeypatch.setattr(dspy_flows, "tutor_turn_module", FakeTurn())
+        events = _sse(client.post("/api/tutor-turn", json={"utterance": "error please"}).text)
+        assert events == [("error", {"detail": "RuntimeError: LM down"})]
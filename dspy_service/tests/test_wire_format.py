@@ -0,0 +1,98 @@
+"""
+Tests for MessagePack content negotiation (wire_format.py): msgpack request
+bodies validated into the request models, msgpack responses on Accept, and
+JSON staying the default.
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+msgpack = pytest.importorskip("msgpack")
+
+import app as app_module  # noqa: E402
+import dspy_flows  # noqa: E402
+import wire_format  # noqa: E402
+from ist_client import AsyncISTClient  # noqa: E402
+
+MSGPACK = {"Content-Type": "application/msgpack", "Accept": "application/msgpack"}
+
+
+def _history(n):
+    return [{"role": "student" if i % 2 == 0 else "tutor", "content": f"Message {i}"} for i in range(n)]
+
+
+@pytest.mark.unit
+class TestNegotiation:
+    @pytest.mark.parametrize("accept, expected", [
+        ("application/msgpack", True),
+        ("application/json, application/x-msgpack;q=0.9", True),
+        ("application/msgpack;q=0", False),
+        ("application/json", False),
+        (None, False),
+    ])
+    def test_accepts_msgpack(self, accept, expected):
+        assert wire_format.accepts_msgpack(accept) is expected
+
+    def test_unpack_rejects_garbage(self):
+        with pytest.raises(ValueError):
+            wire_format.unpack(b"\xc1")
+
+
+@pytest.mark.integration
+class TestEndpoints:
+    def test_msgpack_both_directions(self, client):
+        body = {"utterance": "What is recursion?", "course_id": "cs101", "chat_history": _history(5)}
+        response = client.post("/api/intent-skill-trajectory", content=msgpack.packb(body), headers=MSGPACK)
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/msgpack"
+        assert "Accept" in response.headers["vary"]
+        result = msgpack.unpackb(response.content)
+        assert result["intent"].startswith("Student is asking about: What is recursion?")
+
+    def test_json_stays_the_default(self, client):
+        response = client.post("/api/intent-skill-trajectory", json={"utterance": "What is recursion?"})
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        assert response.json()["intent"].startswith("Student is asking about:")
+
+    def test_msgpack_request_json_response(self, client):
+        response = client.post("/api/intent-skill-trajectory", content=msgpack.packb({"utterance": "Loops?"}),
+                               headers={"Content-Type": "application/msgpack"})
+        assert response.status_code == 200
+        assert response.json()["intent"].startswith("Student is asking about: Loops?")
+
+    def test_invalid_bodies_and_errors_stay_json(self, client):
+        garbage = client.post("/api/intent-skill-trajectory", content=b"\xc1", headers=MSGPACK)
+        assert garbage.status_code == 400 and garbage.headers["content-type"] == "application/json"
+        invalid = client.post("/api/intent-skill-trajectory", content=msgpack.packb({"utterance": 42}),
+                              headers=MSGPACK)
+        assert invalid.status_code == 422 and "detail" in invalid.json()
+
+    def test_request_models_still_apply(self, client, monkeypatch):
+        seen = {}
+
+        def extractor(utterance, **kwargs):
+            seen.update(kwargs)
+            return {"intent": "i", "skills": [], "trajectory": []}
+
+        monkeypatch.setattr(dspy_flows, "ist_extractor", extractor)
+        body = {"utterance": "q", "chat_history": _history(500)}
+        response = client.post("/api/intent-skill-trajectory", content=msgpack.packb(body), headers=MSGPACK)
+        assert response.status_code == 200
+        # Validated (and truncated) exactly as a JSON body would be
+        assert len(seen["chat_history"]) == app_module.CHAT_HISTORY_PROMPT_LIMIT
+        assert seen["chat_history_total"] == 500
+
+    def test_ist_client_msgpack_encoding(self):
+        async def scenario():
+            transport = httpx.ASGITransport(app=app_module.app)
+            async with AsyncISTClient(transport=transport, encoding="msgpack", batch_window_ms=20) as client:
+                many = await client.extract_many([{"utterance": f"Question {i}"} for i in range(3)])
+                one = await client.extract(utterance="Alone", chat_history=_history(50))
+                return many, one
+
+        many, one = asyncio.run(scenario())
+        assert [r.intent for r in many] == [f"Student is asking about: Question {i}..." for i in range(3)]
+        assert one.intent.startswith("Student is asking about: Alone")
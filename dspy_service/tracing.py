@@ -0,0 +1,506 @@
+"""
+Lightweight, OpenTelemetry-compatible tracing for the IST request path.
+
+Spans cover the HTTP request (root span, continued from an incoming W3C
+`traceparent` header), request validation, each forward stage of the IST
+modules, every LM call (model, tokens, cache hit) and the JSON-repair and
+fallback paths. Finished spans are batched on a background thread and sent
+to one exporter:
+
+  - console: one line per span on stdout ([TRACE] ...)
+  - file: OTLP/JSON lines (one ExportTraceServiceRequest per batch), readable
+    by the OpenTelemetry Collector's otlpjsonfile receiver or jq
+  - otlp: OTLP/HTTP JSON POST to a collector (e.g. http://localhost:4318/v1/traces)
+
+Sampling is parent-based with a trace-id ratio for new traces (the
+OpenTelemetry default sampler): a caller's sampled flag is honoured, and
+IST_TRACE_SAMPLE_RATIO=0.01 keeps 1% of new traces. Unsampled requests
+carry only a trace context; every span() inside them returns a shared no-op
+span, so tracing costs a few microseconds per request.
+
+Instrumented code uses the module-level helpers, which are no-ops until
+configure() installs a tracer:
+    with tracing.span("ist.predict", model=...) as span:
+        span.set_attribute("ist.lm_calls", 2)
+
+Environment variables:
+  - IST_TRACE_EXPORTER: none | console | file | otlp (default none = tracing off)
+  - IST_TRACE_SAMPLE_RATIO: fraction of new traces sampled (default 1.0)
+  - IST_TRACE_FILE: file for the file exporter (default ./traces/spans.otlp.jsonl)
+  - IST_TRACE_OTLP_ENDPOINT: OTLP/HTTP traces URL (default http://localhost:4318/v1/traces)
+  - IST_TRACE_OTLP_HEADERS: extra headers for the OTLP exporter, "k1=v1,k2=v2"
+  - IST_TRACE_SERVICE_NAME: service.name resource attribute (default courselm-dspy-service)
+"""
+
+from __future__ import annotations
+
+import contextvars
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+_TRACEPARENT_RE = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_ZERO_TRACE = "0" * 32
+_ZERO_SPAN = "0" * 16
+
+
+class SpanContext:
+    __slots__ = ("trace_id", "span_id", "sampled", "tracestate")
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool, tracestate: Optional[str] = None) -> None:
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+        self.tracestate = tracestate
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def parse_traceparent(header: Optional[str], tracestate: Optional[str] = None) -> Optional[SpanContext]:
+    """SpanContext from a W3C traceparent header, or None if absent or invalid."""
+    if not header:
+        return None
+    match = _TRACEPARENT_RE.match(header.strip().lower())
+    if match is None:
+        return None
+    version, trace_id, span_id, flags = match.groups()
+    if version == "ff" or trace_id == _ZERO_TRACE or span_id == _ZERO_SPAN:
+        return None
+    return SpanContext(trace_id, span_id, bool(int(flags, 16) & 1), tracestate)
+
+
+# ---------------------------------------------------------------------
+# Spans
+# ---------------------------------------------------------------------
+
+class Span:
+    """A recorded span; attributes, events and status follow the OpenTelemetry data model."""
+
+    __slots__ = ("name", "context", "parent_span_id", "kind", "start_ns", "end_ns",
+                 "attributes", "events", "status", "status_message", "_tracer")
+
+    def __init__(self, tracer: "Tracer", name: str, context: SpanContext, parent_span_id: Optional[str],
+                 kind: str = "internal", attributes: Optional[dict] = None) -> None:
+        self._tracer = tracer
+        self.name = name
+        self.context = context
+        self.parent_span_id = parent_span_id
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = {k: v for k, v in (attributes or {}).items() if v is not None}
+        self.events: List[tuple] = []
+        self.status = "unset"
+        self.status_message = ""
+
+    recording = True
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, attributes: dict) -> None:
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def add_event(self, name: str, **attributes: Any) -> None:
+        self.events.append((time.time_ns(), name, attributes))
+
+    def record_exception(self, error: BaseException) -> None:
+        self.add_event("exception", **{"exception.type": type(error).__name__, "exception.message": str(error)[:500]})
+        self.set_status("error", f"{type(error).__name__}: {error}"[:500])
+
+    def set_status(self, status: str, message: str = "") -> None:
+        self.status = status
+        self.status_message = message
+
+    def end(self) -> None:
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self._tracer._on_end(self)
+
+
+class _NoopSpan:
+    """Returned for unsampled or untraced work; every method does nothing."""
+
+    recording = False
+    context = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def add_event(self, name, **attributes):
+        pass
+
+    def record_exception(self, error):
+        pass
+
+    def set_status(self, status, message=""):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+# Innermost active span (Span), or the bare SpanContext of an unsampled request.
+_current: contextvars.ContextVar = contextvars.ContextVar("ist_trace_current", default=None)
+
+
+# ---------------------------------------------------------------------
+# Exporters
+# ---------------------------------------------------------------------
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(v) for v in value]}}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict) -> list:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+_OTLP_KINDS = {"internal": 1, "server": 2, "client": 3}
+_OTLP_STATUS = {"unset": 0, "ok": 1, "error": 2}
+
+
+def to_otlp(spans: List[Span], service_name: str) -> dict:
+    """OTLP/JSON ExportTraceServiceRequest for a batch of spans."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attributes({"service.name": service_name})},
+        "scopeSpans": [{
+            "scope": {"name": "dspy_service.tracing"},
+            "spans": [{
+                "traceId": span.context.trace_id,
+                "spanId": span.context.span_id,
+                **({"parentSpanId": span.parent_span_id} if span.parent_span_id else {}),
+                "name": span.name,
+                "kind": _OTLP_KINDS.get(span.kind, 1),
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": _otlp_attributes(span.attributes),
+                "events": [{"timeUnixNano": str(ts), "name": name, "attributes": _otlp_attributes(attrs)}
+                           for ts, name, attrs in span.events],
+                "status": {"code": _OTLP_STATUS.get(span.status, 0),
+                           **({"message": span.status_message} if span.status_message else {})},
+            } for span in spans],
+        }],
+    }]}
+
+
+class ConsoleExporter:
+    def export(self, spans: List[Span], service_name: str) -> None:
+        for span in spans:
+            duration_ms = (span.end_ns - span.start_ns) / 1e6
+            attrs = " ".join(f"{key}={value}" for key, value in span.attributes.items())
+            status = " ERROR" if span.status == "error" else ""
+            print(f"[TRACE] {span.context.trace_id} {span.context.span_id} <- {span.parent_span_id or '-'} "
+                  f"{span.name} {duration_ms:.1f}ms{status} {attrs}".rstrip())
+
+    def close(self) -> None:
+        pass
+
+
+class FileExporter:
+    """Appends one OTLP/JSON line per batch."""
+
+    def __init__(self, path: str | os.PathLike) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span], service_name: str) -> None:
+        line = json.dumps(to_otlp(spans, service_name), separators=(",", ":")) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as handle:
+            handle.write(line)
+
+    def close(self) -> None:
+        pass
+
+
+class OTLPHttpExporter:
+    """POSTs OTLP/JSON batches to a collector's /v1/traces endpoint."""
+
+    def __init__(self, endpoint: str, headers: Optional[dict] = None, timeout_s: float = 5.0) -> None:
+        import httpx
+
+        self.endpoint = endpoint
+        self._client = httpx.Client(timeout=timeout_s, headers={"Content-Type": "application/json", **(headers or {})})
+
+    def export(self, spans: List[Span], service_name: str) -> None:
+        response = self._client.post(self.endpoint, content=json.dumps(to_otlp(spans, service_name)))
+        response.raise_for_status()
+
+    def close(self) -> None:
+        self._client.close()
+
+
+# ---------------------------------------------------------------------
+# Tracer
+# ---------------------------------------------------------------------
+
+class Tracer:
+    """Creates spans, decides sampling and exports finished spans in batches."""
+
+    def __init__(self, exporter, sample_ratio: float = 1.0, service_name: str = "courselm-dspy-service",
+                 max_queue: int = 4096, batch_size: int = 512, flush_interval_s: float = 2.0,
+                 start: bool = True) -> None:
+        self.exporter = exporter
+        self.sample_ratio = min(1.0, max(0.0, sample_ratio))
+        self._threshold = int(self.sample_ratio * (1 << 64))
+        self.service_name = service_name
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self._queue: deque = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._stats = {"traces": 0, "sampled": 0, "spans": 0, "exported": 0, "dropped": 0, "export_errors": 0}
+        self._thread = None
+        if start:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="ist-trace-export")
+            self._thread.start()
+
+    @classmethod
+    def from_env(cls) -> Optional["Tracer"]:
+        kind = os.getenv("IST_TRACE_EXPORTER", "none").strip().lower()
+        if kind in ("", "none", "off", "0"):
+            return None
+        if kind == "console":
+            exporter = ConsoleExporter()
+        elif kind == "file":
+            exporter = FileExporter(os.getenv("IST_TRACE_FILE", "./traces/spans.otlp.jsonl"))
+        elif kind == "otlp":
+            headers = dict(item.split("=", 1) for item in os.getenv("IST_TRACE_OTLP_HEADERS", "").split(",") if "=" in item)
+            exporter = OTLPHttpExporter(os.getenv("IST_TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces"), headers)
+        else:
+            raise ValueError(f"Unknown IST_TRACE_EXPORTER {kind!r} (use none, console, file or otlp)")
+        return cls(
+            exporter,
+            sample_ratio=float(os.getenv("IST_TRACE_SAMPLE_RATIO", "1.0")),
+            service_name=os.getenv("IST_TRACE_SERVICE_NAME", "courselm-dspy-service"),
+        )
+
+    def _should_sample(self, trace_id: str) -> bool:
+        # TraceIdRatioBased: compare the low 64 bits of the trace id with the ratio.
+        return int(trace_id[16:], 16) < self._threshold if self._threshold < (1 << 64) else True
+
+    def start_trace(self, name: str, parent: Optional[SpanContext] = None, kind: str = "server",
+                    attributes: Optional[dict] = None):
+        """Root span of a request: continues `parent` (incoming traceparent) or starts a new trace."""
+        trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        sampled = parent.sampled if parent is not None else self._should_sample(trace_id)
+        with self._lock:
+            self._stats["traces"] += 1
+            self._stats["sampled"] += int(sampled)
+        if not sampled:
+            return None, SpanContext(trace_id, parent.span_id if parent else secrets.token_hex(8), False,
+                                     parent.tracestate if parent else None)
+        context = SpanContext(trace_id, secrets.token_hex(8), True, parent.tracestate if parent else None)
+        return Span(self, name, context, parent.span_id if parent else None, kind, attributes), context
+
+    def start_span(self, name: str, parent: Span, kind: str = "internal", attributes: Optional[dict] = None) -> Span:
+        context = SpanContext(parent.context.trace_id, secrets.token_hex(8), True, parent.context.tracestate)
+        return Span(self, name, context, parent.context.span_id, kind, attributes)
+
+    def _on_end(self, span: Span) -> None:
+        with self._lock:
+            self._stats["spans"] += 1
+            if len(self._queue) >= self.max_queue:
+                self._stats["dropped"] += 1
+                return
+            self._queue.append(span)
+            full = len(self._queue) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_interval_s)
+            self._wakeup.clear()
+            self.flush()
+            with self._lock:
+                if self._closed:
+                    return
+
+    def flush(self) -> int:
+        """Export every queued span now; returns the number exported."""
+        exported = 0
+        while True:
+            with self._lock:
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            if not batch:
+                return exported
+            try:
+                self.exporter.export(batch, self.service_name)
+            except Exception as e:
+                with self._lock:
+                    self._stats["export_errors"] += 1
+                    self._stats["dropped"] += len(batch)
+                print(f"[TRACE] ⚠️ Export failed: {type(e).__name__}: {e}")
+                continue
+            exported += len(batch)
+            with self._lock:
+                self._stats["exported"] += len(batch)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self.flush()
+        self.exporter.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, queued=len(self._queue), sample_ratio=self.sample_ratio,
+                        exporter=type(self.exporter).__name__)
+
+
+_tracer: Optional[Tracer] = None
+
+
+def configure(tracer: Optional[Tracer]) -> Optional[Tracer]:
+    """Install `tracer` for the module-level helpers (None turns tracing off); returns the previous one."""
+    global _tracer
+    previous, _tracer = _tracer, tracer
+    return previous
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+# ---------------------------------------------------------------------
+# Instrumentation helpers
+# ---------------------------------------------------------------------
+
+@contextmanager
+def request_span(name: str, traceparent: Optional[str] = None, tracestate: Optional[str] = None,
+                 **attributes: Any) -> Iterator[Any]:
+    """
+    Root span for an incoming request. Yields the Span, or NOOP_SPAN when
+    tracing is off or the trace is not sampled.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield NOOP_SPAN
+        return
+    span, context = tracer.start_trace(name, parse_traceparent(traceparent, tracestate), attributes=attributes)
+    token = _current.set(span if span is not None else context)
+    try:
+        if span is None:
+            yield NOOP_SPAN
+        else:
+            try:
+                yield span
+            except BaseException as e:
+                span.record_exception(e)
+                raise
+            finally:
+                span.end()
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attributes: Any) -> Iterator[Any]:
+    """Child of the current span; NOOP_SPAN outside a sampled trace."""
+    parent = _current.get()
+    tracer = _tracer
+    if tracer is None or not isinstance(parent, Span):
+        yield NOOP_SPAN
+        return
+    child = tracer.start_span(name, parent, kind, attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.record_exception(e)
+        raise
+    finally:
+        child.end()
+        _current.reset(token)
+
+
+def current_span():
+    """The innermost recording span, or NOOP_SPAN."""
+    current = _current.get()
+    return current if isinstance(current, Span) else NOOP_SPAN
+
+
+def current_trace_id() -> Optional[str]:
+    """Trace id of the current request (sampled or not), for logs and response headers."""
+    current = _current.get()
+    if isinstance(current, Span):
+        return current.context.trace_id
+    if isinstance(current, SpanContext):
+        return current.trace_id
+    return None
+
+
+def traceparent() -> Optional[str]:
+    """W3C traceparent for outgoing calls made inside the current span."""
+    current = _current.get()
+    if isinstance(current, Span):
+        return current.context.traceparent
+    if isinstance(current, SpanContext):
+        return current.traceparent
+    return None
+
+
+class TracingMiddleware:
+    """
+    Pure ASGI middleware opening the root span for each traced HTTP request
+    (continuing an incoming traceparent) and returning its trace id in the
+    X-Trace-Id response header.
+    """
+
+    def __init__(self, app, path_prefix: str = "/api/") -> None:
+        self.app = app
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _tracer is None or not scope.get("path", "").startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope.get("headers", [])}
+        with request_span(f"{scope.get('method', 'GET')} {scope['path']}",
+                          traceparent=headers.get("traceparent"), tracestate=headers.get("tracestate"),
+                          **{"http.method": scope.get("method"), "http.target": scope["path"]}) as root:
+            trace_id = current_trace_id()
+
+            async def traced_send(message):
+                if message["type"] == "http.response.start":
+                    root.set_attribute("http.status_code", message["status"])
+                    if message["status"] >= 500:
+                        root.set_status("error")
+                    if trace_id:
+                        message = dict(message)
+                        message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", trace_id.encode())]
+                await send(message)
+
+            await self.app(scope, receive, traced_send)
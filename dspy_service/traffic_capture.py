@@ -0,0 +1,345 @@
+"""
+Opt-in traffic capture for the CourseLLM DSPy service.
+
+When TRAFFIC_CAPTURE_DIR is set, every IST request (sanitized) is written to
+rotating JSONL files together with its arrival timestamp, status code, latency
+and response body. The files are the input to replay.py, which re-issues the
+captured load shape against a running service.
+
+Environment variables:
+  - TRAFFIC_CAPTURE_DIR: directory for capture files (capture is off when unset)
+  - TRAFFIC_CAPTURE_MAX_BYTES: rotate after this many bytes (default 50 MB)
+  - TRAFFIC_CAPTURE_MAX_FILES: number of capture files to keep (default 20)
+  - TRAFFIC_CAPTURE_SAMPLE_RATE: fraction of requests to capture (default 1.0)
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional
+
+import wire_format
+
+
+CAPTURED_PATHS = frozenset({"/api/intent-skill-trajectory"})
+
+# Redaction patterns applied to every string in a captured request body.
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+# Phone shapes only: grouped digits with separators ("+1 (555) 123-4567",
+# "555.123.4567") or a "+" and 10-14 digits. ISO dates, times and plain
+# numbers do not match.
+_PHONE_RE = re.compile(
+    r"(?<![\w+-])(?:\+\d{1,3}[\s.-]?)?(?:\(\d{2,4}\)\s?|\d{2,4}[\s.-])\d{3,4}[\s.-]\d{3,4}(?![\w-])"
+    r"|(?<![\w+])\+\d{10,14}\b"
+)
+_SECRET_RE = re.compile(r"\b(?:sk|pk|AIza)[-_A-Za-z0-9]{16,}\b")
+
+# Timestamps and ids are kept verbatim: they carry no personal text, and
+# replay needs them (thread summaries; replay.py rewrites idempotency keys per run).
+_UNREDACTED_KEYS = frozenset({"created_at", "idempotency_key", "course_id", "thread_id"})
+
+
+def _redact_text(text: str) -> str:
+    text = _EMAIL_RE.sub("<email>", text)
+    text = _SECRET_RE.sub("<secret>", text)
+    text = _PHONE_RE.sub("<phone>", text)
+    return text
+
+
+def sanitize_request_body(body: Any) -> Any:
+    """
+    Recursively redact emails, phone numbers and API-key-like tokens from a
+    decoded request body. Structure (keys, list lengths, types) is preserved so
+    a replayed request exercises the same validation and prompt-building work.
+    Timestamp and id fields (_UNREDACTED_KEYS) are left as they are.
+    """
+    if isinstance(body, str):
+        return _redact_text(body)
+    if isinstance(body, list):
+        return [sanitize_request_body(item) for item in body]
+    if isinstance(body, dict):
+        return {key: value if key in _UNREDACTED_KEYS else sanitize_request_body(value)
+                for key, value in body.items()}
+    return body
+
+
+def _content_type(headers) -> Optional[str]:
+    for key, value in headers or ():
+        if key.lower() == b"content-type":
+            return value.decode("latin-1")
+    return None
+
+
+def _decode_body(chunks: list[bytes], content_type: Optional[str]) -> Any:
+    """Decode a captured JSON or msgpack body; None when it is malformed."""
+    body = b"".join(chunks)
+    try:
+        if wire_format.is_msgpack(content_type):
+            return wire_format.unpack(body)
+        return json.loads(body or b"null")
+    except (ValueError, UnicodeDecodeError):
+        # Malformed bodies are still part of the load shape.
+        return None
+
+
+# ---------------------------------------------------------------------
+# Rotating JSONL writer
+# ---------------------------------------------------------------------
+
+class CaptureWriter:
+    """
+    Write-behind, size-rotated JSONL writer.
+
+    write() only appends the record to an in-memory buffer; a background
+    thread serializes and writes the buffer every `flush_interval_s` (or as
+    soon as `batch_size` records are waiting), so the ASGI send path never
+    touches the disk. When `max_buffer` records are waiting, new ones are
+    dropped and counted. close() writes whatever is still buffered.
+
+    Files are named <prefix>-<UTC timestamp>-<pid>-<seq>.jsonl so several
+    uvicorn workers can share one capture directory without clobbering each
+    other. Only the newest `max_files` files written by this process are kept.
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike,
+        max_bytes: int = 50 * 1024 * 1024,
+        max_files: int = 20,
+        prefix: str = "capture",
+        batch_size: int = 256,
+        flush_interval_s: float = 1.0,
+        max_buffer: int = 10_000,
+    ) -> None:
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max(1, int(max_bytes))
+        self.max_files = max(1, int(max_files))
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval_s = flush_interval_s
+        self.max_buffer = max(1, int(max_buffer))
+        self._buffer: deque = deque()
+        self._lock = threading.Lock()          # guards the buffer and counters
+        self._write_lock = threading.Lock()    # serializes flushes and the open file
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._seq = 0
+        self._file = None
+        self._path: Optional[Path] = None
+        self._size = 0
+        self._written: list[Path] = []
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"{prefix}-writer")
+        self._thread.start()
+
+    @property
+    def current_path(self) -> Optional[Path]:
+        return self._path
+
+    def _open_next(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        self._seq += 1
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        self._path = self.directory / f"{self.prefix}-{stamp}-{os.getpid()}-{self._seq:04d}.jsonl"
+        self._file = open(self._path, "a", encoding="utf-8")
+        self._size = 0
+        self._written.append(self._path)
+        while len(self._written) > self.max_files:
+            stale = self._written.pop(0)
+            try:
+                stale.unlink()
+            except OSError:
+                pass
+
+    def write(self, record: dict) -> bool:
+        """Queue a record; returns False if it was dropped (buffer full or writer closed)."""
+        with self._lock:
+            if self._closed or len(self._buffer) >= self.max_buffer:
+                self.dropped += 1
+                return False
+            self._buffer.append(record)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wakeup.set()
+        return True
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_interval_s)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:  # keep the writer alive
+                print(f"[CAPTURE] ⚠️ Flush failed: {type(e).__name__}: {e}")
+            with self._lock:
+                if self._closed and not self._buffer:
+                    return
+
+    def flush(self) -> int:
+        """Write everything buffered so far; returns the number of records written."""
+        written = 0
+        with self._write_lock:
+            while True:
+                with self._lock:
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                if not batch:
+                    break
+                for record in batch:
+                    line = json.dumps(record, ensure_ascii=False) + "\n"
+                    data_len = len(line.encode("utf-8"))
+                    if self._file is None or (self._size and self._size + data_len > self.max_bytes):
+                        self._open_next()
+                    self._file.write(line)
+                    self._size += data_len
+                self._file.flush()
+                written += len(batch)
+        return written
+
+    def close(self, timeout_s: float = 5.0) -> None:
+        """Stop accepting records, write the buffered ones and close the file."""
+        with self._lock:
+            self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout=timeout_s)
+        self.flush()
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def iter_capture_records(paths: str | os.PathLike | Iterable[str | os.PathLike]) -> Iterator[dict]:
+    """
+    Yield capture records from a file, a directory of capture files, or a list
+    of either, in file-name order (which is arrival order per worker).
+    """
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+
+    files: list[Path] = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            files.extend(sorted(path.glob("capture-*.jsonl")))
+        else:
+            files.append(path)
+
+    for file_path in files:
+        with open(file_path, "r", encoding="utf-8") as handle:
+            for line in handle:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A worker killed mid-write leaves a truncated last line.
+                    continue
+
+
+# ---------------------------------------------------------------------
+# ASGI middleware
+# ---------------------------------------------------------------------
+
+class TrafficCaptureMiddleware:
+    """
+    Pure ASGI middleware that records captured POST requests.
+
+    The request body is teed from `receive` and the response body from `send`,
+    so neither side is buffered or delayed; the record is handed to the
+    writer's buffer once the final response chunk has been sent to the server.
+    """
+
+    def __init__(
+        self,
+        app,
+        writer: CaptureWriter,
+        paths: Iterable[str] = CAPTURED_PATHS,
+        sample_rate: float = 1.0,
+    ) -> None:
+        self.app = app
+        self.writer = writer
+        self.paths = frozenset(paths)
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope.get("method") != "POST"
+            or scope.get("path") not in self.paths
+            or (self.sample_rate < 1.0 and random.random() >= self.sample_rate)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        arrived_at = time.time()
+        started = time.perf_counter()
+        request_chunks: list[bytes] = []
+        response_chunks: list[bytes] = []
+        status_holder = {"status": None, "content_type": None}
+
+        async def capturing_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                request_chunks.append(message.get("body", b""))
+            return message
+
+        async def capturing_send(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+                status_holder["content_type"] = _content_type(message.get("headers"))
+            elif message["type"] == "http.response.body":
+                response_chunks.append(message.get("body", b""))
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                self._record(scope, arrived_at, started, request_chunks, response_chunks, status_holder)
+
+        await self.app(scope, capturing_receive, capturing_send)
+
+    def _record(self, scope, arrived_at, started, request_chunks, response_chunks, response_start) -> None:
+        try:
+            request_body = sanitize_request_body(_decode_body(request_chunks, _content_type(scope.get("headers"))))
+            response_body = _decode_body(response_chunks, response_start["content_type"])
+
+            self.writer.write({
+                "ts": arrived_at,
+                "path": scope.get("path"),
+                "request": request_body,
+                "status": response_start["status"],
+                "latency_ms": round((time.perf_counter() - started) * 1000, 3),
+                "response": response_body,
+            })
+        except Exception as e:
+            # Capture must never break the request path.
+            print(f"[CAPTURE] ⚠️ Failed to write capture record: {type(e).__name__}: {e}")
+
+
+def install_traffic_capture(app) -> Optional[CaptureWriter]:
+    """
+    Add TrafficCaptureMiddleware to `app` when TRAFFIC_CAPTURE_DIR is set.
+
+    Returns the writer (so the caller can close it on shutdown), or None when
+    capture is off.
+    """
+    directory = os.getenv("TRAFFIC_CAPTURE_DIR", "").strip()
+    if not directory:
+        return None
+    writer = CaptureWriter(
+        directory,
+        max_bytes=int(os.getenv("TRAFFIC_CAPTURE_MAX_BYTES", str(50 * 1024 * 1024))),
+        max_files=int(os.getenv("TRAFFIC_CAPTURE_MAX_FILES", "20")),
+    )
+    sample_rate = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE_RATE", "1.0"))
+    app.add_middleware(TrafficCaptureMiddleware, writer=writer, sample_rate=sample_rate)
+    print(f"[CAPTURE] Traffic capture enabled -> {writer.directory} (sample rate {sample_rate})")
+    return writer
@@ -0,0 +1,121 @@
+"""
+MessagePack content negotiation for service-to-service calls.
+
+JSON stays the default. A caller that sends `Content-Type:
+application/msgpack` has its body unpacked straight into the Python objects
+the request models validate: there is no JSON text and no second parse. A
+caller that sends `Accept: application/msgpack` gets msgpack back, packed
+straight from the response model's data. Both directions are independent.
+Error responses (HTTPException, validation errors) stay JSON, and streamed
+responses (SSE) are not affected.
+
+  - NegotiatedRoute: APIRoute class that unpacks msgpack request bodies and
+    records whether the caller accepts msgpack
+  - NegotiatedJSONResponse: default response class; renders msgpack when the
+    current request accepted it, JSON otherwise
+
+Needs the optional `msgpack` package. Without it, msgpack request bodies
+get 415 and Accept: application/msgpack falls back to JSON.
+"""
+
+from __future__ import annotations
+
+import contextvars
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None  # Optional dependency
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_MEDIA_TYPES = frozenset({MSGPACK_MEDIA_TYPE, "application/x-msgpack", "application/vnd.msgpack"})
+
+_accepts_msgpack: contextvars.ContextVar[bool] = contextvars.ContextVar("accepts_msgpack", default=False)
+
+
+def _media_type(header: Optional[str]) -> str:
+    return (header or "").split(";", 1)[0].strip().lower()
+
+
+def is_msgpack(content_type: Optional[str]) -> bool:
+    return _media_type(content_type) in MSGPACK_MEDIA_TYPES
+
+
+def accepts_msgpack(accept: Optional[str]) -> bool:
+    """True when the Accept header lists a msgpack type (with q > 0) and msgpack is installed."""
+    if msgpack is None or not accept:
+        return False
+    for part in accept.split(","):
+        media_type, _, params = part.partition(";")
+        if media_type.strip().lower() in MSGPACK_MEDIA_TYPES:
+            quality = params.strip()
+            return not (quality.startswith("q=") and quality[2:].strip() in ("0", "0.0", "0.00", "0.000"))
+    return False
+
+
+def unpack(body: bytes) -> Any:
+    """Decode a msgpack body; ValueError when it is not valid msgpack (or msgpack is not installed)."""
+    if msgpack is None:
+        raise ValueError("msgpack is not installed")
+    try:
+        return msgpack.unpackb(body, raw=False, strict_map_key=True)
+    except Exception as e:
+        raise ValueError(f"Invalid MessagePack body: {e}") from e
+
+
+def pack(content: Any) -> bytes:
+    return msgpack.packb(content, use_bin_type=True)
+
+
+class NegotiatedRoute(APIRoute):
+    """
+    Route class for the app: msgpack request bodies are unpacked and handed to
+    FastAPI's body validation as if they had been JSON, and the request's
+    Accept header is recorded for NegotiatedJSONResponse.
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def negotiated_handler(request: Request) -> Response:
+            if is_msgpack(request.headers.get("content-type")):
+                if msgpack is None:
+                    raise HTTPException(status_code=415, detail="MessagePack bodies need the msgpack package")
+                body = await request.body()
+                try:
+                    data = unpack(body)
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+                # Hand FastAPI the decoded object under a JSON content type; its
+                # body handling then validates it without parsing any text.
+                scope = dict(request.scope)
+                scope["headers"] = [(k, v) for k, v in request.scope["headers"] if k != b"content-type"]
+                scope["headers"].append((b"content-type", b"application/json"))
+                request = Request(scope, request.receive)
+                request._body = body
+                request._json = data
+            token = _accepts_msgpack.set(accepts_msgpack(request.headers.get("accept")))
+            try:
+                response = await handler(request)
+            finally:
+                _accepts_msgpack.reset(token)
+            if isinstance(response, NegotiatedJSONResponse):
+                response.headers["Vary"] = "Accept"
+            return response
+
+        return negotiated_handler
+
+
+class NegotiatedJSONResponse(JSONResponse):
+    """JSON response, or msgpack when the request being handled accepted it."""
+
+    def render(self, content: Any) -> bytes:
+        if _accepts_msgpack.get():
+            self.media_type = MSGPACK_MEDIA_TYPE
+            return pack(content)
+        return super().render(content)
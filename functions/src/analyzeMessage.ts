@@ -15,6 +15,15 @@ interface DSPyISTResponse {
   trajectory: string[];
 }
 
+/**
+ * DSPy result plus whether the service answered from an earlier request
+ * with the same idempotency key (X-IST-Idempotency: replay | waited).
+ */
+interface DSPyISTCall {
+  result: DSPyISTResponse;
+  duplicate: boolean;
+}
+
 /**
  * Call the DSPy microservice to extract real IST data.
  */
@@ -22,8 +31,10 @@ async function callDspyService(
   utterance: string,
   courseContext?: string | null,
   chatHistory?: Array<{ role: 'student' | 'tutor' | 'system'; content: string; created_at: string | null }>,
-  istHistory?: Array<{ intent: string; skills: string[]; trajectory: string[]; created_at: string | null }>
-): Promise<DSPyISTResponse> {
+  istHistory?: Array<{ intent: string; skills: string[]; trajectory: string[]; created_at: string | null }>,
+  userId?: string | null,
+  idempotencyKey?: string | null
+): Promise<DSPyISTCall> {
   const dspyBaseUrl = process.env.DSPY_SERVICE_URL ?? 'http://127.0.0.1:8000';
   const dspyUrl = `${dspyBaseUrl}/api/intent-skill-trajectory`;
 
@@ -46,6 +57,9 @@ async function callDspyService(
       chat_history: chatHistory ?? [],
       ist_history: istHistory ?? [],
       student_profile: null,
+      user_id: userId ?? null,
+      // Retries and double submits of the same message reuse the first analysis.
+      idempotency_key: idempotencyKey ?? null,
     }),
   });
 
@@ -57,13 +71,15 @@ async function callDspyService(
   }
 
   const data = (await response.json()) as DSPyISTResponse;
+  const idempotency = response.headers.get('X-IST-Idempotency');
   console.log('[analyzeMessage] DSPy response received:', {
     intent: data.intent?.substring(0, 50),
     skillsCount: data.skills?.length ?? 0,
     trajectoryCount: data.trajectory?.length ?? 0,
+    idempotency,
   });
 
-  return data;
+  return { result: data, duplicate: idempotency === 'replay' || idempotency === 'waited' };
 }
 
 /**
@@ -188,30 +204,37 @@ async function runIstAnalysis(
   }
 
   // Call the real DSPy service with enriched context
-  const dspyResponse = await callDspyService(
+  const { result: dspyResponse, duplicate } = await callDspyService(
     input.messageText,
     input.courseId ? `Course: ${input.courseId}` : null,
     chatHistory,
-    istHistory
+    istHistory,
+    input.uid,
+    input.messageId !== 'auto-generated' ? input.messageId : null
   );
 
   // --- Non-blocking Data Connect Write (Best Effort) ---
-  console.log('[analyzeMessage] About to save IST event to DataConnect for messageId', input.messageId);
+  if (duplicate) {
+    // A retry or double submit: the request that computed this result already saved it.
+    console.log('[analyzeMessage] Skipping DataConnect save for repeated messageId', input.messageId);
+  } else {
+    console.log('[analyzeMessage] About to save IST event to DataConnect for messageId', input.messageId);
 
-  try {
-    await saveIstEventToDataConnect({
-      userId: input.uid,
-      courseId: input.courseId ?? 'unknown-course',
-      threadId: input.threadId,
-      messageId: input.messageId,
-      utterance: input.messageText,
-      intent: dspyResponse.intent,
-      skills: dspyResponse.skills,
-      trajectory: dspyResponse.trajectory,
-    });
-    console.log('[analyzeMessage] DataConnect save completed for messageId', input.messageId);
-  } catch (err) {
-    console.error('[analyzeMessage] Non-fatal: failed to write IstEvent to DataConnect', err);
+    try {
+      await saveIstEventToDataConnect({
+        userId: input.uid,
+        courseId: input.courseId ?? 'unknown-course',
+        threadId: input.threadId,
+        messageId: input.messageId,
+        utterance: input.messageText,
+        intent: dspyResponse.intent,
+        skills: dspyResponse.skills,
+        trajectory: dspyResponse.trajectory,
+      });
+      console.log('[analyzeMessage] DataConnect save completed for messageId', input.messageId);
+    } catch (err) {
+      console.error('[analyzeMessage] Non-fatal: failed to write IstEvent to DataConnect', err);
+    }
   }
   // -----------------------------------------------------
 